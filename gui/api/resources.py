@@ -49,7 +49,7 @@ from freenasUI.account.forms import (
 )
 from freenasUI.account.forms import bsdUserToGroupForm
 from freenasUI.account.models import bsdUsers, bsdGroups, bsdGroupMembership
-from freenasUI.api.utils import DojoResource
+from freenasUI.api.utils import DojoResource, PagedList
 from freenasUI.common import humanize_size, humanize_number_si
 from freenasUI.common.system import (
     get_sw_login_version,
@@ -2593,31 +2593,17 @@ class SnapshotResource(DojoResource):
         return HttpResponse('Snapshot rolled back.', status=202)
 
     def get_list(self, request, **kwargs):
-
-        snapshots = notifier().zfs_snapshot_list()
-
-        results = []
-        for snaps in list(snapshots.values()):
-            results.extend(snaps)
         FIELD_MAP = {
             'extra': 'mostrecent',
+            'id': 'fullname',
         }
 
+        sort = []
         for sfield in self._apply_sorting(request.GET):
-            if sfield.startswith('-'):
-                field = sfield[1:]
-                reverse = True
-            else:
-                field = sfield
-                reverse = False
-            field = FIELD_MAP.get(field, field)
-            apifield = self.fields.get(field)
-            default = ''
-            if apifield and isinstance(apifield, fields.IntegerField):
-                default = 0
-            results.sort(
-                key=lambda item: getattr(item, field) or default,
-                reverse=reverse)
+            field = FIELD_MAP.get(sfield.lstrip('-'), sfield.lstrip('-'))
+            if field not in self.fields:
+                continue
+            sort.append(('-' if sfield.startswith('-') else '') + field)
 
         limit = self._meta.limit
         if 'HTTP_X_RANGE' in request.META:
@@ -2627,12 +2613,20 @@ class SnapshotResource(DojoResource):
 
         paginator = self._meta.paginator_class(
             request,
-            results,
+            [],
             resource_uri=self.get_resource_uri(),
             limit=limit,
             max_limit=self._meta.max_limit,
             collection_name=self._meta.collection_name,
         )
+        # Only the requested page of snapshots is built, sorted by zfs itself whenever possible
+        snapshots, total = notifier().zfs_snapshot_list_page(
+            offset=paginator.get_offset(),
+            limit=paginator.get_limit(),
+            sort=sort,
+        )
+        results = PagedList(snapshots, paginator.get_offset(), total)
+        paginator.objects = results
         to_be_serialized = paginator.page()
         # Dehydrate the bundles in preparation for serialization.
         bundles = []
@@ -2680,10 +2674,10 @@ class SnapshotResource(DojoResource):
                     })
                 )
             else:
-                snap = list(notifier().zfs_snapshot_list(path='%s@%s' % (
+                snap = notifier().zfs_snapshot_get('%s@%s' % (
                     deserialized['dataset'],
                     deserialized['name'],
-                )).values())[0][0]
+                ))
                 bundle = self.full_dehydrate(
                     self.build_bundle(obj=snap, request=request)
                 )
@@ -2700,18 +2694,13 @@ class SnapshotResource(DojoResource):
                     'error': _('Invalid snapshot'),
                 })
             )
-        dataset, name = kwargs['pk'].split('@', 1)
-        snap = list(notifier().zfs_snapshot_list(path='%s@%s' % (
-            dataset,
-            name,
-        )).values())
-        if not snap:
+        snap = notifier().zfs_snapshot_get(kwargs['pk'])
+        if snap is None:
             raise ImmediateHttpResponse(
                 response=self.error_response(bundle.request, {
                     'error': _('Invalid snapshot'),
                 })
             )
-        snap = snap[0][0]
 
         try:
             with client as c:
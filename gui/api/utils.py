@@ -149,6 +149,29 @@ class DojoPaginator(Paginator):
                 self.limit = int(r[1]) + 1 - self.offset
 
 
+class PagedList(object):
+    """
+    Sequence of `count` items out of which only `items` starting at `offset`
+    were fetched, for paginators to slice the page they asked for.
+    """
+
+    def __init__(self, items, offset, count):
+        self.items = items
+        self.offset = offset
+        self.total = count
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('Only slices of a page are supported')
+
+        start = (key.start or 0) - self.offset
+        stop = None if key.stop is None else key.stop - self.offset
+        return self.items[max(start, 0):stop]
+
+
 class DjangoDeclarativeMetaclass(DeclarativeMetaclass):
 
     def __new__(cls, name, bases, attrs):
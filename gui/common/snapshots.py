@@ -0,0 +1,138 @@
+from subprocess import Popen, PIPE, DEVNULL
+
+# Snapshot attributes `zfs list` can sort by itself
+ZFS_SORT_PROPERTIES = {
+    'fullname': 'name',
+    'used': 'used',
+    'refer': 'referenced',
+}
+ZFS_LIST_PROPERTIES = 'name,createtxg,used,referenced,freenas:vmsynced'
+
+
+def zfs_sort_args(sort):
+    """
+    `zfs list` sort arguments for dojo sort fields or `None` if it can't sort by all of them.
+
+    Fields are applied one after another, like consecutive stable sorts would, so the last one is the primary key.
+    """
+    args = []
+    for field in reversed(sort or []):
+        prop = ZFS_SORT_PROPERTIES.get(field.lstrip('-'))
+        if prop is None:
+            return None
+
+        args.extend(['-S' if field.startswith('-') else '-s', prop])
+
+    return args
+
+
+def snapshot_dict(line, latest, zvols):
+    fullname, createtxg, used, refer, vmsynced = line.rstrip('\n').split('\t')
+    filesystem, name = fullname.split('@', 1)
+    return {
+        'name': name,
+        'filesystem': filesystem,
+        'used': int(used),
+        'refer': int(refer),
+        'mostrecent': latest[filesystem] == int(createtxg),
+        'parent_type': 'volume' if filesystem in zvols else 'filesystem',
+        'vmsynced': vmsynced == 'Y',
+    }
+
+
+def sort_value(snapshot, field):
+    if field == 'fullname':
+        return '%s@%s' % (snapshot['filesystem'], snapshot['name'])
+
+    return snapshot[field]
+
+
+def paginate_snapshots(lines, offset=0, limit=0, sort=None, include=None, zvols=None):
+    """
+    Parses `zfs list -H -p -o ZFS_LIST_PROPERTIES` output `lines` already sorted by `zfs_sort_args(sort)` (if
+    possible) and returns `limit` (0 for all) snapshot dicts starting at `offset` and the total number of snapshots.
+
+    Only the page is parsed; the rest of the lines are just counted. `include(filesystem)` tells if snapshots of a
+    filesystem are listed at all.
+    """
+    zvols = zvols or set()
+    zfs_sorted = zfs_sort_args(sort) is not None
+    stop = offset + limit if limit else None
+
+    included = {}
+    # Greatest createtxg of every filesystem to tell which snapshot is the most recent one
+    latest = {}
+    page = []
+    total = 0
+    for line in lines:
+        fullname, createtxg = line.split('\t', 2)[:2]
+        filesystem = fullname.split('@', 1)[0]
+
+        inc = included.get(filesystem)
+        if inc is None:
+            inc = included[filesystem] = include is None or include(filesystem)
+        if not inc:
+            continue
+
+        createtxg = int(createtxg)
+        if createtxg > latest.get(filesystem, -1):
+            latest[filesystem] = createtxg
+
+        if not zfs_sorted or (offset <= total and (stop is None or total < stop)):
+            page.append(line)
+        total += 1
+
+    snapshots = [snapshot_dict(line, latest, zvols) for line in page]
+
+    if not zfs_sorted:
+        for field in sort:
+            snapshots.sort(key=lambda s: sort_value(s, field.lstrip('-')), reverse=field.startswith('-'))
+        snapshots = snapshots[offset:stop]
+
+    return snapshots, total
+
+
+def list_snapshots_page(offset=0, limit=0, sort=None, include=None, zvols=None, zfs='zfs'):
+    """
+    Lists a page of snapshots like `paginate_snapshots`, sorting by `sort` fields with `zfs list` when possible.
+    """
+    sort_args = zfs_sort_args(sort) or []
+    proc = Popen(
+        [zfs, 'list', '-H', '-p', '-t', 'snapshot', '-o', ZFS_LIST_PROPERTIES] + sort_args,
+        stdout=PIPE, stderr=DEVNULL, encoding='utf8', close_fds=True,
+    )
+    try:
+        return paginate_snapshots(proc.stdout, offset, limit, sort, include, zvols)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def get_snapshot(fullname, include=None, zvols=None, zfs='zfs'):
+    """
+    Returns a dict of a single snapshot (like `paginate_snapshots` does) or `None` if it does not exist.
+    """
+    filesystem = fullname.split('@', 1)[0]
+    if include is not None and not include(filesystem):
+        return None
+
+    proc = Popen(
+        [zfs, 'list', '-H', '-p', '-t', 'snapshot', '-o', ZFS_LIST_PROPERTIES, fullname],
+        stdout=PIPE, stderr=DEVNULL, encoding='utf8', close_fds=True,
+    )
+    line = proc.communicate()[0].split('\n')[0]
+    if proc.returncode != 0 or not line:
+        return None
+
+    # Most recent snapshot is listed first, we don't need the rest
+    proc = Popen(
+        [zfs, 'list', '-H', '-p', '-t', 'snapshot', '-o', 'createtxg', '-S', 'createtxg', '-d', '1', filesystem],
+        stdout=PIPE, stderr=DEVNULL, encoding='utf8', close_fds=True,
+    )
+    try:
+        latest = proc.stdout.readline().strip()
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+    return snapshot_dict(line, {filesystem: int(latest or 0)}, zvols or set())
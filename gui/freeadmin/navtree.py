@@ -24,11 +24,15 @@
 #
 #####################################################################
 import logging
+import os
 import re
+import threading
+import time
 
 from django.conf import settings
 from django.core.urlresolvers import NoReverseMatch, resolve, reverse
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.forms import ModelForm
 from django.utils.translation import ugettext_lazy as _
 
@@ -49,6 +53,11 @@ ssl.create_default_context = ssl._create_unverified_context
 
 log = logging.getLogger('freeadmin.navtree')
 
+# Seconds a generated tree is reused for at most. Changes of the database are
+# noticed right away, this bounds how long other state nodes depend on (e.g.
+# enabled features or IPMI) can be stale.
+NAVTREE_TTL = 60
+
 
 class ModelFormsDict(dict):
 
@@ -88,6 +97,34 @@ class NavTree(object):
         self._modelforms = ModelFormsDict()
         self._navs = {}
         self._generated = False
+        self._lock = threading.RLock()
+        # State the tree was generated for, see `_state`
+        self._state_generated = None
+        self._generated_at = None
+        # Dehydrated tree per user
+        self._dijit_trees = {}
+
+    def invalidate(self, **kwargs):
+        """
+        Makes next `generate` call generate the tree again.
+
+        Connected to model save and delete signals.
+        """
+        with self._lock:
+            self._state_generated = None
+            self._dijit_trees.clear()
+
+    def _state(self, fstatus):
+        # middlewared writes to the database without Django signals being sent,
+        # database file changes whenever a transaction is committed.
+        try:
+            st = os.stat(settings.DATABASES['default']['NAME'])
+        except OSError:
+            st = None
+        return (
+            fstatus,
+            (st.st_mtime_ns, st.st_size) if st else None,
+        )
 
     def isGenerated(self):
         return self._generated
@@ -216,18 +253,36 @@ class NavTree(object):
                 - Objects
                 - Add (Model)
                 - View (Model)
-        """
 
-        self._generated = True
-        self._navs.clear()
-        tree_roots.clear()
-        childs_of = []
+        The generated tree is reused until the database changes (or for
+        NAVTREE_TTL seconds at most).
+        """
 
         if hasattr(notifier, 'failover_status'):
             fstatus = notifier().failover_status()
         else:
             fstatus = 'SINGLE'
 
+        with self._lock:
+            state = self._state(fstatus)
+            if (
+                self._generated and state == self._state_generated and
+                time.monotonic() - self._generated_at < NAVTREE_TTL
+            ):
+                return
+
+            self._generate(request, fstatus)
+
+            self._state_generated = state
+            self._generated_at = time.monotonic()
+            self._dijit_trees.clear()
+
+    def _generate(self, request, fstatus):
+        self._generated = True
+        self._navs.clear()
+        tree_roots.clear()
+        childs_of = []
+
         for app in settings.INSTALLED_APPS:
 
             # If the app is listed at settings.BLACKLIST_NAV, skip it!
@@ -610,6 +665,17 @@ class NavTree(object):
         return my
 
     def dijitTree(self, user):
+        """
+        Tree filtered by `user` permissions, cached until the tree is
+        generated again.
+        """
+        with self._lock:
+            key = getattr(user, 'pk', None)
+            if key not in self._dijit_trees:
+                self._dijit_trees[key] = self._dijitTree(user)
+            return self._dijit_trees[key]
+
+    def _dijitTree(self, user):
 
         class ByRef(object):
             def __init__(self, val):
@@ -627,3 +693,5 @@ class NavTree(object):
 
 
 navtree = NavTree()
+post_save.connect(navtree.invalidate, dispatch_uid='navtree_invalidate')
+post_delete.connect(navtree.invalidate, dispatch_uid='navtree_invalidate')
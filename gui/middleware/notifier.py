@@ -67,6 +67,7 @@ if not apps.app_configs:
 from django.utils.translation import ugettext as _
 
 from freenasUI.common.pipesubr import SIG_SETMASK
+from freenasUI.common.snapshots import get_snapshot, list_snapshots_page
 from freenasUI.freeadmin.hook import HookMetaclass
 from freenasUI.middleware import zfs
 from freenasUI.middleware.client import client
@@ -536,6 +537,45 @@ class notifier(metaclass=HookMetaclass):
                 fsinfo[fs] = snaplist
         return fsinfo
 
+    def _zfs_snapshot_filters(self, system=False):
+        from freenasUI.storage.models import Volume
+
+        basename = None
+        if system is False:
+            with client as c:
+                basename = c.call('systemdataset.config')['basename']
+
+        volnames = set([o.vol_name for o in Volume.objects.all()])
+
+        def include(fs):
+            if basename and (fs == basename or fs.startswith(basename + '/')):
+                return False
+
+            # Do not list snapshots from the root pool
+            return fs.split('/')[0] in volnames
+
+        zfsproc = self._pipeopen("zfs list -t volume -o name -H")
+        zvols = set([y for y in zfsproc.communicate()[0].split('\n') if y != ''])
+
+        return include, zvols
+
+    def zfs_snapshot_list_page(self, offset=0, limit=0, sort=None, system=False):
+        """
+        Returns `limit` (0 for all) snapshots starting at `offset` sorted by dojo `sort` fields
+        and the total number of snapshots.
+        """
+        include, zvols = self._zfs_snapshot_filters(system)
+        snapshots, total = list_snapshots_page(offset, limit, sort, include, zvols)
+        return [zfs.Snapshot(**snapshot) for snapshot in snapshots], total
+
+    def zfs_snapshot_get(self, name, system=False):
+        include, zvols = self._zfs_snapshot_filters(system)
+        snapshot = get_snapshot(name, include, zvols)
+        if snapshot is None:
+            return None
+
+        return zfs.Snapshot(**snapshot)
+
     def zfs_get_options(self, name=None, recursive=False, props=None, zfstype=None):
         noinherit_fields = ['quota', 'refquota', 'reservation', 'refreservation']
 
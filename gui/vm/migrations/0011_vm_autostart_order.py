@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm', '0010_normalize_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vm',
+            name='autostart_order',
+            field=models.IntegerField(default=0, help_text='Guest VMs with lower order start first on boot, VMs with the same order start concurrently.', verbose_name='Autostart Order'),
+        ),
+        migrations.AddField(
+            model_name='vm',
+            name='autostart_delay',
+            field=models.IntegerField(default=0, help_text='Seconds to wait after this guest VM has started on boot before starting VMs with a higher order.', validators=[django.core.validators.MinValueValidator(0)], verbose_name='Autostart Delay'),
+        ),
+    ]
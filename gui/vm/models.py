@@ -79,6 +79,19 @@ class VM(Model):
         help_text=_('Guest VM will start on boot.'),
         default=False,
     )
+    autostart_order = models.IntegerField(
+        verbose_name=_('Autostart Order'),
+        help_text=_('Guest VMs with lower order start first on boot, VMs with the same order start '
+                    'concurrently.'),
+        default=0,
+    )
+    autostart_delay = models.IntegerField(
+        verbose_name=_('Autostart Delay'),
+        help_text=_('Seconds to wait after this guest VM has started on boot before starting VMs with a '
+                    'higher order.'),
+        default=0,
+        validators=[MinValueValidator(0)],
+    )
     time = models.CharField(
         verbose_name=_('System Clock'),
         max_length=5,
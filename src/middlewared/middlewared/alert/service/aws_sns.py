@@ -1,7 +1,8 @@
-import boto3
-
 from middlewared.alert.base import ThreadedAlertService
 from middlewared.schema import Dict, Str
+from middlewared.utils.lazy import lazy_import
+
+boto3 = lazy_import("boto3")
 
 
 class AWSSNSAlertService(ThreadedAlertService):
@@ -1,9 +1,11 @@
+import asyncio
 from collections import namedtuple
 from datetime import datetime
 import csv
 from datetime import timedelta
 import logging
 import os
+import time
 
 from middlewared.alert.base import AlertClass, DismissableAlertClass, AlertCategory, AlertLevel, Alert, AlertSource
 from middlewared.alert.schedule import IntervalSchedule
@@ -13,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 IPMISELRecord = namedtuple("IPMISELRecord", ["id", "datetime", "sensor", "event", "direction", "verbose"])
 
+# SEL is not probed again within this many seconds
+PROBE_INTERVAL = 60
+
 
 def has_ipmi():
     return any(os.path.exists(p) for p in ["/dev/ipmi0", "/dev/ipmi/0", "/dev/ipmidev/0"])
@@ -56,6 +61,115 @@ def parse_sel_information(output):
     }
 
 
+async def ipmitool(*args):
+    return (await run(["ipmitool"] + list(args), encoding="utf8")).stdout
+
+
+class IPMISELTracker:
+    """
+    Keeps records of IPMI System Event Log reading only what was added since the last probe.
+
+    Reading SEL records is slow on many BMCs, so `sel info` is checked first and records are not read at all if
+    the number of entries and last add/delete times did not change. If only new entries were added, only those are
+    read. Otherwise (SEL was cleared or wrapped) all records are read again.
+
+    Records and the cursor are persisted in `keyvalue` so a middleware restart does not need to read them all.
+    """
+
+    cursor_kv_key = "alert:ipmi_sel:cursor"
+
+    def __init__(self, middleware, ipmitool=ipmitool, interval=PROBE_INTERVAL):
+        self.middleware = middleware
+        self.ipmitool = ipmitool
+        self.interval = interval
+        self.lock = asyncio.Lock()
+        self.cursor = None
+        self.records = []
+        self.info = None
+        self.probed_at = None
+
+    async def probe(self):
+        """
+        Returns SEL information and records.
+        """
+        async with self.lock:
+            if self.probed_at is not None and time.monotonic() - self.probed_at < self.interval:
+                return self.info, self.records
+
+            info = parse_sel_information(await self.ipmitool("sel", "info"))
+
+            if self.cursor is None:
+                await self._load()
+
+            state = {
+                "entries": info.get("Entries"),
+                "last_add_time": info.get("Last Add Time"),
+                "last_del_time": info.get("Last Del Time"),
+            }
+            if self.cursor is None or self.cursor["state"] != state:
+                added = self._added(state)
+                if added:
+                    records = [
+                        record
+                        for record in parse_ipmitool_output(
+                            await self.ipmitool("-c", "sel", "elist", "last", str(added))
+                        )
+                        if record.id > self.cursor["last_id"]
+                    ]
+                    self.records = self.records + records
+                else:
+                    self.records = parse_ipmitool_output(await self.ipmitool("-c", "sel", "elist"))
+
+                self.cursor = {
+                    "state": state,
+                    "last_id": max([record.id for record in self.records], default=-1),
+                }
+                await self._save()
+
+            self.info = info
+            self.probed_at = time.monotonic()
+            return self.info, self.records
+
+    async def forget(self, until):
+        """
+        Forget records that happened before or at `until` (e.g. dismissed ones).
+        """
+        async with self.lock:
+            records = [record for record in self.records if record.datetime > until]
+            if len(records) != len(self.records):
+                self.records = records
+                await self._save()
+
+    def _added(self, state):
+        """
+        Number of entries added since the last probe or `None` if SEL has to be read again.
+        """
+        if self.cursor is None or state["last_del_time"] != self.cursor["state"]["last_del_time"]:
+            return None
+
+        try:
+            added = int(state["entries"]) - int(self.cursor["state"]["entries"])
+        except (TypeError, ValueError):
+            return None
+
+        return added if added > 0 else None
+
+    async def _load(self):
+        if await self.middleware.call("keyvalue.has_key", self.cursor_kv_key):
+            cursor = await self.middleware.call("keyvalue.get", self.cursor_kv_key)
+            self.cursor = {"state": cursor["state"], "last_id": cursor["last_id"]}
+            self.records = [
+                IPMISELRecord(**dict(record, datetime=datetime.strptime(record["datetime"], "%Y-%m-%dT%H:%M:%S")))
+                for record in cursor["records"]
+            ]
+
+    async def _save(self):
+        await self.middleware.call("keyvalue.set", self.cursor_kv_key, dict(self.cursor, records=[
+            dict(record._asdict(), datetime=record.datetime.strftime("%Y-%m-%dT%H:%M:%S"))
+            for record in self.records
+        ]))
+
+
 class IPMISELAlertClass(AlertClass, DismissableAlertClass):
     category = AlertCategory.HARDWARE
     level = AlertLevel.WARNING
@@ -87,17 +201,22 @@ class IPMISELAlertSource(AlertSource):
 
     dismissed_datetime_kv_key = "alert:ipmi_sel:dismissed_datetime"
 
+    def __init__(self, middleware):
+        super().__init__(middleware)
+        self.tracker = IPMISELTracker(middleware)
+
     async def check(self):
         if not has_ipmi():
             return
 
-        return await self._produce_alerts_for_ipmitool_output(
-            (await run(["ipmitool", "-c", "sel", "elist"], encoding="utf8")).stdout)
+        info, records = await self.tracker.probe()
+        return await self._produce_alerts_for_records(records, self.tracker)
 
     async def _produce_alerts_for_ipmitool_output(self, output):
-        alerts = []
+        return await self._produce_alerts_for_records(parse_ipmitool_output(output))
 
-        records = parse_ipmitool_output(output)
+    async def _produce_alerts_for_records(self, records, tracker=None):
+        alerts = []
 
         if records:
             if await self.middleware.call("keyvalue.has_key", self.dismissed_datetime_kv_key):
@@ -109,6 +228,10 @@ class IPMISELAlertSource(AlertSource):
                 dismissed_datetime = max(record.datetime for record in records)
                 await self.middleware.call("keyvalue.set", self.dismissed_datetime_kv_key, dismissed_datetime)
 
+            if tracker is not None:
+                # Dismissed records will never produce an alert again
+                await tracker.forget(dismissed_datetime)
+
             for record in records:
                 if record.datetime <= dismissed_datetime:
                     continue
@@ -141,8 +264,7 @@ class IPMISELSpaceLeftAlertSource(AlertSource):
         if not has_ipmi():
             return
 
-        return self._produce_alert_for_ipmitool_output(
-            (await run(["ipmitool", "sel", "info"], encoding="utf8")).stdout)
+        return self._produce_alert_for_ipmitool_output(await ipmitool("sel", "info"))
 
     def _produce_alert_for_ipmitool_output(self, output):
         sel_information = parse_sel_information(output)
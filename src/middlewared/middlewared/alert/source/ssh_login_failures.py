@@ -8,28 +8,48 @@ import re
 from middlewared.alert.base import AlertClass, AlertCategory, AlertLevel, Alert, ThreadedAlertSource
 from middlewared.alert.schedule import CrontabSchedule
 
+LOG_DIRECTORY = "/var/log"
+LOGIN_FAILURE = re.compile(rb"\b(fail(ures?|ed)?|invalid|bad|illegal|auth.*error)\b", re.I)
+# Length of "%b %e " message prefix
+DAY_LENGTH = 7
+# Consecutive runs of messages of the same day remembered between checks
+MAX_SEGMENTS = 16
+# Login failure messages of a single day remembered to be shown in the alert
+MAX_FAILURE_MESSAGES = 100
+# Beginning of `auth.log` remembered to recognize it after it is rotated
+HEAD_LENGTH = 256
 
-def catmsgs():
-    log_directory = "/var/log"
 
-    for log_file in sorted(
+def rotated_logs(log_directory=LOG_DIRECTORY):
+    """
+    Rotated `auth.log` archives, oldest first.
+    """
+    return sorted(
         filter(
             lambda path: re.match(r".*\.[0-9]+\.[^.]+$", path),
-            glob.glob("/var/log/auth.log.*.*"),
+            glob.glob(os.path.join(log_directory, "auth.log.*.*")),
         ),
         key=lambda path: int(path.split(".")[-2]),
         reverse=True,
-    ):
-        if log_file.endswith(".bz2"):
-            try:
-                with bz2.BZ2File(log_file, "rb") as f:
-                    yield from f
-            except IOError:
-                pass
+    )
+
+
+def open_rotated_log(log_file):
+    if log_file.endswith(".bz2"):
+        return bz2.BZ2File(log_file, "rb")
 
-        if log_file.endswith(".gz"):
+    if log_file.endswith(".gz"):
+        return gzip.GzipFile(log_file, "rb")
+
+    return None
+
+
+def catmsgs(log_directory=LOG_DIRECTORY):
+    for log_file in rotated_logs(log_directory):
+        f = open_rotated_log(log_file)
+        if f is not None:
             try:
-                with gzip.GzipFile(log_file, "rb") as f:
+                with f:
                     yield from f
             except IOError:
                 pass
@@ -49,7 +69,7 @@ def get_login_failures(now, messages):
     for message in messages:
         if message.strip():
             if message.startswith(yesterday):
-                if re.search(rb"\b(fail(ures?|ed)?|invalid|bad|illegal|auth.*error)\b", message, re.I):
+                if LOGIN_FAILURE.search(message):
                     login_failures.append(message)
 
             if not message.startswith(yesterday) and not message.startswith(today):
@@ -58,6 +78,183 @@ def get_login_failures(now, messages):
     return login_failures
 
 
+class LoginFailuresCounter:
+    """
+    Rolling per-day login failure counters of a log that is read incrementally.
+
+    The log is split into segments of consecutive messages that start with the same day. Yesterday login failures
+    are those in the trailing run of yesterday and today segments, like `get_login_failures` does for a whole log
+    (`syslog` does not log the year so the same day of the previous year is not counted).
+    """
+
+    def __init__(self, segments=None):
+        # [day, login failures count, login failure messages]
+        self.segments = segments or []
+
+    def feed(self, messages):
+        segment = self.segments[-1] if self.segments else None
+        day = segment[0].encode("latin-1") if segment else None
+        search = LOGIN_FAILURE.search
+        for message in messages:
+            if day is None or not message.startswith(day):
+                if not message.strip():
+                    continue
+
+                day = message[:DAY_LENGTH]
+                segment = [day.decode("latin-1"), 0, []]
+                self.segments.append(segment)
+                del self.segments[:-MAX_SEGMENTS]
+
+            if search(message):
+                segment[1] += 1
+                if len(segment[2]) < MAX_FAILURE_MESSAGES:
+                    segment[2].append(message.decode("utf-8", "ignore"))
+
+    def get_login_failures(self, now):
+        """
+        Returns yesterday login failures count and (up to `MAX_FAILURE_MESSAGES`) messages.
+        """
+        yesterday = (now - timedelta(days=1)).strftime("%b %e ")
+        today = now.strftime("%b %e ")
+
+        count = 0
+        messages = []
+        for day, segment_count, segment_messages in reversed(self.segments):
+            if day == yesterday:
+                count += segment_count
+                messages = segment_messages + messages
+            elif day != today:
+                break
+
+        return count, messages[:MAX_FAILURE_MESSAGES]
+
+
+class LogScanner:
+    """
+    Reads messages of `auth.log` and its rotated archives that were not read before.
+
+    Checkpoint remembers `auth.log` inode, read offset and beginning and fingerprints of archives that were already
+    read. When `auth.log` is rotated, the remainder of it is read from the archive that starts like it did.
+    """
+
+    def __init__(self, checkpoint=None, log_directory=LOG_DIRECTORY):
+        checkpoint = checkpoint or {}
+        self.log_directory = log_directory
+        self.inode = checkpoint.get("inode")
+        self.offset = checkpoint.get("offset", 0)
+        self.head = checkpoint.get("head", "").encode("latin-1")
+        self.archives = set(checkpoint.get("archives", []))
+        # Set if all messages had to be read again
+        self.full = False
+
+    def checkpoint(self):
+        return {
+            "inode": self.inode,
+            "offset": self.offset,
+            "head": self.head.decode("latin-1"),
+            "archives": sorted(self.archives),
+        }
+
+    def scan(self):
+        """
+        Returns an iterator over new messages. `full` is set if all of them have to be read again.
+        """
+        archives = []
+        for log_file in rotated_logs(self.log_directory):
+            try:
+                st = os.stat(log_file)
+            except FileNotFoundError:
+                continue
+
+            archives.append((log_file, f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"))
+
+        try:
+            st = os.stat(os.path.join(self.log_directory, "auth.log"))
+        except FileNotFoundError:
+            st = None
+
+        rotated = (
+            st is None or st.st_ino != self.inode or st.st_size < self.offset or
+            # Inode might have been reused
+            not self._starts_with(lambda: open(os.path.join(self.log_directory, "auth.log"), "rb"))
+        )
+
+        # Archives to read with the offset to start reading them at
+        read = []
+        if self.inode is None:
+            self.full = True
+        elif rotated:
+            new_archives = [log_file for log_file, fingerprint in archives if fingerprint not in self.archives]
+            for i, log_file in enumerate(new_archives):
+                if self._starts_with(lambda: open_rotated_log(log_file)):
+                    read = [(log_file, self.offset)] + [(log_file, 0) for log_file in new_archives[i + 1:]]
+                    break
+            else:
+                self.full = True
+
+        if self.full:
+            read = [(log_file, 0) for log_file, fingerprint in archives]
+
+        self.archives = {fingerprint for log_file, fingerprint in archives}
+
+        return self._read(read, st, 0 if rotated or self.full else self.offset)
+
+    def _read(self, archives, st, offset):
+        for log_file, skip in archives:
+            yield from self._read_archive(log_file, skip)
+
+        if st is None:
+            self.inode = None
+            self.offset = 0
+            self.head = b""
+            return
+
+        try:
+            with open(os.path.join(self.log_directory, "auth.log"), "rb") as f:
+                if offset == 0 or len(self.head) < HEAD_LENGTH:
+                    self.head = f.read(HEAD_LENGTH)
+
+                f.seek(offset)
+                for message in f:
+                    if not message.endswith(b"\n"):
+                        # Incomplete message, will be read next time
+                        break
+
+                    offset += len(message)
+                    yield message
+        except IOError:
+            return
+
+        self.inode = st.st_ino
+        self.offset = offset
+
+    def _starts_with(self, open_log):
+        if not self.head:
+            return True
+
+        try:
+            f = open_log()
+            if f is None:
+                return False
+
+            with f:
+                return f.read(len(self.head)) == self.head
+        except IOError:
+            return False
+
+    def _read_archive(self, log_file, skip):
+        f = open_rotated_log(log_file)
+        if f is None:
+            return
+
+        try:
+            with f:
+                f.seek(skip)
+                yield from f
+        except IOError:
+            pass
+
+
 class SSHLoginFailuresAlertClass(AlertClass):
     category = AlertCategory.SYSTEM
     level = AlertLevel.WARNING
@@ -68,10 +265,26 @@ class SSHLoginFailuresAlertClass(AlertClass):
 class SSHLoginFailuresAlertSource(ThreadedAlertSource):
     schedule = CrontabSchedule(hour=0)
 
+    checkpoint_kv_key = "alert:ssh_login_failures:checkpoint"
+
     def check_sync(self):
-        login_failures = get_login_failures(datetime.now(), catmsgs())
-        if login_failures:
+        checkpoint = {}
+        if self.middleware.call_sync("keyvalue.has_key", self.checkpoint_kv_key):
+            checkpoint = self.middleware.call_sync("keyvalue.get", self.checkpoint_kv_key)
+
+        scanner = LogScanner(checkpoint.get("log"))
+        messages = scanner.scan()
+        counter = LoginFailuresCounter(None if scanner.full else checkpoint.get("segments"))
+        counter.feed(messages)
+
+        self.middleware.call_sync("keyvalue.set", self.checkpoint_kv_key, {
+            "log": scanner.checkpoint(),
+            "segments": counter.segments,
+        })
+
+        count, login_failures = counter.get_login_failures(datetime.now())
+        if count:
             return Alert(SSHLoginFailuresAlertClass, {
-                "count": len(login_failures),
-                "failures": b"".join(login_failures).decode("utf-8", "ignore")
+                "count": count,
+                "failures": "".join(login_failures),
             })
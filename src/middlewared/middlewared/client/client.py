@@ -237,6 +237,8 @@ class Call(object):
         self.type = None
         self.extra = None
         self.py_exception = None
+        # Items of partial results received so far
+        self.chunks = []
 
 
 class Job(object):
@@ -326,12 +328,13 @@ class Client(object):
 
     def __init__(
         self, uri=None, reserved_ports=False, reserved_ports_blacklist=None,
-        py_exceptions=False,
+        py_exceptions=False, chunked_results=False,
     ):
         """
         Arguments:
            :reserved_ports(bool): whether the connection should origin using a reserved port (<= 1024)
            :reserved_ports_blacklist(list): list of ports that should not be used as origin
+           :chunked_results(bool): whether large list results can be received as a series of partial results
         """
         self._calls = {}
         self._jobs = defaultdict(dict)
@@ -339,6 +342,7 @@ class Client(object):
         self._jobs_watching = False
         self._pings = {}
         self._py_exceptions = py_exceptions
+        self._chunked_results = chunked_results
         self._event_callbacks = {}
         if uri is None:
             uri = 'ws+unix:///var/run/middlewared.sock'
@@ -387,7 +391,13 @@ class Client(object):
         elif _id is not None and msg == 'result':
             call = self._calls.get(_id)
             if call:
+                if message.get('more'):
+                    call.chunks.extend(message['result'])
+                    return
                 call.result = message.get('result')
+                if call.chunks and isinstance(call.result, list):
+                    call.chunks.extend(call.result)
+                    call.result = call.chunks
                 if 'error' in message:
                     call.errno = message['error'].get('error')
                     call.error = message['error'].get('reason')
@@ -429,6 +439,8 @@ class Client(object):
         features = []
         if self._py_exceptions:
             features.append('PY_EXCEPTIONS')
+        if self._chunked_results:
+            features.append('CHUNKED_RESULTS')
         self._send({
             'msg': 'connect',
             'version': '1',
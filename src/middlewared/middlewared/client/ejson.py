@@ -39,5 +39,42 @@ def dumps(obj, **kwargs):
     return json.dumps(obj, cls=JSONEncoder, **kwargs)
 
 
+def iterdumps(obj, chunk_length=1000, **kwargs):
+    """
+    Yields JSON encoding of `obj` in pieces. Lists (and dicts) are encoded `chunk_length` items at a time so encoding
+    of a large `obj` can be interleaved with other work (and does not hold the GIL for all the time it takes).
+    """
+    if isinstance(obj, list) and len(obj) > chunk_length:
+        yield '['
+        for i in range(0, len(obj), chunk_length):
+            if i:
+                yield ', '
+            yield from _iterdumps_items(obj[i:i + chunk_length], chunk_length, **kwargs)
+        yield ']'
+    elif isinstance(obj, dict) and all(isinstance(k, str) for k in obj) and (
+        len(obj) > chunk_length or
+        any(isinstance(v, (list, dict)) and len(v) > chunk_length for v in obj.values())
+    ):
+        yield '{'
+        for i, (k, v) in enumerate(obj.items()):
+            if i:
+                yield ', '
+            yield dumps(k) + ': '
+            yield from iterdumps(v, chunk_length, **kwargs)
+        yield '}'
+    else:
+        yield dumps(obj, **kwargs)
+
+
+def _iterdumps_items(items, chunk_length, **kwargs):
+    if any(isinstance(item, (list, dict)) and len(item) > chunk_length for item in items):
+        for i, item in enumerate(items):
+            if i:
+                yield ', '
+            yield from iterdumps(item, chunk_length, **kwargs)
+    else:
+        yield dumps(items, **kwargs)[1:-1]
+
+
 def loads(obj, **kwargs):
     return json.loads(obj, object_hook=object_hook, **kwargs)
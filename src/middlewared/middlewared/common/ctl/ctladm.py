@@ -0,0 +1,224 @@
+from collections import defaultdict
+import re
+
+from lxml import etree
+
+# LUN attributes which can't be changed on the fly, LUN has to be re-created if any of them changes
+LUN_IDENTITY = ('ctl_lun', 'path', 'blocksize', 'serial', 'device_id')
+SIZE_SUFFIXES = 'KMGTPE'
+
+
+class CtlConfig:
+    """
+    `ctl.conf` generated by `etc_files/ctld.py` split into LUNs, target LUN mappings and everything else.
+    """
+
+    def __init__(self, luns, targets, skeleton):
+        # LUN name -> dict(ctl_lun, path, blocksize, serial, device_id, size, options)
+        self.luns = luns
+        # Target name -> dict(target LUN number -> LUN name)
+        self.targets = targets
+        # Everything but LUN sections and target LUN mappings, e.g. portal groups and auth groups
+        self.skeleton = skeleton
+
+
+def parse_size(size):
+    if size is None:
+        return None
+
+    size = size.upper().rstrip('B')
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * 1024 ** (SIZE_SUFFIXES.index(size[-1]) + 1))
+
+    return int(size)
+
+
+def parse_config(text):
+    luns = {}
+    targets = {}
+    skeleton = []
+
+    lun = target = None
+    for line in text.splitlines():
+        words = re.findall(r'"([^"]*)"', line)
+        keyword = line.split(None, 1)[0] if line.strip() else ''
+
+        if lun is not None:
+            if keyword == '}':
+                lun = None
+            elif keyword == 'ctl-lun':
+                lun['ctl_lun'] = int(words[0])
+            elif keyword in ('path', 'blocksize', 'serial', 'device-id', 'size'):
+                lun[keyword.replace('-', '_')] = words[0]
+            elif keyword == 'option':
+                lun['options'][words[0]] = words[1]
+            continue
+
+        if keyword == 'lun' and line.rstrip().endswith('{'):
+            lun = luns[words[0]] = {
+                'ctl_lun': None, 'path': None, 'blocksize': None, 'serial': None, 'device_id': None, 'size': None,
+                'options': {},
+            }
+            continue
+
+        if keyword == 'target' and line.rstrip().endswith('{'):
+            target = targets[words[0]] = {}
+        elif target is not None:
+            if keyword == '}':
+                target = None
+            elif keyword == 'lun':
+                target[int(words[0])] = words[1]
+                continue
+
+        if line.strip():
+            skeleton.append(line)
+
+    for lun in luns.values():
+        lun['blocksize'] = int(lun['blocksize']) if lun['blocksize'] else 512
+        lun['size'] = parse_size(lun['size'])
+
+    return CtlConfig(luns, targets, '\n'.join(skeleton))
+
+
+def parse_devlist(xml):
+    """
+    Parse `ctladm devlist -x` output.
+
+    Returns dict(ctl_lun) = dict(name, backend, path, blocksize, size, serial, device_id, options)
+    """
+    luns = {}
+    for lun in etree.fromstring(xml).iterfind('lun'):
+        # Values are not stripped, device id is padded with spaces
+        data = {i.tag: i.text or '' for i in lun.iterchildren()}
+        blocksize = int(data.pop('blocksize', 0) or 0)
+        size = data.pop('size', None)
+        luns[int(lun.attrib['id'])] = {
+            'name': data.pop('ctld_name', None),
+            'backend': data.pop('backend_type', None),
+            'path': data.pop('file', None),
+            'blocksize': blocksize,
+            'size': int(size) * blocksize if size else None,
+            'serial': data.pop('serial_number', None),
+            'device_id': data.pop('device_id', None),
+            'options': data,
+        }
+
+    return luns
+
+
+def parse_portlist(xml):
+    """
+    Parse `ctladm portlist -x` output.
+
+    Returns list of dict(id, frontend, target, luns) where `luns` is dict(port LUN number) = ctl_lun
+    """
+    ports = []
+    for port in etree.fromstring(xml).iterfind('targ_port'):
+        ports.append({
+            'id': int(port.attrib['id']),
+            'frontend': port.findtext('frontend_type'),
+            'target': port.findtext('target') or port.findtext('cfiscsi_target'),
+            'luns': {int(lun.attrib['id']): int(lun.text) for lun in port.iterfind('lun')},
+        })
+
+    return ports
+
+
+def plan(old, new, devlist, portlist):
+    """
+    Compute `ctladm` invocations which bring kernel LUNs and target LUN mappings from `devlist` and `portlist`
+    to the state described by `new` config (`old` is the config ctld is currently running with).
+
+    Returns `None` if the change can't be applied this way and ctld has to reload its configuration
+    (e.g. a target, portal group or auth group has changed).
+    """
+    if old.skeleton != new.skeleton:
+        return None
+
+    # Fibre Channel ports are set up by ctld by their physical port name
+    if any(line.split(None, 1)[0] == 'port' for line in new.skeleton.splitlines() if line.strip()):
+        return None
+
+    kernel = {lun['name']: dict(lun, ctl_lun=ctl_lun) for ctl_lun, lun in devlist.items() if lun['name']}
+    foreign = {ctl_lun for ctl_lun, lun in devlist.items() if not lun['name']}
+
+    removed = []
+    created = []
+    modify = []
+    for name, lun in kernel.items():
+        if name not in new.luns:
+            removed.append(lun['ctl_lun'])
+
+    for name, lun in new.luns.items():
+        current = kernel.get(name)
+        if current is not None and any(lun[k] != current[k] for k in LUN_IDENTITY):
+            removed.append(current['ctl_lun'])
+            current = None
+
+        if current is None:
+            if lun['ctl_lun'] in foreign:
+                return None
+            created.append(name)
+            continue
+
+        if set(old.luns.get(name, lun)['options']) - set(lun['options']):
+            # Options can't be unset on the fly
+            return None
+
+        args = []
+        if lun['size'] is not None and lun['size'] // lun['blocksize'] * lun['blocksize'] != current['size']:
+            args += ['-s', str(lun['size'])]
+        for k, v in lun['options'].items():
+            if current['options'].get(k) != v:
+                args += ['-o', f'{k}={v}']
+        if args:
+            modify.append(['modify', '-b', 'block', '-l', str(lun['ctl_lun'])] + args)
+
+    taken = set(devlist) - set(removed)
+    if any(new.luns[name]['ctl_lun'] in taken for name in created):
+        return None
+
+    recreated = set(removed) | {new.luns[name]['ctl_lun'] for name in created}
+
+    ports = defaultdict(list)
+    for port in portlist:
+        if port['target']:
+            ports[port['target']].append(port)
+
+    unmap = []
+    lunmap = []
+    for target, mapping in new.targets.items():
+        if target not in ports:
+            # ctld has to create ports for a new target
+            return None
+
+        desired = {
+            number: new.luns[name]['ctl_lun'] for number, name in mapping.items() if name in new.luns
+        }
+        for port in ports[target]:
+            for number, ctl_lun in port['luns'].items():
+                if desired.get(number) != ctl_lun or ctl_lun in recreated:
+                    unmap.append(['lunmap', '-p', str(port['id']), '-l', str(number)])
+            for number, ctl_lun in desired.items():
+                if port['luns'].get(number) != ctl_lun or ctl_lun in recreated:
+                    lunmap.append(['lunmap', '-p', str(port['id']), '-l', str(number), '-L', str(ctl_lun)])
+
+    return (
+        unmap +
+        [['remove', '-b', 'block', '-l', str(ctl_lun)] for ctl_lun in removed] +
+        [create_args(new.luns[name], name) for name in created] +
+        modify +
+        lunmap
+    )
+
+
+def create_args(lun, name):
+    args = [
+        'create', '-b', 'block', '-l', str(lun['ctl_lun']), '-o', f'file={lun["path"]}', '-o', f'ctld_name={name}',
+        '-B', str(lun['blocksize']), '-S', lun['serial'], '-d', lun['device_id'],
+    ]
+    if lun['size'] is not None:
+        args += ['-s', str(lun['size'])]
+    for k, v in lun['options'].items():
+        args += ['-o', f'{k}={v}']
+    return args
@@ -0,0 +1,220 @@
+from collections import deque, namedtuple
+import concurrent.futures
+import io
+import logging
+import os
+import re
+import signal
+import subprocess
+import tarfile
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+FREENAS_DEBUG_MODULEDIR = '/usr/local/libexec/freenas-debug'
+PATH = '/bin:/sbin:/usr/bin:/usr/sbin:/usr/local/bin:/usr/local/sbin'
+# Extensions of files which are not truncated to the last `limit` lines
+# (`textdump.tar.last` is the last kernel textdump)
+COMPRESSED_EXTENSIONS = (
+    '.tar', '.tar.last', '.tar.gz', '.tgz', '.gz', '.zip', '.gzip', '.bzip', '.bzip2', '.bz2', '.compressed',
+)
+
+DebugModule = namedtuple('DebugModule', ['name', 'opt', 'directory', 'help'])
+# `freenas-debug -A` does not run modules with this option, they must be called explicitly (e.g. database dump)
+EXPLICIT_OPT = 'B'
+DebugResult = namedtuple('DebugResult', ['module', 'output', 'elapsed', 'timed_out'])
+
+
+def _module_echo(script, name, function):
+    # Modules define their metadata as `name_directory() { echo "ZFS"; }`
+    m = re.search(rf'^{re.escape(name)}_{function}\(\)\s*{{\s*echo\s+"?([^";}}]*)"?\s*;?\s*}}', script, re.M)
+    if m:
+        return m.group(1).strip()
+
+
+def list_modules(moduledir=FREENAS_DEBUG_MODULEDIR):
+    """
+    List `freenas-debug` modules available in `moduledir`.
+
+    A module is `<name>/<name>.sh` implementing `<name>_func`, `<name>_help` and `<name>_directory`.
+    """
+    modules = []
+    for name in sorted(os.listdir(moduledir)):
+        path = os.path.join(moduledir, name, f'{name}.sh')
+        if not os.path.isfile(path):
+            continue
+
+        with open(path, errors='ignore') as f:
+            script = f.read()
+
+        if not re.search(rf'^{re.escape(name)}_func\(\)', script, re.M):
+            continue
+
+        modules.append(DebugModule(
+            name,
+            _module_echo(script, name, 'opt'),
+            _module_echo(script, name, 'directory') or name,
+            _module_echo(script, name, 'help') or name,
+        ))
+
+    return modules
+
+
+def run_module(module, moduledir=FREENAS_DEBUG_MODULEDIR, timeout=None, directory=None):
+    """
+    Run `module` function the same way `freenas-debug` does and return its combined output.
+
+    Files the module writes itself (e.g. `iocage debug` output) go to `directory` (`FREENAS_DEBUG_DIRECTORY`).
+    The module gets its own process group so everything it spawned is killed if it times out.
+    """
+    env = dict(os.environ, PATH=PATH, FREENAS_DEBUG_MODULEDIR=moduledir)
+    if directory is not None:
+        env['FREENAS_DEBUG_DIRECTORY'] = directory
+
+    start = time.monotonic()
+    cp = subprocess.Popen(
+        [
+            'sh', '-c', '. "$FREENAS_DEBUG_MODULEDIR/include.sh"; . "$FREENAS_DEBUG_MODULEDIR/$1/$1.sh"; "$1_func"',
+            'freenas-debug', module.name,
+        ],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+        env=env,
+        start_new_session=True,
+    )
+    timed_out = False
+    try:
+        output = cp.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        try:
+            os.killpg(cp.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        output = cp.communicate()[0]
+        output += f'\n\nModule {module.name} timed out after {timeout} seconds\n'.encode()
+
+    return DebugResult(module, output, time.monotonic() - start, timed_out)
+
+
+def _tail(path, limit):
+    with open(path, 'rb') as f:
+        return b''.join(deque(f, limit))
+
+
+class _PaddedReader:
+    """
+    Archive member header is written before its contents so if a file gets truncated while it is
+    being archived we pad it with zeros to keep the tar stream consistent.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if size > 0 and len(data) < size:
+            data += b'\0' * (size - len(data))
+        return data
+
+
+class DebugCollector:
+    """
+    Builds a debug bundle as a compressed tar stream written to `fileobj`.
+
+    `freenas-debug` modules run concurrently (at most `concurrency` at a time, each one killed after
+    `timeout` seconds) and their output goes straight into the archive along with logs and other
+    system files, nothing is staged on disk first. Only files modules write themselves are stored in a
+    temporary directory which is archived under `fndebug` and removed afterwards.
+
+    `progress_cb(percent, description)` is called as the bundle is built.
+    """
+
+    def __init__(
+        self, fileobj, moduledir=FREENAS_DEBUG_MODULEDIR, timeout=300, concurrency=None, limit=10000,
+        progress_cb=None, prefix='ixdiagnose',
+    ):
+        self.fileobj = fileobj
+        self.moduledir = moduledir
+        self.timeout = timeout
+        self.concurrency = concurrency or min(8, os.cpu_count() or 1)
+        self.limit = limit
+        self.progress_cb = progress_cb or (lambda percent, description: None)
+        self.prefix = prefix
+        self.timings = {}
+
+    def collect(self, extra_commands=None, extra_paths=None):
+        """
+        Write the debug bundle.
+
+        `extra_commands` maps archive file name to the command whose output is stored in it.
+        `extra_paths` maps archive path to the file or directory which is added (recursively) there.
+        """
+        with tarfile.open(fileobj=self.fileobj, mode='w|gz', dereference=True) as tar:
+            with tempfile.TemporaryDirectory(prefix='fndebug') as directory:
+                self._add_modules(tar, directory)
+                self._add_path(tar, 'fndebug', directory)
+
+            self.progress_cb(80, 'Collecting system information')
+            for arcname, command in (extra_commands or {}).items():
+                try:
+                    output = subprocess.run(
+                        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout,
+                        env=dict(os.environ, PATH=PATH),
+                    ).stdout
+                except (OSError, subprocess.TimeoutExpired) as e:
+                    output = f'Failed to run {command!r}: {e}\n'.encode()
+                self._add_bytes(tar, arcname, output)
+
+            self.progress_cb(90, 'Collecting logs')
+            for arcname, path in (extra_paths or {}).items():
+                self._add_path(tar, arcname, path)
+
+        self.progress_cb(100, 'Debug generation finished')
+
+    def _add_modules(self, tar, directory):
+        modules = [module for module in list_modules(self.moduledir) if module.opt != EXPLICIT_OPT]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='debug_collector',
+        ) as executor:
+            futures = [
+                executor.submit(run_module, module, self.moduledir, self.timeout, directory) for module in modules
+            ]
+            for i, future in enumerate(concurrent.futures.as_completed(futures)):
+                result = future.result()
+                self.timings[result.module.name] = result.elapsed
+                if result.timed_out:
+                    logger.warning('Debug module %r timed out after %d seconds', result.module.name, self.timeout)
+                self._add_bytes(tar, os.path.join('fndebug', result.module.directory, 'dump.txt'), result.output)
+                self.progress_cb(int((i + 1) / len(modules) * 80), result.module.help)
+
+    def _add_bytes(self, tar, arcname, data):
+        tarinfo = tarfile.TarInfo(os.path.join(self.prefix, arcname))
+        tarinfo.size = len(data)
+        tarinfo.mtime = time.time()
+        tarinfo.mode = 0o644
+        tar.addfile(tarinfo, io.BytesIO(data))
+
+    def _add_path(self, tar, arcname, path):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    filepath = os.path.join(root, name)
+                    self._add_path(tar, os.path.join(arcname, os.path.relpath(filepath, path)), filepath)
+            return
+
+        if not os.path.isfile(path):
+            return
+
+        try:
+            if self.limit != -1 and not path.endswith(COMPRESSED_EXTENSIONS) and os.path.basename(path) != 'dump.txt':
+                self._add_bytes(tar, arcname, _tail(path, self.limit))
+            else:
+                with open(path, 'rb') as f:
+                    tarinfo = tar.gettarinfo(arcname=os.path.join(self.prefix, arcname), fileobj=f)
+                    # File may keep growing while it is being archived, only store what we stat'ed
+                    tar.addfile(tarinfo, _PaddedReader(f))
+        except OSError as e:
+            # e.g. file removed or truncated (log rotation) while we were collecting
+            logger.debug('Failed to add %r to debug: %r', path, e)
@@ -0,0 +1,129 @@
+import errno
+import heapq
+from itertools import islice
+from operator import attrgetter
+import os
+
+from middlewared.service_exception import CallError
+from middlewared.utils import filter_list
+
+
+def listdir_entry(entry, stat=True):
+    if entry.is_dir():
+        etype = 'DIRECTORY'
+    elif entry.is_file():
+        etype = 'FILE'
+    elif entry.is_symlink():
+        etype = 'SYMLINK'
+    else:
+        etype = 'OTHER'
+
+    data = {
+        'name': entry.name,
+        'path': entry.path,
+        'realpath': os.path.realpath(entry.path) if etype == 'SYMLINK' else entry.path,
+        'type': etype,
+        'size': None,
+        'mode': None,
+        'uid': None,
+        'gid': None,
+    }
+    if stat:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            pass
+        else:
+            data.update({
+                'size': st.st_size,
+                'mode': st.st_mode,
+                'uid': st.st_uid,
+                'gid': st.st_gid,
+            })
+
+    return data
+
+
+def name_matcher(filters):
+    """
+    Returns a function that tells if a name matches all `name` `filters` (or `None` if there are none).
+    """
+    if not filters:
+        return None
+
+    checks = []
+    for f in filters:
+        name, op, value = f
+        if op == '^':
+            checks.append(lambda n, value=value: n.startswith(value))
+        elif op == '=':
+            checks.append(lambda n, value=value: n == value)
+        else:
+            checks.append(lambda n, f=f: bool(filter_list([{'name': n}], [f])))
+
+    if len(checks) == 1:
+        return checks[0]
+
+    return lambda n: all(check(n) for check in checks)
+
+
+def listdir(path, filters=None, options=None):
+    """
+    Lists directory `path` like `filter_list` over `listdir_entry` of every entry would (see `filesystem.listdir`
+    for `options['extra']`), building only entries that can be returned.
+    """
+    filters = filters or []
+    options = options or {}
+    extra = options.get('extra') or {}
+    after = extra.get('after')
+    stat = extra.get('stat', True)
+
+    order_by = options.get('order_by') or []
+    limit = options.get('limit') or 0
+    if options.get('get') and order_by in ([], ['name']):
+        limit = 1
+    if after is not None:
+        if order_by not in ([], ['name']):
+            raise CallError('Listing with a cursor can only be ordered by name', errno.EINVAL)
+        order_by = ['name']
+
+    name_filters = [f for f in filters if len(f) == 3 and f[0] == 'name']
+    other_filters = [f for f in filters if f not in name_filters]
+    match_name = name_matcher(name_filters)
+
+    def build(entries):
+        for entry in entries:
+            data = listdir_entry(entry, stat)
+            if not other_filters or filter_list([data], other_filters):
+                yield data
+
+    with os.scandir(path) as it:
+        candidates = it
+        if after is not None:
+            candidates = (entry for entry in candidates if entry.name > after)
+        if match_name is not None:
+            candidates = (entry for entry in candidates if match_name(entry.name))
+
+        if options.get('count'):
+            if other_filters:
+                return sum(1 for _ in build(candidates))
+
+            return sum(1 for _ in candidates)
+
+        if order_by == ['name']:
+            if limit and not other_filters:
+                entries = list(build(heapq.nsmallest(limit, candidates, key=attrgetter('name'))))
+            else:
+                entries = list(islice(build(sorted(candidates, key=attrgetter('name'))), limit or None))
+        elif not order_by:
+            entries = list(islice(build(candidates), limit or None))
+        else:
+            entries = list(build(candidates))
+
+    if after is not None:
+        return {
+            'entries': filter_list(entries, [], {'select': options.get('select')}),
+            'after': entries[-1]['name'] if limit and len(entries) == limit else None,
+        }
+
+    return filter_list(entries, [], options)
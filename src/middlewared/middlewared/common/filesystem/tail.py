@@ -0,0 +1,220 @@
+import codecs
+from collections import deque
+import logging
+import os
+import select
+import threading
+
+logger = logging.getLogger(__name__)
+
+BUFSIZE = 8192
+# Lines kept for new subscribers (more are read from the file if one asks for more)
+TAIL_LINES = 100
+POLL_INTERVAL = 0.5
+
+
+def read_tail(fd, end, lines):
+    """
+    Reads data before `end` offset of `fd` that contains at least last `lines` lines (or the whole file).
+    """
+    start = end
+    data = b''
+    while start > 0 and data.count(b'\n') <= lines:
+        size = min(BUFSIZE, start)
+        start -= size
+        data = os.pread(fd, size, start) + data
+
+    return data
+
+
+class KqueueWatcher:
+    def __init__(self, fd, stop):
+        self.kqueue = select.kqueue()
+        self.kqueue.control([select.kevent(
+            fd,
+            filter=select.KQ_FILTER_VNODE,
+            flags=select.KQ_EV_ADD | select.KQ_EV_ENABLE | select.KQ_EV_CLEAR,
+            fflags=(
+                select.KQ_NOTE_DELETE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_WRITE | select.KQ_NOTE_ATTRIB |
+                select.KQ_NOTE_RENAME
+            ),
+        )], 0, 0)
+
+    def wait(self, timeout):
+        # Rotated file is replaced by a new one without any event so we check it on timeout too
+        self.kqueue.control([], 1, timeout)
+
+    def close(self):
+        self.kqueue.close()
+
+
+class PollingWatcher:
+    def __init__(self, fd, stop):
+        self.stop = stop
+
+    def wait(self, timeout):
+        self.stop.wait(timeout)
+
+    def close(self):
+        pass
+
+
+Watcher = KqueueWatcher if hasattr(select, 'kqueue') else PollingWatcher
+
+
+class TailBroker:
+    """
+    Follows a file with a single descriptor and thread and sends data appended to it to all subscribers.
+
+    Last lines of the file are kept in memory so new subscribers get them without reading the file again.
+    Truncated file is followed from its beginning, rotated one (renamed or deleted and created again) is read
+    until its end and then reopened.
+    """
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.subscribers = []
+
+        self.fd = None
+        self.st = None
+        self.position = 0
+        self.decoder = None
+        self.lines = deque(maxlen=TAIL_LINES)
+        self.partial = ''
+        self.watcher = None
+
+        self._open()
+        self.position = self.st.st_size
+        self._load(TAIL_LINES)
+
+        self.thread = threading.Thread(target=self._run, daemon=True, name=f'tail:{path}')
+        self.thread.start()
+
+    def subscribe(self, lines, callback):
+        """
+        Sends last `lines` lines and then everything appended to the file to `callback(data)`.
+        """
+        with self.lock:
+            if lines > self.lines.maxlen:
+                self._load(lines)
+
+            tail = list(self.lines)
+            if self.partial:
+                tail.append(self.partial)
+
+            callback(''.join(tail[-lines:]) if lines > 0 else '')
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Returns `True` if there are no subscribers left and broker has stopped.
+        """
+        with self.lock:
+            self.subscribers.remove(callback)
+            if self.subscribers:
+                return False
+
+            self.stop.set()
+            return True
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_RDONLY)
+        self.st = os.fstat(self.fd)
+        self.position = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.watcher = Watcher(self.fd, self.stop)
+
+    def _close(self):
+        self.watcher.close()
+        os.close(self.fd)
+
+    def _load(self, lines):
+        tail = read_tail(self.fd, self.position, lines).decode('utf-8', 'replace').splitlines(True)
+        self.partial = tail.pop() if tail and not tail[-1].endswith('\n') else ''
+        self.lines = deque(tail[-lines:], maxlen=max(lines, TAIL_LINES))
+
+    def _run(self):
+        try:
+            while not self.stop.is_set():
+                self.watcher.wait(self.interval)
+                if self.stop.is_set():
+                    break
+
+                try:
+                    self._check()
+                except Exception:
+                    logger.warning('Error following %r', self.path, exc_info=True)
+        finally:
+            self._close()
+
+    def _check(self):
+        if os.fstat(self.fd).st_size < self.position:
+            with self.lock:
+                self.position = 0
+                self.decoder.reset()
+                self.lines.clear()
+                self.partial = ''
+
+        self._read()
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+
+        if (st.st_dev, st.st_ino) != (self.st.st_dev, self.st.st_ino):
+            self._close()
+            self._open()
+            self._read()
+
+    def _read(self):
+        while True:
+            data = os.pread(self.fd, BUFSIZE * 16, self.position)
+            if not data:
+                return
+
+            with self.lock:
+                self.position += len(data)
+                data = self.decoder.decode(data)
+                if not data:
+                    continue
+
+                lines = (self.partial + data).splitlines(True)
+                self.partial = lines.pop() if not lines[-1].endswith('\n') else ''
+                self.lines.extend(lines)
+
+                for callback in self.subscribers:
+                    try:
+                        callback(data)
+                    except Exception:
+                        logger.warning('Error sending %r data', self.path, exc_info=True)
+
+
+class TailBrokers:
+    """
+    One `TailBroker` per followed file, stopped when its last subscriber leaves.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.brokers = {}
+
+    def subscribe(self, path, lines, callback):
+        path = os.path.realpath(path)
+        with self.lock:
+            broker = self.brokers.get(path)
+            if broker is None:
+                broker = self.brokers[path] = TailBroker(path, self.interval)
+
+            broker.subscribe(lines, callback)
+
+    def unsubscribe(self, path, callback):
+        path = os.path.realpath(path)
+        with self.lock:
+            if self.brokers[path].unsubscribe(callback):
+                self.brokers.pop(path)
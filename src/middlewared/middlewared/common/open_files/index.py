@@ -0,0 +1,108 @@
+import json
+
+
+class PathTrie:
+    """
+    Maps path prefixes (e.g. dataset mountpoints) to keys. Looking up a path returns keys of all prefixes it is
+    located under, with cost proportional to path depth rather than to the number of prefixes.
+    """
+
+    def __init__(self, prefixes=None):
+        self.root = {}
+        for prefix, key in (prefixes or {}).items():
+            self.add(prefix, key)
+
+    def add(self, prefix, key):
+        node = self.root
+        for component in self._components(prefix):
+            node = node.setdefault(component, {})
+
+        node.setdefault(None, []).append(key)
+
+    def lookup(self, path):
+        keys = []
+        node = self.root
+        keys.extend(node.get(None, []))
+        for component in self._components(path):
+            node = node.get(component)
+            if node is None:
+                break
+
+            keys.extend(node.get(None, []))
+
+        return keys
+
+    def _components(self, path):
+        return [component for component in path.split('/') if component]
+
+
+def parse_procstat(output):
+    """
+    Parse `procstat -af --libxo json` output.
+
+    Returns list of `(pid, command, paths)`.
+    """
+    processes = []
+    for key, process in json.loads(output).get('procstat', {}).get('files', {}).items():
+        try:
+            pid = int(process.get('process_id', key))
+        except ValueError:
+            continue
+
+        paths = [file['path'] for file in process.get('files') or [] if file.get('path')]
+        processes.append((pid, process.get('command'), paths))
+
+    return processes
+
+
+def parse_lsof_processes(lsof):
+    """
+    Parse `lsof -F pcn` output.
+
+    Returns list of `(pid, command, paths)`.
+    """
+    processes = []
+    process = None
+    for line in lsof.split('\n'):
+        if line.startswith('p'):
+            process = None
+            try:
+                process = (int(line[1:]), None, [])
+            except ValueError:
+                pass
+            else:
+                processes.append(process)
+
+        if process is None:
+            continue
+
+        if line.startswith('c'):
+            processes[-1] = process = (process[0], line[1:], process[2])
+
+        if line.startswith('n'):
+            process[2].append(line[1:])
+
+    return processes
+
+
+def index_processes(processes, prefixes):
+    """
+    Find processes which have files open under given path prefixes in a single pass over `processes`.
+
+    `prefixes` maps path prefixes to keys (several prefixes may share the same key).
+    Returns dict(key) = dict(pid) = command, only for keys that have processes using them.
+    """
+    trie = PathTrie(prefixes)
+    result = {}
+    for pid, command, paths in processes:
+        if command is None:
+            continue
+
+        for path in paths:
+            if not path.startswith('/'):
+                continue
+
+            for key in trie.lookup(path):
+                result.setdefault(key, {})[pid] = command
+
+    return result
@@ -0,0 +1,230 @@
+import errno
+import os
+import stat
+import struct
+import threading
+
+try:
+    from bsd import acl
+except ImportError:
+    acl = None
+
+INHERITANCE_FLAGS = ['FILE_INHERIT', 'DIRECTORY_INHERIT', 'NO_PROPAGATE_INHERIT', 'INHERIT_ONLY']
+
+
+def inherit_acl(entries, is_dir):
+    """
+    ACL entries (in `bsd.acl.ACL.__getstate__` format) a new file or directory inherits from its parent directory
+    `entries` (like ZFS with `aclinherit=passthrough` does).
+    """
+    inherited = []
+    for entry in entries:
+        flags = entry['flags']
+        if is_dir:
+            if not (flags.get('FILE_INHERIT') or flags.get('DIRECTORY_INHERIT')):
+                continue
+
+            flags = dict(flags, INHERITED=True)
+            if flags.get('NO_PROPAGATE_INHERIT'):
+                if not flags.get('DIRECTORY_INHERIT'):
+                    continue
+
+                flags.update({flag: False for flag in INHERITANCE_FLAGS})
+            else:
+                # Entries only inherited by files are passed on to files below
+                flags['INHERIT_ONLY'] = not flags.get('DIRECTORY_INHERIT')
+        else:
+            if not flags.get('FILE_INHERIT'):
+                continue
+
+            flags = dict(flags, INHERITED=True, **{flag: False for flag in INHERITANCE_FLAGS})
+
+        inherited.append(dict(entry, flags=flags))
+
+    return inherited
+
+
+class InheritedACLs:
+    """
+    ACLs inherited by files and directories at any depth below a directory with `entries` ACL (depth 0).
+    """
+
+    def __init__(self, entries):
+        self.directories = [entries]
+        self.files = [None]
+        self.lock = threading.Lock()
+
+    def get(self, depth, is_dir):
+        if len(self.directories) <= depth:
+            with self.lock:
+                while len(self.directories) <= depth:
+                    self.files.append(inherit_acl(self.directories[-1], False))
+                    self.directories.append(inherit_acl(self.directories[-1], True))
+
+        return self.directories[depth] if is_dir else self.files[depth]
+
+
+class NFS4ACLBackend:
+    """
+    NFSv4 ACLs (FreeBSD, ZFS).
+    """
+
+    def get(self, path):
+        return acl.ACL(file=path).__getstate__()
+
+    def matches(self, path, st, entries, is_dir):
+        return self.get(path) == entries
+
+    def set(self, path, entries, is_dir):
+        a = acl.ACL()
+        a.__setstate__(entries)
+        a.apply(path)
+
+    def is_trivial(self, path):
+        return acl.ACL(file=path).is_trivial
+
+    def strip(self, path):
+        a = acl.ACL(file=path)
+        a.strip()
+        a.apply(path)
+
+
+class POSIXACLBackend:
+    """
+    Linux POSIX ACLs stand-in for NFSv4 ones (e.g. to run the tree walker on tmpfs). Only ALLOW entries are kept and
+    their permissions are reduced to read, write and execute. Inheritable entries of directories become their default
+    ACL.
+    """
+
+    ACCESS = 'system.posix_acl_access'
+    DEFAULT = 'system.posix_acl_default'
+
+    VERSION = 2
+    UNDEFINED_ID = 0xFFFFFFFF
+    TAGS = {
+        'USER_OBJ': 0x01,
+        'USER': 0x02,
+        'GROUP_OBJ': 0x04,
+        'GROUP': 0x08,
+        'EVERYONE': 0x20,
+    }
+    MASK = 0x10
+    MINIMAL_TAGS = {TAGS['USER_OBJ'], TAGS['GROUP_OBJ'], TAGS['EVERYONE']}
+
+    def encode(self, entries):
+        perms = {}
+        for entry in entries:
+            if entry['type'] != 'ALLOW':
+                continue
+
+            tag = self.TAGS[entry['tag']]
+            key = (tag, self.UNDEFINED_ID if entry['id'] is None or entry['id'] < 0 else entry['id'])
+            perms[key] = perms.get(key, 0) | (
+                (4 if entry['perms'].get('READ_DATA') else 0) |
+                (2 if entry['perms'].get('WRITE_DATA') else 0) |
+                (1 if entry['perms'].get('EXECUTE') else 0)
+            )
+
+        for tag in self.MINIMAL_TAGS:
+            perms.setdefault((tag, self.UNDEFINED_ID), 0)
+
+        if any(tag not in self.MINIMAL_TAGS for tag, id in perms):
+            perms[(self.MASK, self.UNDEFINED_ID)] = 0
+            for (tag, id), perm in list(perms.items()):
+                if tag in (self.TAGS['USER'], self.TAGS['GROUP_OBJ'], self.TAGS['GROUP']):
+                    perms[(self.MASK, self.UNDEFINED_ID)] |= perm
+
+        return struct.pack('<I', self.VERSION) + b''.join(
+            struct.pack('<HHI', tag, perm, id) for (tag, id), perm in sorted(perms.items())
+        )
+
+    def mode(self, encoded):
+        """
+        Mode of a minimal ACL (that kernel stores as mode bits only) or `None`.
+        """
+        entries = {
+            tag: perm
+            for tag, perm, id in struct.iter_unpack('<HHI', encoded[4:])
+        }
+        if set(entries) != self.MINIMAL_TAGS:
+            return None
+
+        return (
+            (entries[self.TAGS['USER_OBJ']] << 6) |
+            (entries[self.TAGS['GROUP_OBJ']] << 3) |
+            entries[self.TAGS['EVERYONE']]
+        )
+
+    def __init__(self):
+        self.encoded = {}
+
+    def matches(self, path, st, entries, is_dir):
+        access, mode, default = self._encoded(entries)
+        if mode is None:
+            if self._get(path, self.ACCESS) != access:
+                return False
+        elif self._get(path, self.ACCESS) is not None or stat.S_IMODE(st.st_mode) & 0o777 != mode:
+            return False
+
+        if is_dir and self._get(path, self.DEFAULT) != default:
+            return False
+
+        return True
+
+    def set(self, path, entries, is_dir):
+        access, mode, default = self._encoded(entries)
+        os.setxattr(path, self.ACCESS, access, follow_symlinks=False)
+
+        if is_dir:
+            if default is None:
+                self._remove(path, self.DEFAULT)
+            else:
+                os.setxattr(path, self.DEFAULT, default, follow_symlinks=False)
+
+    def is_trivial(self, path):
+        return self._get(path, self.ACCESS) is None and self._get(path, self.DEFAULT) is None
+
+    def strip(self, path):
+        self._remove(path, self.ACCESS)
+        self._remove(path, self.DEFAULT)
+
+    def _encoded(self, entries):
+        # `InheritedACLs` returns the same list for every entry at the same depth
+        encoded = self.encoded.get(id(entries))
+        if encoded is None or encoded[0] is not entries:
+            access = self.encode([entry for entry in entries if not entry['flags'].get('INHERIT_ONLY')])
+            encoded = self.encoded[id(entries)] = (entries, access, self.mode(access), self._default(entries))
+
+        return encoded[1:]
+
+    def _default(self, entries):
+        entries = [
+            entry for entry in entries
+            if entry['flags'].get('FILE_INHERIT') or entry['flags'].get('DIRECTORY_INHERIT')
+        ]
+        if not entries:
+            return None
+
+        return self.encode(entries)
+
+    def _get(self, path, name):
+        try:
+            return os.getxattr(path, name, follow_symlinks=False)
+        except OSError as e:
+            if e.errno == errno.ENODATA:
+                return None
+            raise
+
+    def _remove(self, path, name):
+        try:
+            os.removexattr(path, name, follow_symlinks=False)
+        except OSError as e:
+            if e.errno != errno.ENODATA:
+                raise
+
+
+def acl_backend():
+    if acl is not None:
+        return NFS4ACLBackend()
+
+    return POSIXACLBackend()
@@ -0,0 +1,219 @@
+import errno
+import os
+import queue
+import threading
+import time
+
+from middlewared.service_exception import CallError
+
+WALK_WORKERS = 8
+PROGRESS_INTERVAL = 1
+CHECKPOINT_INTERVAL = 30
+MAX_ERRORS = 10
+
+
+class Directory:
+    def __init__(self, path, relpath, depth, parent):
+        self.path = path
+        self.relpath = relpath
+        self.depth = depth
+        self.parent = parent
+        # Own listing and subdirectories that are not finished yet
+        self.pending = 1
+        self.failed = False
+        # Finished subdirectories (in the `done` set)
+        self.finished = []
+
+
+class Walker:
+    """
+    Calls `visit(dir_fd, name, path, st, depth)` for every file and directory below `root` (but not for `root`
+    itself) in `workers` threads. `visit` returns `True` if it has changed anything and raises `OSError` on failure.
+
+    Directories are opened once and listed with `os.scandir` so `visit` can use `dir_fd` (`*at` syscalls) instead of
+    resolving whole paths again. Mount points are not descended into unless `traverse` is set.
+
+    `done` is a set of directory paths (relative to `root`) that were processed completely before (see `checkpoint`),
+    they are skipped. Finished directories replace their subdirectories in this set so it stays small.
+    """
+
+    def __init__(self, root, visit, traverse=False, workers=WALK_WORKERS, done=None):
+        self.root = root
+        self.visit = visit
+        self.traverse = traverse
+        self.workers = workers
+        self.done = set(done or [])
+
+        self.lock = threading.Lock()
+        self.queue = queue.LifoQueue()
+        self.finished = threading.Event()
+
+        self.root_dev = None
+        self.devices = set()
+        self.estimate = 0
+        self.visited = 0
+        self.changed = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, progress=None, checkpoint=None):
+        """
+        Walks the tree, calling `progress(percent, description)` every `PROGRESS_INTERVAL` and
+        `checkpoint(done)` every `CHECKPOINT_INTERVAL` seconds from the calling thread.
+
+        Raises `CallError` if anything has failed (files that vanish while walking are ignored).
+        """
+        st = os.stat(self.root)
+        self.root_dev = st.st_dev
+        self._add_device(self.root, st.st_dev)
+
+        if '' not in self.done:
+            self.queue.put(Directory(self.root, '', 0, None))
+
+            threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+            for thread in threads:
+                thread.start()
+
+            last_checkpoint = time.monotonic()
+            while not self.finished.wait(PROGRESS_INTERVAL):
+                if progress is not None:
+                    progress(*self.progress())
+
+                if checkpoint is not None and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    checkpoint(self.checkpoint())
+                    last_checkpoint = time.monotonic()
+
+            for thread in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if self.failed:
+            if checkpoint is not None:
+                checkpoint(self.checkpoint())
+
+            raise CallError(
+                f'Failed to process {self.failed} entries under {self.root}: ' + '; '.join(self.errors),
+                errno.EIO,
+            )
+
+        if progress is not None:
+            progress(100, f'{self.visited} entries processed, {self.changed} changed')
+
+        return {'visited': self.visited, 'changed': self.changed}
+
+    def progress(self):
+        with self.lock:
+            visited, changed, estimate = self.visited, self.changed, self.estimate
+
+        # Estimate is the number of inodes used on the filesystem(s) which can be less than we have visited when
+        # files are being created or more when `root` is not the filesystem root
+        percent = min(int(visited * 100 / estimate) if estimate else 0, 99)
+        return percent, f'{visited} of about {estimate} entries processed, {changed} changed'
+
+    def checkpoint(self):
+        with self.lock:
+            return sorted(self.done)
+
+    def _add_device(self, path, dev):
+        if dev in self.devices:
+            return
+
+        self.devices.add(dev)
+        try:
+            statvfs = os.statvfs(path)
+        except OSError:
+            return
+
+        # Root directory itself is not visited
+        self.estimate += max(statvfs.f_files - statvfs.f_ffree - 1, 0)
+
+    def _worker(self):
+        while True:
+            directory = self.queue.get()
+            if directory is None:
+                break
+
+            self._scan(directory)
+            self._finish(directory)
+
+    def _scan(self, directory):
+        try:
+            fd = os.open(directory.path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                self._error(directory, directory.path, e)
+            return
+
+        try:
+            with os.scandir(fd) as it:
+                for entry in it:
+                    path = os.path.join(directory.path, entry.name)
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if is_dir:
+                            relpath = os.path.join(directory.relpath, entry.name)
+                            if relpath in self.done:
+                                with self.lock:
+                                    directory.finished.append(relpath)
+                                continue
+
+                            if st.st_dev != self.root_dev:
+                                if not self.traverse:
+                                    continue
+
+                                with self.lock:
+                                    self._add_device(path, st.st_dev)
+
+                        changed = self.visit(fd, entry.name, path, st, directory.depth + 1)
+                    except Exception as e:
+                        if not (isinstance(e, OSError) and e.errno == errno.ENOENT):
+                            self._error(directory, path, e)
+                        continue
+
+                    with self.lock:
+                        self.visited += 1
+                        if changed:
+                            self.changed += 1
+
+                        if is_dir:
+                            directory.pending += 1
+
+                    if is_dir:
+                        self.queue.put(Directory(path, relpath, directory.depth + 1, directory))
+        except OSError as e:
+            self._error(directory, directory.path, e)
+        finally:
+            os.close(fd)
+
+    def _error(self, directory, path, e):
+        with self.lock:
+            directory.failed = True
+            self.failed += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(f'{path}: {getattr(e, "strerror", None) or e}')
+
+    def _finish(self, directory):
+        with self.lock:
+            while directory is not None:
+                directory.pending -= 1
+                if directory.pending:
+                    break
+
+                parent = directory.parent
+                if directory.failed:
+                    # Keep what has been finished so we do not process it again
+                    if parent is not None:
+                        parent.failed = True
+                        parent.finished.extend(directory.finished)
+                else:
+                    self.done.difference_update(directory.finished)
+                    self.done.add(directory.relpath)
+                    if parent is not None:
+                        parent.finished.append(directory.relpath)
+
+                if parent is None:
+                    self.finished.set()
+
+                directory = parent
@@ -0,0 +1,187 @@
+import os
+import select
+import threading
+import time
+
+# How long a service state which is not backed by watched processes or an unchanged pidfile is trusted
+STATUS_TTL = 60
+# Process liveness polling interval where kqueue is not available
+POLL_INTERVAL = 5
+
+
+class ProcessWatcher:
+    """
+    Calls `callback(pid)` from a background thread when a watched process exits.
+
+    Uses kqueue `EVFILT_PROC` where available and falls back to polling watched pids otherwise.
+    """
+
+    def __init__(self, callback, poll_interval=POLL_INTERVAL):
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.pids = set()
+        self.lock = threading.Lock()
+        self.kqueue = select.kqueue() if hasattr(select, 'kqueue') else None
+        self.thread = None
+
+    def watch(self, pid):
+        """
+        Start watching `pid`. Returns `False` if the process does not exist anymore.
+        """
+        with self.lock:
+            if pid in self.pids:
+                return True
+
+            if self.kqueue is not None:
+                try:
+                    self.kqueue.control([select.kevent(
+                        pid, select.KQ_FILTER_PROC, select.KQ_EV_ADD | select.KQ_EV_ONESHOT, select.KQ_NOTE_EXIT,
+                    )], 0)
+                except ProcessLookupError:
+                    return False
+            elif not pid_exists(pid):
+                return False
+
+            self.pids.add(pid)
+
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run_kqueue if self.kqueue is not None else self._run_poll,
+                    daemon=True, name='service_process_watcher',
+                )
+                self.thread.start()
+
+        return True
+
+    def _exited(self, pids):
+        with self.lock:
+            pids = [pid for pid in pids if pid in self.pids]
+            self.pids.difference_update(pids)
+
+        for pid in pids:
+            self.callback(pid)
+
+    def _run_kqueue(self):
+        while True:
+            self._exited([event.ident for event in self.kqueue.control(None, 16)])
+
+    def _run_poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                pids = list(self.pids)
+            self._exited([pid for pid in pids if not pid_exists(pid)])
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def pidfile_stat(pidfile):
+    try:
+        st = os.stat(pidfile)
+    except FileNotFoundError:
+        return None
+
+    return st.st_ino, st.st_mtime_ns
+
+
+class ServiceStatusTracker:
+    """
+    Remembers last known state of services so they don't have to be probed on every `service.query`.
+
+    A known state is trusted while:
+      * the service is RUNNING and all of its pids are being watched (exit of any of them forgets the state)
+      * the service is STOPPED and its pidfile has not appeared or changed since
+      * `ttl` seconds have not passed since the service was probed (services we can't watch)
+
+    `on_exit(service)` is called from the watcher thread when a process of a RUNNING service exits.
+    """
+
+    def __init__(self, on_exit, ttl=STATUS_TTL, watcher=None):
+        self.on_exit = on_exit
+        self.ttl = ttl
+        self.watcher = watcher or ProcessWatcher(self._process_exited)
+        self.states = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, service, pidfile=None):
+        """
+        Returns known `(state, pids)` of `service` or `None` if it has to be probed.
+        """
+        with self.lock:
+            known = self.states.get(service)
+
+        if known is None or known['timestamp'] is None:
+            return None
+
+        if known['state'] == 'RUNNING' and known['watched']:
+            return known['state'], known['pids']
+
+        if known['state'] == 'STOPPED' and pidfile and pidfile_stat(pidfile) == known['pidfile']:
+            return known['state'], known['pids']
+
+        if time.monotonic() - known['timestamp'] < self.ttl:
+            return known['state'], known['pids']
+
+        return None
+
+    def generation(self, service):
+        """
+        Changes every time `service` state is invalidated, pass it to `set` so results of probes started before
+        the service was started/stopped are discarded.
+        """
+        with self.lock:
+            return self.generations.get(service, 0)
+
+    def set(self, service, state, pids, pidfile=None, generation=None):
+        """
+        Record probed state of `service`. Returns `True` if it differs from the previously known state.
+        """
+        watched = state == 'RUNNING' and bool(pids) and all(self.watcher.watch(pid) for pid in pids)
+        with self.lock:
+            if generation is not None and generation != self.generations.get(service, 0):
+                return False
+
+            previous = self.states.get(service)
+            self.states[service] = {
+                'state': state,
+                'pids': pids,
+                'watched': watched,
+                'pidfile': pidfile_stat(pidfile) if pidfile else None,
+                'timestamp': time.monotonic(),
+            }
+
+        return previous is not None and (previous['state'], previous['pids']) != (state, pids)
+
+    def last(self, service):
+        """
+        Last known `(state, pids)` of `service` regardless of whether it can be trusted.
+        """
+        with self.lock:
+            known = self.states.get(service)
+
+        return (known['state'], known['pids']) if known else None
+
+    def invalidate(self, service):
+        with self.lock:
+            self.generations[service] = self.generations.get(service, 0) + 1
+            known = self.states.get(service)
+            if known is not None:
+                known['timestamp'] = None
+
+    def _process_exited(self, pid):
+        with self.lock:
+            services = [service for service, known in self.states.items() if pid in known['pids']]
+
+        for service in services:
+            self.invalidate(service)
+            self.on_exit(service)
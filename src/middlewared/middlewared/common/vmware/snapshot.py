@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+import concurrent.futures
+import time
+
+# VM properties retrieved with a single `PropertyCollector` call per vCenter, everything we need to decide
+# which VMs to snapshot so accessing them does not involve any more SOAP round trips.
+VM_PROPERTIES = [
+    'name',
+    'config.uuid',
+    'summary.runtime.powerState',
+    'datastore',
+    'config.hardware.device',
+    'snapshot',
+]
+# Maximum number of snapshots being created/removed at the same time on a single vCenter
+SNAPSHOT_CONCURRENCY = 8
+
+
+def vm_depends_on_datastore(vm, datastore, datastore_names):
+    """
+    Check if a VM is using a certain datastore.
+
+    `vm` is a dict of `VM_PROPERTIES`, `datastore_names` maps datastore references to their names.
+    """
+    # simple case, VM config data is on a datastore.
+    # not sure how critical it is to snapshot the store that has config data, but best to do so
+    for ref in vm.get('datastore') or []:
+        if (datastore_names.get(ref) or '').startswith(datastore):
+            return True
+
+    # check if VM has disks on the data store
+    # we check both "diskDescriptor" and "diskExtent" types of files
+    for device in vm.get('config.hardware.device') or []:
+        backing = getattr(device, 'backing', None)
+        if backing is None or not hasattr(backing, 'fileName'):
+            continue
+        if datastore_names.get(getattr(backing, 'datastore', None)) == datastore:
+            return True
+
+    return False
+
+
+def find_snapshot(snapshot_info, name):
+    """
+    Find snapshot reference by its name in VM `snapshot` property, returns `None` if there is no such snapshot.
+    """
+    if snapshot_info is None:
+        return None
+
+    trees = list(snapshot_info.rootSnapshotList or [])
+    while trees:
+        tree = trees.pop()
+        if tree.name == name:
+            return tree.snapshot
+        trees.extend(tree.childSnapshotList or [])
+
+    return None
+
+
+def run_concurrently(func, items, concurrency):
+    """
+    Call `func(item)` for every item using at most `concurrency` threads.
+
+    Returns a list of `(item, result, exception)` in the order of `items`.
+    """
+    if not items:
+        return []
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(concurrency, len(items)), thread_name_prefix='vmware',
+    ) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for item, future in zip(items, futures):
+            try:
+                results.append((item, future.result(), None))
+            except Exception as e:
+                results.append((item, None, e))
+
+    return results
+
+
+class PhaseTimer:
+    """
+    Accumulates wall clock time spent in named phases, e.g.
+
+        with timer('login'):
+            ...
+    """
+
+    def __init__(self, timings=None):
+        self.timings = timings if timings is not None else {}
+
+    @contextmanager
+    def __call__(self, phase):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time.monotonic() - start
+
+
+def format_timings(timings):
+    """
+    Format `{hostname: {phase: seconds}}` as a human readable report.
+    """
+    return '; '.join(
+        f'{hostname}: ' + ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in phases.items())
+        for hostname, phases in sorted(timings.items())
+    ) or 'no vCenters'
@@ -0,0 +1,113 @@
+import threading
+import time
+
+# Progress messages of a single task are forwarded at most once per this many seconds
+PROGRESS_INTERVAL = 1
+
+
+class ProgressCoalescer:
+    """
+    Forwards observer messages to `put`, but of messages with the same coalescing key received within `interval`
+    only the latest one is forwarded.
+
+    `key(message)` returns coalescing key for progress messages (e.g. task id and message type) and `None` for all
+    other messages. Other messages are always forwarded immediately, pending messages of the same task are
+    forwarded before them so task progress is never reported after the task has finished.
+    """
+
+    def __init__(self, put, key, interval=PROGRESS_INTERVAL):
+        self.put = put
+        self.key = key
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_sent = {}
+        self.coalesced = 0
+        self.flusher = None
+
+    def __call__(self, message):
+        key = self.key(message)
+        with self.lock:
+            if key is None:
+                task_id = getattr(message, 'task_id', None)
+                for pending_key, pending in list(self.pending.items()):
+                    if getattr(pending, 'task_id', None) == task_id:
+                        del self.pending[pending_key]
+                        self.put(pending)
+                self.put(message)
+                return
+
+            now = time.monotonic()
+            if now - self.last_sent.get(key, 0) >= self.interval:
+                self.pending.pop(key, None)
+                self.last_sent[key] = now
+                self.put(message)
+                return
+
+            if key in self.pending:
+                self.coalesced += 1
+            self.pending[key] = message
+
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_loop, daemon=True, name='observer_coalescer')
+                self.flusher.start()
+
+    def flush(self):
+        """
+        Forward progress messages which have been pending for at least `interval`.
+        """
+        with self.lock:
+            now = time.monotonic()
+            for key, message in list(self.pending.items()):
+                if now - self.last_sent.get(key, 0) >= self.interval:
+                    del self.pending[key]
+                    self.last_sent[key] = now
+                    self.put(message)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval / 4)
+            self.flush()
+
+
+class ObserverMetrics:
+    """
+    Observer queue depth and latency (time between the message was put in the queue in zettarepl process
+    and the moment middleware finished handling it).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latency_total = 0.0
+        self.max_latency = 0.0
+
+    def record(self, queued_at, queue_depth):
+        latency = max(time.monotonic() - queued_at, 0)
+        with self.lock:
+            self.messages += 1
+            self.latency_total += latency
+            self.max_latency = max(self.max_latency, latency)
+            if queue_depth is not None:
+                self.queue_depth = queue_depth
+                self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def get(self):
+        with self.lock:
+            return {
+                'messages': self.messages,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'average_latency': self.latency_total / self.messages if self.messages else None,
+                'max_latency': self.max_latency,
+            }
+
+
+def enqueue(queue, message):
+    """
+    Put observer `message` into multiprocessing `queue` along with the time it was queued at (monotonic clock is
+    system-wide so it can be compared in the middleware process).
+    """
+    queue.put((time.monotonic(), message))
@@ -0,0 +1,132 @@
+import hashlib
+import re
+import threading
+import time
+
+from middlewared.client import ejson
+
+# How long listed datasets and snapshot names of a replication peer are trusted
+SNAPSHOT_INDEX_TTL = 30
+# Datasets which snapshots are listed with a single `zfs list` call
+SNAPSHOT_LIST_BATCH = 100
+
+# Superset of what `datetime.strptime` accepts for directives used in naming schemas. Names that match are then
+# parsed by zettarepl itself, these only let us skip names that can't match without calling `strptime` for each
+NAMING_SCHEMA_DIRECTIVES = {
+    "Y": r"\d{4}",
+    "y": r"\d{1,2}",
+    "m": r"\d{1,2}",
+    "d": r"[ \d]?\d",
+    "H": r"\d{1,2}",
+    "I": r"\d{1,2}",
+    "M": r"\d{1,2}",
+    "S": r"\d{1,2}",
+    "j": r"\d{1,3}",
+    "f": r"\d{1,6}",
+    "z": r"(?:[+-]\d\d:?\d\d(?::?\d\d(?:\.\d{1,6})?)?|Z)?",
+    "%": "%",
+}
+
+
+def naming_schema_regex(naming_schema):
+    pattern = ""
+    i = 0
+    while i < len(naming_schema):
+        c = naming_schema[i]
+        if c == "%" and i + 1 < len(naming_schema):
+            pattern += NAMING_SCHEMA_DIRECTIVES.get(naming_schema[i + 1], ".*?")
+            i += 2
+        elif c.isspace():
+            pattern += r"\s+"
+            while i < len(naming_schema) and naming_schema[i].isspace():
+                i += 1
+        else:
+            pattern += re.escape(c)
+            i += 1
+
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class NamingSchemaMatcher:
+    def __init__(self, naming_schemas):
+        self.naming_schemas = naming_schemas
+        self.regexes = [naming_schema_regex(naming_schema) for naming_schema in naming_schemas]
+
+    def filter(self, names):
+        """
+        Returns `names` that might match any of the naming schemas.
+        """
+        return [name for name in names if any(regex.fullmatch(name) for regex in self.regexes)]
+
+
+def transport_key(transport_definition):
+    return hashlib.sha256(ejson.dumps(transport_definition, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def list_snapshot_names(shell, datasets):
+    """
+    Lists names of snapshots of `datasets` (not recursively) using a single `zfs list` call.
+    """
+    snapshots = {dataset: [] for dataset in datasets}
+    output = shell.exec(["zfs", "list", "-t", "snapshot", "-H", "-o", "name", "-s", "name", "-d", "1"] + datasets)
+    for line in output.split("\n"):
+        if "@" in line:
+            dataset, name = line.split("@", 1)
+            snapshots.setdefault(dataset, []).append(name)
+
+    return snapshots
+
+
+class SnapshotIndex:
+    """
+    Datasets and snapshot names of replication peers (identified by `transport_key`) listed recently.
+    """
+
+    def __init__(self, ttl=SNAPSHOT_INDEX_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.datasets = {}
+        self.snapshots = {}
+
+    def get_datasets(self, key):
+        with self.lock:
+            return self._get(self.datasets, key)
+
+    def put_datasets(self, key, datasets):
+        with self.lock:
+            self._prune()
+            self.datasets[key] = time.monotonic(), datasets
+
+    def get_snapshots(self, key, dataset):
+        with self.lock:
+            return self._get(self.snapshots, (key, dataset))
+
+    def put_snapshots(self, key, snapshots):
+        now = time.monotonic()
+        with self.lock:
+            self._prune()
+            for dataset, names in snapshots.items():
+                self.snapshots[(key, dataset)] = now, names
+
+    def invalidate(self, key):
+        with self.lock:
+            self.datasets.pop(key, None)
+            for k in [k for k in self.snapshots if k[0] == key]:
+                del self.snapshots[k]
+
+    def _get(self, entries, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+
+        if time.monotonic() - entry[0] >= self.ttl:
+            del entries[key]
+            return None
+
+        return entry[1]
+
+    def _prune(self):
+        now = time.monotonic()
+        for entries in (self.datasets, self.snapshots):
+            for k in [k for k, (timestamp, _) in entries.items() if now - timestamp >= self.ttl]:
+                del entries[k]
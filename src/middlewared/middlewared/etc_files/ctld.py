@@ -1,4 +1,5 @@
 #!/usr/local/bin/python
+from collections import defaultdict
 from middlewared.client.utils import Struct
 import contextlib
 import logging
@@ -114,6 +115,30 @@ def main(middleware):
                                         None, {'get': True}))
     if gconf.iscsi_alua:
         node = middleware.call_sync('failover.node')
+        interfaces = middleware.call_sync('datastore.query', 'network.Interfaces')
+        aliases = middleware.call_sync('datastore.query', 'network.Alias')
+
+    # Every table is only queried once and joined here, the number of queries must not depend
+    # on the number of portals, targets or extents.
+    auth_credentials = defaultdict(list)
+    for auth in middleware.call_sync('datastore.query', 'services.iSCSITargetAuthCredential'):
+        auth_credentials[auth['iscsi_target_auth_tag']].append(Struct(auth))
+
+    portal_ips = defaultdict(list)
+    for portal in middleware.call_sync('datastore.query', 'services.iSCSITargetPortalIP'):
+        portal_ips[portal['iscsi_target_portalip_portal']['id']].append(Struct(portal))
+
+    target_groups = defaultdict(list)
+    for grp in middleware.call_sync('datastore.query', 'services.iscsitargetgroups'):
+        target_groups[grp['iscsi_target']['id']].append(Struct(grp))
+
+    fc_ports = defaultdict(list)
+    for fctt in middleware.call_sync('datastore.query', 'services.fibrechanneltotarget'):
+        fc_ports[fctt['fc_target']['id']].append(Struct(fctt))
+
+    target_extents = defaultdict(list)
+    for t2e in middleware.call_sync('datastore.query', 'services.iscsitargettoextent'):
+        target_extents[t2e['iscsi_target']['id']].append(Struct(t2e))
 
     if gconf.iscsi_isns_servers:
         for server in gconf.iscsi_isns_servers.split():
@@ -125,12 +150,7 @@ def main(middleware):
         pg = Struct(pg)
         # Prepare auth group for the portal group
         if pg.iscsi_target_portal_discoveryauthgroup:
-            auth_list = [
-                Struct(i)
-                for i in middleware.call_sync('datastore.query', 'services.iSCSITargetAuthCredential',
-                                              [('iscsi_target_auth_tag', '=',
-                                                pg.iscsi_target_portal_discoveryauthgroup)])
-            ]
+            auth_list = auth_credentials[pg.iscsi_target_portal_discoveryauthgroup]
         else:
             auth_list = []
         agname = 'ag4pg%d' % pg.iscsi_target_portal_tag
@@ -140,11 +160,7 @@ def main(middleware):
             agname = 'no-authentication'
 
         # Prepare IPs to listen on for all portal groups.
-        portals = [
-            Struct(i)
-            for i in middleware.call_sync('datastore.query', 'services.iSCSITargetPortalIP',
-                                          [('iscsi_target_portalip_portal', '=', pg.id)])
-        ]
+        portals = portal_ips[pg.id]
         listen = []
         listenA = []
         listenB = []
@@ -161,14 +177,14 @@ def main(middleware):
                     found = True
                     break
                 if not found:
-                    for net in middleware.call_sync('datastore.query', 'network.Interfaces'):
+                    for net in interfaces:
                         if net['int_vip'] == address and net['int_ipv4address'] and net['int_ipv4address_b']:
                             listenA.append('%s:%s' % (net['int_ipv4address'], portal.iscsi_target_portalip_port))
                             listenB.append('%s:%s' % (net['int_ipv4address_b'], portal.iscsi_target_portalip_port))
                             found = True
                             break
                 if not found:
-                    for alias in middleware.call_sync('datastore.query', 'network.Alias'):
+                    for alias in aliases:
                         if alias['alias_vip'] == address and alias['alias_v4address'] and alias['alias_v4address_b']:
                             listenA.append('%s:%s' % (alias['alias_v4address'], portal.iscsi_target_portalip_port))
                             listenB.append('%s:%s' % (alias['alias_v4address_b'], portal.iscsi_target_portalip_port))
@@ -212,10 +228,31 @@ def main(middleware):
     poolthreshold = {}
     zpoollist = middleware.call_sync('notifier.zpool_list')
 
+    extents = [
+        Struct(extent)
+        for extent in middleware.call_sync('datastore.query', 'services.iSCSITargetExtent',
+                                           [['iscsi_target_extent_enabled', '=', True]])
+    ]
+
+    disks = {}
+    if any(extent.iscsi_target_extent_type == 'Disk' for extent in extents):
+        for disk in middleware.call_sync('datastore.query', 'storage.Disk', None,
+                                         {'order_by': ['disk_expiretime']}):
+            disks.setdefault(disk['disk_identifier'], Struct(disk))
+
+    volsizes = {}
+    if any(
+        extent.iscsi_target_extent_avail_threshold and not extent.iscsi_target_extent_path.startswith('/mnt')
+        for extent in extents if extent.iscsi_target_extent_type != 'Disk' and extent.iscsi_target_extent_path
+    ):
+        for zvol in middleware.call_sync('zfs.dataset.query', [('type', '=', 'VOLUME')],
+                                         {'extra': {'properties': ['volsize'], 'user_properties': False}}):
+            volsizes[zvol['name']] = zvol['properties']['volsize']['parsed']
+
+    vendor = 'FreeNAS' if middleware.call_sync('notifier.is_freenas') else 'TrueNAS'
+
     # Generate the LUN section
-    for extent in middleware.call_sync('datastore.query', 'services.iSCSITargetExtent',
-                                       [['iscsi_target_extent_enabled', '=', True]]):
-        extent = Struct(extent)
+    for extent in extents:
         path = extent.iscsi_target_extent_path
         if not path:
             logger.warning('Path for extent id %d is null, skipping', extent.id)
@@ -224,12 +261,9 @@ def main(middleware):
         poolname = None
         lunthreshold = None
         if extent.iscsi_target_extent_type == 'Disk':
-            disk = middleware.call_sync('datastore.query', 'storage.Disk',
-                                        [('disk_identifier', '=', path)],
-                                        {'order_by': ['disk_expiretime']})
+            disk = disks.get(path)
             if not disk:
                 continue
-            disk = Struct(disk[0])
             if disk.disk_multipath_name:
                 path = '/dev/multipath/%s' % disk.disk_multipath_name
             else:
@@ -246,9 +280,8 @@ def main(middleware):
                         )
                 if extent.iscsi_target_extent_avail_threshold:
                     zvolname = path.split('/', 1)[1]
-                    zfslist = middleware.call_sync('notifier.zfs_list', zvolname, False, False, False, ['volume'])
-                    if zfslist:
-                        lunthreshold = int(zfslist[zvolname]['volsize'] *
+                    if zvolname in volsizes:
+                        lunthreshold = int(volsizes[zvolname] *
                                            (extent.iscsi_target_extent_avail_threshold / 100.0))
                 path = '/dev/' + path
             else:
@@ -283,10 +316,7 @@ def main(middleware):
         if extent.iscsi_target_extent_legacy is True:
             addline('\toption "vendor" "FreeBSD"\n')
         else:
-            if middleware.call_sync('notifier.is_freenas'):
-                addline('\toption "vendor" "FreeNAS"\n')
-            else:
-                addline('\toption "vendor" "TrueNAS"\n')
+            addline('\toption "vendor" "%s"\n' % vendor)
 
         addline('\toption "product" "iSCSI Disk"\n')
         addline('\toption "revision" "0123"\n')
@@ -314,15 +344,9 @@ def main(middleware):
         target = Struct(target)
 
         authgroups = {}
-        for grp in middleware.call_sync('datastore.query', 'services.iscsitargetgroups',
-                                        [('iscsi_target', '=', target.id)]):
-            grp = Struct(grp)
+        for grp in target_groups[target.id]:
             if grp.iscsi_target_authgroup:
-                auth_list = [
-                    Struct(i)
-                    for i in middleware.call_sync('datastore.query', 'services.iSCSITargetAuthCredential',
-                                                  [('iscsi_target_auth_tag', '=', grp.iscsi_target_authgroup)])
-                ]
+                auth_list = auth_credentials[grp.iscsi_target_authgroup]
             else:
                 auth_list = []
             agname = 'ag4tg%d_%d' % (target.id, grp.id)
@@ -342,14 +366,10 @@ def main(middleware):
         elif target.iscsi_target_name:
             addline('\talias "%s"\n' % target.iscsi_target_name)
 
-        for fctt in middleware.call_sync('datastore.query', 'services.fibrechanneltotarget',
-                                         [('fc_target', '=', target.id)]):
-            fctt = Struct(fctt)
+        for fctt in fc_ports[target.id]:
             addline('\tport "%s"\n' % fctt.fc_port)
 
-        for grp in middleware.call_sync('datastore.query', 'services.iscsitargetgroups',
-                                        [('iscsi_target', '=', target.id)]):
-            grp = Struct(grp)
+        for grp in target_groups[target.id]:
             agname = authgroups.get(grp.id) or 'no-authentication'
             if gconf.iscsi_alua:
                 addline('\tportal-group "pg%dA" "%s"\n' % (grp.iscsi_target_portalgroup.iscsi_target_portal_tag,
@@ -360,19 +380,10 @@ def main(middleware):
                 addline('\tportal-group "pg%d" "%s"\n' % (grp.iscsi_target_portalgroup.iscsi_target_portal_tag,
                                                           agname))
         addline('\n')
-        used_lunids = [
-            o['iscsi_lunid']
-            for o in middleware.call_sync('datastore.query', 'services.iscsitargettoextent',
-                                          [('iscsi_target', '=', target.id),
-                                           ('iscsi_lunid', '!=', None)])
-        ]
+        used_lunids = {t2e.iscsi_lunid for t2e in target_extents[target.id] if t2e.iscsi_lunid is not None}
         cur_lunid = 0
-        for t2e in middleware.call_sync('datastore.query', 'services.iscsitargettoextent',
-                                        [('iscsi_target', '=', target.id)],
-                                        {'extra': {'select': {'null_first': 'iscsi_lunid IS NULL'}},
-                                         'order_by': ['null_first', 'iscsi_lunid']}):
-            t2e = Struct(t2e)
-
+        # Explicit LUN ids first, then the ones which get the first free id
+        for t2e in sorted(target_extents[target.id], key=lambda t2e: (t2e.iscsi_lunid is None, t2e.iscsi_lunid or 0)):
             if t2e.iscsi_lunid is None:
                 while cur_lunid in used_lunids:
                     cur_lunid += 1
@@ -379,8 +379,12 @@ class Job(object):
         if self.options.get('process'):
             rv = await self.middleware._call_worker(self.method_name, *self.args, job={'id': self.id})
         else:
-            # Make sure args are not altered during job run
-            args = copy.deepcopy(self.args)
+            if hasattr(self.method, 'accepts'):
+                # `accepts` already passes the method a cleaned copy of its arguments
+                args = list(self.args)
+            else:
+                # Make sure args are not altered during job run
+                args = copy.deepcopy(self.args)
             if asyncio.iscoroutinefunction(self.method):
                 rv = await self.method(*([self] + args))
             else:
@@ -7,7 +7,7 @@ from .restful import RESTfulAPI
 from .schema import Error as SchemaError
 from .service import CallError, CallException, ValidationError, ValidationErrors
 from .service_exception import adapt_exception
-from .utils import start_daemon_thread, LoadPluginsMixin
+from .utils import start_daemon_thread, setup_dependencies, LoadPluginsMixin
 from .utils.debug import get_threads_stacks
 from .utils.lock import SoftHardSemaphore, SoftHardSemaphoreLimit
 from .utils.io_thread_pool_executor import IoThreadPoolExecutor
@@ -51,6 +51,11 @@ import uuid
 from . import logger
 
 
+# Results that are lists longer than this are encoded in a thread, piece by piece, and sent to clients that support
+# chunked results as a series of `result` messages of this many items
+RESULT_CHUNK_LENGTH = 10000
+
+
 class Application(object):
 
     def __init__(self, middleware, loop, request, response):
@@ -66,6 +71,7 @@ class Application(object):
         # Allow at most 10 concurrent calls and only queue up until 20
         self._softhardsemaphore = SoftHardSemaphore(10, 20)
         self._py_exceptions = False
+        self._chunked_results = False
 
         """
         Callback index registered by services. They are blocking.
@@ -85,6 +91,51 @@ class Application(object):
     def _send(self, data):
         asyncio.run_coroutine_threadsafe(self.response.send_str(json.dumps(data)), loop=self.loop)
 
+    async def _send_result(self, message, result):
+        if not isinstance(result, list) or len(result) <= RESULT_CHUNK_LENGTH:
+            self._send({
+                'id': message['id'],
+                'msg': 'result',
+                'result': result,
+            })
+            return
+
+        # Do not block the event loop encoding large results and only encode the next part once the previous one
+        # was written to the websocket
+        if self._chunked_results:
+            for i in range(0, len(result), RESULT_CHUNK_LENGTH):
+                data = {
+                    'id': message['id'],
+                    'msg': 'result',
+                    'result': result[i:i + RESULT_CHUNK_LENGTH],
+                }
+                if i + RESULT_CHUNK_LENGTH < len(result):
+                    data['more'] = True
+                if not await self._send_str(await self.middleware.run_in_thread(json.dumps, data)):
+                    return
+        else:
+            await self._send_str(await self.middleware.run_in_thread(lambda: ''.join(json.iterdumps({
+                'id': message['id'],
+                'msg': 'result',
+                'result': result,
+            }, RESULT_CHUNK_LENGTH))))
+
+    async def _send_str(self, data):
+        """
+        Returns False if the client has disconnected so there is no point in sending anything else.
+        """
+        try:
+            await self.response.send_str(data)
+        except ConnectionResetError:
+            return False
+        except RuntimeError:
+            # aiohttp raises it when writing to a websocket which is already closed
+            if not self.response.closed:
+                raise
+            return False
+
+        return True
+
     def _tb_error(self, exc_info):
         klass, exc, trace = exc_info
 
@@ -177,11 +228,7 @@ class Application(object):
                 result = list(result)
             elif isinstance(result, types.AsyncGeneratorType):
                 result = [i async for i in result]
-            self._send({
-                'id': message['id'],
-                'msg': 'result',
-                'result': result,
-            })
+            await self._send_result(message, result)
         except SoftHardSemaphoreLimit as e:
             self.send_error(
                 message,
@@ -327,6 +374,8 @@ class Application(object):
                 features = message.get('features') or []
                 if 'PY_EXCEPTIONS' in features:
                     self._py_exceptions = True
+                if 'CHUNKED_RESULTS' in features:
+                    self._chunked_results = True
                 # aiohttp can cancel tasks if a request take too long to finish
                 # It is desired to prevent that in this stage in case we are debugging
                 # middlewared via gdb (which makes the program execution a lot slower)
@@ -367,10 +416,14 @@ class Application(object):
 
 class FileApplication(object):
 
+    CHUNK_SIZE = 1048576
+
     def __init__(self, middleware, loop):
         self.middleware = middleware
         self.loop = loop
         self.jobs = {}
+        # Number of downloads in progress for jobs whose output is a regular file
+        self.downloads = defaultdict(int)
 
     def register_job(self, job_id):
         self.jobs[job_id] = self.middleware.loop.call_later(
@@ -423,26 +476,102 @@ class FileApplication(object):
             resp.set_status(410)
             return resp
 
-        resp = web.StreamResponse(status=200, reason='OK', headers={
+        output = job.pipes.output
+        headers = {
             'Content-Type': 'application/octet-stream',
             'Content-Disposition': f'attachment; filename="{filename}"',
-            'Transfer-Encoding': 'chunked',
-        })
-        await resp.prepare(request)
+        }
 
-        def do_copy():
-            while True:
-                read = job.pipes.output.r.read(1048576)
-                if read == b'':
-                    break
-                asyncio.run_coroutine_threadsafe(resp.write(read), loop=self.loop).result()
+        if output.file is None:
+            # Read the pipe in the event loop, it will either carry the job output or be closed right away
+            # in case the job handed us a regular file (see `Pipe.send_file`).
+            reader = asyncio.StreamReader(limit=self.CHUNK_SIZE, loop=self.loop)
+            transport, _ = await self.loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader, loop=self.loop), output.r,
+            )
+            try:
+                read = await reader.read(self.CHUNK_SIZE)
+                if read != b'' or output.file is None:
+                    resp = web.StreamResponse(status=200, reason='OK', headers=dict(headers, **{
+                        'Transfer-Encoding': 'chunked',
+                    }))
+                    await resp.prepare(request)
+                    try:
+                        while read != b'':
+                            await resp.write(read)
+                            read = await reader.read(self.CHUNK_SIZE)
+                    finally:
+                        await self._cleanup_job(job_id)
+
+                    await resp.drain()
+                    return resp
+            finally:
+                transport.close()
+
+        # Output is backed by a regular file, it can be downloaded (and resumed) as many times as needed
+        # until the job registration expires.
+        if job_id not in self.jobs:
+            resp = web.Response()
+            resp.set_status(410)
+            return resp
 
+        self.jobs[job_id].cancel()
+        self.downloads[job_id] += 1
         try:
-            await self.middleware.run_in_thread(do_copy)
+            return await self._send_file(request, output.file, output.file_offset, headers)
         finally:
-            await self._cleanup_job(job_id)
+            self.downloads[job_id] -= 1
+            if self.downloads[job_id] == 0:
+                del self.downloads[job_id]
+                if job_id in self.jobs:
+                    self.register_job(job_id)
+
+    async def _send_file(self, request, f, offset, headers):
+        size = (await self.middleware.run_in_thread(os.fstat, f.fileno())).st_size - offset
+        headers = dict(headers, **{'Accept-Ranges': 'bytes'})
+
+        try:
+            http_range = request.http_range
+        except ValueError:
+            http_range = slice(None, None)
+            invalid_range = True
+        else:
+            invalid_range = False
+
+        start, end = 0, size
+        status = 200
+        if http_range.start is not None or http_range.stop is not None or invalid_range:
+            start = http_range.start or 0
+            if start < 0:
+                # Suffix range, e.g. `bytes=-500`
+                start = max(size + start, 0)
+            if http_range.stop is not None:
+                end = min(http_range.stop, size)
+            if invalid_range or start >= end:
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+
+        resp = web.StreamResponse(status=status, headers=headers)
+        resp.content_length = end - start
+        await resp.prepare(request)
 
-        await resp.drain()
+        if end > start:
+            try:
+                await self.loop.sendfile(request.transport, f, offset + start, end - start)
+            except NotImplementedError:
+                # e.g. transport does not support `sendfile`
+                position = offset + start
+                while position < offset + end:
+                    read = await self.middleware.run_in_thread(
+                        os.pread, f.fileno(), min(self.CHUNK_SIZE, offset + end - position), position,
+                    )
+                    if read == b'':
+                        break
+                    await resp.write(read)
+                    position += len(read)
+
+        await resp.write_eof()
         return resp
 
     async def upload(self, request):
@@ -505,26 +634,28 @@ class FileApplication(object):
             resp.set_status(405)
             return resp
 
-        def copy():
+        async def copy():
+            # Write to the pipe from the event loop, draining it as the job reads
+            transport, protocol = await self.loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, job.pipes.input.w,
+            )
+            writer = asyncio.StreamWriter(transport, protocol, None, self.loop)
             try:
-                try:
-                    while True:
-                        read = asyncio.run_coroutine_threadsafe(
-                            filepart.read_chunk(1048576),
-                            loop=self.loop,
-                        ).result()
-                        if read == b'':
-                            break
-                        job.pipes.input.w.write(read)
-                finally:
-                    job.pipes.input.w.close()
-            except BrokenPipeError:
+                while True:
+                    read = await filepart.read_chunk(self.CHUNK_SIZE)
+                    if read == b'':
+                        break
+                    writer.write(read)
+                    await writer.drain()
+            except (BrokenPipeError, ConnectionResetError):
                 pass
+            finally:
+                writer.close()
 
         try:
             job = await self.middleware.call(data['method'], *(data.get('params') or []),
                                              pipes=Pipes(input=self.middleware.pipe()))
-            await self.middleware.run_in_thread(copy)
+            await copy()
         except CallError as e:
             if e.errno == CallError.ENOMETHOD:
                 status_code = 422
@@ -794,6 +925,13 @@ class Middleware(LoadPluginsMixin):
         self.__console_io = False if os.path.exists(self.CONSOLE_ONCE_PATH) else None
         self.__terminate_task = None
         self.jobs = JobsQueue(self)
+        self.__startup_profile = {
+            'plugins': {},
+            'import': None,
+            'resolve': None,
+            'setup': None,
+            'total': None,
+        }
 
     def __init_services(self):
         from middlewared.service import CoreService
@@ -801,19 +939,40 @@ class Middleware(LoadPluginsMixin):
 
     async def __plugins_load(self):
 
-        setup_funcs = []
+        setup_modules = {}
+        profile = self.__startup_profile
+        plugins_profile = profile['plugins']
+        load_start = last_checkpoint = time.monotonic()
 
         def on_module_begin(mod):
+            nonlocal last_checkpoint
+            # Module has just been imported by the plugins loader
+            now = time.monotonic()
+            plugins_profile[mod.__name__.rsplit('.', 1)[-1]] = {
+                'import': now - last_checkpoint,
+                'setup': None,
+                'setup_start': None,
+                'setup_depends': [],
+            }
+            last_checkpoint = now
             self._console_write(f'loaded plugin {mod.__name__}')
             self.__incr_startup_seq()
 
         def on_module_end(mod):
+            nonlocal last_checkpoint
+            now = time.monotonic()
+            name = mod.__name__.rsplit('.', 1)[-1]
+            # Account services instantiation to the module as well
+            plugins_profile[name]['import'] += now - last_checkpoint
+            last_checkpoint = now
             if not hasattr(mod, 'setup'):
                 return
-            setup_plugin = mod.__name__.rsplit('.', 1)[-1]
-            setup_funcs.append((setup_plugin, mod.setup))
+            setup_modules[name] = mod
 
         def on_modules_loaded():
+            nonlocal last_checkpoint
+            last_checkpoint = time.monotonic()
+            profile['import'] = last_checkpoint - load_start
             self._console_write(f'resolving plugins schemas')
 
         self._load_plugins(
@@ -822,37 +981,64 @@ class Middleware(LoadPluginsMixin):
             on_modules_loaded=on_modules_loaded,
         )
 
-        # TODO: Rework it when we have order defined for setup functions
-        def sort_key(plugin__function):
-            plugin, function = plugin__function
-
-            beginning = [
-                # We need to run system plugin setup's function first because when system boots, the right
-                # timezone is not configured. See #72131
-                'system',
-                # We also need to load alerts first because other plugins can issue one-shot alerts during their
-                # initialization
-                'alert',
-            ]
-            try:
-                return beginning.index(plugin)
-            except ValueError:
-                return len(beginning)
-        setup_funcs = sorted(setup_funcs, key=sort_key)
+        setup_start = time.monotonic()
+        profile['resolve'] = setup_start - last_checkpoint
 
         # Only call setup after all schemas have been resolved because
         # they can call methods with schemas defined.
-        setup_total = len(setup_funcs)
-        for i, setup_func in enumerate(setup_funcs):
-            name, f = setup_func
-            self._console_write(f'setting up plugins ({name}) [{i + 1}/{setup_total}]')
+        # Setup functions run concurrently, each one waiting only for the plugins it depends on.
+        setup_depends = setup_dependencies(setup_modules)
+        setup_total = len(setup_modules)
+        setup_tasks = {}
+        setup_started = 0
+
+        async def run_setup(name, f):
+            nonlocal setup_started
+            depends = setup_depends[name]
+            if depends:
+                await asyncio.wait([setup_tasks[i] for i in depends])
+                for i in depends:
+                    if setup_tasks[i].exception() is not None:
+                        raise RuntimeError(f'Plugin {name!r} setup dependency {i!r} failed')
+
+            setup_started += 1
+            self._console_write(f'setting up plugins ({name}) [{setup_started}/{setup_total}]')
             self.__incr_startup_seq()
-            call = f(self)
-            # Allow setup to be a coroutine
-            if asyncio.iscoroutinefunction(f):
-                await call
+            start = time.monotonic()
+            plugins_profile[name]['setup_start'] = start - setup_start
+            plugins_profile[name]['setup_depends'] = sorted(depends)
+            try:
+                call = f(self)
+                # Allow setup to be a coroutine
+                if asyncio.iscoroutinefunction(f):
+                    await call
+            finally:
+                plugins_profile[name]['setup'] = time.monotonic() - start
+
+        for name, mod in setup_modules.items():
+            setup_tasks[name] = asyncio.ensure_future(run_setup(name, mod.setup))
+        await asyncio.gather(*setup_tasks.values())
+
+        profile['setup'] = time.monotonic() - setup_start
+        profile['total'] = time.monotonic() - load_start
+
+        self.logger.debug(
+            'All plugins loaded in %.2fs (import %.2fs, schemas %.2fs, setup %.2fs)',
+            profile['total'], profile['import'], profile['resolve'], profile['setup'],
+        )
+        for name, plugin in sorted(
+            plugins_profile.items(), key=lambda i: i[1]['import'] + (i[1]['setup'] or 0), reverse=True,
+        ):
+            if plugin['setup'] is None:
+                self.logger.debug('Plugin %s: import %.3fs', name, plugin['import'])
+            else:
+                self.logger.debug(
+                    'Plugin %s: import %.3fs, setup %.3fs (started at %.3fs, after %s)', name, plugin['import'],
+                    plugin['setup'], plugin['setup_start'], ', '.join(plugin['setup_depends']) or 'nothing',
+                )
 
-        self.logger.debug('All plugins loaded')
+    def get_startup_profile(self):
+        return self.__startup_profile
 
     def __setup_periodic_tasks(self):
         for service_name, service_obj in self.get_services().items():
@@ -1053,8 +1239,8 @@ class Middleware(LoadPluginsMixin):
     async def run_in_thread(self, method, *args, **kwargs):
         return await self.loop.run_in_executor(self.__io_threadpool, functools.partial(method, *args, **kwargs))
 
-    def pipe(self):
-        return Pipe(self)
+    def pipe(self, sendfile=False):
+        return Pipe(self, sendfile)
 
     async def _call(
         self, name, serviceobj, methodobj, params=None, app=None, pipes=None,
@@ -1,4 +1,5 @@
 import os
+import shutil
 
 
 class Pipes:
@@ -19,13 +20,34 @@ class Pipes:
 
 
 class Pipe:
-    def __init__(self, middleware):
+    def __init__(self, middleware, sendfile=False):
         self.middleware = middleware
 
         r, w = os.pipe()
         self.r = os.fdopen(r, "rb")
         self.w = os.fdopen(w, "wb")
 
+        # Whether the reader is able to read a regular file instead of the pipe (see `send_file`)
+        self.sendfile = sendfile
+        self.file = None
+        self.file_offset = 0
+
+    def send_file(self, f):
+        """
+        Write contents of regular file `f` (starting at its current position) to the pipe and close it.
+
+        If the reader supports it, it gets a duplicate of `f` in `self.file` instead so it can use
+        `sendfile` and serve byte ranges rather than copying everything through the pipe.
+        """
+        if self.sendfile:
+            self.file_offset = f.tell()
+            self.file = os.fdopen(os.dup(f.fileno()), "rb")
+        else:
+            shutil.copyfileobj(f, self.w, 1048576)
+        self.w.close()
+
     async def close(self):
         await self.middleware.run_in_thread(self.r.close)
         await self.middleware.run_in_thread(self.w.close)
+        if self.file is not None:
+            await self.middleware.run_in_thread(self.file.close)
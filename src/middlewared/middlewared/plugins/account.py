@@ -1,10 +1,12 @@
-from middlewared.schema import accepts, Any, Bool, Dict, Int, List, Patch, Str
+from middlewared.schema import accepts, Any, Bool, Dict, Int, List, Patch, Ref, Str
 from middlewared.service import (
-    CallError, CRUDService, ValidationErrors, item_method, no_auth_required, pass_app, private, filterable
+    CallError, CRUDService, ValidationErrors, item_method, job, no_auth_required, pass_app, private, filterable
 )
 from middlewared.utils import run, filter_list
+from middlewared.utils.asyncio_ import DebouncedCall
 from middlewared.validators import Email
 
+from collections import defaultdict
 import asyncio
 import binascii
 import crypt
@@ -18,6 +20,10 @@ import subprocess
 import time
 
 SKEL_PATH = '/usr/share/skel/'
+# Lowest uid/gid given to accounts created without one
+MIN_ID = 1000
+# Account changes made within this many seconds from each other share a single account files regeneration
+RELOAD_DELAY = 0.5
 
 
 def pw_checkname(verrors, attribute, name):
@@ -50,6 +56,19 @@ def pw_checkname(verrors, attribute, name):
         )
 
 
+def next_free_ids(used, count, start=MIN_ID):
+    """
+    Returns `count` lowest ids starting from `start` that are not in `used`.
+    """
+    ids = []
+    i = start
+    while len(ids) < count:
+        if i not in used:
+            ids.append(i)
+        i += 1
+    return ids
+
+
 def crypted_password(cleartext):
     """
     Generates an unix hash from `cleartext`.
@@ -69,17 +88,34 @@ class UserService(CRUDService):
     class Config:
         datastore = 'account.bsdusers'
         datastore_extend = 'user.user_extend'
+        datastore_extend_context = 'user.user_extend_context'
         datastore_prefix = 'bsdusr_'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reload_accounts_call = DebouncedCall(
+            lambda: self.middleware.call('service.reload', 'user'), RELOAD_DELAY,
+        )
+
     @private
-    async def user_extend(self, user):
+    async def user_extend_context(self):
+        # Group membership of all users at once instead of querying it for every user
+        memberships = defaultdict(list)
+        for gm in await self.middleware.call(
+            'datastore.sql', 'SELECT bsdgrpmember_user_id, bsdgrpmember_group_id FROM account_bsdgroupmembership'
+        ):
+            memberships[gm['bsdgrpmember_user_id']].append(gm['bsdgrpmember_group_id'])
+        return {'memberships': memberships}
+
+    @private
+    async def user_extend(self, user, context):
 
         # Normalize email, empty is really null
         if user['email'] == '':
             user['email'] = None
 
         # Get group membership
-        user['groups'] = [gm['group']['id'] for gm in await self.middleware.call('datastore.query', 'account.bsdgroupmembership', [('user', '=', user['id'])], {'prefix': 'bsdgrpmember_'})]
+        user['groups'] = list(context['memberships'].get(user['id'], []))
 
         # Get authorized keys
         keysfile = f'{user["home"]}/.ssh/authorized_keys'
@@ -211,50 +247,8 @@ class UserService(CRUDService):
                 raise CallError(f'Group {data["group"]} not found')
             group = group[0]
 
-        # Is this a new directory or not? Let's not nuke existing directories,
-        # e.g. /, /root, /mnt/tank/my-dataset, etc ;).
-        new_homedir = False
         home_mode = data.pop('home_mode')
-        if data['home'] and data['home'] != '/nonexistent':
-            try:
-                try:
-                    os.makedirs(data['home'], mode=int(home_mode, 8))
-                    new_homedir = True
-                    await self.middleware.call('filesystem.setperm', {
-                        'path': data['home'],
-                        'mode': home_mode,
-                        'uid': data['uid'],
-                        'gid': group['gid'],
-                        'options': {'stripacl': True}
-                    })
-                except FileExistsError:
-                    if not os.path.isdir(data['home']):
-                        raise CallError(
-                            'Path for home directory already '
-                            'exists and is not a directory',
-                            errno.EEXIST
-                        )
-
-                    # If it exists, ensure the user is owner.
-                    await self.middleware.call('filesystem.chown', {
-                        'path': data['home'],
-                        'uid': data['uid'],
-                        'gid': group['gid'],
-                    })
-                except OSError as oe:
-                    raise CallError(
-                        'Failed to create the home directory '
-                        f'({data["home"]}) for user: {oe}'
-                    )
-                if os.stat(data['home']).st_dev == os.stat('/mnt').st_dev:
-                    raise CallError(
-                        f'The path for the home directory "({data["home"]})" '
-                        'must include a volume or dataset.'
-                    )
-            except Exception:
-                if new_homedir:
-                    shutil.rmtree(data['home'])
-                raise
+        new_homedir = await self.__create_home(data, home_mode, group['gid'])
 
         if not data.get('uid'):
             data['uid'] = await self.get_next_uid()
@@ -262,7 +256,7 @@ class UserService(CRUDService):
         pk = None  # Make sure pk exists to rollback in case of an error
         data = await self.user_compress(data)
         try:
-            await self.__set_password(data)
+            self.__set_password(data)
             sshpubkey = data.pop('sshpubkey', None)  # datastore does not have sshpubkey
 
             pk = await self.middleware.call('datastore.insert', 'account.bsdusers', data, {'prefix': 'bsdusr_'})
@@ -278,34 +272,154 @@ class UserService(CRUDService):
                 shutil.rmtree(data['home'])
             raise
 
-        await self.middleware.call('service.reload', 'user')
+        await self.reload_accounts()
 
         await self.__set_smbpasswd(data['username'])
 
-        if os.path.exists(data['home']):
-            for f in os.listdir(SKEL_PATH):
-                if f.startswith('dot'):
-                    dest_file = os.path.join(data['home'], f[3:])
-                else:
-                    dest_file = os.path.join(data['home'], f)
-                if not os.path.exists(dest_file):
-                    shutil.copyfile(os.path.join(SKEL_PATH, f), dest_file)
-                    await self.middleware.call('filesystem.chown', {
-                        'path': dest_file,
-                        'uid': data['uid'],
-                        'gid': group['gid'],
-                        'options': {'recursive': True}
-                    })
-
-            data['sshpubkey'] = sshpubkey
-            try:
-                await self.__update_sshpubkey(data['home'], data, group['group'])
-            except PermissionError as e:
-                self.logger.warn('Failed to update authorized keys', exc_info=True)
-                raise CallError(f'Failed to update authorized keys: {e}')
+        await self.__populate_home(data, group['gid'], group['group'], sshpubkey)
 
         return pk
 
+    @accepts(List('users', items=[Ref('user_create')], required=True))
+    @job(lock='account_create_bulk')
+    async def create_bulk(self, job, users):
+        """
+        Create many users at once.
+
+        Accepts a list of `user.create` arguments. Users are validated all together and inserted in a single
+        transaction, account files and SMB passdb are regenerated once in the end. Either all users are created
+        or none of them.
+
+        Returns a list of ids of created users in the order they were given.
+        """
+        verrors = ValidationErrors()
+
+        usernames = {
+            u['username']
+            for u in await self.middleware.call('datastore.query', 'account.bsdusers', [], {
+                'prefix': 'bsdusr_', 'select': ['username'],
+            })
+        }
+        groups = {
+            g['id']: g
+            for g in await self.middleware.call('datastore.query', 'account.bsdgroups', [], {'prefix': 'bsdgrp_'})
+        }
+        groups_by_name = {g['group']: g for g in groups.values()}
+
+        for i, data in enumerate(users):
+            schema = f'user_create_bulk.{i}'
+
+            if (
+                not data.get('group') and not data.get('group_create')
+            ) or (
+                data.get('group') is not None and data.get('group_create')
+            ):
+                verrors.add(
+                    f'{schema}.group',
+                    'Enter either a group name or create a new group to '
+                    'continue.',
+                    errno.EINVAL
+                )
+            elif data.get('group') and data['group'] not in groups:
+                verrors.add(f'{schema}.group', f'Group {data["group"]} not found', errno.ENOENT)
+
+            await self.__common_validation(verrors, data, schema, usernames=usernames)
+            usernames.add(data['username'])
+
+            if data.get('sshpubkey') and not data['home'].startswith('/mnt'):
+                verrors.add(
+                    f'{schema}.sshpubkey',
+                    'The home directory is not writable. Leave this field blank.'
+                )
+
+            notfound = set(data['groups']) - set(groups)
+            if notfound:
+                verrors.add(f'{schema}.groups', f'Following groups do not exist: {", ".join(map(str, notfound))}')
+
+        verrors.check()
+
+        job.set_progress(10, 'Creating primary groups')
+        new_groups = []
+        new_group_names = list(dict.fromkeys(
+            data['username']
+            for data in users
+            if data['group_create'] and data['username'] not in groups_by_name
+        ))
+        if new_group_names:
+            new_groups = await self.middleware.call('group.insert_bulk', [
+                {'name': name} for name in new_group_names
+            ])
+            groups.update({g['id']: g for g in new_groups})
+            groups_by_name.update({g['group']: g for g in new_groups})
+
+        used = {
+            u['uid']
+            for u in await self.middleware.call('datastore.query', 'account.bsdusers', [('builtin', '=', False)], {
+                'prefix': 'bsdusr_', 'select': ['uid'],
+            })
+        }
+        used.update(data['uid'] for data in users if data.get('uid'))
+        uids = iter(next_free_ids(used, len([data for data in users if not data.get('uid')])))
+
+        rows = []
+        memberships = []
+        sshpubkeys = []
+        new_homedirs = []
+        pks = None
+        try:
+            job.set_progress(20, 'Creating home directories')
+            for data in users:
+                data = data.copy()
+                memberships.append(data.pop('groups'))
+                if data.pop('group_create'):
+                    data['group'] = groups_by_name[data['username']]['id']
+                group = groups[data['group']]
+
+                if not data.get('uid'):
+                    data['uid'] = next(uids)
+
+                home_mode = data.pop('home_mode')
+                if await self.__create_home(data, home_mode, group['gid']):
+                    new_homedirs.append(data['home'])
+
+                data = await self.user_compress(data)
+                sshpubkeys.append((data.pop('sshpubkey', None), group))
+                rows.append(data)
+
+            job.set_progress(40, 'Setting passwords')
+            await self.middleware.run_in_thread(lambda: [self.__set_password(data) for data in rows])
+
+            job.set_progress(60, 'Saving users')
+            pks = await self.middleware.call('datastore.insert_many', 'account.bsdusers', rows, {'prefix': 'bsdusr_'})
+            await self.middleware.call('datastore.insert_many', 'account.bsdgroupmembership', [
+                {'group': group, 'user': pk}
+                for pk, groups_ in zip(pks, memberships)
+                for group in set(groups_)
+            ], {'prefix': 'bsdgrpmember_'})
+        except Exception:
+            if pks is not None:
+                await self.middleware.call('datastore.delete', 'account.bsdusers', [('id', 'in', pks)])
+            if new_groups:
+                await self.middleware.call('datastore.delete', 'account.bsdgroups', [
+                    ('id', 'in', [g['id'] for g in new_groups])
+                ])
+            for home in new_homedirs:
+                shutil.rmtree(home)
+            raise
+
+        job.set_progress(70, 'Regenerating account files')
+        await self.reload_accounts()
+        await self.middleware.call('smb.synchronize_passdb')
+        for group in new_groups:
+            await self.middleware.call('smb.groupmap_add', group['group'])
+
+        job.set_progress(80, 'Populating home directories')
+        for data, (sshpubkey, group) in zip(rows, sshpubkeys):
+            await self.__populate_home(data, group['gid'], group['group'], sshpubkey)
+
+        job.set_progress(100, f'Created {len(pks)} users')
+        return pks
+
     @accepts(
         Int('id'),
         Patch(
@@ -415,7 +529,7 @@ class UserService(CRUDService):
             set_home_mode()
 
         user.pop('sshpubkey', None)
-        await self.__set_password(user)
+        self.__set_password(user)
 
         if 'groups' in user:
             groups = user.pop('groups')
@@ -424,7 +538,7 @@ class UserService(CRUDService):
         user = await self.user_compress(user)
         await self.middleware.call('datastore.update', 'account.bsdusers', pk, user, {'prefix': 'bsdusr_'})
 
-        await self.middleware.call('service.reload', 'user')
+        await self.reload_accounts()
 
         await self.__set_smbpasswd(user['username'])
 
@@ -463,7 +577,7 @@ class UserService(CRUDService):
                 await self.middleware.call('datastore.update', 'services.cifs', cifs['id'], {'guest': 'nobody'}, {'prefix': 'cifs_srv_'})
 
         await self.middleware.call('datastore.delete', 'account.bsdusers', pk)
-        await self.middleware.call('service.reload', 'user')
+        await self.reload_accounts()
 
         return pk
 
@@ -547,14 +661,13 @@ class UserService(CRUDService):
         """
         Get the next available/free uid.
         """
-        last_uid = 999
-        for i in await self.middleware.call('datastore.query', 'account.bsdusers', [('builtin', '=', False)], {'order_by': ['uid'], 'prefix': 'bsdusr_'}):
-            # If the difference between the last uid and the current one is
-            # bigger than 1, it means we have a gap and can use it.
-            if i['uid'] - last_uid > 1:
-                return last_uid + 1
-            last_uid = i['uid']
-        return last_uid + 1
+        used = {
+            i['uid']
+            for i in await self.middleware.call('datastore.query', 'account.bsdusers', [('builtin', '=', False)], {
+                'prefix': 'bsdusr_', 'select': ['uid'],
+            })
+        }
+        return next_free_ids(used, 1)[0]
 
     @no_auth_required
     @accepts()
@@ -582,16 +695,27 @@ class UserService(CRUDService):
         root = await self.middleware.call('user.query', [('username', '=', 'root')], {'get': True})
         await self.middleware.call('user.update', root['id'], {'password': password})
 
-    async def __common_validation(self, verrors, data, schema, pk=None):
+    @private
+    async def reload_accounts(self):
+        """
+        Regenerates account files. Concurrent and rapid successive calls share a single regeneration.
+        """
+        await self.reload_accounts_call()
+
+    async def __common_validation(self, verrors, data, schema, pk=None, usernames=None):
 
         exclude_filter = [('id', '!=', pk)] if pk else []
 
         if 'username' in data:
             pw_checkname(verrors, f'{schema}.username', data['username'])
 
-            if await self.middleware.call('datastore.query', 'account.bsdusers', [
-                ('username', '=', data['username'])
-            ] + exclude_filter, {'prefix': 'bsdusr_'}):
+            if usernames is not None:
+                exists = data['username'] in usernames
+            else:
+                exists = await self.middleware.call('datastore.query', 'account.bsdusers', [
+                    ('username', '=', data['username'])
+                ] + exclude_filter, {'prefix': 'bsdusr_'})
+            if exists:
                 verrors.add(
                     f'{schema}.username',
                     f'The username "{data["username"]}" already exists.',
@@ -649,7 +773,7 @@ class UserService(CRUDService):
                 'The ":" character is not allowed in a "Full Name".'
             )
 
-    async def __set_password(self, data):
+    def __set_password(self, data):
         if 'password' not in data:
             return
         password = data.pop('password')
@@ -662,6 +786,79 @@ class UserService(CRUDService):
             data['smbhash'] = '*'
         return password
 
+    async def __create_home(self, data, home_mode, gid):
+        """
+        Creates home directory of a new user. Returns `True` if it did not exist before.
+        """
+        # Is this a new directory or not? Let's not nuke existing directories,
+        # e.g. /, /root, /mnt/tank/my-dataset, etc ;).
+        new_homedir = False
+        if data['home'] and data['home'] != '/nonexistent':
+            try:
+                try:
+                    os.makedirs(data['home'], mode=int(home_mode, 8))
+                    new_homedir = True
+                    await self.middleware.call('filesystem.setperm', {
+                        'path': data['home'],
+                        'mode': home_mode,
+                        'uid': data['uid'],
+                        'gid': gid,
+                        'options': {'stripacl': True}
+                    })
+                except FileExistsError:
+                    if not os.path.isdir(data['home']):
+                        raise CallError(
+                            'Path for home directory already '
+                            'exists and is not a directory',
+                            errno.EEXIST
+                        )
+
+                    # If it exists, ensure the user is owner.
+                    await self.middleware.call('filesystem.chown', {
+                        'path': data['home'],
+                        'uid': data['uid'],
+                        'gid': gid,
+                    })
+                except OSError as oe:
+                    raise CallError(
+                        'Failed to create the home directory '
+                        f'({data["home"]}) for user: {oe}'
+                    )
+                if os.stat(data['home']).st_dev == os.stat('/mnt').st_dev:
+                    raise CallError(
+                        f'The path for the home directory "({data["home"]})" '
+                        'must include a volume or dataset.'
+                    )
+            except Exception:
+                if new_homedir:
+                    shutil.rmtree(data['home'])
+                raise
+
+        return new_homedir
+
+    async def __populate_home(self, data, gid, group, sshpubkey):
+        if os.path.exists(data['home']):
+            for f in os.listdir(SKEL_PATH):
+                if f.startswith('dot'):
+                    dest_file = os.path.join(data['home'], f[3:])
+                else:
+                    dest_file = os.path.join(data['home'], f)
+                if not os.path.exists(dest_file):
+                    shutil.copyfile(os.path.join(SKEL_PATH, f), dest_file)
+                    await self.middleware.call('filesystem.chown', {
+                        'path': dest_file,
+                        'uid': data['uid'],
+                        'gid': gid,
+                        'options': {'recursive': True}
+                    })
+
+            data['sshpubkey'] = sshpubkey
+            try:
+                await self.__update_sshpubkey(data['home'], data, group)
+            except PermissionError as e:
+                self.logger.warn('Failed to update authorized keys', exc_info=True)
+                raise CallError(f'Failed to update authorized keys: {e}')
+
     async def __set_smbpasswd(self, username):
         """
         This method will update or create an entry in samba's passdb.tdb file.
@@ -749,12 +946,25 @@ class GroupService(CRUDService):
         datastore = 'account.bsdgroups'
         datastore_prefix = 'bsdgrp_'
         datastore_extend = 'group.group_extend'
+        datastore_extend_context = 'group.group_extend_context'
 
     @private
-    async def group_extend(self, group):
+    async def group_extend_context(self):
+        # Members of all groups at once instead of querying them for every group
+        memberships = defaultdict(list)
+        for gm in await self.middleware.call(
+            'datastore.sql', 'SELECT bsdgrpmember_group_id, bsdgrpmember_user_id FROM account_bsdgroupmembership'
+        ):
+            memberships[gm['bsdgrpmember_group_id']].append(gm['bsdgrpmember_user_id'])
+        primary = defaultdict(list)
+        for u in await self.middleware.call('datastore.sql', 'SELECT id, bsdusr_group_id FROM account_bsdusers'):
+            primary[u['bsdusr_group_id']].append(u['id'])
+        return {'memberships': memberships, 'primary': primary}
+
+    @private
+    async def group_extend(self, group, context):
         # Get group membership
-        group['users'] = [gm['user']['id'] for gm in await self.middleware.call('datastore.query', 'account.bsdgroupmembership', [('group', '=', group['id'])], {'prefix': 'bsdgrpmember_'})]
-        group['users'] += [gmu['id'] for gmu in await self.middleware.call('datastore.query', 'account.bsdusers', [('bsdusr_group_id', '=', group['id'])])]
+        group['users'] = context['memberships'].get(group['id'], []) + context['primary'].get(group['id'], [])
         return group
 
     @private
@@ -838,12 +1048,96 @@ class GroupService(CRUDService):
         for user in users:
             await self.middleware.call('datastore.insert', 'account.bsdgroupmembership', {'bsdgrpmember_group': pk, 'bsdgrpmember_user': user})
 
-        await self.middleware.call('service.reload', 'user')
+        await self.middleware.call('user.reload_accounts')
 
         await self.middleware.call('smb.groupmap_add', data['name'])
 
         return pk
 
+    @accepts(List('groups', items=[Ref('group_create')], required=True))
+    @job(lock='account_create_bulk')
+    async def create_bulk(self, job, groups):
+        """
+        Create many groups at once.
+
+        Accepts a list of `group.create` arguments. Groups are validated all together and inserted in a single
+        transaction, account files are regenerated once in the end. Either all groups are created or none of them.
+
+        Returns a list of ids of created groups in the order they were given.
+        """
+        verrors = ValidationErrors()
+
+        existing = await self.middleware.call('datastore.query', 'account.bsdgroups', [], {
+            'prefix': 'bsdgrp_', 'select': ['group', 'gid'],
+        })
+        names = {g['group'] for g in existing}
+        gids = {g['gid'] for g in existing}
+        user_ids = {u['id'] for u in await self.middleware.call('datastore.query', 'account.bsdusers', [], {
+            'select': ['id'],
+        })}
+
+        groups = [data.copy() for data in groups]
+        for i, data in enumerate(groups):
+            await self.__common_validation(verrors, data, f'group_create_bulk.{i}', names=names, gids=gids,
+                                           user_ids=user_ids)
+            names.add(data['name'])
+            if data.get('gid'):
+                gids.add(data['gid'])
+
+        verrors.check()
+
+        job.set_progress(20, 'Saving groups')
+        created = await self.insert_bulk(groups)
+
+        job.set_progress(60, 'Regenerating account files')
+        await self.middleware.call('user.reload_accounts')
+
+        for i, group in enumerate(created):
+            job.set_progress(70 + int(30 * i / len(created)), 'Adding group mappings')
+            await self.middleware.call('smb.groupmap_add', group['group'])
+
+        job.set_progress(100, f'Created {len(created)} groups')
+        return [group['id'] for group in created]
+
+    @private
+    async def insert_bulk(self, groups):
+        """
+        Inserts validated `groups` (`group.create` arguments) in a single transaction allocating gids for those
+        that don't have one. Does not regenerate account files.
+
+        Returns a list of `{"id", "gid", "group"}` of inserted groups.
+        """
+        used = {
+            g['gid']
+            for g in await self.middleware.call('datastore.query', 'account.bsdgroups', [('builtin', '=', False)], {
+                'prefix': 'bsdgrp_', 'select': ['gid'],
+            })
+        }
+        used.update(data['gid'] for data in groups if data.get('gid'))
+        gids = iter(next_free_ids(used, len([data for data in groups if not data.get('gid')])))
+
+        rows = []
+        for data in groups:
+            row = {
+                'gid': data.get('gid') or next(gids),
+                'group': data['name'],
+                'sudo': data.get('sudo', False),
+            }
+            rows.append(row)
+
+        pks = await self.middleware.call('datastore.insert_many', 'account.bsdgroups', rows, {'prefix': 'bsdgrp_'})
+        try:
+            await self.middleware.call('datastore.insert_many', 'account.bsdgroupmembership', [
+                {'group': pk, 'user': user}
+                for pk, data in zip(pks, groups)
+                for user in set(data.get('users') or [])
+            ], {'prefix': 'bsdgrpmember_'})
+        except Exception:
+            await self.middleware.call('datastore.delete', 'account.bsdgroups', [('id', 'in', pks)])
+            raise
+
+        return [dict(row, id=pk) for pk, row in zip(pks, rows)]
+
     @accepts(
         Int('id'),
         Patch(
@@ -889,7 +1183,7 @@ class GroupService(CRUDService):
         if delete_groupmap:
             await self.middleware.call('notifier.groupmap_delete', delete_groupmap)
 
-        await self.middleware.call('service.reload', 'user')
+        await self.middleware.call('user.reload_accounts')
 
         await self.middleware.call('smb.groupmap_add', group['group'])
 
@@ -915,7 +1209,7 @@ class GroupService(CRUDService):
 
         await self.middleware.call('datastore.delete', 'account.bsdgroups', pk)
 
-        await self.middleware.call('service.reload', 'user')
+        await self.middleware.call('user.reload_accounts')
 
         return pk
 
@@ -923,14 +1217,13 @@ class GroupService(CRUDService):
         """
         Get the next available/free gid.
         """
-        last_gid = 999
-        for i in await self.middleware.call('datastore.query', 'account.bsdgroups', [('builtin', '=', False)], {'order_by': ['gid'], 'prefix': 'bsdgrp_'}):
-            # If the difference between the last gid and the current one is
-            # bigger than 1, it means we have a gap and can use it.
-            if i['gid'] - last_gid > 1:
-                return last_gid + 1
-            last_gid = i['gid']
-        return last_gid + 1
+        used = {
+            i['gid']
+            for i in await self.middleware.call('datastore.query', 'account.bsdgroups', [('builtin', '=', False)], {
+                'prefix': 'bsdgrp_', 'select': ['gid'],
+            })
+        }
+        return next_free_ids(used, 1)[0]
 
     @accepts(Dict(
         'get_group_obj',
@@ -944,12 +1237,15 @@ class GroupService(CRUDService):
         """
         return await self.middleware.call('dscache.get_uncached_group', data['groupname'], data['gid'])
 
-    async def __common_validation(self, verrors, data, schema, pk=None):
+    async def __common_validation(self, verrors, data, schema, pk=None, names=None, gids=None, user_ids=None):
 
         exclude_filter = [('id', '!=', pk)] if pk else []
 
         if 'name' in data:
-            existing = await self.middleware.call('datastore.query', 'account.bsdgroups', [('group', '=', data['name'])] + exclude_filter, {'prefix': 'bsdgrp_'})
+            if names is not None:
+                existing = data['name'] in names
+            else:
+                existing = await self.middleware.call('datastore.query', 'account.bsdgroups', [('group', '=', data['name'])] + exclude_filter, {'prefix': 'bsdgrp_'})
             if existing:
                 verrors.add(
                     f'{schema}.name',
@@ -961,7 +1257,10 @@ class GroupService(CRUDService):
 
         allow_duplicate_gid = data.pop('allow_duplicate_gid', False)
         if data.get('gid') and not allow_duplicate_gid:
-            existing = await self.middleware.call('datastore.query', 'account.bsdgroups', [('gid', '=', data['gid'])] + exclude_filter, {'prefix': 'bsdgrp_'})
+            if gids is not None:
+                existing = data['gid'] in gids
+            else:
+                existing = await self.middleware.call('datastore.query', 'account.bsdgroups', [('gid', '=', data['gid'])] + exclude_filter, {'prefix': 'bsdgrp_'})
             if existing:
                 verrors.add(
                     f'{schema}.gid',
@@ -970,7 +1269,10 @@ class GroupService(CRUDService):
                 )
 
         if 'users' in data:
-            existing = set([i['id'] for i in await self.middleware.call('datastore.query', 'account.bsdusers', [('id', 'in', data['users'])])])
+            if user_ids is not None:
+                existing = user_ids
+            else:
+                existing = set([i['id'] for i in await self.middleware.call('datastore.query', 'account.bsdusers', [('id', 'in', data['users'])])])
             notfound = set(data['users']) - existing
             if notfound:
                 verrors.add(
@@ -1,18 +1,21 @@
-import boto3
-import josepy as jose
 import json
 import requests
 import time
 
 from middlewared.schema import Bool, Dict, Int, Str, ValidationErrors
 from middlewared.service import accepts, CallError, CRUDService, private
+from middlewared.utils.lazy import lazy_import
 from middlewared.validators import validate_attributes
 
-from acme import client, messages
-from botocore import exceptions as boto_exceptions
-from botocore.errorfactory import BaseClientExceptions as boto_BaseClientException
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+# These are only needed when talking to an ACME server, avoid loading them on middlewared startup
+boto3 = lazy_import('boto3')
+boto_exceptions = lazy_import('botocore.exceptions')
+boto_errorfactory = lazy_import('botocore.errorfactory')
+jose = lazy_import('josepy')
+client = lazy_import('acme.client')
+messages = lazy_import('acme.messages')
+backends = lazy_import('cryptography.hazmat.backends')
+rsa = lazy_import('cryptography.hazmat.primitives.asymmetric.rsa')
 
 
 # TODO: See what can be done to respect rate limits
@@ -133,7 +136,7 @@ class ACMERegistrationService(CRUDService):
         key = jose.JWKRSA(key=rsa.generate_private_key(
             public_exponent=data['JWK_create']['public_exponent'],
             key_size=data['JWK_create']['key_size'],
-            backend=default_backend()
+            backend=backends.default_backend()
         ))
         acme_client = client.ClientV2(directory, client.ClientNetwork(key))
         register = acme_client.new_account(
@@ -435,7 +438,7 @@ class DNSAuthenticatorService(CRUDService):
                                'NAS-dns-route53 certificate validation'
                 }
             )
-        except boto_BaseClientException as e:
+        except boto_errorfactory.BaseClientExceptions as e:
             raise CallError(
                 f'Failed to update record sets : {e}'
             )
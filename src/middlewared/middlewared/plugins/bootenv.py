@@ -1,39 +1,139 @@
 from middlewared.schema import Bool, Dict, Str, accepts
 from middlewared.service import (
-    CallError, CRUDService, ValidationErrors, filterable, item_method, job
+    CallError, CRUDService, ValidationErrors, filterable, item_method, job, private
 )
 from middlewared.utils import filter_list
+from middlewared.utils.lazy import lazy_import
 from middlewared.validators import Match
 
-from freenasOS import Update
-
+from datetime import datetime
 import errno
-import subprocess
+import threading
+from time import monotonic
 
+libzfs = lazy_import('libzfs')
+Update = lazy_import('freenasOS.Update')
 
 RE_BE_NAME = r'^[^/ *\'"?@!#$%^&()+=~<>;\\]+$'
+BOOT_POOL = 'freenas-boot'
+BE_ROOT = f'{BOOT_POOL}/ROOT'
+# Boot environments are cached for this long unless changed through `bootenv` or ZFS events are reported by devd
+# (boot environments can also be changed by legacy UI or `beadm` directly)
+BOOT_ENVIRONMENTS_TTL = 30
+
+
+def nicenum(num):
+    """
+    Formats `num` bytes the way `zfs list` (and `beadm list`) does, e.g. 512, 4K, 1.50G.
+    """
+    index = 0
+    n = num
+    while n >= 1024 and index < 6:
+        n //= 1024
+        index += 1
+
+    if index == 0:
+        return str(n)
+
+    unit = 'BKMGTPE'[index]
+    if num % (1 << 10 * index) == 0:
+        return f'{n}{unit}'
+
+    for precision in (2, 1, 0):
+        result = f'{num / (1 << 10 * index):.{precision}f}{unit}'
+        if len(result) <= 5:
+            break
+    return result
+
+
+def list_boot_environments(zfs):
+    """
+    Boot environments (children of `BE_ROOT`) as returned by `Update.ListClones` read in a single libzfs pass
+    instead of parsing `beadm list` output. Ordered by creation like `beadm list`.
+    """
+    bootfs = zfs.get(BOOT_POOL).properties['bootfs'].value
+    result = []
+    for ds in zfs.get_dataset(BE_ROOT).children:
+        properties = ds.properties
+        realname = ds.name.split('/')[-1]
+        mountpoint = ds.mountpoint
+
+        active = ('N' if mountpoint == '/' else '') + ('R' if ds.name == bootfs else '')
+
+        rawspace = int(properties['used'].rawvalue)
+        origin = properties['origin'].value
+        if origin and origin != '-':
+            try:
+                rawspace += int(zfs.get_snapshot(origin).properties['used'].rawvalue)
+            except libzfs.ZFSException:
+                pass
+
+        nickname = properties.get('beadm:nickname')
+        keep = properties.get('beadm:keep')
+        creation = int(properties['creation'].rawvalue)
+        result.append((creation, {
+            'name': nickname.value if nickname and nickname.value not in (None, '-') else realname,
+            'realname': realname,
+            'active': active or '-',
+            'mountpoint': mountpoint or '-',
+            'space': nicenum(rawspace),
+            'created': datetime.fromtimestamp(creation).replace(second=0),
+            'keep': keep.value == 'True' if keep and keep.value not in (None, '-') else None,
+            'rawspace': rawspace,
+        }))
+
+    return [clone for creation, clone in sorted(result, key=lambda v: v[0])]
 
 
 class BootEnvService(CRUDService):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (generation, timestamp, boot environments)
+        self.boot_environments = None
+        self.boot_environments_generation = 0
+        self.boot_environments_lock = threading.Lock()
+
     @filterable
     def query(self, filters=None, options=None):
         """
         Query all Boot Environments with `query-filters` and `query-options`.
         """
-        results = []
-        for clone in Update.ListClones():
-            clone['id'] = clone['name']
-            results.append(clone)
+        results = [dict(clone, id=clone['name']) for clone in self.get_boot_environments()]
         return filter_list(results, filters, options)
 
+    @private
+    def get_boot_environments(self):
+        with self.boot_environments_lock:
+            if self.boot_environments is not None:
+                generation, timestamp, clones = self.boot_environments
+                if (
+                    generation == self.boot_environments_generation and
+                    monotonic() - timestamp < BOOT_ENVIRONMENTS_TTL
+                ):
+                    return clones
+
+            generation = self.boot_environments_generation
+            with libzfs.ZFS() as zfs:
+                clones = list_boot_environments(zfs)
+
+            self.boot_environments = (generation, monotonic(), clones)
+            return clones
+
+    @private
+    def invalidate(self):
+        self.boot_environments_generation += 1
+
     @item_method
     @accepts(Str('id'))
     def activate(self, oid):
         """
         Activates boot environment `id`.
         """
-        return Update.ActivateClone(oid)
+        try:
+            return Update.ActivateClone(oid)
+        finally:
+            self.invalidate()
 
     @item_method
     @accepts(
@@ -50,7 +150,10 @@ class BootEnvService(CRUDService):
         Currently only `keep` attribute is allowed.
         """
         clone = Update.FindClone(oid)
-        return Update.CloneSetAttr(clone, **attrs)
+        try:
+            return Update.CloneSetAttr(clone, **attrs)
+        finally:
+            self.invalidate()
 
     @accepts(Dict(
         'bootenv_create',
@@ -75,7 +178,10 @@ class BootEnvService(CRUDService):
         source = data.get('source')
         if source:
             kwargs['bename'] = source
-        clone = Update.CreateClone(data['name'], **kwargs)
+        try:
+            clone = Update.CreateClone(data['name'], **kwargs)
+        finally:
+            self.invalidate()
         if clone is False:
             raise CallError('Failed to create boot environment')
         return data['name']
@@ -94,19 +200,19 @@ class BootEnvService(CRUDService):
         if verrors:
             raise verrors
 
-        if not Update.RenameClone(oid, data['name']):
+        try:
+            renamed = Update.RenameClone(oid, data['name'])
+        finally:
+            self.invalidate()
+        if not renamed:
             raise CallError('Failed to update boot environment')
         return data['name']
 
     def _clean_be_name(self, verrors, schema, name):
-        beadm_names = subprocess.Popen(
-            "beadm list | awk '{print $7}'",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding='utf8',
-        ).communicate()[0].split('\n')
-        if name in filter(None, beadm_names):
+        # Not cached, boot environment might have been created by someone else in the meantime
+        with libzfs.ZFS() as zfs:
+            clones = list_boot_environments(zfs)
+        if any(name in (clone['name'], clone['realname']) for clone in clones):
             verrors.add(f'{schema}.name', f'The name "{name}" already exists', errno.EEXIST)
 
     @accepts(Str('id'))
@@ -115,4 +221,18 @@ class BootEnvService(CRUDService):
         """
         Delete `id` boot environment. This removes the clone from the system.
         """
-        return Update.DeleteClone(oid)
+        try:
+            return Update.DeleteClone(oid)
+        finally:
+            self.invalidate()
+
+
+async def devd_zfs_hook(middleware, data):
+    if data.get('subsystem') != 'ZFS':
+        return
+
+    await middleware.call('bootenv.invalidate')
+
+
+def setup(middleware):
+    middleware.register_hook('devd.zfs', devd_zfs_hook)
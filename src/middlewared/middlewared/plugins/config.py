@@ -59,7 +59,7 @@ class ConfigService(Service):
                         tar.add(path, arcname=arcname)
 
         with open(filename, 'rb') as f:
-            await self.middleware.run_in_thread(shutil.copyfileobj, f, job.pipes.output.w)
+            await self.middleware.run_in_thread(job.pipes.output.send_file, f)
 
         if bundle:
             os.remove(filename)
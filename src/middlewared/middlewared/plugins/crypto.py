@@ -2,7 +2,6 @@ import datetime
 import dateutil
 import dateutil.parser
 import ipaddress
-import josepy as jose
 import json
 import os
 import random
@@ -11,17 +10,26 @@ import re
 from middlewared.async_validators import validate_country
 from middlewared.schema import accepts, Bool, Dict, Int, List, Patch, Ref, Str
 from middlewared.service import CallError, CRUDService, job, periodic, private, Service, skip_arg, ValidationErrors
+from middlewared.utils.lazy import lazy_import
 from middlewared.validators import Email, IpAddress, Range
 
-from acme import client, errors, messages
-from OpenSSL import crypto, SSL
 from contextlib import suppress
 
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.primitives.asymmetric import dsa, ec, rsa
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, serialization
+# acme, pyOpenSSL and cryptography are expensive to import, only load them when a method needs them
+jose = lazy_import('josepy')
+client = lazy_import('acme.client')
+errors = lazy_import('acme.errors')
+messages = lazy_import('acme.messages')
+crypto = lazy_import('OpenSSL.crypto')
+SSL = lazy_import('OpenSSL.SSL')
+x509 = lazy_import('cryptography.x509')
+x509_oid = lazy_import('cryptography.x509.oid')
+dsa = lazy_import('cryptography.hazmat.primitives.asymmetric.dsa')
+ec = lazy_import('cryptography.hazmat.primitives.asymmetric.ec')
+rsa = lazy_import('cryptography.hazmat.primitives.asymmetric.rsa')
+backends = lazy_import('cryptography.hazmat.backends')
+hashes = lazy_import('cryptography.hazmat.primitives.hashes')
+serialization = lazy_import('cryptography.hazmat.primitives.serialization')
 
 
 CA_TYPE_EXISTING = 0x01
@@ -330,7 +338,7 @@ class CryptoKeyService(Service):
         cert = cert.public_key(
             key.public_key()
         ).sign(
-            key, hashes.SHA256(), default_backend()
+            key, hashes.SHA256(), backends.default_backend()
         )
 
         return (
@@ -379,7 +387,7 @@ class CryptoKeyService(Service):
             'csr': True
         })
 
-        csr = csr.sign(key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), default_backend())
+        csr = csr.sign(key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), backends.default_backend())
 
         return (
             csr.public_bytes(serialization.Encoding.PEM).decode(),
@@ -447,7 +455,7 @@ class CryptoKeyService(Service):
         ).add_extension(
             x509.SubjectKeyIdentifier.from_public_key(key.public_key()), False
         ).sign(
-            ca_key or key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), default_backend()
+            ca_key or key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), backends.default_backend()
         )
 
         return (
@@ -513,7 +521,9 @@ class CryptoKeyService(Service):
             key.public_key()
         )
 
-        cert = cert.sign(ca_key or key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), default_backend())
+        cert = cert.sign(
+            ca_key or key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), backends.default_backend()
+        )
 
         return (
             cert.public_bytes(serialization.Encoding.PEM).decode(),
@@ -554,7 +564,7 @@ class CryptoKeyService(Service):
         new_cert = new_cert.public_key(
             csr_key.public_key()
         ).sign(
-            ca_key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), default_backend()
+            ca_key, getattr(hashes, data.get('digest_algorithm') or 'SHA256')(), backends.default_backend()
         )
 
         return new_cert.public_bytes(serialization.Encoding.PEM).decode()
@@ -564,7 +574,7 @@ class CryptoKeyService(Service):
         data = {}
         for key in ('crypto_subject_name', 'crypto_issuer_name'):
             data[key] = x509.Name([
-                x509.NameAttribute(getattr(NameOID, k.upper()), v)
+                x509.NameAttribute(getattr(x509_oid.NameOID, k.upper()), v)
                 for k, v in (options.get(key) or {}).items() if v
             ])
         if not data['crypto_issuer_name']:
@@ -618,13 +628,13 @@ class CryptoKeyService(Service):
         if options.get('type') == 'EC':
             key = ec.generate_private_key(
                 getattr(ec, options.get('curve')),
-                default_backend()
+                backends.default_backend()
             )
         else:
             key = rsa.generate_private_key(
                 public_exponent=65537,
                 key_size=options.get('key_length'),
-                backend=default_backend()
+                backend=backends.default_backend()
             )
 
         if options.get('serialize'):
@@ -641,7 +651,7 @@ class CryptoKeyService(Service):
             return serialization.load_pem_private_key(
                 key_string.encode(),
                 password=passphrase.encode() if passphrase else None,
-                backend=default_backend()
+                backend=backends.default_backend()
             )
 
     def export_private_key(self, buffer, passphrase=None):
@@ -15,7 +15,7 @@ if not apps.ready:
     django.setup()
 
 from django.apps import apps
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import Q
 from django.db.models.fields.related import ForeignKey, ManyToManyField
 
@@ -235,11 +235,29 @@ class DatastoreService(Service):
         """
         Insert a new entry to `name`.
         """
-        data = data.copy()
-        many_to_many_fields_data = {}
         options = options or {}
-        prefix = options.get('prefix')
+        return self.__insert(self.__get_model(name), data, options.get('prefix'))
+
+    @accepts(
+        Str('name'),
+        List('data', items=[Dict('data', additional_attrs=True)]),
+        Dict('options', Str('prefix', null=True)),
+    )
+    def insert_many(self, name, data, options=None):
+        """
+        Insert new entries to `name` within a single transaction.
+
+        Returns primary keys of inserted entries in the same order as `data`.
+        """
+        options = options or {}
         model = self.__get_model(name)
+        related = {}
+        with transaction.atomic():
+            return [self.__insert(model, row, options.get('prefix'), related) for row in data]
+
+    def __insert(self, model, data, prefix, related=None):
+        data = data.copy()
+        many_to_many_fields_data = {}
         self.validate_data_keys(data, model, 'datastore_insert', prefix)
 
         for field in chain(model._meta.fields, model._meta.many_to_many):
@@ -250,7 +268,13 @@ class DatastoreService(Service):
             if name not in data:
                 continue
             if isinstance(field, ForeignKey) and data[name] is not None:
-                data[name] = field.rel.to.objects.get(pk=data[name])
+                if related is None:
+                    data[name] = field.rel.to.objects.get(pk=data[name])
+                else:
+                    key = (field.rel.to, data[name])
+                    if key not in related:
+                        related[key] = field.rel.to.objects.get(pk=data[name])
+                    data[name] = related[key]
             if isinstance(field, ManyToManyField):
                 many_to_many_fields_data[field.name] = data.pop(name)
             else:
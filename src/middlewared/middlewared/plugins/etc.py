@@ -4,18 +4,119 @@ from middlewared.service import Service
 from middlewared.utils.io import write_if_changed
 
 import asyncio
+import concurrent.futures
+import copy
 import grp
 import imp
+import json
 import os
 import pwd
+import re
+import threading
+import time
+
+# Methods whose result is memoised for the duration of a generation pass
+RENDER_CACHE_RE = re.compile(r'\.(config|query|get_state)$')
+RENDER_CACHE = {
+    'failover.licensed', 'failover.node', 'failover.status', 'iscsi.global.alua_enabled', 'notifier.common',
+    'notifier.is_freenas', 'smb.get_smb_ha_mode', 'system.info', 'system.is_freenas', 'system.product_name',
+}
+# Methods which are not memoised but do not change anything either. Calling any other method throws away
+# everything memoised so far as it might have changed the configuration (e.g. `datastore.update`).
+RENDER_READ_ONLY = {
+    'certificate._get_instance', 'certificate.cert_services_validation', 'cronjob.construct_cron_command',
+    'device.get_info', 'disk.identifier_to_device', 'idmap.get_configured_idmap_domains', 'netdata.list_alarms',
+    'notifier.dojango_dojo_version', 'notifier.zfs_list', 'notifier.zpool_list', 'smb.getparm', 'smb.groupmap_list',
+    'truenas.get_chassis_hardware', 'user.get_user_obj', 'group.get_group_obj',
+}
+
+
+class RenderContext(object):
+    """
+    Passed to templates instead of the middleware for a single generation pass.
+
+    Read-only calls (e.g. `smb.config`, `user.query`) made by several templates are only done once,
+    every caller gets its own copy of the result. Concurrent callers of the same method wait for
+    the call already in progress.
+    """
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def __getattr__(self, item):
+        return getattr(self.middleware, item)
+
+    def invalidate(self):
+        with self.lock:
+            self.cache = {}
+
+    def _lookup(self, name, params):
+        """
+        Returns cache key, future holding result of the call and whether the caller is the one that should make it.
+        """
+        if name not in RENDER_CACHE and not RENDER_CACHE_RE.search(name):
+            if name not in RENDER_READ_ONLY:
+                self.invalidate()
+            return None, None, False
+
+        try:
+            key = name, json.dumps(params, sort_keys=True)
+        except TypeError:
+            return None, None, False
+
+        with self.lock:
+            fut = self.cache.get(key)
+            if fut is not None:
+                return key, fut, False
+
+            fut = self.cache[key] = concurrent.futures.Future()
+            return key, fut, True
+
+    def _failed(self, key, fut, e):
+        # Do not keep failures around, next caller will try again
+        with self.lock:
+            if self.cache.get(key) is fut:
+                self.cache.pop(key)
+        fut.set_exception(e)
+
+    async def call(self, name, *params, **kwargs):
+        key, fut, owner = (None, None, False) if kwargs else self._lookup(name, params)
+        if fut is None:
+            return await self.middleware.call(name, *params, **kwargs)
+
+        if owner:
+            try:
+                fut.set_result(await self.middleware.call(name, *params))
+            except BaseException as e:
+                self._failed(key, fut, e)
+                raise
+
+        return copy.deepcopy(await asyncio.wrap_future(fut))
+
+    def call_sync(self, name, *params, **kwargs):
+        key, fut, owner = (None, None, False) if kwargs else self._lookup(name, params)
+        if fut is None:
+            return self.middleware.call_sync(name, *params, **kwargs)
+
+        if owner:
+            try:
+                fut.set_result(self.middleware.call_sync(name, *params))
+            except BaseException as e:
+                self._failed(key, fut, e)
+                raise
+
+        return copy.deepcopy(fut.result())
 
 
 class MakoRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.lookups = {}
 
-    async def render(self, path):
+    async def render(self, path, context):
         try:
             # Mako is not asyncio friendly so run it within a thread
             def do():
@@ -23,14 +124,18 @@ class MakoRenderer(object):
                 name = os.path.basename(path)
                 dir = os.path.dirname(path)
 
-                # This will be where we search for templates
-                lookup = TemplateLookup(directories=[dir], module_directory="/tmp/mako/%s" % dir)
+                # This will be where we search for templates, it keeps compiled templates around
+                lookup = self.lookups.get(dir)
+                if lookup is None:
+                    lookup = self.lookups.setdefault(
+                        dir, TemplateLookup(directories=[dir], module_directory="/tmp/mako/%s" % dir),
+                    )
 
                 # Get the template by its relative path
                 tmpl = lookup.get_template(name)
 
                 # Render the template
-                return tmpl.render(middleware=self.service.middleware)
+                return tmpl.render(middleware=context)
 
             return await self.service.middleware.run_in_thread(do)
         except Exception:
@@ -45,15 +150,15 @@ class PyRenderer(object):
     def __init__(self, service):
         self.service = service
 
-    async def render(self, path):
+    async def render(self, path, context):
         name = os.path.basename(path)
         find = imp.find_module(name, [os.path.dirname(path)])
         mod = imp.load_module(name, *find)
         if asyncio.iscoroutinefunction(mod.render):
-            return await mod.render(self.service, self.service.middleware)
+            return await mod.render(self.service, context)
         else:
             return await self.service.middleware.run_in_thread(
-                mod.render, self.service, self.service.middleware,
+                mod.render, self.service, context,
             )
 
 
@@ -211,6 +316,19 @@ class EtcService(Service):
 
     SKIP_LIST = ['system_dataset', 'collectd', 'syslogd', 'smb_configure']
 
+    # Groups which must be generated before others when generating everything at once
+    DEPENDS = {
+        'ftp': ['ssl'],
+        'nginx': ['ssl'],
+        's3': ['ssl'],
+        'smb_configure': ['user', 'smb', 'smb_share'],
+        'smb_share': ['smb'],
+        'webdav': ['ssl'],
+    }
+    # Groups which are generated before all the others when generating everything at once, e.g. other groups
+    # resolve file owners by name and must not read /etc/passwd or /etc/group while they are being rewritten
+    GENERATE_FIRST = ['user']
+
     class Config:
         private = True
 
@@ -223,13 +341,19 @@ class EtcService(Service):
             'mako': MakoRenderer(self),
             'py': PyRenderer(self),
         }
+        # Time spent generating each file the last time it was generated
+        self.timings = {}
 
-    async def generate(self, name):
+    async def generate(self, name, context=None):
         group = self.GROUPS.get(name)
         if group is None:
             raise ValueError('{0} group not found'.format(name))
 
+        if context is None:
+            context = RenderContext(self.middleware)
+
         for entry in group:
+            start = time.monotonic()
 
             renderer = self._renderers.get(entry['type'])
             if renderer is None:
@@ -237,7 +361,7 @@ class EtcService(Service):
 
             path = os.path.join(self.files_dir, entry['path'])
             try:
-                rendered = await renderer.render(path)
+                rendered = await renderer.render(path, context)
             except Exception:
                 self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
                 continue
@@ -246,7 +370,7 @@ class EtcService(Service):
                 continue
 
             outfile = '/etc/{0}'.format(entry['path'])
-            changes = write_if_changed(outfile, rendered)
+            changes = await self.middleware.run_in_thread(write_if_changed, outfile, rendered)
 
             # If ownership or permissions are specified, see if
             # they need to be changed.
@@ -275,20 +399,57 @@ class EtcService(Service):
                 except Exception:
                     pass
 
+            self.timings[outfile] = time.monotonic() - start
+            self.logger.debug(f'Generated {outfile} in {self.timings[outfile]:.3f} seconds')
+
             if not changes:
                 self.logger.debug(f'No new changes for {outfile}')
 
+    async def get_timings(self):
+        """
+        Returns seconds spent generating each file the last time it was generated, slowest first.
+        """
+        return dict(sorted(self.timings.items(), key=lambda item: item[1], reverse=True))
+
     async def generate_all(self, skip_list=True):
         """
         Generate all configuration file groups
         `skip_list` tells whether to skip groups in SKIP_LIST. This defaults to true.
+
+        Groups in GENERATE_FIRST are generated first, the rest concurrently (a group waits only for groups listed
+        in DEPENDS). All of them share a single render context so configuration is only read once.
         """
+        start = time.monotonic()
+        context = RenderContext(self.middleware)
+        tasks = {}
+
+        async def generate(name):
+            for depends in self.DEPENDS.get(name, []):
+                if depends in tasks:
+                    await asyncio.wait([tasks[depends]])
+
+            try:
+                await self.generate(name, context)
+            except Exception:
+                self.logger.error(f'Failed to generate {name} group', exc_info=True)
+
+        names = []
         for name in self.GROUPS.keys():
             if skip_list and name in self.SKIP_LIST:
                 self.logger.info(f'Skipping {name} group generation')
                 continue
 
-            try:
-                await self.generate(name)
-            except Exception:
-                self.logger.error(f'Failed to generate {name} group', exc_info=True)
+            names.append(name)
+
+        for name in self.GENERATE_FIRST:
+            if name in names:
+                tasks[name] = asyncio.ensure_future(generate(name))
+                await tasks[name]
+
+        for name in names:
+            if name not in tasks:
+                tasks[name] = asyncio.ensure_future(generate(name))
+
+        if tasks:
+            await asyncio.wait(list(tasks.values()))
+        self.logger.debug(f'Generated all configuration files in {time.monotonic() - start:.3f} seconds')
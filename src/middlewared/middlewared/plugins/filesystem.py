@@ -4,16 +4,25 @@ from bsd import acl
 import errno
 import enum
 import grp
+import hashlib
 import os
 import pwd
-import select
-import shutil
-import subprocess
+import stat
 
+from middlewared.client import ejson as json
+from middlewared.common.filesystem.listdir import listdir
+from middlewared.common.filesystem.tail import TailBrokers
+from middlewared.common.permissions.acl import acl_backend, InheritedACLs
+from middlewared.common.permissions.walker import Walker
 from middlewared.main import EventSource
 from middlewared.schema import Bool, Dict, Int, Ref, List, Str, UnixPerm, accepts
 from middlewared.service import private, CallError, Service, job
-from middlewared.utils import filter_list
+from middlewared.utils.io import copy_pipe_to_file
+
+
+PERM_CHANGE_CHECKPOINT_KEY = 'filesystem:perm_change:checkpoint'
+
+tail_brokers = TailBrokers()
 
 
 class ACLDefault(enum.Enum):
@@ -124,6 +133,16 @@ class FilesystemService(Service):
           mode(int): file mode/permission
           uid(int): user id of entry owner
           gid(int): group id of entry onwer
+
+        Only entries that are returned are `stat`ed when possible: filters on `name` are checked first,
+        scanning stops once `limit` entries are found if no `order_by` is requested and only `limit` first names
+        are kept if entries are ordered by `name`.
+
+        `options.extra` can contain:
+          stat(bool): set to false to skip `stat` of every entry (`size`, `mode`, `uid` and `gid` will be null)
+          after(str): list entries ordered by name that go after this name (empty string for the first page).
+            `{"entries": [...], "after": "<name>"}` is returned, `after` is the cursor of the next page or null
+            if this page is the last one.
         """
         if not os.path.exists(path):
             raise CallError(f'Directory {path} does not exist', errno.ENOENT)
@@ -131,35 +150,7 @@ class FilesystemService(Service):
         if not os.path.isdir(path):
             raise CallError(f'Path {path} is not a directory', errno.ENOTDIR)
 
-        rv = []
-        for entry in os.scandir(path):
-            if entry.is_dir():
-                etype = 'DIRECTORY'
-            elif entry.is_file():
-                etype = 'FILE'
-            elif entry.is_symlink():
-                etype = 'SYMLINK'
-            else:
-                etype = 'OTHER'
-
-            data = {
-                'name': entry.name,
-                'path': entry.path,
-                'realpath': os.path.realpath(entry.path) if etype == 'SYMLINK' else entry.path,
-                'type': etype,
-            }
-            try:
-                stat = entry.stat()
-                data.update({
-                    'size': stat.st_size,
-                    'mode': stat.st_mode,
-                    'uid': stat.st_uid,
-                    'gid': stat.st_gid,
-                })
-            except FileNotFoundError:
-                data.update({'size': None, 'mode': None, 'uid': None, 'gid': None})
-            rv.append(data)
-        return filter_list(rv, filters=filters or [], options=options or {})
+        return listdir(path, filters, options)
 
     @accepts(Str('path'))
     def stat(self, path):
@@ -264,7 +255,7 @@ class FilesystemService(Service):
             raise CallError(f'{path} is not a file')
 
         with open(path, 'rb') as f:
-            await self.middleware.run_in_thread(shutil.copyfileobj, f, job.pipes.output.w)
+            await self.middleware.run_in_thread(job.pipes.output.send_file, f)
 
     @accepts(
         Str('path'),
@@ -289,7 +280,7 @@ class FilesystemService(Service):
             openmode = 'wb+'
 
         with open(path, openmode) as f:
-            await self.middleware.run_in_thread(shutil.copyfileobj, job.pipes.input.r, f)
+            await self.middleware.run_in_thread(copy_pipe_to_file, job.pipes.input.r, f)
 
         mode = options.get('mode')
         if mode:
@@ -376,16 +367,50 @@ class FilesystemService(Service):
 
         return flagset
 
-    def _winacl(self, path, action, uid, gid, options):
-        winacl = subprocess.run([
-            '/usr/local/bin/winacl',
-            '-a', action,
-            '-O', str(uid), '-G', str(gid),
-            '-rx' if options['traverse'] else '-r',
-            '-p', path], check=False, capture_output=True
-        )
-        if winacl.returncode != 0:
-            CallError(f"Winacl {action} on path {path} failed with error: [{winacl.stderr.decode().strip()}]")
+    def _chown_at(self, dir_fd, name, st, uid, gid):
+        if (uid == -1 or st.st_uid == uid) and (gid == -1 or st.st_gid == gid):
+            return False
+
+        os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
+        return True
+
+    def _strip_acl_at(self, backend, path, st):
+        if stat.S_ISLNK(st.st_mode) or backend.is_trivial(path):
+            return False
+
+        backend.strip(path)
+        return True
+
+    def _walk(self, job, method, data, visit):
+        """
+        Calls `visit` (see `Walker`) for everything below `data['path']`.
+
+        Every `CHECKPOINT_INTERVAL` seconds (and on failure) a list of finished directories is saved so if `method`
+        is called with the same `data` and `resume` option again (e.g. after a failure or a reboot) they are skipped.
+        Checkpoint of any other call is discarded so files created since then are not skipped.
+        """
+        options = {k: v for k, v in data['options'].items() if k != 'resume'}
+        checkpoint_id = hashlib.sha256(
+            json.dumps([method, dict(data, options=options)], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        checkpoint = self.middleware.call_sync('keyvalue.get', PERM_CHANGE_CHECKPOINT_KEY, {})
+        done = None
+        if data['options']['resume'] and checkpoint.get('id') == checkpoint_id:
+            done = checkpoint['done']
+        elif checkpoint:
+            self.middleware.call_sync('keyvalue.delete', PERM_CHANGE_CHECKPOINT_KEY)
+            checkpoint = {}
+
+        def save_checkpoint(done):
+            checkpoint['id'] = checkpoint_id
+            checkpoint['done'] = done
+            self.middleware.call_sync('keyvalue.set', PERM_CHANGE_CHECKPOINT_KEY, checkpoint)
+
+        walker = Walker(data['path'], visit, data['options']['traverse'], done=done)
+        walker.run(job.set_progress, save_checkpoint)
+
+        if checkpoint:
+            self.middleware.call_sync('keyvalue.delete', PERM_CHANGE_CHECKPOINT_KEY)
 
     @accepts(Str('path'))
     def acl_is_trivial(self, path):
@@ -408,7 +433,8 @@ class FilesystemService(Service):
             Dict(
                 'options',
                 Bool('recursive', default=False),
-                Bool('traverse', default=False)
+                Bool('traverse', default=False),
+                Bool('resume', default=False),
             )
         )
     )
@@ -422,7 +448,12 @@ class FilesystemService(Service):
         changed.
 
         `recursive` performs action recursively, but does
-        not traverse filesystem mount points.
+        not traverse filesystem mount points. Files that already have
+        requested owner and group are skipped.
+
+        `resume` continues recursive operation that failed or was
+        interrupted where it has stopped. Other parameters have to be the
+        same as in that call.
 
         If `traverse` and `recursive` are specified, then the chown
         operation will traverse filesystem mount points.
@@ -440,7 +471,10 @@ class FilesystemService(Service):
         if not options['recursive']:
             os.chown(data['path'], uid, gid)
         else:
-            self._winacl(data['path'], 'chown', uid, gid, options)
+            self._walk(
+                job, 'filesystem.chown', data,
+                lambda dir_fd, name, path, st, depth: self._chown_at(dir_fd, name, st, uid, gid),
+            )
 
     @accepts(
         Dict(
@@ -454,6 +488,7 @@ class FilesystemService(Service):
                 Bool('stripacl', default=False),
                 Bool('recursive', default=False),
                 Bool('traverse', default=False),
+                Bool('resume', default=False),
             )
         )
     )
@@ -475,7 +510,12 @@ class FilesystemService(Service):
         unless `stripacl` is set to True.
 
         `recursive` remove ACLs recursively, but do not traverse dataset
-        boundaries.
+        boundaries. Files that already have trivial ACL, requested mode and
+        owner are skipped.
+
+        `resume` continues recursive operation that failed or was interrupted
+        where it has stopped. Other parameters have to be the same as in that
+        call.
 
         `traverse` remove ACLs from child datasets.
 
@@ -518,8 +558,17 @@ class FilesystemService(Service):
         if not options['recursive']:
             return
 
-        action = 'clone' if mode else 'strip'
-        self._winacl(data['path'], action, uid, gid, options)
+        backend = acl_backend()
+
+        def visit(dir_fd, name, path, st, depth):
+            changed = self._strip_acl_at(backend, path, st)
+            if mode and not stat.S_ISLNK(st.st_mode) and (changed or stat.S_IMODE(st.st_mode) != mode):
+                os.chmod(name, mode, dir_fd=dir_fd)
+                changed = True
+
+            return self._chown_at(dir_fd, name, st, uid, gid) or changed
+
+        self._walk(job, 'filesystem.setperm', data, visit)
 
     @accepts()
     async def default_acl_choices(self):
@@ -731,7 +780,8 @@ class FilesystemService(Service):
                 Bool('stripacl', default=False),
                 Bool('recursive', default=False),
                 Bool('traverse', default=False),
-                Bool('canonicalize', default=True)
+                Bool('canonicalize', default=True),
+                Bool('resume', default=False),
             )
         )
     )
@@ -747,7 +797,11 @@ class FilesystemService(Service):
 
         `gid` the desired GID of the file group. If set to None (the default), then group is not changed.
 
-        `recursive` apply the ACL recursively
+        `recursive` apply the ACL recursively. Files and directories get the ACL they would inherit from `path`,
+        the ones that already have it (and requested owner) are skipped.
+
+        `resume` continues recursive operation that failed or was interrupted where it has stopped. Other
+        parameters have to be the same as in that call.
 
         `traverse` traverse filestem boundaries (ZFS datasets)
 
@@ -821,7 +875,29 @@ class FilesystemService(Service):
         if not options['recursive']:
             return True
 
-        self._winacl(data['path'], 'clone', uid, gid, options)
+        backend = acl_backend()
+        if options['stripacl']:
+            def visit(dir_fd, name, path, st, depth):
+                changed = self._strip_acl_at(backend, path, st)
+                return self._chown_at(dir_fd, name, st, uid, gid) or changed
+        else:
+            inherited = InheritedACLs(acl.ACL(file=data['path']).__getstate__())
+
+            def visit(dir_fd, name, path, st, depth):
+                changed = False
+                if not stat.S_ISLNK(st.st_mode):
+                    is_dir = stat.S_ISDIR(st.st_mode)
+                    entries = inherited.get(depth, is_dir)
+                    if not entries:
+                        changed = self._strip_acl_at(backend, path, st)
+                    elif not backend.matches(path, st, entries, is_dir):
+                        backend.set(path, entries, is_dir)
+                        changed = True
+
+                return self._chown_at(dir_fd, name, st, uid, gid) or changed
+
+        self._walk(job, 'filesystem.setacl', data, visit)
+        return True
 
 
 class FileFollowTailEventSource(EventSource):
@@ -837,41 +913,15 @@ class FileFollowTailEventSource(EventSource):
             # FIXME: Error?
             return
 
-        bufsize = 8192
-        fsize = os.stat(path).st_size
-        if fsize < bufsize:
-            bufsize = fsize
-        i = 0
-        with open(path) as f:
-            data = []
-            while True:
-                i += 1
-                if bufsize * i > fsize:
-                    break
-                f.seek(fsize - bufsize * i)
-                data.extend(f.readlines())
-                if len(data) >= lines or f.tell() == 0:
-                    break
-
-            self.send_event('ADDED', fields={'data': ''.join(data[-lines:])})
-            f.seek(fsize)
-
-            kqueue = select.kqueue()
-
-            ev = [select.kevent(
-                f.fileno(),
-                filter=select.KQ_FILTER_VNODE,
-                flags=select.KQ_EV_ADD | select.KQ_EV_ENABLE | select.KQ_EV_CLEAR,
-                fflags=select.KQ_NOTE_DELETE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_WRITE | select.KQ_NOTE_ATTRIB,
-            )]
-            kqueue.control(ev, 0, 0)
-
-            while not self._cancel.is_set():
-                events = kqueue.control([], 1, 1)
-                if not events:
-                    continue
-                # TODO: handle other file operations other than just extend/write
-                self.send_event('ADDED', fields={'data': f.read()})
+        # All subscribers to the same file share a single reader
+        tail_brokers.subscribe(path, lines, self._send_data)
+        try:
+            self._cancel.wait()
+        finally:
+            tail_brokers.unsubscribe(path, self._send_data)
+
+    def _send_data(self, data):
+        self.send_event('ADDED', fields={'data': data})
 
 
 def setup(middleware):
@@ -2,6 +2,7 @@ from lxml import etree
 
 from middlewared.async_validators import check_path_resides_within_volume
 from middlewared.common.attachment import FSAttachmentDelegate
+from middlewared.common.ctl import ctladm
 from middlewared.schema import (accepts, Bool, Dict, IPAddr, Int, List, Patch,
                                 Str)
 from middlewared.service import (
@@ -12,6 +13,7 @@ from middlewared.utils.path import is_child
 from middlewared.validators import IpAddress, Range
 
 import bidict
+import contextlib
 import errno
 import hashlib
 import re
@@ -25,6 +27,9 @@ AUTHMETHOD_LEGACY_MAP = bidict.bidict({
     'CHAP': 'CHAP',
     'CHAP Mutual': 'CHAP_MUTUAL',
 })
+CTL_CONFIG = '/etc/ctl.conf'
+# Copy of the configuration ctld has loaded, present while kernel LUNs were changed with `ctladm` behind its back
+CTLD_LOADED_CONFIG = '/var/run/ctld.loaded.conf'
 RE_IP_PORT = re.compile(r'^(.+?)(:[0-9]+)?$')
 RE_TARGET_NAME = re.compile(r'^[-a-z0-9\.:]+$')
 
@@ -132,6 +137,120 @@ class ISCSIGlobalService(SystemServiceService):
 
         return (await self.middleware.call('iscsi.global.config'))['alua']
 
+    @private
+    def read_ctl_config(self):
+        try:
+            with open(CTL_CONFIG) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @private
+    async def apply_config_delta(self, old_config):
+        """
+        Apply changes between `old_config` (ctl.conf ctld is running with) and newly generated ctl.conf
+        using `ctladm` so only affected LUNs and LUN mappings are touched instead of having ctld re-read
+        everything.
+
+        Returns False if the change can't be applied this way and ctld has to reload its configuration.
+
+        ctld reload compares the new configuration with its own in-memory one, not with the kernel, so once LUNs
+        were changed this way it would fail to add LUNs which already exist (and unmap them from their target)
+        and keep LUNs which were already removed. The configuration ctld has loaded is kept in
+        `CTLD_LOADED_CONFIG` until then so `sync_ctld` can bring kernel LUNs back to it before ctld is reloaded.
+        """
+        if old_config is None or await self.alua_enabled():
+            return False
+
+        devlist = await run(['ctladm', 'devlist', '-x'], check=False, encoding='utf8')
+        portlist = await run(['ctladm', 'portlist', '-x'], check=False, encoding='utf8')
+        if devlist.returncode or portlist.returncode:
+            return False
+
+        def plan():
+            return ctladm.plan(
+                ctladm.parse_config(old_config),
+                ctladm.parse_config(self.read_ctl_config() or ''),
+                ctladm.parse_devlist(devlist.stdout),
+                ctladm.parse_portlist(portlist.stdout),
+            )
+
+        operations = await self.middleware.run_in_thread(plan)
+        if operations is None:
+            return False
+
+        if operations and not os.path.exists(CTLD_LOADED_CONFIG):
+            await self.middleware.run_in_thread(self.write_ctld_loaded_config, old_config)
+
+        if not await self.__run_ctladm(operations):
+            return False
+
+        self.logger.debug('Applied iSCSI configuration change using %d ctladm operation(s)', len(operations))
+        return True
+
+    @private
+    async def sync_ctld(self, old_config):
+        """
+        Bring kernel LUNs and target LUN mappings (currently described by `old_config`) back to the configuration
+        ctld has loaded so it can be reloaded.
+
+        Returns False if that can't be done and ctld has to be restarted to read kernel LUNs again.
+        """
+        try:
+            with open(CTLD_LOADED_CONFIG) as f:
+                loaded_config = f.read()
+        except FileNotFoundError:
+            return True
+
+        if old_config is None:
+            return False
+
+        devlist = await run(['ctladm', 'devlist', '-x'], check=False, encoding='utf8')
+        portlist = await run(['ctladm', 'portlist', '-x'], check=False, encoding='utf8')
+        if devlist.returncode or portlist.returncode:
+            return False
+
+        def plan():
+            return ctladm.plan(
+                ctladm.parse_config(old_config),
+                ctladm.parse_config(loaded_config),
+                ctladm.parse_devlist(devlist.stdout),
+                ctladm.parse_portlist(portlist.stdout),
+            )
+
+        operations = await self.middleware.run_in_thread(plan)
+        if operations is None:
+            return False
+
+        if not await self.__run_ctladm(operations):
+            return False
+
+        self.logger.debug('Reverted %d ctladm operation(s) before reloading ctld', len(operations))
+        return True
+
+    @private
+    def reset_ctld_sync(self):
+        """
+        ctld was started, stopped or has reloaded the current configuration, so its view of kernel LUNs is
+        up to date.
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(CTLD_LOADED_CONFIG)
+
+    @private
+    def write_ctld_loaded_config(self, config):
+        with open(CTLD_LOADED_CONFIG, 'w') as f:
+            f.write(config)
+
+    async def __run_ctladm(self, operations):
+        for args in operations:
+            cp = await run(['ctladm'] + args, check=False, encoding='utf8')
+            if cp.returncode:
+                self.logger.warning('Failed to run ctladm %s: %s', ' '.join(args), cp.stderr.strip())
+                return False
+
+        return True
+
     @private
     async def terminate_luns_for_pool(self, pool_name):
         cp = await run(['ctladm', 'devlist', '-b', 'block', '-x'], check=False, encoding='utf8')
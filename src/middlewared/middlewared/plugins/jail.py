@@ -2,37 +2,50 @@ import asyncio
 import contextlib
 import os
 import subprocess as su
-import libzfs
 import itertools
 import tempfile
 import pathlib
 import json
 import sqlite3
 import errno
+import importlib
 import re
 
-import iocage_lib.iocage as ioc
-import iocage_lib.ioc_exceptions as ioc_exceptions
-import iocage_lib.ioc_common as ioc_common
-from iocage_lib.ioc_check import IOCCheck
-from iocage_lib.ioc_clean import IOCClean
-from iocage_lib.ioc_image import IOCImage
-from iocage_lib.ioc_json import IOCJson
-# iocage's imports are per command, these are just general facilities
-from iocage_lib.ioc_list import IOCList
-from iocage_lib.ioc_plugin import IOCPlugin
-from iocage_lib.release import ListableReleases
-
 from middlewared.common.attachment import FSAttachmentDelegate
 from middlewared.schema import Bool, Dict, Int, List, Str, accepts, Patch
 from middlewared.service import CRUDService, job, private, filterable, periodic, item_method
 from middlewared.service_exception import CallError, ValidationErrors
 from middlewared.utils import filter_list, run
+from middlewared.utils.lazy import lazy_import
 from middlewared.validators import IpInUse, MACAddr
 
 from collections import deque, Iterable
 
+libzfs = lazy_import('libzfs')
+
+
+def iocage_setup(module):
+    # Whichever iocage module is imported first, iocage must never prompt for input
+    importlib.import_module('iocage_lib.ioc_common').set_interactive(False)
+
+
+# iocage is only imported once a jail method is used, it is expensive to load
+ioc = lazy_import('iocage_lib.iocage', iocage_setup)
+ioc_exceptions = lazy_import('iocage_lib.ioc_exceptions', iocage_setup)
+ioc_common = lazy_import('iocage_lib.ioc_common', iocage_setup)
+ioc_check = lazy_import('iocage_lib.ioc_check', iocage_setup)
+ioc_clean = lazy_import('iocage_lib.ioc_clean', iocage_setup)
+ioc_image = lazy_import('iocage_lib.ioc_image', iocage_setup)
+ioc_json = lazy_import('iocage_lib.ioc_json', iocage_setup)
+# iocage's imports are per command, these are just general facilities
+ioc_list = lazy_import('iocage_lib.ioc_list', iocage_setup)
+ioc_plugin = lazy_import('iocage_lib.ioc_plugin', iocage_setup)
+ioc_release = lazy_import('iocage_lib.release', iocage_setup)
+
 BRANCH_REGEX = re.compile(r'\d+\.\d-RELEASE')
+RE_DHCLIENT_ADDRESS = re.compile(r'fixed-address\s+(.+);')
+# Jail configurations kept in `cache` service (jail methods run in process pool)
+JAIL_CATALOGUE_CACHE = 'jail_catalogue'
 
 SHUTDOWN_LOCK = asyncio.Lock()
 
@@ -171,8 +184,8 @@ class PluginService(CRUDService):
         self.middleware.call_sync('jail.check_dataset_existence')  # Make sure our datasets exist.
         iocage = ioc.IOCage(skip_jails=True)
         resource_list = iocage.list('all', plugin=True)
-        pool = IOCJson().json_get_value('pool')
-        iocroot = IOCJson(pool).json_get_value('iocroot')
+        pool = ioc_json.IOCJson().json_get_value('pool')
+        iocroot = ioc_json.IOCJson(pool).json_get_value('iocroot')
         plugin_dir_path = os.path.join(iocroot, '.plugins')
         plugin_jails = {
             j['host_hostuuid']: j for j in self.middleware.call_sync(
@@ -423,17 +436,17 @@ class PluginService(CRUDService):
             pool = None
 
         if pool:
-            plugins = IOCPlugin(branch=branch, git_repository=plugin_repository).fetch_plugin_versions()
+            plugins = ioc_plugin.IOCPlugin(branch=branch, git_repository=plugin_repository).fetch_plugin_versions()
         else:
             with tempfile.TemporaryDirectory() as td:
                 try:
-                    IOCPlugin._clone_repo(branch, plugin_repository, td, depth=1)
+                    ioc_plugin.IOCPlugin._clone_repo(branch, plugin_repository, td, depth=1)
                 except Exception:
                     self.middleware.logger.error('Failed to clone iocage-ix-plugins repository.', exc_info=True)
                     return {}
                 else:
-                    plugins_index_data = IOCPlugin.retrieve_plugin_index_data(td)
-                    plugins = IOCPlugin.fetch_plugin_versions_from_plugin_index(plugins_index_data)
+                    plugins_index_data = ioc_plugin.IOCPlugin.retrieve_plugin_index_data(td)
+                    plugins = ioc_plugin.IOCPlugin.fetch_plugin_versions_from_plugin_index(plugins_index_data)
 
         self.middleware.call_sync(
             'cache.put', f'iocage_plugin_versions_{branch}_{plugin_repository}', plugins, 86400
@@ -444,7 +457,7 @@ class PluginService(CRUDService):
     def retrieve_plugin_index(self, options):
         self.middleware.call_sync('jail.check_dataset_existence')
         branch = options['branch'] or self.get_version()
-        plugins = IOCPlugin(branch=branch, git_repository=options['plugin_repository'])
+        plugins = ioc_plugin.IOCPlugin(branch=branch, git_repository=options['plugin_repository'])
         if not os.path.exists(plugins.git_destination) or options['refresh']:
             plugins.pull_clone_git_repo()
         return plugins.retrieve_plugin_index_data(plugins.git_destination)
@@ -469,7 +482,7 @@ class PluginService(CRUDService):
             raise CallError(f'{options["plugin"]} not found')
         return {
             'plugin': options['plugin'],
-            'properties': {**IOCPlugin.DEFAULT_PROPS, **index[options['plugin']].get('properties', {})}
+            'properties': {**ioc_plugin.IOCPlugin.DEFAULT_PROPS, **index[options['plugin']].get('properties', {})}
         }
 
     @accepts(
@@ -574,61 +587,27 @@ class JailService(CRUDService):
         jail_identifier = None
         jails = []
 
-        if not self.iocage_set_up():
-            return []
-
         if filters and len(filters) == 1 and list(
-                filters[0][:2]) == ['host_hostuuid', '=']:
+                filters[0][:2]) in (['host_hostuuid', '='], ['id', '=']):
             jail_identifier = filters[0][2]
 
-        recursive = False if jail_identifier == 'default' else True
-
         try:
-            jail_dicts = ioc.IOCage(
-                jail=jail_identifier).get('all', recursive=recursive)
-
             if jail_identifier == 'default':
+                if not self.iocage_set_up():
+                    return []
+
+                jail_dicts = ioc.IOCage(
+                    jail=jail_identifier).get('all', recursive=False)
                 jail_dicts['host_hostuuid'] = 'default'
                 jails.append(jail_dicts)
             else:
-                for jail in jail_dicts:
-                    jail = list(jail.values())[0]
-                    jail['id'] = jail['host_hostuuid']
-                    if jail['dhcp']:
-                        uuid = jail['host_hostuuid']
-
-                        if jail['state'] == 'up':
-                            interface = jail['interfaces'].split(',')[0].split(
-                                ':')[0]
-                            if interface == 'vnet0':
-                                # Inside jails they are epair0b
-                                interface = 'epair0b'
-                            ip4_cmd = ['jexec', f'ioc-{uuid}', 'ifconfig',
-                                       interface, 'inet']
-                            try:
-                                out = su.check_output(ip4_cmd)
-                                out = out.splitlines()[2].split()[1].decode()
-                                jail['ip4_addr'] = f'{interface}|{out}'
-                            except (su.CalledProcessError, IndexError):
-                                jail['ip4_addr'] = f'{interface}|ERROR'
-                        else:
-                            jail['ip4_addr'] = 'DHCP (not running)'
-
-                    if jail['state'] == 'up':
-                        try:
-                            jail['jid'] = su.check_output(
-                                [
-                                    'jls', '-j',
-                                    f'ioc-{jail["host_hostuuid"]}',
-                                    'jid'
-                                ]
-                            ).decode().strip()
-                        except su.CalledProcessError:
-                            jail['jid'] = 'ERROR'
-                    else:
-                        jail['jid'] = None
-
-                    jails.append(jail)
+                catalogue = self.get_catalogue(jail_identifier)
+                if catalogue is None:
+                    return []
+
+                jails = self._extend_live_state(catalogue['iocroot'], [
+                    dict(jail, id=jail['host_hostuuid']) for jail in catalogue['jails'].values()
+                ])
         except ioc_exceptions.JailMisconfigured as e:
             self.logger.error(e, exc_info=True)
         except Exception:
@@ -638,6 +617,124 @@ class JailService(CRUDService):
 
         return filter_list(jails, filters, options)
 
+    @private
+    def get_catalogue(self, jail=None):
+        """
+        Jail configurations (as iocage reports them) by their uuid, `None` if iocage is not set up.
+
+        Configurations are cached until a jail is changed using middleware (or devd reports a jail interface
+        change) and are re-read if any jail `config.json` changes behind our back (e.g. iocage CLI).
+        If `jail` is specified only configuration of this jail is read.
+        """
+        with contextlib.suppress(KeyError):
+            catalogue = self.middleware.call_sync('cache.get', JAIL_CATALOGUE_CACHE)
+            try:
+                mtimes = self._config_mtimes(catalogue['iocroot'])
+            except OSError:
+                # iocage pool is gone
+                mtimes = None
+
+            if mtimes is not None:
+                if jail is not None:
+                    if jail not in mtimes:
+                        return dict(catalogue, jails={})
+                    if mtimes[jail] == catalogue['mtimes'].get(jail):
+                        return dict(catalogue, jails={jail: catalogue['jails'][jail]})
+                elif mtimes == catalogue['mtimes']:
+                    return catalogue
+
+        if not self.iocage_set_up():
+            return None
+
+        iocroot = self.get_iocroot()
+        if jail is not None:
+            try:
+                self.check_jail_existence(jail)
+            except CallError:
+                return {'iocroot': iocroot, 'jails': {}}
+
+            config = ioc.IOCage(jail=jail, skip_jails=True).get('all')
+            return {'iocroot': iocroot, 'jails': {config['host_hostuuid']: config}}
+
+        # Take file modification times first so changes done while we are reading configurations invalidate the cache
+        mtimes = self._config_mtimes(iocroot)
+        jails = {}
+        for jail in ioc.IOCage().get('all', recursive=True):
+            jail = list(jail.values())[0]
+            jails[jail['host_hostuuid']] = jail
+
+        catalogue = {'iocroot': iocroot, 'mtimes': mtimes, 'jails': jails}
+        self.middleware.call_sync('cache.put', JAIL_CATALOGUE_CACHE, catalogue)
+        return catalogue
+
+    def _config_mtimes(self, iocroot):
+        mtimes = {}
+        for directory in ('jails', 'templates'):
+            path = os.path.join(iocroot, directory)
+            if directory == 'templates' and not os.path.isdir(path):
+                continue
+
+            with os.scandir(path) as it:
+                for entry in it:
+                    with contextlib.suppress(FileNotFoundError, NotADirectoryError):
+                        mtimes[entry.name] = os.stat(os.path.join(entry.path, 'config.json')).st_mtime_ns
+
+        return mtimes
+
+    @private
+    def invalidate_catalogue(self):
+        self.middleware.call_sync('cache.pop', JAIL_CATALOGUE_CACHE)
+
+    def _extend_live_state(self, iocroot, jails):
+        """
+        Add live state (`state`, `jid` and DHCP address) to jail configurations using a single `jls` call.
+        """
+        running = {}
+        cp = su.run(['jls', '--libxo', 'json', 'jid', 'name'], stdout=su.PIPE, stderr=su.DEVNULL)
+        if cp.returncode == 0:
+            for j in json.loads(cp.stdout)['jail-information'].get('jail', []):
+                running[j['name']] = str(j['jid'])
+
+        for jail in jails:
+            uuid = jail['host_hostuuid']
+            jid = running.get(f'ioc-{uuid}')
+            jail['state'] = 'up' if jid is not None else 'down'
+            jail['jid'] = jid
+
+            if jail['dhcp']:
+                if jail['state'] == 'up':
+                    interface = jail['interfaces'].split(',')[0].split(
+                        ':')[0]
+                    if interface == 'vnet0':
+                        # Inside jails they are epair0b
+                        interface = 'epair0b'
+                    address = self._dhcp_address(iocroot, jail, interface)
+                    jail['ip4_addr'] = f'{interface}|{address or "ERROR"}'
+                else:
+                    jail['ip4_addr'] = 'DHCP (not running)'
+
+        return jails
+
+    def _dhcp_address(self, iocroot, jail, interface):
+        # Last lease dhclient got inside the jail, this does not require entering the jail
+        leases = os.path.join(
+            iocroot, 'templates' if jail.get('type') == 'template' else 'jails', jail['host_hostuuid'],
+            'root/var/db', f'dhclient.leases.{interface}',
+        )
+        with contextlib.suppress(OSError):
+            with open(leases) as f:
+                addresses = RE_DHCLIENT_ADDRESS.findall(f.read())
+            if addresses:
+                return addresses[-1]
+
+        ip4_cmd = ['jexec', f'ioc-{jail["host_hostuuid"]}', 'ifconfig',
+                   interface, 'inet']
+        try:
+            out = su.check_output(ip4_cmd)
+            return out.splitlines()[2].split()[1].decode()
+        except (su.CalledProcessError, IndexError):
+            return None
+
     @private
     def iocage_set_up(self):
         datasets = self.middleware.call_sync(
@@ -655,7 +752,7 @@ class JailService(CRUDService):
         Retrieve default configuration for iocage jails.
         """
         if not self.iocage_set_up():
-            return IOCJson.retrieve_default_props()
+            return ioc_json.IOCJson.retrieve_default_props()
         else:
             return self.query(filters=[['host_hostuuid', '=', 'default']], options={'get': True})
 
@@ -670,7 +767,7 @@ class JailService(CRUDService):
             with contextlib.suppress(KeyError):
                 return self.middleware.call_sync('cache.get', 'iocage_remote_releases')
 
-        choices = {str(k): str(k) for k in ListableReleases(remote=remote)}
+        choices = {str(k): str(k) for k in ioc_release.ListableReleases(remote=remote)}
 
         if remote:
             self.middleware.call_sync('cache.put', 'iocage_remote_releases', choices, 86400)
@@ -740,8 +837,8 @@ class JailService(CRUDService):
         empty = options["empty"]
         short = options["short"]
         props = options["props"]
-        pool = IOCJson().json_get_value("pool")
-        iocroot = IOCJson(pool).json_get_value("iocroot")
+        pool = ioc_json.IOCJson().json_get_value("pool")
+        iocroot = ioc_json.IOCJson(pool).json_get_value("iocroot")
         https = options.get('https', True)
 
         if template:
@@ -767,6 +864,8 @@ class JailService(CRUDService):
             empty=empty
         )
 
+        self.invalidate_catalogue()
+
         if err:
             raise CallError(msg)
 
@@ -812,9 +911,12 @@ class JailService(CRUDService):
 
         job.set_progress(25, 'Initial validation complete.')
 
-        ioc.IOCage(jail=source_jail, skip_jails=True).create(
-            source_jail, options['props'], _uuid=options['uuid'], thickjail=options['thickjail'], clone=True
-        )
+        try:
+            ioc.IOCage(jail=source_jail, skip_jails=True).create(
+                source_jail, options['props'], _uuid=options['uuid'], thickjail=options['thickjail'], clone=True
+            )
+        finally:
+            self.invalidate_catalogue()
 
         job.set_progress(100, 'Jail has been successfully cloned.')
 
@@ -847,16 +949,19 @@ class JailService(CRUDService):
         if verrors:
             raise verrors
 
-        for prop, val in options.items():
-            p = f"{prop}={val}"
+        try:
+            for prop, val in options.items():
+                p = f"{prop}={val}"
 
-            try:
-                iocage.set(p, plugin)
-            except RuntimeError as err:
-                raise CallError(err)
+                try:
+                    iocage.set(p, plugin)
+                except RuntimeError as err:
+                    raise CallError(err)
 
-        if name:
-            iocage.rename(name)
+            if name:
+                iocage.rename(name)
+        finally:
+            self.invalidate_catalogue()
 
         return True
 
@@ -872,14 +977,17 @@ class JailService(CRUDService):
         _, _, iocage = self.check_jail_existence(jail)
 
         # TODO: Port children checking, release destroying.
-        iocage.destroy_jail(force=options.get('force'))
+        try:
+            iocage.destroy_jail(force=options.get('force'))
+        finally:
+            self.invalidate_catalogue()
 
         return True
 
     @private
     def check_dataset_existence(self):
         try:
-            IOCCheck(migrate=True)
+            ioc_check.IOCCheck(migrate=True)
         except ioc_exceptions.PoolNotActivated as e:
             raise CallError(e, errno=errno.ENOENT)
 
@@ -1019,6 +1127,8 @@ class JailService(CRUDService):
                 iocage.restart()
         except Exception as e:
             raise CallError(str(e))
+        finally:
+            self.invalidate_catalogue()
 
         return True
 
@@ -1027,13 +1137,15 @@ class JailService(CRUDService):
     def start(self, job, jail):
         """Takes a jail and starts it."""
         uuid, _, iocage = self.check_jail_existence(jail)
-        status, _ = IOCList.list_get_jid(uuid)
+        status, _ = ioc_list.IOCList.list_get_jid(uuid)
 
         if not status:
             try:
                 iocage.start(used_ports=[6000] + list(range(1025)))
             except Exception as e:
                 raise CallError(str(e))
+            finally:
+                self.invalidate_catalogue()
 
         return True
 
@@ -1042,13 +1154,15 @@ class JailService(CRUDService):
     def stop(self, job, jail, force):
         """Takes a jail and stops it."""
         uuid, _, iocage = self.check_jail_existence(jail)
-        status, _ = IOCList.list_get_jid(uuid)
+        status, _ = ioc_list.IOCList.list_get_jid(uuid)
 
         if status:
             try:
                 iocage.stop(force=force)
             except Exception as e:
                 raise CallError(str(e))
+            finally:
+                self.invalidate_catalogue()
 
             return True
 
@@ -1057,7 +1171,7 @@ class JailService(CRUDService):
     def restart(self, job, jail):
         """Takes a jail and restarts it."""
         uuid, _, iocage = self.check_jail_existence(jail)
-        status, _ = IOCList.list_get_jid(uuid)
+        status, _ = ioc_list.IOCList.list_get_jid(uuid)
 
         if status:
             try:
@@ -1069,13 +1183,15 @@ class JailService(CRUDService):
             iocage.start()
         except Exception as e:
             raise CallError(str(e))
+        finally:
+            self.invalidate_catalogue()
 
         return True
 
     @private
     def get_iocroot(self):
-        pool = IOCJson().json_get_value("pool")
-        return IOCJson(pool).json_get_value("iocroot")
+        pool = ioc_json.IOCJson().json_get_value("pool")
+        return ioc_json.IOCJson(pool).json_get_value("iocroot")
 
     @accepts(
         Str("jail"),
@@ -1096,7 +1212,7 @@ class JailService(CRUDService):
     def fstab(self, jail, options):
         """Manipulate a jails fstab"""
         uuid, _, iocage = self.check_jail_existence(jail, skip=False)
-        status, jid = IOCList.list_get_jid(uuid)
+        status, jid = ioc_list.IOCList.list_get_jid(uuid)
         action = options['action'].lower()
         index = options.get('index')
 
@@ -1221,6 +1337,7 @@ class JailService(CRUDService):
                 ds = zfs.get_dataset(_pool.name)
                 ds.properties[prop] = libzfs.ZFSUserProperty("no")
 
+        self.invalidate_catalogue()
         return activated
 
     @accepts(Str("ds_type", enum=["ALL", "JAIL", "TEMPLATE", "RELEASE"]))
@@ -1228,12 +1345,13 @@ class JailService(CRUDService):
         """Cleans all iocage datasets of ds_type"""
 
         if ds_type == "JAIL":
-            IOCClean().clean_jails()
+            ioc_clean.IOCClean().clean_jails()
         elif ds_type == "ALL":
-            IOCClean().clean_all()
+            ioc_clean.IOCClean().clean_all()
         elif ds_type == "TEMPLATE":
-            IOCClean().clean_templates()
+            ioc_clean.IOCClean().clean_templates()
 
+        self.invalidate_catalogue()
         return True
 
     @accepts(
@@ -1317,14 +1435,14 @@ class JailService(CRUDService):
         """
         jail = options['jail']
         uuid, path, _ = self.check_jail_existence(jail)
-        status, jid = IOCList.list_get_jid(uuid)
+        status, jid = ioc_list.IOCList.list_get_jid(uuid)
         started = False
 
         if status:
             self.middleware.call_sync('jail.stop', jail, job=True)
             started = True
 
-        IOCImage().export_jail(uuid, path, compression_algo=options['compression_algorithm'].lower())
+        ioc_image.IOCImage().export_jail(uuid, path, compression_algo=options['compression_algorithm'].lower())
 
         if started:
             self.middleware.call_sync('jail.start', jail, job=True)
@@ -1353,9 +1471,10 @@ class JailService(CRUDService):
 
         path = options['path'] or os.path.join(self.get_iocroot(), 'images')
 
-        IOCImage().import_jail(
+        ioc_image.IOCImage().import_jail(
             options['jail'], compression_algo=options['compression_algorithm'], path=path
         )
+        self.invalidate_catalogue()
 
         return True
 
@@ -1363,6 +1482,7 @@ class JailService(CRUDService):
     def start_on_boot(self):
         self.logger.debug('Starting jails on boot: PENDING')
         ioc.IOCage(rc=True).start()
+        self.invalidate_catalogue()
         self.logger.debug('Starting jails on boot: SUCCESS')
 
         return True
@@ -1392,6 +1512,12 @@ async def jail_pool_pre_lock(middleware, pool):
             await middleware.call('jail.stop', j['host_hostuuid'])
 
 
+async def devd_ifnet_hook(middleware, data):
+    # Jail virtual network interfaces come and go as jails are started and stopped (also outside of middleware)
+    if data.get('subsystem', '').startswith(('epair', 'vnet')):
+        await middleware.call('cache.pop', JAIL_CATALOGUE_CACHE)
+
+
 async def __event_system(middleware, event_type, args):
     """
     Method called when system is ready or shutdown, supposed to start/stop jails
@@ -1449,5 +1575,5 @@ class JailFSAttachmentDelegate(FSAttachmentDelegate):
 async def setup(middleware):
     await middleware.call('pool.dataset.register_attachment_delegate', JailFSAttachmentDelegate(middleware))
     middleware.register_hook('pool.pre_lock', jail_pool_pre_lock)
+    middleware.register_hook('devd.ifnet', devd_ifnet_hook)
     middleware.event_subscribe('system', __event_system)
-    ioc_common.set_interactive(False)
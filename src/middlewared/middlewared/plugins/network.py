@@ -1,6 +1,7 @@
 from middlewared.service import (CallError, ConfigService, CRUDService, Service,
                                  filterable, pass_app, private)
 from middlewared.utils import Popen, filter_list, run
+from middlewared.utils.asyncio_ import asyncio_map
 from middlewared.schema import (Bool, Dict, Int, IPAddr, List, Patch, Ref, Str,
                                 ValidationErrors, accepts)
 from middlewared.validators import Match, Range
@@ -18,6 +19,7 @@ import shlex
 import signal
 import socket
 import subprocess
+import time
 import urllib.request
 
 
@@ -27,6 +29,14 @@ if '/usr/local/www' not in sys.path:
 
 RE_NAMESERVER = re.compile(r'^nameserver\s+(\S+)', re.M)
 RE_MTU = re.compile(r'\bmtu\s+(\d+)')
+RE_DHCLIENT_PIDFILE = re.compile(r'^dhclient\.(.+)\.pid$')
+# Maximum number of interfaces configured at the same time by `interface.sync`
+SYNC_CONCURRENCY = 8
+# How long `interface.sync(wait_dhcp=True)` waits for all dhclients to get a lease
+DHCP_WAIT_TIMEOUT = 30
+
+# `dns.sync` on first boot calls `dns.post_sync` hook registered by mdns plugin
+SETUP_DEPENDS = ['system', 'alert', 'mdns']
 
 
 class NetworkConfigurationService(ConfigService):
@@ -280,6 +290,21 @@ def dhclient_status(interface):
     return running, pid
 
 
+def dhclient_statuses():
+    """
+    Get the current status of dhclient for all interfaces at once.
+
+    Returns:
+        dict: interface name -> tuple(bool, pid) (see `dhclient_status`).
+    """
+    statuses = {}
+    for name in os.listdir('/var/run'):
+        m = RE_DHCLIENT_PIDFILE.match(name)
+        if m:
+            statuses[m.group(1)] = dhclient_status(m.group(1))
+    return statuses
+
+
 def dhclient_leases(interface):
     """
     Reads the leases file for `interface` and returns the content.
@@ -296,6 +321,42 @@ def dhclient_leases(interface):
             return f.read()
 
 
+class InterfacePlan(object):
+    """
+    Operations needed to bring interface `name` from its current state to the one configured in database.
+
+    `steps` are `(description, func)` where `func(iface)` is called in a thread with `netif` interface object,
+    `post_steps` are `(description, coroutine function)` which are awaited afterwards (e.g. starting dhclient).
+    `pending` are futures started by post steps which the caller may wait for (e.g. dhclient getting a lease).
+    """
+
+    def __init__(self, name, iface, create=False):
+        self.name = name
+        self.iface = iface
+        self.create = create
+        self.steps = []
+        self.post_steps = []
+        self.pending = []
+        self.time = None
+
+    def add(self, description, func):
+        self.steps.append((description, func))
+
+    def add_post(self, description, func):
+        self.post_steps.append((description, func))
+
+    def describe(self):
+        return (['create'] if self.create else []) + [step[0] for step in self.steps + self.post_steps]
+
+    def apply(self):
+        if self.create:
+            netif.create_interface(self.name)
+        if self.iface is None:
+            self.iface = netif.get_interface(self.name)
+        for description, func in self.steps:
+            func(self.iface)
+
+
 class InterfaceService(CRUDService):
 
     class Config:
@@ -1512,185 +1573,294 @@ class InterfaceService(CRUDService):
         })
 
     @private
-    async def sync(self, wait_dhcp=False):
+    async def sync(self, wait_dhcp=False, dry_run=False):
         """
         Sync interfaces configured in database to the OS.
+
+        Network configuration is read from the database once and compared with the current state of the
+        interfaces. The resulting plan is applied in dependency order: LAGGs, VLANs, bridges, then addresses
+        and options of every configured interface and finally interfaces which are not in the database are
+        deconfigured. Interfaces within the same phase are applied concurrently.
+
+        `dry_run` only computes the plan. Returns list of dict(phase, interface, steps, time) where `time` is
+        the time in seconds it took to apply the steps (`None` for `dry_run`).
         """
 
-        await self.middleware.call_hook('interface.pre_sync')
+        if not dry_run:
+            await self.middleware.call_hook('interface.pre_sync')
 
-        interfaces = [i['int_interface'] for i in (await self.middleware.call('datastore.query', 'network.interfaces'))]
+        config = await self._sync_config()
+        interfaces = list(config['interfaces'])
         cloned_interfaces = []
         parent_interfaces = []
         sync_interface_opts = defaultdict(dict)
+        # Interfaces which do not exist yet but will be created by the preceding phases
+        created = set()
+
+        report = []
+        timings = {}
+        pending = []
+
+        async def apply(phase, plan_func):
+            start = time.monotonic()
+            plans = [
+                plan for plan in await self.middleware.run_in_thread(plan_func, netif.list_interfaces())
+                if plan.create or plan.steps or plan.post_steps
+            ]
+            created.update(plan.name for plan in plans if plan.create)
+            if not dry_run:
+                await asyncio_map(self._apply_plan, plans, SYNC_CONCURRENCY)
+                pending.extend(future for plan in plans for future in plan.pending)
+            report.extend(
+                {'phase': phase, 'interface': plan.name, 'steps': plan.describe(), 'time': plan.time}
+                for plan in plans
+            )
+            timings[phase] = time.monotonic() - start
 
         # First of all we need to create the virtual interfaces
         # LAGG comes first and then VLAN
-        laggs = await self.middleware.call('datastore.query', 'network.lagginterface')
-        for lagg in laggs:
-            name = lagg['lagg_interface']['int_interface']
-            cloned_interfaces.append(name)
-            self.logger.info('Setting up {}'.format(name))
-            try:
-                iface = netif.get_interface(name)
-            except KeyError:
-                netif.create_interface(name)
-                iface = netif.get_interface(name)
-
-            protocol = getattr(netif.AggregationProtocol, lagg['lagg_protocol'].upper())
-            if iface.protocol != protocol:
-                self.logger.info('{}: changing protocol to {}'.format(name, protocol))
-                iface.protocol = protocol
-
-            members_database = set()
-            members_configured = set(p[0] for p in iface.ports)
-            for member in (await self.middleware.call('datastore.query', 'network.lagginterfacemembers', [('lagg_interfacegroup_id', '=', lagg['id'])])):
-                # For Link Aggregation MTU is configured in parent, not ports
-                sync_interface_opts[member['lagg_physnic']]['skip_mtu'] = True
-                members_database.add(member['lagg_physnic'])
-                try:
-                    member_iface = netif.get_interface(member['lagg_physnic'])
-                except KeyError:
-                    self.logger.warn('Could not find {} from {}'.format(member['lagg_physnic'], name))
+        def plan_laggs(ifaces):
+            plans = []
+            for lagg in config['laggs']:
+                cloned_interfaces.append(lagg['lagg_interface']['int_interface'])
+                plans.append(self._plan_lagg(lagg, ifaces, sync_interface_opts, parent_interfaces))
+            return plans
+
+        def plan_vlans(ifaces):
+            plans = []
+            for vlan in config['vlans']:
+                cloned_interfaces.append(vlan['vlan_vint'])
+                plans.append(self._plan_vlan(vlan, ifaces, created, parent_interfaces))
+            return plans
+
+        def plan_bridges(ifaces):
+            plans = []
+            for bridge in config['bridges']:
+                cloned_interfaces.append(bridge['interface']['int_interface'])
+                plans.append(self._plan_bridge(bridge, ifaces))
+            return plans
+
+        def plan_interfaces(ifaces):
+            dhclient = dhclient_statuses()
+            plans = []
+            for name in interfaces:
+                if name not in ifaces and name not in created:
+                    self.logger.warn('Could not find {} to configure'.format(name))
+                    continue
+                plans.append(self._plan_interface(
+                    config, name, ifaces.get(name), dhclient.get(name, (False, None)), wait_dhcp,
+                    **sync_interface_opts[name],
+                ))
+            return plans
+
+        def plan_cleanup(ifaces):
+            dhclient = dhclient_statuses()
+            plans = []
+            for name, iface in ifaces.items():
+                # Skip internal interfaces
+                if name.startswith(config['internal_interfaces']):
                     continue
 
-                lagg_mtu = lagg['lagg_interface']['int_mtu'] or 1500
-                if member_iface.mtu != lagg_mtu:
-                    member_name = member['lagg_physnic']
-                    if member_name in members_configured:
-                        iface.delete_port(member_name)
-                        members_configured.remove(member_name)
-                    member_iface.mtu = lagg_mtu
-
-            # Remove member configured but not in database
-            for member in (members_configured - members_database):
-                iface.delete_port(member)
-
-            # Add member in database but not configured
-            for member in (members_database - members_configured):
-                iface.add_port(member)
-
-            for port in iface.ports:
-                try:
-                    port_iface = netif.get_interface(port[0])
-                except KeyError:
-                    self.logger.warn('Could not find {} from {}'.format(port[0], name))
+                # bridge0/bridge1 are special, may be used by Jails/VM
+                if name in ('bridge0', 'bridge1'):
                     continue
-                parent_interfaces.append(port[0])
-                port_iface.up()
 
-        vlans = await self.middleware.call('datastore.query', 'network.vlan')
-        for vlan in vlans:
-            cloned_interfaces.append(vlan['vlan_vint'])
-            self.logger.info('Setting up {}'.format(vlan['vlan_vint']))
-            try:
-                iface = netif.get_interface(vlan['vlan_vint'])
-            except KeyError:
-                netif.create_interface(vlan['vlan_vint'])
-                iface = netif.get_interface(vlan['vlan_vint'])
+                plan = InterfacePlan(name, iface)
+                dhclient_running, dhclient_pid = dhclient.get(name, (False, None))
+                # If there are no interfaces configured we start DHCP on all
+                if not interfaces:
+                    if not dhclient_running:
+                        plan.add_post('start dhclient', self._dhclient_start_step(plan, wait_dhcp))
+                elif name not in interfaces:
+                    # Destroy interfaces which are not in database
+
+                    # Interface not in database lose addresses
+                    for address in iface.addresses:
+                        plan.add(f'remove address {address}', lambda i, address=address: i.remove_address(address))
+
+                    # Kill dhclient if its running for this interface
+                    if dhclient_running:
+                        plan.add(f'kill dhclient (pid {dhclient_pid})',
+                                 lambda i, pid=dhclient_pid: os.kill(pid, signal.SIGTERM))
+
+                    # If we have bridge/vlan/lagg not in the database at all
+                    # it gets destroy, otherwise just bring it down.
+                    if name not in cloned_interfaces and name.startswith(('bridge', 'lagg', 'vlan')):
+                        plan.add('destroy', lambda i: netif.destroy_interface(i.name))
+                    elif name not in parent_interfaces:
+                        plan.add('down', lambda i: i.down())
+                plans.append(plan)
+            return plans
+
+        await apply('lagg', plan_laggs)
+        await apply('vlan', plan_vlans)
+        await apply('bridge', plan_bridges)
+        self.logger.info('Interfaces in database: {}'.format(', '.join(interfaces) or 'NONE'))
+        await apply('interface', plan_interfaces)
+        await apply('cleanup', plan_cleanup)
 
-            if iface.parent != vlan['vlan_pint'] or iface.tag != vlan['vlan_tag'] or iface.pcp != vlan['vlan_pcp']:
-                iface.unconfigure()
-                try:
-                    iface.configure(vlan['vlan_pint'], vlan['vlan_tag'], vlan['vlan_pcp'])
-                except FileNotFoundError:
-                    self.logger.warn(
-                        'VLAN %s parent interface %s not found, skipping.',
-                        vlan['vlan_vint'],
-                        vlan['vlan_pint'],
-                    )
-                    continue
+        if pending:
+            start = time.monotonic()
+            await asyncio.wait(pending, timeout=DHCP_WAIT_TIMEOUT)
+            timings['dhcp'] = time.monotonic() - start
 
-            try:
-                parent_iface = netif.get_interface(iface.parent)
-            except KeyError:
-                self.logger.warn('Could not find {} from {}'.format(iface.parent, vlan['vlan_vint']))
-                continue
-            parent_interfaces.append(iface.parent)
-            parent_iface.up()
-
-        bridges = await self.middleware.call('datastore.query', 'network.bridge')
-        for bridge in bridges:
-            name = bridge['interface']['int_interface']
-            cloned_interfaces.append(name)
-            self.logger.info(f'Setting up {name}')
-            try:
-                iface = netif.get_interface(name)
-            except KeyError:
-                netif.create_interface(name)
-                iface = netif.get_interface(name)
+        self.logger.debug('Interfaces sync%s took %s', ' (dry run)' if dry_run else '', ', '.join(
+            f'{phase} {seconds:.3f}s' for phase, seconds in timings.items()
+        ))
 
-            members = set(iface.members)
-            members_database = set(bridge['members'])
+        if not dry_run:
+            await self.middleware.call_hook('interface.post_sync')
 
-            for member in members_database - members:
-                try:
-                    iface.add_member(member)
-                except FileNotFoundError:
-                    self.logger.error('Bridge member %s not found', member)
+        return report
 
-            for member in members - members_database:
-                # These interfaces may be added dynamically for Jails/VMs
-                if member.startswith(('vnet', 'epair', 'tap')):
-                    continue
-                iface.delete_member(member)
+    async def _sync_config(self):
+        """
+        Load all the network configuration `sync` needs at once.
+        """
+        interfaces = {
+            i['int_interface']: i
+            for i in await self.middleware.call('datastore.query', 'network.interfaces')
+        }
 
-        self.logger.info('Interfaces in database: {}'.format(', '.join(interfaces) or 'NONE'))
-        for interface in interfaces:
-            try:
-                await self.sync_interface(interface, wait_dhcp, **sync_interface_opts[interface])
-            except Exception:
-                self.logger.error('Failed to configure {}'.format(interface), exc_info=True)
+        aliases = defaultdict(list)
+        for alias in await self.middleware.call('datastore.query', 'network.alias'):
+            aliases[alias['alias_interface']['id']].append(alias)
+
+        lagg_members = defaultdict(list)
+        for member in await self.middleware.call('datastore.query', 'network.lagginterfacemembers'):
+            lagg_members[member['lagg_interfacegroup']['id']].append(member)
 
         internal_interfaces = ['lo', 'pflog', 'pfsync', 'tun', 'tap', 'epair']
-        if not await self.middleware.call('system.is_freenas'):
+        is_freenas = await self.middleware.call('system.is_freenas')
+        if not is_freenas:
             internal_interfaces.extend(await self.middleware.call('failover.internal_interfaces') or [])
-        internal_interfaces = tuple(internal_interfaces)
 
-        dhclient_aws = []
-        for name, iface in list(netif.list_interfaces().items()):
-            # Skip internal interfaces
-            if name.startswith(internal_interfaces):
-                continue
+        return {
+            'interfaces': interfaces,
+            'aliases': aliases,
+            'laggs': [
+                dict(lagg, members=lagg_members[lagg['id']])
+                for lagg in await self.middleware.call('datastore.query', 'network.lagginterface')
+            ],
+            'vlans': await self.middleware.call('datastore.query', 'network.vlan'),
+            'bridges': await self.middleware.call('datastore.query', 'network.bridge'),
+            'is_freenas': is_freenas,
+            'failover_node': None if is_freenas else await self.middleware.call('failover.node'),
+            'internal_interfaces': tuple(internal_interfaces),
+        }
 
-            # bridge0/bridge1 are special, may be used by Jails/VM
-            if name in ('bridge0', 'bridge1'):
+    async def _apply_plan(self, plan):
+        start = time.monotonic()
+        try:
+            await self.middleware.run_in_thread(plan.apply)
+            for description, func in plan.post_steps:
+                await func(plan.iface)
+        except Exception:
+            self.logger.error('Failed to configure {}'.format(plan.name), exc_info=True)
+        plan.time = time.monotonic() - start
+
+    def _plan_lagg(self, lagg, ifaces, sync_interface_opts, parent_interfaces):
+        name = lagg['lagg_interface']['int_interface']
+        self.logger.info('Setting up {}'.format(name))
+        iface = ifaces.get(name)
+        plan = InterfacePlan(name, iface, create=iface is None)
+
+        protocol = getattr(netif.AggregationProtocol, lagg['lagg_protocol'].upper())
+        if iface is None or iface.protocol != protocol:
+            plan.add(f'change protocol to {protocol.name}', lambda i: setattr(i, 'protocol', protocol))
+
+        members_database = set()
+        members_configured = set(p[0] for p in iface.ports) if iface is not None else set()
+        lagg_mtu = lagg['lagg_interface']['int_mtu'] or 1500
+        for member in lagg['members']:
+            member_name = member['lagg_physnic']
+            # For Link Aggregation MTU is configured in parent, not ports
+            sync_interface_opts[member_name]['skip_mtu'] = True
+            member_iface = ifaces.get(member_name)
+            if member_iface is None:
+                self.logger.warn('Could not find {} from {}'.format(member_name, name))
                 continue
+            members_database.add(member_name)
 
-            # If there are no interfaces configured we start DHCP on all
-            if not interfaces:
-                dhclient_running = dhclient_status(name)[0]
-                if not dhclient_running:
-                    dhclient_aws.append(asyncio.ensure_future(
-                        self.dhclient_start(name, wait_dhcp)
-                    ))
-            else:
-                # Destroy interfaces which are not in database
+            if member_iface.mtu != lagg_mtu:
+                if member_name in members_configured:
+                    plan.add(f'remove port {member_name}', lambda i, port=member_name: i.delete_port(port))
+                    members_configured.remove(member_name)
+                plan.add(f'set {member_name} mtu {lagg_mtu}',
+                         lambda i, member_iface=member_iface: setattr(member_iface, 'mtu', lagg_mtu))
 
-                # Skip interfaces in database
-                if name in interfaces:
-                    continue
+        # Remove member configured but not in database
+        for member in sorted(members_configured - members_database):
+            plan.add(f'remove port {member}', lambda i, port=member: i.delete_port(port))
 
-                # Interface not in database lose addresses
-                for address in iface.addresses:
-                    iface.remove_address(address)
+        # Add member in database but not configured
+        for member in sorted(members_database - members_configured):
+            plan.add(f'add port {member}', lambda i, port=member: i.add_port(port))
 
-                dhclient_running, dhclient_pid = dhclient_status(name)
-                # Kill dhclient if its running for this interface
-                if dhclient_running:
-                    os.kill(dhclient_pid, signal.SIGTERM)
+        for member in sorted(members_database):
+            parent_interfaces.append(member)
+            if netif.InterfaceFlags.UP not in ifaces[member].flags:
+                plan.add(f'bring {member} up', lambda i, member_iface=ifaces[member]: member_iface.up())
+
+        return plan
+
+    def _plan_vlan(self, vlan, ifaces, created, parent_interfaces):
+        name = vlan['vlan_vint']
+        self.logger.info('Setting up {}'.format(name))
+        iface = ifaces.get(name)
+        plan = InterfacePlan(name, iface, create=iface is None)
+
+        if (
+            iface is None or
+            (iface.parent, iface.tag, iface.pcp) != (vlan['vlan_pint'], vlan['vlan_tag'], vlan['vlan_pcp'])
+        ):
+            if vlan['vlan_pint'] not in ifaces and vlan['vlan_pint'] not in created:
+                self.logger.warn(
+                    'VLAN %s parent interface %s not found, skipping.',
+                    vlan['vlan_vint'],
+                    vlan['vlan_pint'],
+                )
+                return plan
+
+            if iface is not None:
+                plan.add('unconfigure', lambda i: i.unconfigure())
+            plan.add(
+                f'configure parent {vlan["vlan_pint"]} tag {vlan["vlan_tag"]} pcp {vlan["vlan_pcp"]}',
+                lambda i: i.configure(vlan['vlan_pint'], vlan['vlan_tag'], vlan['vlan_pcp']),
+            )
+
+        parent_interfaces.append(vlan['vlan_pint'])
+        parent_iface = ifaces.get(vlan['vlan_pint'])
+        if parent_iface is None or netif.InterfaceFlags.UP not in parent_iface.flags:
+            plan.add(f'bring {vlan["vlan_pint"]} up', lambda i: netif.get_interface(vlan['vlan_pint']).up())
+
+        return plan
 
-                # If we have bridge/vlan/lagg not in the database at all
-                # it gets destroy, otherwise just bring it down.
-                if name not in cloned_interfaces and name.startswith(('bridge', 'lagg', 'vlan')):
-                    netif.destroy_interface(name)
-                elif name not in parent_interfaces:
-                    iface.down()
+    def _plan_bridge(self, bridge, ifaces):
+        name = bridge['interface']['int_interface']
+        self.logger.info(f'Setting up {name}')
+        iface = ifaces.get(name)
+        plan = InterfacePlan(name, iface, create=iface is None)
 
-        if wait_dhcp and dhclient_aws:
-            await asyncio.wait(dhclient_aws, timeout=30)
+        members = set(iface.members) if iface is not None else set()
+        members_database = set(bridge['members'])
 
-        await self.middleware.call_hook('interface.post_sync')
+        def add_member(i, member):
+            try:
+                i.add_member(member)
+            except FileNotFoundError:
+                self.logger.error('Bridge member %s not found', member)
+
+        for member in sorted(members_database - members):
+            plan.add(f'add member {member}', lambda i, member=member: add_member(i, member))
+
+        for member in sorted(members - members_database):
+            # These interfaces may be added dynamically for Jails/VMs
+            if member.startswith(('vnet', 'epair', 'tap')):
+                continue
+            plan.add(f'remove member {member}', lambda i, member=member: i.delete_member(member))
+
+        return plan
 
     @private
     def alias_to_addr(self, alias):
@@ -1706,28 +1876,39 @@ class InterfaceService(CRUDService):
 
     @private
     async def sync_interface(self, name, wait_dhcp=False, **kwargs):
-        try:
-            data = await self.middleware.call('datastore.query', 'network.interfaces', [('int_interface', '=', name)], {'get': True})
-        except IndexError:
+        config = await self._sync_config()
+        if name not in config['interfaces']:
             self.logger.info('{} is not in interfaces database'.format(name))
             return
 
-        aliases = await self.middleware.call('datastore.query', 'network.alias', [('alias_interface_id', '=', data['id'])])
+        plan = await self.middleware.run_in_thread(
+            lambda: self._plan_interface(
+                config, name, netif.get_interface(name), dhclient_status(name), wait_dhcp, **kwargs,
+            )
+        )
+        await self._apply_plan(plan)
+        if plan.pending:
+            await asyncio.wait(plan.pending, timeout=DHCP_WAIT_TIMEOUT)
+
+    def _plan_interface(self, config, name, iface, dhclient, wait_dhcp=False, skip_mtu=False):
+        """
+        Plan configuration of addresses and options of interface `name`.
 
-        iface = netif.get_interface(name)
+        `iface` is `None` if the interface does not exist yet (it is going to be created in preceding phase).
+        """
+        data = config['interfaces'][name]
+        aliases = config['aliases'][data['id']]
+        plan = InterfacePlan(name, iface)
 
         addrs_database = set()
         addrs_configured = set([
-            a for a in iface.addresses
+            a for a in (iface.addresses if iface is not None else [])
             if a.af != netif.AddressFamily.LINK
         ])
 
         has_ipv6 = data['int_ipv6auto'] or False
 
-        if (
-            not await self.middleware.call('system.is_freenas') and
-            await self.middleware.call('failover.node') == 'B'
-        ):
+        if not config['is_freenas'] and config['failover_node'] == 'B':
             ipv4_field = 'int_ipv4address_b'
             ipv6_field = 'int_ipv6address'
             alias_ipv4_field = 'alias_v4address_b'
@@ -1738,7 +1919,7 @@ class InterfaceService(CRUDService):
             alias_ipv4_field = 'alias_v4address'
             alias_ipv6_field = 'alias_v6address'
 
-        dhclient_running, dhclient_pid = dhclient_status(name)
+        dhclient_running, dhclient_pid = dhclient
         if dhclient_running and data['int_dhcp']:
             leases = dhclient_leases(name)
             if leases:
@@ -1798,91 +1979,115 @@ class InterfaceService(CRUDService):
                     'vhid': data['int_vhid'],
                 }))
 
-        if carp_vhid:
-            advskew = None
+        advskew = None
+        if carp_vhid and iface is not None:
             for cc in iface.carp_config:
                 if cc.vhid == carp_vhid:
                     advskew = cc.advskew
                     break
 
+        nd6_flags = iface.nd6_flags if iface is not None else set()
         if has_ipv6:
-            iface.nd6_flags = iface.nd6_flags - {netif.NeighborDiscoveryFlags.IFDISABLED}
-            iface.nd6_flags = iface.nd6_flags | {netif.NeighborDiscoveryFlags.AUTO_LINKLOCAL}
+            nd6_flags = (nd6_flags - {netif.NeighborDiscoveryFlags.IFDISABLED}) | {
+                netif.NeighborDiscoveryFlags.AUTO_LINKLOCAL
+            }
+        else:
+            nd6_flags = (nd6_flags | {netif.NeighborDiscoveryFlags.IFDISABLED}) - {
+                netif.NeighborDiscoveryFlags.AUTO_LINKLOCAL
+            }
+        if data['int_ipv6auto']:
+            nd6_flags = nd6_flags | {netif.NeighborDiscoveryFlags.ACCEPT_RTADV}
         else:
-            iface.nd6_flags = iface.nd6_flags | {netif.NeighborDiscoveryFlags.IFDISABLED}
-            iface.nd6_flags = iface.nd6_flags - {netif.NeighborDiscoveryFlags.AUTO_LINKLOCAL}
+            nd6_flags = nd6_flags - {netif.NeighborDiscoveryFlags.ACCEPT_RTADV}
+        if iface is None or nd6_flags != iface.nd6_flags:
+            plan.add('set nd6 flags {}'.format(', '.join(sorted(f.name for f in nd6_flags)) or 'NONE'),
+                     lambda i: setattr(i, 'nd6_flags', nd6_flags))
 
         # Remove addresses configured and not in database
         for addr in (addrs_configured - addrs_database):
             if has_ipv6 and str(addr.address).startswith('fe80::'):
                 continue
             self.logger.debug('{}: removing {}'.format(name, addr))
-            iface.remove_address(addr)
+            plan.add(f'remove address {addr}', lambda i, addr=addr: i.remove_address(addr))
 
         # carp must be configured after removing addresses
         # in case removing the address removes the carp
         if carp_vhid:
-            if not await self.middleware.call('system.is_freenas') and not advskew:
-                if await self.middleware.call('failover.node') == 'A':
+            if not config['is_freenas'] and not advskew:
+                if config['failover_node'] == 'A':
                     advskew = 20
                 else:
                     advskew = 80
             # FIXME: change py-netif to accept str() key
-            iface.carp_config = [netif.CarpConfig(carp_vhid, advskew=advskew, key=carp_pass.encode())]
+            plan.add(f'configure carp vhid {carp_vhid} advskew {advskew}', lambda i: setattr(
+                i, 'carp_config', [netif.CarpConfig(carp_vhid, advskew=advskew, key=carp_pass.encode())],
+            ))
 
         # Add addresses in database and not configured
         for addr in (addrs_database - addrs_configured):
             self.logger.debug('{}: adding {}'.format(name, addr))
-            iface.add_address(addr)
+            plan.add(f'add address {addr}', lambda i, addr=addr: i.add_address(addr))
 
         # Apply interface options specified in GUI
         if data['int_options']:
-            self.logger.info('{}: applying {}'.format(name, data['int_options']))
-            proc = await Popen(['/sbin/ifconfig', name] + shlex.split(data['int_options']), stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-            err = (await proc.communicate())[1].decode()
-            if err:
-                self.logger.info('{}: error applying: {}'.format(name, err))
+            def apply_options(i):
+                self.logger.info('{}: applying {}'.format(name, data['int_options']))
+                err = subprocess.run(
+                    ['/sbin/ifconfig', name] + shlex.split(data['int_options']),
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True,
+                ).stderr.decode()
+                if err:
+                    self.logger.info('{}: error applying: {}'.format(name, err))
+
+            plan.add(f'apply options {data["int_options"]}', apply_options)
 
         # In case there is no MTU in interface and it is currently
         # different than the default of 1500, revert it
-        if not kwargs.get('skip_mtu'):
-            if data['int_mtu']:
-                if iface.mtu != data['int_mtu']:
-                    iface.mtu = data['int_mtu']
-            elif iface.mtu != 1500:
-                iface.mtu = 1500
-
-        if data['int_name'] and iface.description != data['int_name']:
-            try:
-                iface.description = data['int_name']
-            except Exception:
-                self.logger.warn(f'Failed to set interface {name} description', exc_info=True)
+        if not skip_mtu:
+            mtu = data['int_mtu'] or 1500
+            if iface is None or iface.mtu != mtu:
+                plan.add(f'set mtu {mtu}', lambda i: setattr(i, 'mtu', mtu))
+
+        if data['int_name'] and (iface is None or iface.description != data['int_name']):
+            def set_description(i):
+                try:
+                    i.description = data['int_name']
+                except Exception:
+                    self.logger.warn(f'Failed to set interface {name} description', exc_info=True)
 
-        if netif.InterfaceFlags.UP not in iface.flags:
-            iface.up()
+            plan.add(f'set description {data["int_name"]}', set_description)
+
+        if iface is None or netif.InterfaceFlags.UP not in iface.flags:
+            plan.add('bring up', lambda i: i.up())
 
         # If dhclient is not running and dhcp is configured, lets start it
         if not dhclient_running and data['int_dhcp']:
-            self.logger.debug('Starting dhclient for {}'.format(name))
-            dhclient_coro = self.dhclient_start(data['int_interface'], wait_dhcp)
-            if wait_dhcp:
-                await dhclient_coro
-            else:
-                asyncio.ensure_future(dhclient_coro)
+            plan.add_post('start dhclient', self._dhclient_start_step(plan, wait_dhcp))
         elif dhclient_running and not data['int_dhcp']:
             self.logger.debug('Killing dhclient for {}'.format(name))
-            os.kill(dhclient_pid, signal.SIGTERM)
+            plan.add(f'kill dhclient (pid {dhclient_pid})', lambda i: os.kill(dhclient_pid, signal.SIGTERM))
 
         if data['int_ipv6auto']:
-            iface.nd6_flags = iface.nd6_flags | {netif.NeighborDiscoveryFlags.ACCEPT_RTADV}
-            await (await Popen(
-                ['/etc/rc.d/rtsold', 'onestart'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                close_fds=True,
-            )).wait()
-        else:
-            iface.nd6_flags = iface.nd6_flags - {netif.NeighborDiscoveryFlags.ACCEPT_RTADV}
+            async def start_rtsold(i):
+                await (await Popen(
+                    ['/etc/rc.d/rtsold', 'onestart'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    close_fds=True,
+                )).wait()
+
+            plan.add_post('start rtsold', start_rtsold)
+
+        return plan
+
+    def _dhclient_start_step(self, plan, wait_dhcp):
+        async def dhclient_start(i):
+            self.logger.debug('Starting dhclient for {}'.format(plan.name))
+            future = asyncio.ensure_future(self.dhclient_start(plan.name, wait_dhcp))
+            if wait_dhcp:
+                plan.pending.append(future)
+
+        return dhclient_start
 
     @private
     async def dhclient_start(self, interface, wait=False):
@@ -1,5 +1,6 @@
 import asyncio
 import base64
+import copy
 import contextlib
 import errno
 import logging
@@ -10,12 +11,14 @@ import shutil
 import subprocess
 import sysctl
 import tempfile
+import threading
+from time import monotonic
 import uuid
 
 import bsd
 import psutil
 
-from libzfs import ZFSException
+from middlewared.common.open_files.index import index_processes, parse_lsof_processes, parse_procstat
 from middlewared.job import JobProgressBuffer
 from middlewared.schema import (accepts, Attribute, Bool, Cron, Dict, EnumMixin, Int, List, Patch,
                                 Str, UnixPerm)
@@ -25,12 +28,21 @@ from middlewared.service import (
 from middlewared.service_exception import ValidationError
 from middlewared.utils import Popen, filter_list, run, start_daemon_thread
 from middlewared.utils.asyncio_ import asyncio_map
+from middlewared.utils.lazy import lazy_import
 from middlewared.utils.shell import join_commandline
 from middlewared.validators import Range, Time
 
+libzfs = lazy_import('libzfs')
+
 logger = logging.getLogger(__name__)
 
 GELI_KEYPATH = '/data/geli'
+# Pool fields which come from libzfs, pools are only queried if one of them is requested
+ZPOOL_FIELDS = {'status', 'scan', 'topology', 'healthy', 'status_detail'}
+# libzfs state of pools is cached for this long unless devd reports a ZFS event
+ZPOOL_STATES_TTL = 30
+# Open files scan is shared by `pool.dataset.processes` calls made within this many seconds
+OPEN_FILES_MAX_AGE = 5
 RE_DISKPART = re.compile(r'^([a-z]+\d+)(p\d+)?')
 RE_HISTORY_ZPOOL_SCRUB = re.compile(r'^([0-9\.\:\-]{19})\s+zpool scrub', re.MULTILINE)
 RE_HISTORY_ZPOOL_CREATE = re.compile(r'^([0-9\.\:\-]{19})\s+zpool create', re.MULTILINE)
@@ -274,6 +286,33 @@ class MountFsContextManager:
             await self.middleware.run_in_thread(bsd.unmount, self.path)
 
 
+def query_fields(filters, options):
+    """
+    Top level fields `filter_list` needs to apply `filters` and `options` to query results.
+
+    Returns `None` if all fields are needed.
+    """
+    if options.get('count'):
+        fields = set()
+    elif options.get('select'):
+        fields = set(options['select'])
+    else:
+        return None
+
+    filters = list(filters or [])
+    while filters:
+        f = filters.pop()
+        if len(f) == 2 and f[0] == 'OR':
+            filters.extend(f[1])
+        elif len(f) == 3:
+            fields.add(f[0].split('.')[0])
+
+    for o in options.get('order_by') or []:
+        fields.add(o.lstrip('-'))
+
+    return fields
+
+
 class PoolService(CRUDService):
 
     GELI_KEYPATH = '/data/geli'
@@ -283,6 +322,33 @@ class PoolService(CRUDService):
         datastore_extend = 'pool.pool_extend'
         datastore_prefix = 'vol_'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (generation, timestamp, dict(pool name) = ZPOOL_FIELDS) for all imported pools
+        self.zpool_states = None
+        self.zpool_states_generation = 0
+        self.zpool_states_lock = threading.Lock()
+
+    @filterable
+    async def query(self, filters=None, options=None):
+        """
+        Query pools with `query-filters` and `query-options`.
+
+        Only fields needed for `query-options.select` (and `query-filters` and `query-options.order_by`) are
+        computed, e.g. selecting just `name` and `status` skips vdev topology and encryption state.
+        """
+        options = options or {}
+        fields = query_fields(filters, options)
+        pools = await self.middleware.call(
+            'datastore.query', self._config.datastore, [], {'prefix': self._config.datastore_prefix},
+        )
+        pools = await self.middleware.run_in_thread(self.__extend_pools, pools, fields)
+        return await self.middleware.run_in_thread(filter_list, pools, filters, options)
+
+    def __extend_pools(self, pools, fields):
+        context = self.pool_extend_context(fields)
+        return [self.pool_extend(pool, context) for pool in pools]
+
     @item_method
     @accepts(
         Int('id', required=True),
@@ -308,9 +374,9 @@ class PoolService(CRUDService):
             }
         """
         pool = await self._get_instance(oid)
-        return await job.wrap(
-            await self.middleware.call('zfs.pool.scrub', pool['name'], action)
-        )
+        scrub_job = await self.middleware.call('zfs.pool.scrub', pool['name'], action)
+        self.invalidate_zpool_states()
+        return await job.wrap(scrub_job)
 
     @accepts(List('types', items=[Str('type', enum=['FILESYSTEM', 'VOLUME'])], default=['FILESYSTEM', 'VOLUME']))
     async def filesystem_choices(self, types):
@@ -423,6 +489,7 @@ class PoolService(CRUDService):
             'zfs.pool.upgrade',
             (await self._get_instance(oid))['name']
         )
+        self.invalidate_zpool_states()
         return True
 
     def _topology(self, x, geom_scan=True):
@@ -448,51 +515,100 @@ class PoolService(CRUDService):
         return x
 
     @private
-    def pool_extend(self, pool):
+    def pool_extend_context(self, fields=None):
+        """
+        `fields` is a set of pool fields to compute, `None` means all of them.
+        """
+        zpools = None
+        if fields is None or fields & (ZPOOL_FIELDS | {'is_decrypted'}):
+            zpools = self.get_zpool_states()
+
+        return {'fields': fields, 'zpools': zpools}
+
+    @private
+    def pool_extend(self, pool, context=None):
 
         """
         If pool is encrypted we need to check if the pool is imported
         or if all geli providers exist.
         """
+        if context is None:
+            context = self.pool_extend_context()
+        fields = context['fields']
+
         pool['path'] = f'/mnt/{pool["name"]}'
-        try:
-            zpool = self.middleware.call_sync('zfs.pool.query', [('id', '=', pool['name'])])[0]
-        except Exception:
-            zpool = None
-
-        if zpool:
-            pool.update({
-                'status': zpool['status'],
-                'scan': zpool['scan'],
-                'topology': self._topology(zpool['groups']),
-                'healthy': zpool['healthy'],
-                'status_detail': zpool['status_detail'],
-            })
-        else:
-            pool.update({
-                'status': 'OFFLINE',
-                'scan': None,
-                'topology': None,
-                'healthy': False,
-                'status_detail': None,
-            })
+        zpool = None
+        if context['zpools'] is not None:
+            zpool = context['zpools'].get(pool['name'])
 
-        if pool['encrypt'] > 0:
+        if fields is None or fields & ZPOOL_FIELDS:
             if zpool:
-                pool['is_decrypted'] = True
+                # Cached state is shared by all queries
+                pool.update(copy.deepcopy(zpool))
             else:
-                decrypted = True
-                for ed in self.middleware.call_sync('datastore.query', 'storage.encrypteddisk', [('encrypted_volume', '=', pool['id'])]):
-                    if not os.path.exists(f'/dev/{ed["encrypted_provider"]}.eli'):
-                        decrypted = False
-                        break
-                pool['is_decrypted'] = decrypted
+                pool.update({
+                    'status': 'OFFLINE',
+                    'scan': None,
+                    'topology': None,
+                    'healthy': False,
+                    'status_detail': None,
+                })
+
+        if pool['encrypt'] > 0:
+            if fields is None or 'is_decrypted' in fields:
+                if zpool:
+                    pool['is_decrypted'] = True
+                else:
+                    decrypted = True
+                    for ed in self.middleware.call_sync('datastore.query', 'storage.encrypteddisk', [('encrypted_volume', '=', pool['id'])]):
+                        if not os.path.exists(f'/dev/{ed["encrypted_provider"]}.eli'):
+                            decrypted = False
+                            break
+                    pool['is_decrypted'] = decrypted
             pool['encryptkey_path'] = os.path.join(GELI_KEYPATH, f'{pool["encryptkey"]}.key')
         else:
             pool['encryptkey_path'] = None
             pool['is_decrypted'] = True
         return pool
 
+    @private
+    def get_zpool_states(self):
+        """
+        `ZPOOL_FIELDS` of all imported pools retrieved in a single libzfs pass (and a single GEOM scan).
+
+        Cached until devd reports a ZFS event (vdev state changes, scrub start/finish, config sync, ...) and not
+        cached at all while a pool is being scrubbed/resilvered so its scan progress is always up to date.
+        """
+        with self.zpool_states_lock:
+            if self.zpool_states is not None:
+                generation, timestamp, states = self.zpool_states
+                if (
+                    generation == self.zpool_states_generation and
+                    monotonic() - timestamp < ZPOOL_STATES_TTL and
+                    not any((state['scan'] or {}).get('state') == 'SCANNING' for state in states.values())
+                ):
+                    return states
+
+            generation = self.zpool_states_generation
+            states = {}
+            geom_scan = True
+            for zpool in self.middleware.call_sync('zfs.pool.query'):
+                states[zpool['name']] = {
+                    'status': zpool['status'],
+                    'scan': zpool['scan'],
+                    'topology': self._topology(zpool['groups'], geom_scan),
+                    'healthy': zpool['healthy'],
+                    'status_detail': zpool['status_detail'],
+                }
+                geom_scan = False
+
+            self.zpool_states = (generation, monotonic(), states)
+            return states
+
+    @private
+    def invalidate_zpool_states(self):
+        self.zpool_states_generation += 1
+
     @accepts(Dict(
         'pool_create',
         Str('name', required=True),
@@ -586,7 +702,7 @@ class PoolService(CRUDService):
 
         verrors = ValidationErrors()
 
-        if await self.middleware.call('pool.query', [('name', '=', data['name'])]):
+        if await self.middleware.call('pool.query', [('name', '=', data['name'])], {'select': ['name']}):
             verrors.add('pool_create.name', 'A pool with this name already exists.', errno.EEXIST)
 
         if not data['topology']['data']:
@@ -638,6 +754,7 @@ class PoolService(CRUDService):
             'options': options,
             'fsoptions': fsoptions,
         })
+        self.invalidate_zpool_states()
 
         job.set_progress(95, 'Setting pool options')
         pool_id = None
@@ -678,6 +795,7 @@ class PoolService(CRUDService):
                 await self.middleware.call('zfs.pool.delete', data['name'])
             except Exception:
                 self.logger.warn('Failed to delete pool on pool.create rollback', exc_info=True)
+            self.invalidate_zpool_states()
             if pool_id:
                 await self.middleware.call('datastore.delete', 'storage.volume', pool_id)
             raise e
@@ -749,6 +867,7 @@ class PoolService(CRUDService):
 
         extend_job = await self.middleware.call('zfs.pool.extend', pool['name'], vdevs)
         await extend_job.wait()
+        self.invalidate_zpool_states()
 
         if extend_job.error:
             raise CallError(extend_job.error)
@@ -1116,6 +1235,7 @@ class PoolService(CRUDService):
                 self.logger.warn(f'Failed to geli detach {new_devname}', exc_info=True)
             raise e
         finally:
+            self.invalidate_zpool_states()
             # Needs to happen even if replace failed to put back disk that had been
             # removed from swap prior to replacement
             await self.middleware.call('disk.swaps_configure')
@@ -1182,6 +1302,7 @@ class PoolService(CRUDService):
             await self.middleware.call('disk.swaps_remove_disks', [disk])
 
         await self.middleware.call('zfs.pool.detach', pool['name'], found[1]['guid'])
+        self.invalidate_zpool_states()
 
         await self.middleware.call('pool.sync_encrypted', oid)
 
@@ -1230,6 +1351,7 @@ class PoolService(CRUDService):
         await self.middleware.call('disk.swaps_remove_disks', [disk])
 
         await self.middleware.call('zfs.pool.offline', pool['name'], found[1]['guid'])
+        self.invalidate_zpool_states()
 
         if found[1]['path'].endswith('.eli'):
             devname = found[1]['path'].replace('/dev/', '')[:-4]
@@ -1281,6 +1403,7 @@ class PoolService(CRUDService):
             raise verrors
 
         await self.middleware.call('zfs.pool.online', pool['name'], found[1]['guid'])
+        self.invalidate_zpool_states()
 
         disk = await self.middleware.call(
             'disk.label_to_disk', found[1]['path'].replace('/dev/', '')
@@ -1333,6 +1456,7 @@ class PoolService(CRUDService):
             raise verrors
 
         await self.middleware.call('zfs.pool.remove', pool['name'], found[1]['guid'])
+        self.invalidate_zpool_states()
 
         await self.middleware.call('pool.sync_encrypted', oid)
 
@@ -1618,7 +1742,7 @@ class PoolService(CRUDService):
             })
         except Exception as e:
             # mounting filesystems may fail if we have readonly datasets as parent
-            if not isinstance(e, ZFSException) or e.code.name != 'MOUNTFAILED':
+            if not isinstance(e, libzfs.ZFSException) or e.code.name != 'MOUNTFAILED':
                 detach_failed = await self.middleware.call('disk.geli_detach', pool)
                 if failed > 0:
                     msg = f'Pool could not be imported: {failed} devices failed to decrypt.'
@@ -1631,6 +1755,8 @@ class PoolService(CRUDService):
                     self.logger.warn('Pool %s failed to import', pool['name'], exc_info=True)
                     raise CallError(f'Pool could not be imported ({detach_failed} devices left decrypted): {str(e)}')
                 raise e
+        finally:
+            self.invalidate_zpool_states()
 
         await self.middleware.call('pool.sync_encrypted', oid)
 
@@ -1644,13 +1770,17 @@ class PoolService(CRUDService):
                 'vm.query', [('autostart', '=', True)])
             )
             pool_name = pool['name']
+            restart_vms = []
             for vm in vms:
                 for device in vm['devices']:
                     path = device['attributes'].get('path', '')
                     if f'/dev/zvol/{pool_name}/' in path or \
                             f'/mnt/{pool_name}/' in path:
                         await self.middleware.call('vm.stop', vm['id'])
-                        await self.middleware.call('vm.start', vm['id'])
+                        restart_vms.append(vm['id'])
+                        break
+            if restart_vms:
+                await self.middleware.call('vm.autostart', restart_vms)
 
         await self.middleware.call_hook('pool.post_unlock', pool=pool)
 
@@ -1701,6 +1831,7 @@ class PoolService(CRUDService):
                 raise CallError(job.error)
 
         await self.middleware.call('zfs.pool.export', pool['name'])
+        self.invalidate_zpool_states()
 
         for ed in await self.middleware.call(
                 'datastore.query', 'storage.encrypteddisk', [('encrypted_volume', '=', pool['id'])]
@@ -1779,7 +1910,7 @@ class PoolService(CRUDService):
         name, guid, status, hostname.
         """
 
-        existing_guids = [i['guid'] for i in await self.middleware.call('pool.query')]
+        existing_guids = [i['guid'] for i in await self.middleware.call('pool.query', [], {'select': ['guid']})]
 
         for pool in await self.middleware.call('zfs.pool.find_import'):
             if pool['status'] == 'UNAVAIL':
@@ -1881,6 +2012,7 @@ class PoolService(CRUDService):
                 'altroot': '/mnt',
                 'cachefile': ZPOOL_CACHE_FILE,
             })
+            self.invalidate_zpool_states()
 
             await self.middleware.call('zfs.dataset.update', pool_name, {
                 'properties': {
@@ -2193,6 +2325,8 @@ class PoolService(CRUDService):
             await self.middleware.call('zfs.pool.export', pool['name'])
             await self.middleware.call('disk.geli_detach', pool)
 
+        self.invalidate_zpool_states()
+
         job.set_progress(90, 'Cleaning up')
         if os.path.isdir(pool['path']):
             try:
@@ -2408,6 +2542,8 @@ class PoolService(CRUDService):
             proc.kill()
             proc.wait()
 
+        self.invalidate_zpool_states()
+
         with contextlib.suppress(OSError):
             os.unlink(ZPOOL_KILLCACHE)
 
@@ -2464,6 +2600,11 @@ class PoolDatasetService(CRUDService):
     class Config:
         namespace = 'pool.dataset'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.open_files_snapshot = (None, [])
+        self.open_files_lock = asyncio.Lock()
+
     @filterable
     def query(self, filters=None, options=None):
         """
@@ -2945,6 +3086,7 @@ class PoolDatasetService(CRUDService):
                 Bool('stripacl', default=False),
                 Bool('recursive', default=False),
                 Bool('traverse', default=False),
+                Bool('resume', default=False),
             )
 
         ),
@@ -3151,43 +3293,99 @@ class PoolDatasetService(CRUDService):
           }
         ]
         """
-        result = []
         dataset = await self._get_instance(oid)
-        path = self.__attachments_path(dataset)
-        zvol_path = f"/dev/zvol/{dataset['name']}"
-        if path:
-            lsof = await run('lsof',
-                             '-F', 'pcn',       # Output format parseable by `parse_lsof`
-                             '-l', '-n', '-P',  # Inhibits login name, hostname and port number conversion
-                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False, encoding='utf8')
-            for pid, name in parse_lsof(lsof.stdout, [path, zvol_path]):
-                service = await self.middleware.call('service.identify_process', name)
-                if service:
-                    result.append({
+        return (await self.__processes([dataset]))[dataset['id']]
+
+    async def __processes(self, datasets, max_age=OPEN_FILES_MAX_AGE):
+        prefixes = {}
+        for dataset in datasets:
+            path = self.__attachments_path(dataset)
+            if path:
+                prefixes[path] = dataset['id']
+                prefixes[f"/dev/zvol/{dataset['name']}"] = dataset['id']
+
+        index = {}
+        if prefixes:
+            index = await self.middleware.run_in_thread(index_processes, await self.open_files(max_age), prefixes)
+
+        services = {}
+        for name in {name for processes in index.values() for name in processes.values()}:
+            services[name] = await self.middleware.call('service.identify_process', name)
+
+        cmdlines = await self.middleware.run_in_thread(self.__cmdlines, [
+            pid for processes in index.values() for pid, name in processes.items() if not services[name]
+        ])
+
+        result = {}
+        for dataset in datasets:
+            result[dataset['id']] = []
+            for pid, name in index.get(dataset['id'], {}).items():
+                if services[name]:
+                    result[dataset['id']].append({
                         "pid": pid,
                         "name": name,
-                        "service": service,
+                        "service": services[name],
+                    })
+                elif pid in cmdlines:
+                    result[dataset['id']].append({
+                        "pid": pid,
+                        "name": name,
+                        "cmdline": join_commandline(cmdlines[pid]),
                     })
-                else:
-                    try:
-                        cmdline = await self.middleware.run_in_thread(
-                            lambda: psutil.Process(pid).cmdline()
-                        )
-                    except psutil.NoSuchProcess:
-                        pass
-                    else:
-                        result.append({
-                            "pid": pid,
-                            "name": name,
-                            "cmdline": join_commandline(cmdline),
-                        })
 
         return result
 
+    def __cmdlines(self, pids):
+        cmdlines = {}
+        for pid in pids:
+            try:
+                cmdlines[pid] = psutil.Process(pid).cmdline()
+            except psutil.NoSuchProcess:
+                pass
+
+        return cmdlines
+
+    @private
+    async def open_files(self, max_age=OPEN_FILES_MAX_AGE):
+        """
+        Files open by all processes as a list of `(pid, command, paths)`.
+
+        System is scanned once for all callers, the scan is reused if it is not older than `max_age` seconds.
+        """
+        async with self.open_files_lock:
+            timestamp, processes = self.open_files_snapshot
+            if timestamp is None or asyncio.get_event_loop().time() - timestamp > max_age:
+                processes = await self.middleware.run_in_thread(self.__scan_open_files)
+                self.open_files_snapshot = (asyncio.get_event_loop().time(), processes)
+
+            return processes
+
+    def __scan_open_files(self):
+        procstat = subprocess.run(['procstat', '--libxo', 'json', '-af'],
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf8')
+        # procstat complains about processes that exited while it was running but still reports the rest
+        if procstat.stdout:
+            try:
+                return parse_procstat(procstat.stdout)
+            except ValueError:
+                self.logger.warning('Unable to parse procstat output, falling back to lsof', exc_info=True)
+
+        lsof = subprocess.run(['lsof',
+                               '-F', 'pcn',       # Output format parseable by `parse_lsof_processes`
+                               '-l', '-n', '-P'],  # Inhibits login name, hostname and port number conversion
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf8')
+        return parse_lsof_processes(lsof.stdout)
+
     @private
     async def kill_processes(self, oid, restart_services, max_tries=5):
+        dataset = await self._get_instance(oid)
+
+        async def processes():
+            # Always rescan, processes we have just stopped must not be reported again
+            return (await self.__processes([dataset], max_age=0))[dataset['id']]
+
         manually_restart_services = []
-        for process in await self.middleware.call('pool.dataset.processes', oid):
+        for process in await processes():
             if process.get("service") is not None:
                 manually_restart_services.append(process["service"])
         if manually_restart_services and not restart_services:
@@ -3197,11 +3395,11 @@ class PoolDatasetService(CRUDService):
             })
 
         for i in range(max_tries):
-            processes = await self.middleware.call('pool.dataset.processes', oid)
-            if not processes:
+            running = await processes()
+            if not running:
                 return
 
-            for process in processes:
+            for process in running:
                 if process.get("service") is not None:
                     self.logger.info('Restarting service %r that holds dataset %r', process['service'], oid)
                     await self.middleware.call('service.restart', process['service'])
@@ -3210,14 +3408,14 @@ class PoolDatasetService(CRUDService):
                                      process['cmdline'], oid)
                     await self.middleware.call('service.terminate_process', process['pid'])
 
-        processes = await self.middleware.call('pool.dataset.processes', oid)
-        if not processes:
+        running = await processes()
+        if not running:
             return
 
-        self.logger.info('The following processes don\'t want to stop: %r', processes)
+        self.logger.info('The following processes don\'t want to stop: %r', running)
         raise CallError('Unable to stop processes that have open files', errno.EBUSY, {
             'code': 'unstoppable_processes',
-            'processes': processes,
+            'processes': running,
         })
 
     @private
@@ -3445,43 +3643,16 @@ class PoolScrubService(CRUDService):
             return False
 
         await self.middleware.call('zfs.pool.scrub', pool['name'])
+        await self.middleware.call('pool.invalidate_zpool_states')
         return True
 
 
-def parse_lsof(lsof, dirs):
-    pids = {}
-
-    pid = None
-    command = None
-    for line in lsof.split("\n"):
-        if line.startswith("p"):
-            pid = None
-            command = None
-
-            try:
-                pid = int(line[1:])
-            except ValueError:
-                pass
-
-        if line.startswith("c"):
-            command = line[1:]
-
-        if line.startswith("f"):
-            pass
-
-        if line.startswith("n"):
-            path = line[1:]
-            if os.path.isabs(path) and any(os.path.commonpath([path, dir]) == dir for dir in dirs):
-                if pid is not None and command is not None:
-                    pids[pid] = command
-
-    return list(pids.items())
-
-
 async def devd_zfs_hook(middleware, data):
     if data.get('subsystem') != 'ZFS':
         return
 
+    await middleware.call('pool.invalidate_zpool_states')
+
     if data.get('type') in (
         'ATTACH',
         'DETACH',
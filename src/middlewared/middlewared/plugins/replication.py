@@ -686,6 +686,28 @@ class ReplicationService(CRUDService):
         return await self.middleware.call("zettarepl.count_eligible_manual_snapshots", datasets, naming_schema,
                                           transport, ssh_credentials)
 
+    @accepts(
+        List("datasets", empty=False, items=[
+            Path("dataset", empty=False),
+        ]),
+        List("naming_schema", empty=False, items=[
+            Str("naming_schema", validators=[ReplicationSnapshotNamingSchema()])
+        ]),
+        Str("transport", enum=["SSH", "SSH+NETCAT", "LOCAL", "LEGACY"], required=True),
+        Int("ssh_credentials", null=True, default=None),
+    )
+    @job()
+    async def count_eligible_manual_snapshots_job(self, job, datasets, naming_schema, transport, ssh_credentials):
+        """
+        Same as `replication.count_eligible_manual_snapshots` but runs as a job. Counts for datasets processed so far
+        are reported in progress `extra` as they are computed.
+
+        Snapshot names are listed once and reused for a short time, so repeating the count with a different
+        `naming_schema` does not list snapshots again.
+        """
+        return await self.middleware.call("zettarepl.count_eligible_manual_snapshots", datasets, naming_schema,
+                                          transport, ssh_credentials, job)
+
     # Legacy pair support
     @private
     @accepts(Dict(
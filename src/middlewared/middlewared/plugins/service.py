@@ -10,6 +10,7 @@ import threading
 import time
 import subprocess
 
+from middlewared.common.service.status import ServiceStatusTracker
 from middlewared.schema import accepts, Bool, Dict, Int, Ref, Str
 from middlewared.service import filterable, CallError, CRUDService, private
 from middlewared.utils import Popen, filter_list, run
@@ -106,6 +107,12 @@ class ServiceService(CRUDService):
         'netdata': ServiceDefinition('netdata', '/var/db/netdata/netdata.pid'),
     }
 
+    def __init__(self, *args, **kwargs):
+        super(ServiceService, self).__init__(*args, **kwargs)
+        # Services states are answered from memory and only probed when they can't be trusted anymore
+        self.status_tracker = ServiceStatusTracker(self._service_process_exited)
+        self.probes = {}
+
     @filterable
     async def query(self, filters=None, options=None):
         """
@@ -121,34 +128,32 @@ class ServiceService(CRUDService):
         if not isinstance(services, list):
             services = [services]
 
-        jobs = {
-            asyncio.ensure_future(self._get_status(entry)): entry
-            for entry in services
-        }
-        if jobs:
-            done, pending = await asyncio.wait(list(jobs.keys()), timeout=15)
-
-        def result(task):
-            """
-            Method to handle results of the coroutines.
-            In case of error or timeout, provide UNKNOWN state.
-            """
-            result = None
-            try:
-                if task in done:
-                    result = task.result()
-            except Exception:
-                pass
-            if result is None:
-                entry = jobs.get(task)
-                self.logger.warn('Failed to get status for %s', entry['service'])
-                entry['state'] = 'UNKNOWN'
-                entry['pids'] = []
-                return entry
+        statuses = {}
+        probes = {}
+        for entry in services:
+            status = self.status_tracker.get(entry['service'], self._status_pidfile(entry['service']))
+            if status is None:
+                probes[entry['service']] = self._probe(entry['service'])
             else:
-                return result
+                statuses[entry['service']] = status
+
+        if probes:
+            done, pending = await asyncio.wait(list(probes.values()), timeout=15)
+            for service, probe in probes.items():
+                try:
+                    if probe in done:
+                        statuses[service] = probe.result()
+                        continue
+                except Exception:
+                    pass
+
+                self.logger.warn('Failed to get status for %s', service)
+                # Rather report last known state than UNKNOWN if there is one
+                statuses[service] = self.status_tracker.last(service) or ('UNKNOWN', [])
+
+        for entry in services:
+            entry['state'], entry['pids'] = statuses[entry['service']]
 
-        services = list(map(result, jobs))
         return filter_list(services, filters, options)
 
     @accepts(
@@ -203,9 +208,13 @@ class ServiceService(CRUDService):
         if sn:
             await self.middleware.run_in_thread(sn.join)
 
+        self._invalidate_status(service)
+        previous = self.status_tracker.last(service)
         try:
             svc = await self.query([('service', '=', service)], {'get': True})
-            self.middleware.send_event('service.query', 'CHANGED', fields=svc)
+            if previous is None or previous == (svc['state'], svc['pids']):
+                # Otherwise the change has already been published by `_probe_status`
+                self.middleware.send_event('service.query', 'CHANGED', fields=svc)
             return svc['state'] == 'RUNNING'
         except IndexError:
             f = getattr(self, '_started_' + service, None)
@@ -264,27 +273,68 @@ class ServiceService(CRUDService):
             await self.restart(service, options)
         return await self.started(service)
 
-    async def _get_status(self, service):
-        f = getattr(self, '_started_' + service['service'], None)
+    def _status_pidfile(self, service):
+        """
+        Pidfile which tells whether a STOPPED `service` might have been started behind our back.
+        """
+        if service in self.SERVICE_DEFS and not hasattr(self, '_started_' + service):
+            return self.SERVICE_DEFS[service].pidfile
+
+    def _probe(self, service):
+        """
+        Probe status of `service`, concurrent callers share the same probe.
+        """
+        probe = self.probes.get(service)
+        if probe is None:
+            probe = self.probes[service] = asyncio.ensure_future(self._probe_status(service))
+
+            def done(_):
+                if self.probes.get(service) is probe:
+                    self.probes.pop(service)
+
+            probe.add_done_callback(done)
+
+        return probe
+
+    async def _probe_status(self, service):
+        generation = self.status_tracker.generation(service)
+
+        f = getattr(self, '_started_' + service, None)
         if callable(f):
             if inspect.iscoroutinefunction(f):
                 running, pids = await f()
             else:
                 running, pids = f()
         else:
-            running, pids = await self._started(service['service'])
+            running, pids = await self._started(service)
 
         if running:
             state = 'RUNNING'
         else:
             state = 'STOPPED'
 
-        service['state'] = state
-        service['pids'] = pids
-        return service
+        if await self.middleware.run_in_thread(
+            self.status_tracker.set, service, state, pids, self._status_pidfile(service), generation,
+        ):
+            svc = await self.middleware.call('datastore.query', 'services.services', [('srv_service', '=', service)],
+                                             {'prefix': 'srv_'})
+            if svc:
+                self.middleware.send_event('service.query', 'CHANGED', fields=dict(svc[0], state=state, pids=pids))
+
+        return state, pids
+
+    def _service_process_exited(self, service):
+        # Called from process watcher thread
+        self.middleware.loop.call_soon_threadsafe(self._probe, service)
+
+    def _invalidate_status(self, service):
+        # Probes which are already running will have their results discarded
+        self.status_tracker.invalidate(service)
+        self.probes.pop(service, None)
 
     async def _simplecmd(self, action, what, options=None):
         self.logger.debug("Calling: %s(%s) ", action, what)
+        self._invalidate_status(what)
         f = getattr(self, '_' + action + '_' + what, None)
         if f is None:
             # Provide generic start/stop/restart verbs for rc.d scripts
@@ -315,6 +365,12 @@ class ServiceService(CRUDService):
         quiet = options.pop('quiet', None)
         extra = options.pop('extra', '')
 
+        if verb != 'status':
+            # Pids are learned again when the service is queried
+            for name, definition in self.SERVICE_DEFS.items():
+                if service in (name, definition.rc_script):
+                    self._invalidate_status(name)
+
         # force comes before one which comes before quiet
         # they are mutually exclusive
         preverb = ''
@@ -418,20 +474,38 @@ class ServiceService(CRUDService):
         await self._service("ctld", "stop", force=True, **kwargs)
         await self.middleware.call("etc.generate", "ctld")
         await self._service("ctld", "restart", **kwargs)
+        await self.middleware.call("iscsi.global.reset_ctld_sync")
 
     async def _start_iscsitarget(self, **kwargs):
         await self.middleware.call("etc.generate", "ctld")
         await self._service("ctld", "start", **kwargs)
+        await self.middleware.call("iscsi.global.reset_ctld_sync")
 
     async def _stop_iscsitarget(self, **kwargs):
         with contextlib.suppress(IndexError):
             sysctl.filter("kern.cam.ctl.ha_peer")[0].value = ""
 
         await self._service("ctld", "stop", force=True, **kwargs)
+        await self.middleware.call("iscsi.global.reset_ctld_sync")
 
     async def _reload_iscsitarget(self, **kwargs):
+        old_config = await self.middleware.call("iscsi.global.read_ctl_config")
         await self.middleware.call("etc.generate", "ctld")
+        if not (await self._started("iscsitarget"))[0]:
+            await self._service("ctld", "reload", **kwargs)
+            return
+
+        # Changes which only touch LUNs are applied directly without making ctld re-read everything
+        if await self.middleware.call("iscsi.global.apply_config_delta", old_config):
+            return
+
+        # ctld would reload against its stale view of LUNs changed with ctladm and unmap live ones
+        if not await self.middleware.call("iscsi.global.sync_ctld", old_config):
+            await self._restart_iscsitarget(**kwargs)
+            return
+
         await self._service("ctld", "reload", **kwargs)
+        await self.middleware.call("iscsi.global.reset_ctld_sync")
 
     async def _start_collectd(self, **kwargs):
         if not await self.started('rrdcached'):
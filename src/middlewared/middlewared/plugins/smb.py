@@ -420,11 +420,18 @@ class SMBService(SystemServiceService):
         if not bsduser:
             self.logger.debug(f'{username} is not an SMB user, bypassing passdb import')
             return
-        smbpasswd_string = bsduser[0]['smbhash'].split(':')
         p = await run([SMBCmd.PDBEDIT.value, '-d', '0', '-Lw', username], check=False)
         if p.returncode != 0:
             CallError(f'Failed to retrieve passdb entry for {username}: {p.stderr.decode()}')
-        entry = p.stdout.decode()
+        await self.__update_passdb_entry(bsduser[0], p.stdout.decode())
+
+    async def __update_passdb_entry(self, bsduser, entry):
+        """
+        Creates or updates passdb entry of `bsduser`. `entry` is its current `pdbedit -Lw` line (empty if there is
+        none).
+        """
+        username = bsduser['username']
+        smbpasswd_string = bsduser['smbhash'].split(':')
         if not entry:
             self.logger.debug("User [%s] does not exist in the passdb.tdb file. Creating entry.", username)
             pdbcreate = await Popen(
@@ -435,13 +442,13 @@ class SMBService(SystemServiceService):
             setntpass = await run([SMBCmd.PDBEDIT.value, '-d', '0', '--set-nt-hash', smbpasswd_string[3], username], check=False)
             if setntpass.returncode != 0:
                 raise CallError(f'Failed to set NT password for {username}: {setntpass.stderr.decode()}')
-            if bsduser[0]['locked']:
+            if bsduser['locked']:
                 disableacct = await run([SMBCmd.SMBPASSWD.value, '-d', username], check=False)
                 if disableacct.returncode != 0:
                     raise CallError(f'Failed to disable {username}: {disableacct.stderr.decode()}')
             return
 
-        if entry == bsduser[0]['smbhash']:
+        if entry.strip() == bsduser['smbhash']:
             return
 
         entry = entry.split(':')
@@ -450,11 +457,11 @@ class SMBService(SystemServiceService):
             setntpass = await run([SMBCmd.PDBEDIT.value, '-d', '0', '--set-nt-hash', smbpasswd_string[3], username], check=False)
             if setntpass.returncode != 0:
                 raise CallError(f'Failed to set NT password for {username}: {setntpass.stderr.decode()}')
-        if bsduser[0]['locked'] and 'D' not in entry[4]:
+        if bsduser['locked'] and 'D' not in entry[4]:
             disableacct = await run([SMBCmd.SMBPASSWD.value, '-d', username], check=False)
             if disableacct.returncode != 0:
                 raise CallError(f'Failed to disable {username}: {disableacct.stderr.decode()}')
-        elif not bsduser[0]['locked'] and 'D' in entry[4]:
+        elif not bsduser['locked'] and 'D' in entry[4]:
             enableacct = await run([SMBCmd.SMBPASSWD.value, '-e', username], check=False)
             if enableacct.returncode != 0:
                 raise CallError(f'Failed to enable {username}: {enableacct.stderr.decode()}')
@@ -476,13 +483,23 @@ class SMBService(SystemServiceService):
                 ('smbhash', '~', r'^.+:.+:[A-F0-9]{32}:.+$'),
             ]]
         ])
+        # List all passdb entries at once instead of running `pdbedit` for every user
+        p = await run([SMBCmd.PDBEDIT.value, '-d', '0', '-Lw'], check=False)
+        if p.returncode != 0:
+            raise CallError(f'Failed to list passdb entries: {p.stderr.decode()}')
+        entries = {}
+        for line in p.stdout.decode().splitlines():
+            if line:
+                entries[line.split(':', 1)[0]] = line
+
         for u in conf_users:
-            await self.middleware.call('smb.update_passdb_user', u['username'])
+            await self.__update_passdb_entry(u, entries.get(u['username'], ''))
 
         pdb_users = await self.passdb_list()
         if len(pdb_users) > len(conf_users):
+            conf_usernames = {u['username'] for u in conf_users}
             for entry in pdb_users:
-                if not any(filter(lambda x: entry['username'] == x['username'], conf_users)):
+                if entry['username'] not in conf_usernames:
                     self.logger.debug('Synchronizing passdb with config file: deleting user [%s] from passdb.tdb', entry['username'])
                     deluser = await run([SMBCmd.PDBEDIT.value, '-d', '0', '-x', entry['username']], check=False)
                     if deluser.returncode != 0:
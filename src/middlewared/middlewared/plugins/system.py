@@ -2,6 +2,7 @@ import asyncio
 from datetime import datetime, date
 from middlewared.event import EventSource
 from middlewared.i18n import set_language
+from middlewared.common.debug.collector import DebugCollector, FREENAS_DEBUG_MODULEDIR
 from middlewared.logger import CrashReporting
 from middlewared.schema import accepts, Bool, Dict, Int, IPAddr, List, Str
 from middlewared.service import CallError, ConfigService, no_auth_required, job, private, Service, ValidationErrors
@@ -9,7 +10,6 @@ from middlewared.utils import Popen, run, start_daemon_thread, sw_buildtime, sw_
 from middlewared.validators import Range
 
 import csv
-import io
 import os
 import psutil
 import re
@@ -21,6 +21,7 @@ import subprocess
 import sysctl
 import syslog
 import tarfile
+import tempfile
 import textwrap
 import time
 import uuid
@@ -472,6 +473,36 @@ class SystemService(Service):
 
         await Popen(['/sbin/poweroff'])
 
+    @private
+    def debug_collector(self, fileobj, progress_cb=None):
+        collector = DebugCollector(fileobj, progress_cb=progress_cb)
+        collector.collect(
+            extra_commands={
+                'fndebug/osinfo.txt': ['sh', '-c', f'. {FREENAS_DEBUG_MODULEDIR}/include.sh; freenas_header'],
+                'dmidecode': ['/usr/local/sbin/dmidecode'],
+                'sysctl_hw': ['sysctl', 'hw'],
+                'cpuid': ['/usr/local/bin/cpuid'],
+                'ses/sesutil_map': ['sesutil', 'map'],
+                'ses/sesutil_status': ['sesutil', 'status'],
+                'ses/phy': [
+                    'sh', '-c',
+                    'for ses in /dev/ses[0-9]*; do echo "${ses#/dev/}:"; camcontrol smpphylist "${ses#/dev/}" -l; done',
+                ],
+            },
+            extra_paths={
+                'log': '/var/log',
+                'syslog': '/root/syslog',
+                'crash': '/data/crash',
+                'textdump/textdump.tar.last': '/var/crash/textdump.tar.last',
+                'textdump/textdump.tar.last.gz': '/var/crash/textdump.tar.last.gz',
+                'hostid': '/etc/hostid',
+                'version': '/etc/version',
+            },
+        )
+        self.logger.debug('Debug modules timings: %s', ', '.join(
+            f'{name} {elapsed:.2f}s' for name, elapsed in sorted(collector.timings.items(), key=lambda i: -i[1])
+        ))
+
     @private
     @job(lock='system.debug_generate')
     def debug_generate(self, job):
@@ -490,28 +521,10 @@ class SystemService(Service):
         # Be extra safe in case we have left over from previous run
         if os.path.exists(direc):
             shutil.rmtree(direc)
+        os.makedirs(direc)
 
-        cp = subprocess.Popen(
-            ['ixdiagnose', '-d', direc, '-s', '-F', '-p'],
-            text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            bufsize=1
-        )
-
-        for line in iter(cp.stdout.readline, ''):
-            line = line.rstrip()
-
-            if line.startswith('**'):
-                percent, help = line.split(':')
-                job.set_progress(
-                    int(percent.split()[-1].strip('%')),
-                    help.lstrip()
-                )
-        _, stderr = cp.communicate()
-
-        if cp.returncode != 0:
-            raise CallError(f'Failed to generate debug file: {stderr}')
-
-        job.set_progress(100, 'Debug generation finished')
+        with open(dump, 'wb') as f:
+            self.debug_collector(f, job.set_progress)
 
         return dump
 
@@ -524,6 +537,14 @@ class SystemService(Service):
         This method is meant to be used in conjuntion with `core.download` to get the debug
         downloaded via HTTP.
         """
+        is_freenas = self.middleware.call_sync('system.is_freenas')
+        if is_freenas or not self.middleware.call_sync('failover.licensed'):
+            # Stream the debug straight to the client while it is being generated
+            job.set_progress(0, 'Generating debug file')
+            self.debug_collector(job.pipes.output.w, job.set_progress)
+            job.pipes.output.w.close()
+            return
+
         job.set_progress(0, 'Generating debug file')
         debug_job = self.middleware.call_sync(
             'system.debug_generate',
@@ -532,27 +553,12 @@ class SystemService(Service):
         )
 
         standby_debug = None
-        is_freenas = self.middleware.call_sync('system.is_freenas')
-        if not is_freenas and self.middleware.call_sync('failover.licensed'):
-            try:
-                standby_debug = self.middleware.call_sync(
-                    'failover.call_remote', 'system.debug_generate', [], {'job': True}
-                )
-            except Exception:
-                self.logger.warn('Failed to get debug from standby node', exc_info=True)
-            else:
-                remote_ip = self.middleware.call_sync('failover.remote_ip')
-                url = self.middleware.call_sync(
-                    'failover.call_remote', 'core.download', ['filesystem.get', [standby_debug], 'debug.txz'],
-                )[1]
-
-                url = f'http://{remote_ip}:6000{url}'
-                standby_debug = io.BytesIO()
-                with requests.get(url, stream=True) as r:
-                    for i in r.iter_content(chunk_size=1048576):
-                        if standby_debug.tell() > 20971520:
-                            raise CallError(f'Standby debug file is bigger than 20MiB.')
-                        standby_debug.write(i)
+        try:
+            standby_debug = self.middleware.call_sync(
+                'failover.call_remote', 'system.debug_generate', [], {'job': True}
+            )
+        except Exception:
+            self.logger.warn('Failed to get debug from standby node', exc_info=True)
 
         debug_job.wait_sync()
         if debug_job.error:
@@ -560,40 +566,44 @@ class SystemService(Service):
 
         job.set_progress(90, 'Preparing debug file for streaming')
 
-        if standby_debug:
-            # Debug file cannot be big on HA because we put both debugs in memory
-            # so they can be downloaded at once.
+        network = self.middleware.call_sync('network.configuration.config')
+        node = self.middleware.call_sync('failover.node')
+        if node == 'A':
+            my_hostname = network['hostname']
+            remote_hostname = network['hostname_b']
+        else:
+            my_hostname = network['hostname_b']
+            remote_hostname = network['hostname']
+
+        # Both debugs are streamed into the combined archive as they are read, neither is loaded in memory
+        with tarfile.open(fileobj=job.pipes.output.w, mode='w|') as tar:
             try:
-                if os.stat(debug_job.result).st_size > 20971520:
-                    raise CallError(f'Debug file is bigger than 20MiB.')
+                tar.add(debug_job.result, f'{my_hostname}.txz')
             except FileNotFoundError:
                 raise CallError('Debug file was not found, try again.')
 
-            network = self.middleware.call_sync('network.configuration.config')
-            node = self.middleware.call_sync('failover.node')
-
-            tario = io.BytesIO()
-            with tarfile.open(fileobj=tario, mode='w') as tar:
-
-                if node == 'A':
-                    my_hostname = network['hostname']
-                    remote_hostname = network['hostname_b']
-                else:
-                    my_hostname = network['hostname_b']
-                    remote_hostname = network['hostname']
-
-                tar.add(debug_job.result, f'{my_hostname}.txz')
+            if standby_debug:
+                remote_ip = self.middleware.call_sync('failover.remote_ip')
+                url = self.middleware.call_sync(
+                    'failover.call_remote', 'core.download', ['filesystem.get', [standby_debug], 'debug.txz'],
+                )[1]
 
-                tarinfo = tarfile.TarInfo(f'{remote_hostname}.txz')
-                tarinfo.size = standby_debug.tell()
-                standby_debug.seek(0)
-                tar.addfile(tarinfo, fileobj=standby_debug)
+                url = f'http://{remote_ip}:6000{url}'
+                with requests.get(url, stream=True) as r:
+                    r.raise_for_status()
+                    tarinfo = tarfile.TarInfo(f'{remote_hostname}.txz')
+                    tarinfo.mtime = time.time()
+                    if 'Content-Length' in r.headers:
+                        tarinfo.size = int(r.headers['Content-Length'])
+                        tar.addfile(tarinfo, fileobj=r.raw)
+                    else:
+                        # Tar member size has to be known upfront, spool it to disk
+                        with tempfile.TemporaryFile() as f:
+                            shutil.copyfileobj(r.raw, f, 1048576)
+                            tarinfo.size = f.tell()
+                            f.seek(0)
+                            tar.addfile(tarinfo, fileobj=f)
 
-            tario.seek(0)
-            shutil.copyfileobj(tario, job.pipes.output.w)
-        else:
-            with open(debug_job.result, 'rb') as f:
-                shutil.copyfileobj(f, job.pipes.output.w)
         job.pipes.output.w.close()
 
 
@@ -1112,7 +1122,7 @@ class SystemHealthEventSource(EventSource):
     def pools_statuses(self):
         return {
             p['name']: {'status': p['status']}
-            for p in self.middleware.call_sync('pool.query')
+            for p in self.middleware.call_sync('pool.query', [], {'select': ['name', 'status']})
         }
 
     def run(self):
@@ -1,7 +1,10 @@
 from bsd import geom
 from middlewared.schema import accepts, Bool, Dict, Str
 from middlewared.service import job, private, CallError, Service
+from middlewared.utils.io import copy_pipe_to_file
+from middlewared.utils.lazy import lazy_import
 
+import copy
 from datetime import datetime
 import enum
 import errno
@@ -11,6 +14,8 @@ import shutil
 import subprocess
 import sys
 import textwrap
+import threading
+from time import monotonic
 
 if '/usr/local/lib' not in sys.path:
     sys.path.append('/usr/local/lib')
@@ -26,8 +31,14 @@ from freenasOS.Update import (
     ApplyUpdate, CheckForUpdates, GetServiceDescription, ExtractFrozenUpdate,
 )
 
+libzfs = lazy_import('libzfs')
+
 UPLOAD_LOCATION = '/var/tmp/firmware'
 UPLOAD_LABEL = 'updatemdu'
+SYSTEM_MANIFEST = '/data/manifest'
+# Update check result is returned without asking update server for this long, then only latest manifest is retrieved
+# to see whether it is still valid
+CHECK_AVAILABLE_TTL = 600
 
 
 def parse_train_name(name):
@@ -38,6 +49,22 @@ def parse_train_name(name):
     return [int(v) if v.isdigit() else v for v in version] + [branch]
 
 
+def pending_validator(path):
+    """
+    Changes whenever update cache in `path` or installed system manifest change, so pending updates have to be
+    computed again.
+    """
+    validator = []
+    for p in (path, os.path.join(path, 'MANIFEST'), SYSTEM_MANIFEST):
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            validator.append(None)
+        else:
+            validator.append((st.st_ino, st.st_size, st.st_mtime_ns))
+    return validator
+
+
 class CompareTrainsResult(enum.Enum):
     MAJOR_DOWNGRADE = "MAJOR_DOWNGRADE"
     MAJOR_UPGRADE = "MAJOR_UPGRADE"
@@ -238,6 +265,14 @@ def parse_changelog(changelog, start='', end=''):
 
 class UpdateService(Service):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # dict(train) = (validator, timestamp, result)
+        self.check_available_cache = {}
+        self.check_available_lock = threading.Lock()
+        # dict(path) = (validator, result)
+        self.pending_cache = {}
+
     @accepts()
     def get_trains(self):
         """
@@ -372,6 +407,41 @@ class UpdateService(Service):
 
         train = (attrs or {}).get('train') or self.middleware.call_sync('update.get_trains')['selected']
 
+        with self.check_available_lock:
+            cached = self.check_available_cache.get(train)
+            if cached is not None and monotonic() - cached[1] < CHECK_AVAILABLE_TTL:
+                return copy.deepcopy(cached[2])
+
+            if cached is not None:
+                validator = self._check_available_validator(train)
+                if validator is not None and cached[0] == validator:
+                    self.check_available_cache[train] = (validator, monotonic(), cached[2])
+                    return copy.deepcopy(cached[2])
+
+            validator, data = self._check_available(train)
+            self.check_available_cache[train] = (validator, monotonic(), data)
+            return copy.deepcopy(data)
+
+    def _check_available_validator(self, train):
+        """
+        Update check result of `train` stays the same as long as both installed and latest manifest do.
+        """
+        conf = Configuration.Configuration()
+        latest = conf.FindLatestManifest(train=train, require_signature=True)
+        if latest is None:
+            return None
+
+        return self._system_sequence(conf), latest.Sequence()
+
+    def _system_sequence(self, conf):
+        sys_mani = conf.SystemManifest()
+        return sys_mani.Sequence() if sys_mani else ''
+
+    def _check_available(self, train):
+        """
+        Returns update check result of `train` along with its validator, which is derived from the manifest
+        already fetched by `CheckForUpdates` so the update server is only asked once.
+        """
         handler = CheckUpdateHandler()
         manifest = CheckForUpdates(
             diff_handler=handler.diff_call,
@@ -379,8 +449,11 @@ class UpdateService(Service):
             train=train,
         )
 
+        sequence = self._system_sequence(Configuration.Configuration())
+
         if not manifest:
-            return {'status': 'UNAVAILABLE'}
+            # Latest manifest is the installed one
+            return (sequence, sequence), {'status': 'UNAVAILABLE'}
 
         data = {
             'status': 'AVAILABLE',
@@ -389,12 +462,6 @@ class UpdateService(Service):
             'notes': manifest.Notes(),
         }
 
-        conf = Configuration.Configuration()
-        sys_mani = conf.SystemManifest()
-        if sys_mani:
-            sequence = sys_mani.Sequence()
-        else:
-            sequence = ''
         data['changelog'] = get_changelog(
             train,
             start=sequence,
@@ -402,7 +469,7 @@ class UpdateService(Service):
         )
 
         data['version'] = manifest.Version()
-        return data
+        return (sequence, manifest.Sequence()), data
 
     @accepts(Str('path', null=True, default=None))
     async def get_pending(self, path=None):
@@ -417,14 +484,23 @@ class UpdateService(Service):
         """
         if path is None:
             path = await self.middleware.call('update.get_update_location')
+        return await self.middleware.run_in_thread(self._get_pending, path)
+
+    def _get_pending(self, path):
+        validator = pending_validator(path)
+        cached = self.pending_cache.get(path)
+        if cached is not None and cached[0] == validator:
+            return copy.deepcopy(cached[1])
+
         data = []
         try:
-            changes = await self.middleware.run_in_thread(Update.PendingUpdatesChanges, path)
+            changes = Update.PendingUpdatesChanges(path)
         except (
             UpdateIncompleteCacheException, UpdateInvalidCacheException,
             UpdateBusyCacheException,
         ):
-            changes = []
+            # Cache is being written, do not remember this
+            return data
         if changes:
             if changes.get("Reboot", True) is False:
                 for svc in changes.get("Restart", []):
@@ -454,7 +530,9 @@ class UpdateService(Service):
                     'operation': op,
                     'name': name,
                 })
-        return data
+
+        self.pending_cache[path] = (validator, data)
+        return copy.deepcopy(data)
 
     @accepts(Dict(
         'update',
@@ -493,10 +571,13 @@ class UpdateService(Service):
         new_manifest = Manifest.Manifest(require_signature=True)
         new_manifest.LoadPath('{}/MANIFEST'.format(location))
 
-        Update.ApplyUpdate(
-            location,
-            install_handler=handler.install_handler,
-        )
+        try:
+            Update.ApplyUpdate(
+                location,
+                install_handler=handler.install_handler,
+            )
+        finally:
+            await self.middleware.call('bootenv.invalidate')
         await self.middleware.call('cache.put', 'update.applied', True)
 
         if (
@@ -549,7 +630,10 @@ class UpdateService(Service):
                 job.set_progress(30, 'Extracting file')
                 ExtractFrozenUpdate(path, dest_extracted, verbose=True)
                 job.set_progress(50, 'Applying update')
-                ApplyUpdate(dest_extracted)
+                try:
+                    ApplyUpdate(dest_extracted)
+                finally:
+                    self.middleware.call_sync('bootenv.invalidate')
             except Exception as e:
                 self.logger.debug('Applying manual update failed', exc_info=True)
                 raise CallError(str(e), errno.EFAULT)
@@ -597,9 +681,7 @@ class UpdateService(Service):
         try:
             job.set_progress(10, 'Writing uploaded file to disk')
             with open(destfile, 'wb') as f:
-                await self.middleware.run_in_thread(
-                    shutil.copyfileobj, job.pipes.input.r, f, 1048576,
-                )
+                await self.middleware.run_in_thread(copy_pipe_to_file, job.pipes.input.r, f)
 
             def do_update():
                 try:
@@ -610,7 +692,10 @@ class UpdateService(Service):
                 except Exception as e:
                     raise CallError(str(e))
 
-            await self.middleware.run_in_thread(do_update)
+            try:
+                await self.middleware.run_in_thread(do_update)
+            finally:
+                await self.middleware.call('bootenv.invalidate')
 
             job.set_progress(95, 'Cleaning up')
 
@@ -707,13 +792,13 @@ class UpdateService(Service):
 
         dataset = f'{basename}/samba4'
 
-        proc = subprocess.run(['zfs', 'list', '-t', 'snapshot', '-H', '-o', 'name', '-s', 'name', '-d', '1', dataset],
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf8', errors='ignore')
-        if proc.returncode != 0:
-            self.logger.warning('Unable to list dataset %s snapshots: %s', dataset, proc.stderr)
+        try:
+            with libzfs.ZFS() as zfs:
+                snapshots = sorted(s.name.split('@')[1] for s in zfs.get_dataset(dataset).snapshots)
+        except libzfs.ZFSException as e:
+            self.logger.warning('Unable to list dataset %s snapshots: %s', dataset, e)
             return
 
-        snapshots = [s.split('@')[1] for s in proc.stdout.strip().split()]
         for snapshot in [s for s in snapshots if s.startswith('update--')][:-4]:
             self.logger.info('Deleting dataset %s snapshot %s', dataset, snapshot)
             subprocess.run(['zfs', 'destroy', f'{dataset}@{snapshot}'])
@@ -6,10 +6,13 @@ from middlewared.service import (
     item_method, pass_app, private, CRUDService, CallError, ValidationErrors
 )
 from middlewared.utils import Nid, Popen, run
+from middlewared.utils.asyncio_ import asyncio_map
 from middlewared.utils.path import is_child
+from middlewared.validators import Range
 
 import middlewared.logger
 import asyncio
+from collections import defaultdict
 import errno
 import ipaddress
 import math
@@ -33,6 +36,8 @@ ZFS_ARC_MAX_INITIAL = None
 
 ZVOL_CLONE_SUFFIX = '_clone'
 ZVOL_CLONE_RE = re.compile(rf'^(.*){ZVOL_CLONE_SUFFIX}\d+$')
+# Maximum number of VMs `vm.autostart` starts at the same time
+AUTOSTART_CONCURRENCY = 4
 
 
 class VMManager(object):
@@ -42,15 +47,25 @@ class VMManager(object):
         self.logger = self.service.logger
         self._vm = {}
 
-    async def start(self, vm):
+    def create_supervisor(self, vm):
+        supervisor = self._vm[vm['id']] = VMSupervisor(self, vm)
+        return supervisor
+
+    async def start(self, vm, supervisor=None):
         vid = vm['id']
-        self._vm[vid] = VMSupervisor(self, vm)
-        coro = self._vm[vid].run()
+        if supervisor is None:
+            supervisor = self.create_supervisor(vm)
+        coro = supervisor.run()
         # If run() has not returned in about 4 seconds we assume
         # bhyve process started successfully.
         done = (await asyncio.wait([coro], timeout=4))[0]
         if done:
-            list(done)[0].result()
+            try:
+                list(done)[0].result()
+            finally:
+                # VM failed to start, make sure it is not reported as running
+                if self._vm.get(vid) is supervisor and not supervisor.running():
+                    self._vm.pop(vid)
 
     async def stop(self, id, force=False):
         supervisor = self._vm.get(id)
@@ -70,7 +85,7 @@ class VMManager(object):
 
     async def status(self, id):
         supervisor = self._vm.get(id)
-        if supervisor and await supervisor.running():
+        if supervisor and supervisor.running():
             return {
                 'state': 'RUNNING',
                 'pid': supervisor.proc.pid if supervisor.proc else None,
@@ -107,8 +122,16 @@ class VMSupervisor(object):
         self.web_proc = None
         self.taps = []
         self.bhyve_error = None
+        # STARTING -> RUNNING (bhyve process spawned) -> STOPPED (bhyve process exited)
+        self.state = 'STARTING'
 
     async def run(self):
+        try:
+            await self._run()
+        finally:
+            self.state = 'STOPPED'
+
+    async def _run(self):
         vnc_web = None  # We need to initialize before line 200
         args = [
             'bhyve',
@@ -290,6 +313,7 @@ class VMSupervisor(object):
 
         self.logger.debug('Starting bhyve: {}'.format(' '.join(args)))
         self.proc = await Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.state = 'RUNNING'
 
         if vnc_web:
             split_port = int(str(vnc_port)[:2]) - 1
@@ -327,6 +351,7 @@ class VMSupervisor(object):
         # 4 - VM exited due to an error
         # all other non-zero status codes are errors
         self.bhyve_error = await self.proc.wait()
+        self.state = 'STOPPED'
         if self.bhyve_error == 0:
             self.logger.info('===> Rebooting VM: {0} ID: {1} BHYVE_CODE: {2}'.format(self.vm['name'], self.vm['id'], self.bhyve_error))
             await self.manager.restart(self.vm['id'])
@@ -466,22 +491,14 @@ class VMSupervisor(object):
         self.destroy_tap()
         return await self.kill_bhyve_pid()
 
-    async def running(self):
-        bhyve_error = await (await Popen(['bhyvectl', '--vm={}'.format(str(self.vm['id']) + '_' + self.vm['name'])], stdout=subprocess.PIPE, stderr=subprocess.PIPE)).wait()
-        if bhyve_error == 0:
-            if self.proc:
-                try:
-                    os.kill(self.proc.pid, 0)
-                except OSError:
-                    self.logger.error('===> VMM {0} is running without bhyve process.'.format(self.vm['name']))
-                    return False
-                return True
-            else:
-                # XXX: We return true for now to keep the vm.status sane.
-                # It is necessary handle in a better way the bhyve process associated with the vmm.
-                return True
-        elif bhyve_error == 1:
-            return False
+    def running(self):
+        """
+        VM state is tracked from bhyve process events, a VM which is being started counts as running
+        (its memory is already reserved).
+        """
+        if self.state == 'STARTING':
+            return True
+        return self.state == 'RUNNING' and self.proc is not None and self.proc.returncode is None
 
 
 class VMService(CRUDService):
@@ -490,10 +507,13 @@ class VMService(CRUDService):
         namespace = 'vm'
         datastore = 'vm.vm'
         datastore_extend = 'vm._extend_vm'
+        datastore_extend_context = 'vm.extend_context'
 
     def __init__(self, *args, **kwargs):
         super(VMService, self).__init__(*args, **kwargs)
         self._manager = VMManager(self)
+        # Serializes memory reservation of VMs being started
+        self._vmemory_lock = asyncio.Lock()
 
     @accepts()
     def flags(self):
@@ -532,8 +552,15 @@ class VMService(CRUDService):
             return True
         return False
 
-    async def _extend_vm(self, vm):
-        vm['devices'] = await self.middleware.call('vm.device.query', [('vm', '=', vm['id'])])
+    @private
+    async def extend_context(self):
+        devices = defaultdict(list)
+        for device in await self.middleware.call('vm.device.query'):
+            devices[device['vm']].append(device)
+        return {'devices': devices}
+
+    async def _extend_vm(self, vm, context):
+        vm['devices'] = context['devices'].get(vm['id'], [])
         vm['status'] = await self.status(vm['id'])
         return vm
 
@@ -699,9 +726,12 @@ class VMService(CRUDService):
             # If overcommit is not wanted its verified how much physical memory
             # the bhyve process is currently using and add the maximum memory its
             # supposed to have.
-            for vm in self.middleware.call_sync('vm.query'):
+            for vm in self.middleware.call_sync('datastore.query', 'vm.vm'):
                 status = self.middleware.call_sync('vm.status', vm['id'])
-                if status['pid']:
+                if status['state'] == 'RUNNING' and not status['pid']:
+                    # VM is being started, all its memory is reserved
+                    vms_memory_used += vm['memory'] * 1024 * 1024
+                elif status['pid']:
                     try:
                         p = psutil.Process(status['pid'])
                     except psutil.NoSuchProcess:
@@ -773,6 +803,8 @@ class VMService(CRUDService):
         Str('grubconfig', null=True),
         List('devices', default=[], items=[Patch('vmdevice_create', 'vmdevice_update', ('rm', {'name': 'vm'}))]),
         Bool('autostart', default=True),
+        Int('autostart_order', default=0),
+        Int('autostart_delay', default=0, validators=[Range(min=0)]),
         Str('time', enum=['LOCAL', 'UTC'], default='LOCAL'),
         register=True,
     ))
@@ -785,6 +817,10 @@ class VMService(CRUDService):
 
         `devices` is a list of virtualized hardware to add to the newly created Virtual Machine.
         Failure to attach a device destroys the VM and any resources allocated by the VM devices.
+
+        `autostart_order` and `autostart_delay` are used when VMs are started on boot: VMs with lower
+        `autostart_order` are started first (VMs with the same order are started concurrently) and the next
+        group is started `autostart_delay` seconds after the VMs of the current group have started.
         """
 
         verrors = ValidationErrors()
@@ -996,8 +1032,41 @@ class VMService(CRUDService):
             # Perhaps we should have a default config option for VMs?
             overcommit = False
 
-        await self.__init_guest_vmemory(vm, overcommit=overcommit)
-        await self._manager.start(vm)
+        # Memory available for the VM is checked and reserved atomically so VMs started concurrently
+        # do not reserve the same memory
+        async with self._vmemory_lock:
+            await self.__init_guest_vmemory(vm, overcommit=overcommit)
+            supervisor = self._manager.create_supervisor(vm)
+        await self._manager.start(vm, supervisor)
+
+    @private
+    async def autostart(self, ids=None, concurrency=AUTOSTART_CONCURRENCY):
+        """
+        Start VMs flagged to start on boot (only those with `ids` if specified).
+
+        VMs are started in groups of the same `autostart_order`, at most `concurrency` VMs at a time.
+        """
+        filters = [('autostart', '=', True)]
+        if ids is not None:
+            filters.append(('id', 'in', ids))
+
+        groups = defaultdict(list)
+        for vm in await self.middleware.call('vm.query', filters):
+            groups[vm['autostart_order']].append(vm)
+
+        async def start(vm):
+            try:
+                await self.middleware.call('vm.start', vm['id'])
+            except Exception:
+                self.logger.error('Failed to start VM %r', vm['name'], exc_info=True)
+
+        delay = 0
+        for order in sorted(groups):
+            if delay:
+                await asyncio.sleep(delay)
+
+            await asyncio_map(start, groups[order], concurrency)
+            delay = max(vm['autostart_delay'] for vm in groups[order])
 
     @item_method
     @accepts(Int('id'), Bool('force', default=False),)
@@ -1610,8 +1679,7 @@ async def __event_system_ready(middleware, event_type, args):
     global ZFS_ARC_MAX_INITIAL
     ZFS_ARC_MAX_INITIAL = sysctl.filter('vfs.zfs.arc_max')[0].value
 
-    for vm in await middleware.call('vm.query', [('autostart', '=', True)]):
-        await middleware.call('vm.start', vm['id'])
+    await middleware.call('vm.autostart')
 
 
 class VMFSAttachmentDelegate(FSAttachmentDelegate):
@@ -1,11 +1,18 @@
 from collections import defaultdict
 from datetime import datetime
 import errno
+import hmac
+import os
 import socket
 import ssl
+import threading
 import uuid
 
 from middlewared.async_validators import resolve_hostname
+from middlewared.common.vmware.snapshot import (
+    find_snapshot, format_timings, PhaseTimer, run_concurrently, SNAPSHOT_CONCURRENCY, VM_PROPERTIES,
+    vm_depends_on_datastore,
+)
 from middlewared.schema import accepts, Bool, Dict, Int, Str, Patch
 from middlewared.service import CallError, CRUDService, private, ValidationErrors
 
@@ -19,6 +26,16 @@ class VMWareService(CRUDService):
         datastore = 'storage.vmwareplugin'
         datastore_extend = 'vmware.item_extend'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # VMware task id -> (credentials, service instance, service content)
+        self._sessions = {}
+        self._session_locks = defaultdict(threading.Lock)
+        self._sessions_lock = threading.Lock()
+        # Sessions are told apart by credentials digest so passwords are not kept around
+        self._credentials_key = os.urandom(32)
+        self.periodic_snapshot_task_timings = {}
+
     @private
     async def item_extend(self, item):
         item['password'] = await self.middleware.call('pwenc.decrypt', item['password'])
@@ -119,6 +136,8 @@ class VMWareService(CRUDService):
             new,
         )
 
+        await self.middleware.run_in_thread(self._close_session, id)
+
         return await self._get_instance(id)
 
     @accepts(
@@ -134,6 +153,8 @@ class VMWareService(CRUDService):
             id
         )
 
+        await self.middleware.run_in_thread(self._close_session, id)
+
         return response
 
     @accepts(Dict(
@@ -413,79 +434,23 @@ class VMWareService(CRUDService):
         # over all the VMWare tasks for a given ZFS filesystem, do all the VMWare snapshotting
         # then take the ZFS snapshot, then iterate again over all the VMWare "tasks" and undo
         # all the snaps we created in the first place.
+        # All the tasks which use the same vCenter are handled together and vCenters are handled concurrently.
         vmsnapobjs = []
-        for vmsnapobj in qs:
-            # Data structures that will be used to keep track of VMs that are snapped,
-            # as wel as VMs we tried to snap and failed, and VMs we realized we couldn't
-            # snapshot.
-            snapvms = []
-            snapvmfails = []
-            snapvmskips = []
-
-            try:
-                ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                ssl_context.verify_mode = ssl.CERT_NONE
-                si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
-                                          pwd=vmsnapobj["password"], sslContext=ssl_context)
-                content = si.RetrieveContent()
-            except Exception as e:
-                self.logger.warn("VMware login to %s failed", vmsnapobj["hostname"], exc_info=True)
-                self._alert_vmware_login_failed(vmsnapobj, e)
+        timings = {}
+        for vcenter_vmsnapobjs, result, error in run_concurrently(
+            lambda vcenter_vmsnapobjs: self._snapshot_begin_vcenter(
+                vcenter_vmsnapobjs, vmsnapname, vmsnapdescription, dataset,
+            ),
+            list(self._group_by_vcenter(qs).values()),
+            len(qs),
+        ):
+            if error is not None:
+                self.logger.error("Unhandled exception while snapshotting VMs on %s",
+                                  vcenter_vmsnapobjs[0]["hostname"], exc_info=error)
                 continue
 
-            # There's no point to even consider VMs that are paused or powered off.
-            vm_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
-            for vm in vm_view.view:
-                if vm.summary.runtime.powerState != "poweredOn":
-                    continue
-
-                if self._doesVMDependOnDataStore(vm, vmsnapobj["datastore"]):
-                    try:
-                        if self._canSnapshotVM(vm):
-                            if not self._doesVMSnapshotByNameExists(vm, vmsnapname):
-                                # have we already created a snapshot of the VM for this volume
-                                # iteration? can happen if the VM uses two datasets (a and b)
-                                # where both datasets are mapped to the same ZFS volume in FreeNAS.
-                                VimTask.WaitForTask(vm.CreateSnapshot_Task(
-                                    name=vmsnapname,
-                                    description=vmsnapdescription,
-                                    memory=False, quiesce=True,
-                                ))
-                            else:
-                                self.logger.debug("Not creating snapshot %s for VM %s because it "
-                                                  "already exists", vmsnapname, vm)
-                        else:
-                            # TODO:
-                            # we can try to shutdown the VM, if the user provided us an ok to do
-                            # so (might need a new list property in obj to know which VMs are
-                            # fine to shutdown and a UI to specify such exceptions)
-                            # otherwise can skip VM snap and then make a crash-consistent zfs
-                            # snapshot for this VM
-                            self.logger.info("Can't snapshot VM %s that depends on "
-                                             "datastore %s and filesystem %s. "
-                                             "Possibly using PT devices. Skipping.",
-                                             vm.name, vmsnapobj["datastore"], dataset)
-                            snapvmskips.append(vm.config.uuid)
-                    except Exception as e:
-                        self.logger.warning("Snapshot of VM %s failed", vm.name, exc_info=True)
-                        self.middleware.call("alert.oneshot_create", "VMWareSnapshotCreateFailed", {
-                            "hostname": vmsnapobj["hostname"],
-                            "vm": vm.name,
-                            "snapshot": vmsnapname,
-                            "error": str(e),
-                        })
-                        snapvmfails.append([vm.config.uuid, vm.name])
-
-                    snapvms.append(vm.config.uuid)
-
-            connect.Disconnect(si)
-
-            vmsnapobjs.append({
-                "vmsnapobj": vmsnapobj,
-                "snapvms": snapvms,
-                "snapvmfails": snapvmfails,
-                "snapvmskips": snapvmskips,
-            })
+            vcenter_result, timings[vcenter_vmsnapobjs[0]["hostname"]] = result
+            vmsnapobjs.extend(vcenter_result)
 
         # At this point we've completed snapshotting VMs.
 
@@ -496,50 +461,193 @@ class VMWareService(CRUDService):
             "vmsnapname": vmsnapname,
             "vmsnapobjs": vmsnapobjs,
             "vmsynced": vmsnapobjs and all(len(vmsnapobj["snapvms"]) > 0 and len(vmsnapobj["snapvmfails"]) == 0
-                                           for vmsnapobj in vmsnapobjs)
+                                           for vmsnapobj in vmsnapobjs),
+            "timings": timings,
         }
 
+    def _snapshot_begin_vcenter(self, vmsnapobjs, vmsnapname, vmsnapdescription, dataset):
+        timer = PhaseTimer()
+
+        try:
+            with timer("login"):
+                si, content = self._get_session(vmsnapobjs[0])
+        except Exception as e:
+            self.logger.warn("VMware login to %s failed", vmsnapobjs[0]["hostname"], exc_info=True)
+            self._alert_vmware_login_failed(vmsnapobjs[0], e)
+            return [], timer.timings
+
+        with timer("retrieve"):
+            datastore_names = {
+                ref: properties.get("name")
+                for ref, properties in self._retrieve_properties(content, vim.Datastore, ["name"]).items()
+            }
+            vms = self._retrieve_properties(content, vim.VirtualMachine, VM_PROPERTIES)
+
+        # Data structures that will be used to keep track of VMs that are snapped,
+        # as wel as VMs we tried to snap and failed, and VMs we realized we couldn't
+        # snapshot.
+        result = []
+        snapshot_vms = {}
+        for vmsnapobj in vmsnapobjs:
+            snapvms = []
+            snapvmskips = []
+
+            for ref, vm in vms.items():
+                # There's no point to even consider VMs that are paused or powered off.
+                if vm.get("summary.runtime.powerState") != "poweredOn":
+                    continue
+
+                if not vm_depends_on_datastore(vm, vmsnapobj["datastore"], datastore_names):
+                    continue
+
+                if self._canSnapshotVM(vm):
+                    # A VM can use two datastores (a and b) where both datastores are mapped to the same ZFS
+                    # volume in FreeNAS, it is only snapshotted once.
+                    snapshot_vms[ref] = vm
+                else:
+                    # TODO:
+                    # we can try to shutdown the VM, if the user provided us an ok to do
+                    # so (might need a new list property in obj to know which VMs are
+                    # fine to shutdown and a UI to specify such exceptions)
+                    # otherwise can skip VM snap and then make a crash-consistent zfs
+                    # snapshot for this VM
+                    self.logger.info("Can't snapshot VM %s that depends on "
+                                     "datastore %s and filesystem %s. "
+                                     "Possibly using PT devices. Skipping.",
+                                     vm.get("name"), vmsnapobj["datastore"], dataset)
+                    snapvmskips.append(vm.get("config.uuid"))
+
+                snapvms.append(vm.get("config.uuid"))
+
+            result.append({
+                "vmsnapobj": vmsnapobj,
+                "snapvms": snapvms,
+                "snapvmfails": [],
+                "snapvmskips": snapvmskips,
+                "snapshots": {},
+            })
+
+        snapshots = {}
+        failed = set()
+        with timer("snapshot"):
+            for (ref, vm), snapshot, error in run_concurrently(
+                lambda item: self._create_snapshot(item[0], item[1], vmsnapname, vmsnapdescription),
+                list(snapshot_vms.items()),
+                SNAPSHOT_CONCURRENCY,
+            ):
+                if error is not None:
+                    self.logger.warning("Snapshot of VM %s failed", vm.get("name"), exc_info=error)
+                    self.middleware.call_sync("alert.oneshot_create", "VMWareSnapshotCreateFailed", {
+                        "hostname": vmsnapobjs[0]["hostname"],
+                        "vm": vm.get("name"),
+                        "snapshot": vmsnapname,
+                        "error": str(error),
+                    })
+                    failed.add(vm.get("config.uuid"))
+                else:
+                    snapshots[vm.get("config.uuid")] = {"vm": vm.get("name"), "snapshot": snapshot._moId}
+
+        names = {vm.get("config.uuid"): vm.get("name") for vm in snapshot_vms.values()}
+        for elem in result:
+            elem["snapvmfails"] = [[vm_uuid, names[vm_uuid]] for vm_uuid in elem["snapvms"] if vm_uuid in failed]
+            elem["snapshots"] = {vm_uuid: snapshots[vm_uuid] for vm_uuid in elem["snapvms"] if vm_uuid in snapshots}
+
+        return result, timer.timings
+
+    def _create_snapshot(self, ref, vm, vmsnapname, vmsnapdescription):
+        # Retried or overlapping run might have already created it
+        snapshot = find_snapshot(vm.get("snapshot"), vmsnapname)
+        if snapshot is not None:
+            self.logger.debug("Not creating snapshot %s for VM %s because it already exists",
+                              vmsnapname, vm.get("name"))
+            return snapshot
+
+        task = ref.CreateSnapshot_Task(
+            name=vmsnapname,
+            description=vmsnapdescription,
+            memory=False, quiesce=True,
+        )
+        VimTask.WaitForTask(task)
+        return task.info.result
+
     @private
     def snapshot_end(self, context):
         vmsnapname = context["vmsnapname"]
-
-        for elem in context["vmsnapobjs"]:
-            vmsnapobj = elem["vmsnapobj"]
-
-            try:
-                ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                ssl_context.verify_mode = ssl.CERT_NONE
-                si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
-                                          pwd=vmsnapobj["password"], sslContext=ssl_context)
-                self._delete_vmware_login_failed_alert(vmsnapobj)
-            except Exception as e:
-                self.logger.warning("VMware login failed to %s", vmsnapobj["hostname"])
-                self._alert_vmware_login_failed(vmsnapobj, e)
+        timings = context.setdefault("timings", {})
+
+        for vcenter_elems, vcenter_timings, error in run_concurrently(
+            lambda vcenter_elems: self._snapshot_end_vcenter(vcenter_elems, vmsnapname),
+            list(self._group_by_vcenter(context["vmsnapobjs"], lambda elem: elem["vmsnapobj"]).values()),
+            len(context["vmsnapobjs"]),
+        ):
+            hostname = vcenter_elems[0]["vmsnapobj"]["hostname"]
+            if error is not None:
+                self.logger.error("Unhandled exception while removing VM snapshots on %s", hostname, exc_info=error)
                 continue
 
-            # vm is an object, so we'll dereference that object anywhere it's user facing.
+            for phase, seconds in vcenter_timings.items():
+                timings.setdefault(hostname, {})
+                timings[hostname][phase] = timings[hostname].get(phase, 0) + seconds
+
+    def _snapshot_end_vcenter(self, elems, vmsnapname):
+        vmsnapobj = elems[0]["vmsnapobj"]
+        timer = PhaseTimer()
+
+        try:
+            with timer("login"):
+                si, content = self._get_session(vmsnapobj)
+            self._delete_vmware_login_failed_alert(vmsnapobj)
+        except Exception as e:
+            self.logger.warning("VMware login failed to %s", vmsnapobj["hostname"])
+            self._alert_vmware_login_failed(vmsnapobj, e)
+            return timer.timings
+
+        snapshots = {}
+        for elem in elems:
             for vm_uuid in elem["snapvms"]:
-                vm = si.content.searchIndex.FindByUuid(None, vm_uuid, True)
-                if not vm:
-                    self.logger.debug("Could not find VM %s", vm_uuid)
-                    continue
-                if [vm_uuid, vm.name] not in elem["snapvmfails"] and vm_uuid not in elem["snapvmskips"]:
+                if vm_uuid in [fail[0] for fail in elem["snapvmfails"]] or vm_uuid in elem["snapvmskips"]:
                     # The test above is paranoia.  It shouldn't be possible for a vm to
                     # be in more than one of the three dictionaries.
-                    snap = self._doesVMSnapshotByNameExists(vm, vmsnapname)
-                    try:
-                        if snap is not False:
-                            VimTask.WaitForTask(snap.RemoveSnapshot_Task(True))
-                    except Exception as e:
-                        self.logger.debug("Exception removing snapshot %s on %s", vmsnapname, vm.name, exc_info=True)
-                        self.middleware.call("alert.oneshot_create", "VMWareSnapshotDeleteFailed", {
-                            "hostname": vmsnapobj["hostname"],
-                            "vm": vm.name,
-                            "snapshot": vmsnapname,
-                            "error": str(e),
-                        })
+                    continue
 
-            connect.Disconnect(si)
+                snapshots[vm_uuid] = elem.get("snapshots", {}).get(vm_uuid)
+
+        with timer("remove"):
+            for (vm_uuid, snapshot), vm_name, error in run_concurrently(
+                lambda item: self._remove_snapshot(si, content, item[0], item[1], vmsnapname),
+                list(snapshots.items()),
+                SNAPSHOT_CONCURRENCY,
+            ):
+                if error is not None:
+                    vm_name = (snapshot or {}).get("vm", vm_uuid)
+                    self.logger.debug("Exception removing snapshot %s on %s", vmsnapname, vm_name, exc_info=error)
+                    self.middleware.call_sync("alert.oneshot_create", "VMWareSnapshotDeleteFailed", {
+                        "hostname": vmsnapobj["hostname"],
+                        "vm": vm_name,
+                        "snapshot": vmsnapname,
+                        "error": str(error),
+                    })
+
+        return timer.timings
+
+    def _remove_snapshot(self, si, content, vm_uuid, snapshot, vmsnapname):
+        if snapshot is not None:
+            # We know snapshot reference from `snapshot_begin`, no need to look it up
+            snap = vim.vm.Snapshot(snapshot["snapshot"], stub=si._stub)
+            vm_name = snapshot["vm"]
+        else:
+            # vm is an object, so we'll dereference that object anywhere it's user facing.
+            vm = content.searchIndex.FindByUuid(None, vm_uuid, True)
+            if not vm:
+                self.logger.debug("Could not find VM %s", vm_uuid)
+                return None
+            vm_name = vm.name
+            snap = find_snapshot(vm.snapshot, vmsnapname)
+            if snap is None:
+                return vm_name
+
+        VimTask.WaitForTask(snap.RemoveSnapshot_Task(True))
+        return vm_name
 
     @private
     def periodic_snapshot_task_begin(self, task_id):
@@ -547,38 +655,130 @@ class VMWareService(CRUDService):
                                          [["id", "=", task_id]],
                                          {"get": True})
 
-        return self.snapshot_begin(task["dataset"], task["recursive"])
+        context = self.snapshot_begin(task["dataset"], task["recursive"])
+        if context:
+            context["periodic_snapshot_task_id"] = task_id
+        return context
 
     @private
     async def periodic_snapshot_task_end(self, context):
-        return self.snapshot_end(context)
+        await self.middleware.run_in_thread(self.snapshot_end, context)
+
+        task_id = context.get("periodic_snapshot_task_id")
+        self.periodic_snapshot_task_timings[task_id] = context["timings"]
+        self.logger.info("VMware snapshots for periodic snapshot task %r took %s",
+                         task_id, format_timings(context["timings"]))
+
+    @private
+    def get_periodic_snapshot_task_timings(self, task_id):
+        """
+        Time spent in each phase (login, retrieve, snapshot, remove) on every vCenter during the last run of
+        periodic snapshot task `task_id`.
+        """
+        return self.periodic_snapshot_task_timings.get(task_id)
+
+    def _group_by_vcenter(self, items, key=lambda vmsnapobj: vmsnapobj):
+        vcenters = defaultdict(list)
+        for item in items:
+            vmsnapobj = key(item)
+            vcenters[self._credentials(vmsnapobj)].append(item)
+        return vcenters
+
+    def _credentials(self, vmsnapobj):
+        return (
+            vmsnapobj["hostname"],
+            vmsnapobj["username"],
+            hmac.new(self._credentials_key, vmsnapobj["password"].encode(), "sha256").digest(),
+        )
+
+    def _get_session(self, vmsnapobj):
+        """
+        Returns `(service instance, service content)` for vCenter of VMware task `vmsnapobj`.
+
+        Sessions are kept between `snapshot_begin` and `snapshot_end` (and between periodic snapshot task runs)
+        and we only log in again if the session has expired or task credentials have changed.
+        """
+        task_id = vmsnapobj["id"]
+        credentials = self._credentials(vmsnapobj)
+        with self._sessions_lock:
+            lock = self._session_locks[task_id]
+
+        with lock:
+            session = self._sessions.pop(task_id, None)
+            if session is not None:
+                if session[0] == credentials:
+                    try:
+                        if session[2].sessionManager.currentSession is not None:
+                            self._sessions[task_id] = session
+                            return session[1:]
+                    except Exception:
+                        self.logger.debug("VMware session to %s is not usable", vmsnapobj["hostname"], exc_info=True)
+
+                self._disconnect(session[1])
 
-    # Check if a VM is using a certain datastore
-    def _doesVMDependOnDataStore(self, vm, dataStore):
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            ssl_context.verify_mode = ssl.CERT_NONE
+            si = connect.SmartConnect(host=vmsnapobj["hostname"], user=vmsnapobj["username"],
+                                      pwd=vmsnapobj["password"], sslContext=ssl_context)
+            session = self._sessions[task_id] = (credentials, si, si.RetrieveContent())
+            return session[1:]
+
+    def _close_session(self, task_id):
+        """
+        Log out of the vCenter session of VMware task `task_id` (e.g. it was updated or deleted).
+        """
+        with self._sessions_lock:
+            lock = self._session_locks.pop(task_id, None)
+        if lock is None:
+            return
+
+        with lock:
+            session = self._sessions.pop(task_id, None)
+        if session is not None:
+            self._disconnect(session[1])
+
+    def _disconnect(self, si):
         try:
-            # simple case, VM config data is on a datastore.
-            # not sure how critical it is to snapshot the store that has config data, but best to do so
-            for i in vm.datastore:
-                if i.info.name.startswith(dataStore):
-                    return True
-            # check if VM has disks on the data store
-            # we check both "diskDescriptor" and "diskExtent" types of files
-            for device in vm.config.hardware.device:
-                if device.backing is None:
-                    continue
-                if hasattr(device.backing, 'fileName'):
-                    if device.backing.datastore.info.name == dataStore:
-                        return True
+            connect.Disconnect(si)
         except Exception:
-            self.logger.debug('Exception in doesVMDependOnDataStore', exc_info=True)
+            self.logger.debug("Failed to log out of VMware session", exc_info=True)
+
+    def _retrieve_properties(self, content, type_, properties):
+        """
+        Retrieve `properties` of all the objects of `type_` with a single `PropertyCollector` call.
+
+        Returns dict(object reference) = dict(property path) = value. Unset properties are omitted.
+        """
+        view = content.viewManager.CreateContainerView(content.rootFolder, [type_], True)
+        try:
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[vmodl.query.PropertyCollector.ObjectSpec(
+                    obj=view,
+                    skip=True,
+                    selectSet=[vmodl.query.PropertyCollector.TraversalSpec(
+                        name="traverseView", path="view", skip=False, type=vim.view.ContainerView,
+                    )],
+                )],
+                propSet=[vmodl.query.PropertyCollector.PropertySpec(type=type_, pathSet=properties)],
+            )
 
-        return False
+            objects = {}
+            collector = content.propertyCollector
+            result = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+            while result is not None:
+                for obj in result.objects:
+                    objects[obj.obj] = {prop.name: prop.val for prop in obj.propSet}
+                result = collector.ContinueRetrievePropertiesEx(result.token) if result.token else None
+
+            return objects
+        finally:
+            view.Destroy()
 
     # check if VMware can snapshot a VM
     def _canSnapshotVM(self, vm):
         try:
             # check for PCI pass-through devices
-            for device in vm.config.hardware.device:
+            for device in vm.get("config.hardware.device") or []:
                 if isinstance(device, vim.VirtualPCIPassthrough):
                     return False
             # consider supporting more cases of VMs that can't be snapshoted
@@ -588,22 +788,6 @@ class VMWareService(CRUDService):
 
         return True
 
-    # check if there is already a snapshot by a given name
-    def _doesVMSnapshotByNameExists(self, vm, snapshotName):
-        try:
-            tree = vm.snapshot.rootSnapshotList
-            while tree[0].childSnapshotList is not None:
-                snap = tree[0]
-                if snap.name == snapshotName:
-                    return snap.snapshot
-                if len(tree[0].childSnapshotList) < 1:
-                    break
-                tree = tree[0].childSnapshotList
-        except Exception:
-            self.logger.debug('Exception in doesVMSnapshotByNameExists', exc_info=True)
-
-        return False
-
     def _alert_vmware_login_failed(self, vmsnapobj, e):
         if hasattr(e, "msg"):
             vmlogin_fail = e.msg
@@ -24,7 +24,6 @@ from zettarepl.observer import (
 from zettarepl.scheduler.clock import Clock
 from zettarepl.scheduler.scheduler import Scheduler
 from zettarepl.scheduler.tz_clock import TzClock
-from zettarepl.snapshot.list import multilist_snapshots
 from zettarepl.snapshot.name import parse_snapshots_names_with_multiple_schemas
 from zettarepl.transport.create import create_transport
 from zettarepl.transport.local import LocalShell
@@ -34,6 +33,10 @@ from zettarepl.utils.logging import (
 from zettarepl.zettarepl import Zettarepl
 
 from middlewared.client import Client, ejson
+from middlewared.common.zettarepl.observer import enqueue, ObserverMetrics, ProgressCoalescer
+from middlewared.common.zettarepl.snapshots import (
+    list_snapshot_names, NamingSchemaMatcher, SNAPSHOT_LIST_BATCH, SnapshotIndex, transport_key,
+)
 from middlewared.logger import setup_logging
 from middlewared.service import CallError, periodic, Service
 from middlewared.utils import start_daemon_thread
@@ -92,7 +95,7 @@ class ObserverQueueLoggingHandler(logging.Handler):
     def emit(self, record):
         replication_task_id = logging_record_replication_task(record)
         if replication_task_id is not None:
-            self.observer_queue.put(ReplicationTaskLog(replication_task_id, self.format(record)))
+            enqueue(self.observer_queue, ReplicationTaskLog(replication_task_id, self.format(record)))
 
 
 class ZettareplProcess:
@@ -107,6 +110,21 @@ class ZettareplProcess:
 
         self.vmware_contexts = {}
 
+        # Recursive replication of many datasets reports progress of every snapshot it sends, middleware only
+        # needs the latest progress and the last sent snapshot
+        self.observer_coalescer = ProgressCoalescer(
+            lambda message: enqueue(self.observer_queue, message),
+            lambda message: (
+                (message.task_id, type(message).__name__)
+                if isinstance(message, (ReplicationTaskSnapshotProgress, ReplicationTaskSnapshotSuccess))
+                else None
+            ),
+        )
+
+        # Single middleware connection reused for all hook calls
+        self.client = None
+        self.client_lock = threading.Lock()
+
     def __call__(self):
         setproctitle.setproctitle('middlewared (zettarepl)')
         start_daemon_thread(target=watch_parent)
@@ -128,7 +146,7 @@ class ZettareplProcess:
             handler.addFilter(ReplicationTaskLoggingLevelFilter(default_level))
 
         definition = Definition.from_data(self.definition, raise_on_error=False)
-        self.observer_queue.put(DefinitionErrors(definition.errors))
+        enqueue(self.observer_queue, DefinitionErrors(definition.errors))
 
         clock = Clock()
         tz_clock = TzClock(definition.timezone, clock.now)
@@ -150,7 +168,7 @@ class ZettareplProcess:
                 time.sleep(10)
 
     def _observer(self, message):
-        self.observer_queue.put(message)
+        self.observer_coalescer(message)
 
         logger = logging.getLogger("middlewared.plugins.zettarepl")
 
@@ -159,8 +177,7 @@ class ZettareplProcess:
                 task_id = int(message.task_id.split("_")[-1])
 
                 if isinstance(message, PeriodicSnapshotTaskStart):
-                    with Client(py_exceptions=True) as c:
-                        context = c.call("vmware.periodic_snapshot_task_begin", task_id)
+                    context = self._call("vmware.periodic_snapshot_task_begin", task_id)
 
                     self.vmware_contexts[task_id] = context
 
@@ -173,12 +190,24 @@ class ZettareplProcess:
                 if isinstance(message, (PeriodicSnapshotTaskSuccess, PeriodicSnapshotTaskError)):
                     context = self.vmware_contexts.pop(task_id, None)
                     if context:
-                        with Client(py_exceptions=True) as c:
-                            c.call("vmware.periodic_snapshot_task_end", context)
+                        self._call("vmware.periodic_snapshot_task_end", context)
 
         except Exception:
             logger.error("Unhandled exception in ZettareplProcess._observer", exc_info=True)
 
+    def _call(self, method, *args):
+        with self.client_lock:
+            if self.client is not None and self.client._closed.is_set():
+                # middlewared was restarted or the connection was lost otherwise
+                self.client = None
+
+            if self.client is None:
+                self.client = Client(py_exceptions=True)
+
+            client = self.client
+
+        return client.call(method, *args)
+
     def _process_command_queue(self):
         logger = logging.getLogger("middlewared.plugins.zettarepl")
 
@@ -188,7 +217,7 @@ class ZettareplProcess:
                 self.zettarepl.scheduler.tz_clock.timezone = pytz.timezone(args)
             if command == "tasks":
                 definition = Definition.from_data(args, raise_on_error=False)
-                self.observer_queue.put(DefinitionErrors(definition.errors))
+                enqueue(self.observer_queue, DefinitionErrors(definition.errors))
                 self.zettarepl.set_tasks(definition.tasks)
             if command == "run_task":
                 class_name, task_id = args
@@ -213,6 +242,8 @@ class ZettareplService(Service):
         self.command_queue = None
         self.observer_queue = multiprocessing.Queue()
         self.observer_queue_reader = None
+        self.observer_metrics = ObserverMetrics()
+        self.snapshot_index = SnapshotIndex()
         self.state = {}
         self.definition_errors = {}
         self.last_snapshot = {}
@@ -332,38 +363,81 @@ class ZettareplService(Service):
 
     async def list_datasets(self, transport, ssh_credentials=None):
         try:
-            shell = await self._get_zettarepl_shell(transport, ssh_credentials)
-            datasets = await self.middleware.run_in_thread(list_datasets, shell)
+            transport_definition = await self._define_transport(transport, ssh_credentials)
+            key = transport_key(transport_definition)
+            datasets = self.snapshot_index.get_datasets(key)
+            if datasets is None:
+                shell = self._create_zettarepl_shell(transport_definition)
+                datasets = [
+                    ds
+                    for ds in await self.middleware.run_in_thread(list_datasets, shell)
+                    if not any(r.match(ds) for r in INVALID_DATASETS)
+                ]
+                self.snapshot_index.put_datasets(key, datasets)
         except Exception as e:
             raise CallError(repr(e))
 
-        return [
-            ds
-            for ds in datasets
-            if not any(r.match(ds) for r in INVALID_DATASETS)
-        ]
+        return datasets
 
     async def create_dataset(self, dataset, transport, ssh_credentials=None):
         try:
-            shell = await self._get_zettarepl_shell(transport, ssh_credentials)
-            return await self.middleware.run_in_thread(create_dataset, shell, dataset)
+            transport_definition = await self._define_transport(transport, ssh_credentials)
+            shell = self._create_zettarepl_shell(transport_definition)
+            try:
+                return await self.middleware.run_in_thread(create_dataset, shell, dataset)
+            finally:
+                self.snapshot_index.invalidate(transport_key(transport_definition))
         except Exception as e:
             raise CallError(repr(e))
 
-    async def count_eligible_manual_snapshots(self, datasets, naming_schemas, transport, ssh_credentials=None):
+    async def count_eligible_manual_snapshots(self, datasets, naming_schemas, transport, ssh_credentials=None,
+                                              job=None):
         try:
-            shell = await self._get_zettarepl_shell(transport, ssh_credentials)
-            snapshots = await self.middleware.run_in_thread(multilist_snapshots, shell, [(dataset, False)
-                                                                                         for dataset in datasets])
+            transport_definition = await self._define_transport(transport, ssh_credentials)
         except Exception as e:
             raise CallError(repr(e))
 
-        parsed = parse_snapshots_names_with_multiple_schemas([s.name for s in snapshots], naming_schemas)
-
-        return {
-            "total": len(snapshots),
-            "eligible": len(parsed),
+        key = transport_key(transport_definition)
+        matcher = NamingSchemaMatcher(naming_schemas)
+        shell = None
+        result = {
+            "total": 0,
+            "eligible": 0,
         }
+        for i in range(0, len(datasets), SNAPSHOT_LIST_BATCH):
+            batch = datasets[i:i + SNAPSHOT_LIST_BATCH]
+
+            snapshots = {}
+            for dataset in batch:
+                names = self.snapshot_index.get_snapshots(key, dataset)
+                if names is not None:
+                    snapshots[dataset] = names
+
+            missing = [dataset for dataset in batch if dataset not in snapshots]
+            if missing:
+                try:
+                    if shell is None:
+                        shell = self._create_zettarepl_shell(transport_definition)
+                    listed = await self.middleware.run_in_thread(list_snapshot_names, shell, missing)
+                except Exception as e:
+                    raise CallError(repr(e))
+
+                self.snapshot_index.put_snapshots(key, listed)
+                snapshots.update(listed)
+
+            names = [name for dataset in batch for name in snapshots.get(dataset, [])]
+            result["total"] += len(names)
+            result["eligible"] += await self.middleware.run_in_thread(self._count_eligible_snapshots, matcher, names)
+
+            if job is not None:
+                done = min(i + SNAPSHOT_LIST_BATCH, len(datasets))
+                job.set_progress(100 * done / len(datasets), f"Counted snapshots of {done} of {len(datasets)} datasets",
+                                 dict(result))
+
+        return result
+
+    def _count_eligible_snapshots(self, matcher, names):
+        return len(parse_snapshots_names_with_multiple_schemas(matcher.filter(names), matcher.naming_schemas))
 
     async def get_definition(self):
         timezone = (await self.middleware.call("system.general.config"))["timezone"]
@@ -472,8 +546,7 @@ class ZettareplService(Service):
 
         return definition
 
-    async def _get_zettarepl_shell(self, transport, ssh_credentials):
-        transport_definition = await self._define_transport(transport, ssh_credentials)
+    def _create_zettarepl_shell(self, transport_definition):
         transport = create_transport(transport_definition)
         return transport.shell(transport)
 
@@ -525,123 +598,137 @@ class ZettareplService(Service):
     def _is_empty_definition(self, definition):
         return not definition["periodic-snapshot-tasks"] and not definition["replication-tasks"]
 
+    def get_observer_metrics(self):
+        return self.observer_metrics.get()
+
     def _observer_queue_reader(self):
         while True:
-            message = self.observer_queue.get()
+            queued_at, message = self.observer_queue.get()
 
             try:
-                self.logger.debug("Observer queue got %r", message)
-
-                # Global events
-
-                if isinstance(message, DefinitionErrors):
-                    self.definition_errors = {}
-                    for error in message.errors:
-                        if isinstance(error, PeriodicSnapshotTaskDefinitionError):
-                            self.definition_errors[f"periodic_snapshot_{error.task_id}"] = {
-                                "state": "ERROR",
-                                "datetime": datetime.utcnow(),
-                                "error": str(error),
-                            }
-                        if isinstance(error, ReplicationTaskDefinitionError):
-                            self.definition_errors[f"replication_{error.task_id}"] = {
-                                "state": "ERROR",
-                                "datetime": datetime.utcnow(),
-                                "error": str(error),
-                            }
-
-                # Periodic snapshot task
+                self._observer_queue_message(message)
+            finally:
+                try:
+                    queue_depth = self.observer_queue.qsize()
+                except NotImplementedError:
+                    queue_depth = None
 
-                if isinstance(message, PeriodicSnapshotTaskStart):
-                    self.state[f"periodic_snapshot_{message.task_id}"] = {
-                        "state": "RUNNING",
-                        "datetime": datetime.utcnow(),
-                    }
+                self.observer_metrics.record(queued_at, queue_depth)
 
-                if isinstance(message, PeriodicSnapshotTaskSuccess):
-                    self.state[f"periodic_snapshot_{message.task_id}"] = {
-                        "state": "FINISHED",
-                        "datetime": datetime.utcnow(),
-                    }
-
-                if isinstance(message, PeriodicSnapshotTaskError):
-                    self.state[f"periodic_snapshot_{message.task_id}"] = {
-                        "state": "ERROR",
-                        "datetime": datetime.utcnow(),
-                        "error": message.error,
-                    }
-
-                # Replication task events
-
-                if isinstance(message, ReplicationTaskScheduled):
-                    self.state[f"replication_{message.task_id}"] = {
-                        "state": "WAITING",
-                        "datetime": datetime.utcnow(),
-                    }
-
-                if isinstance(message, ReplicationTaskStart):
-                    self.state[f"replication_{message.task_id}"] = {
-                        "state": "RUNNING",
-                        "datetime": datetime.utcnow(),
-                    }
-
-                    # Start fake job if none are already running
-                    if not self.replication_jobs_channels[message.task_id]:
-                        self.middleware.call_sync("replication.run", int(message.task_id[5:]), False)
-
-                if isinstance(message, ReplicationTaskLog):
-                    for channel in self.replication_jobs_channels[message.task_id]:
-                        channel.put(message)
-
-                if isinstance(message, ReplicationTaskSnapshotProgress):
-                    self.state[f"replication_{message.task_id}"] = {
-                        "state": "RUNNING",
-                        "datetime": datetime.utcnow(),
-                        "progress": {
-                            "dataset": message.dataset,
-                            "snapshot": message.snapshot,
-                            "current": message.current,
-                            "total": message.total,
+    def _observer_queue_message(self, message):
+        try:
+            self.logger.debug("Observer queue got %r", message)
+
+            # Global events
+
+            if isinstance(message, DefinitionErrors):
+                self.definition_errors = {}
+                for error in message.errors:
+                    if isinstance(error, PeriodicSnapshotTaskDefinitionError):
+                        self.definition_errors[f"periodic_snapshot_{error.task_id}"] = {
+                            "state": "ERROR",
+                            "datetime": datetime.utcnow(),
+                            "error": str(error),
+                        }
+                    if isinstance(error, ReplicationTaskDefinitionError):
+                        self.definition_errors[f"replication_{error.task_id}"] = {
+                            "state": "ERROR",
+                            "datetime": datetime.utcnow(),
+                            "error": str(error),
                         }
+
+            # Periodic snapshot task
+
+            if isinstance(message, PeriodicSnapshotTaskStart):
+                self.state[f"periodic_snapshot_{message.task_id}"] = {
+                    "state": "RUNNING",
+                    "datetime": datetime.utcnow(),
+                }
+
+            if isinstance(message, PeriodicSnapshotTaskSuccess):
+                self.state[f"periodic_snapshot_{message.task_id}"] = {
+                    "state": "FINISHED",
+                    "datetime": datetime.utcnow(),
+                }
+
+            if isinstance(message, PeriodicSnapshotTaskError):
+                self.state[f"periodic_snapshot_{message.task_id}"] = {
+                    "state": "ERROR",
+                    "datetime": datetime.utcnow(),
+                    "error": message.error,
+                }
+
+            # Replication task events
+
+            if isinstance(message, ReplicationTaskScheduled):
+                self.state[f"replication_{message.task_id}"] = {
+                    "state": "WAITING",
+                    "datetime": datetime.utcnow(),
+                }
+
+            if isinstance(message, ReplicationTaskStart):
+                self.state[f"replication_{message.task_id}"] = {
+                    "state": "RUNNING",
+                    "datetime": datetime.utcnow(),
+                }
+
+                # Start fake job if none are already running
+                if not self.replication_jobs_channels[message.task_id]:
+                    self.middleware.call_sync("replication.run", int(message.task_id[5:]), False)
+
+            if isinstance(message, ReplicationTaskLog):
+                for channel in self.replication_jobs_channels[message.task_id]:
+                    channel.put(message)
+
+            if isinstance(message, ReplicationTaskSnapshotProgress):
+                self.state[f"replication_{message.task_id}"] = {
+                    "state": "RUNNING",
+                    "datetime": datetime.utcnow(),
+                    "progress": {
+                        "dataset": message.dataset,
+                        "snapshot": message.snapshot,
+                        "current": message.current,
+                        "total": message.total,
                     }
+                }
 
-                    for channel in self.replication_jobs_channels[message.task_id]:
-                        channel.put(message)
+                for channel in self.replication_jobs_channels[message.task_id]:
+                    channel.put(message)
 
-                if isinstance(message, ReplicationTaskSnapshotSuccess):
-                    last_snapshot = f"{message.dataset}@{message.snapshot}"
-                    self.last_snapshot[f"replication_{message.task_id}"] = last_snapshot
-                    self.serializable_state[int(message.task_id.split("_")[1])]["last_snapshot"] = last_snapshot
+            if isinstance(message, ReplicationTaskSnapshotSuccess):
+                last_snapshot = f"{message.dataset}@{message.snapshot}"
+                self.last_snapshot[f"replication_{message.task_id}"] = last_snapshot
+                self.serializable_state[int(message.task_id.split("_")[1])]["last_snapshot"] = last_snapshot
 
-                    for channel in self.replication_jobs_channels[message.task_id]:
-                        channel.put(message)
+                for channel in self.replication_jobs_channels[message.task_id]:
+                    channel.put(message)
 
-                if isinstance(message, ReplicationTaskSuccess):
-                    state = {
-                        "state": "FINISHED",
-                        "datetime": datetime.utcnow(),
-                    }
-                    self.state[f"replication_{message.task_id}"] = state
-                    self.serializable_state[int(message.task_id.split("_")[1])]["state"] = state
+            if isinstance(message, ReplicationTaskSuccess):
+                state = {
+                    "state": "FINISHED",
+                    "datetime": datetime.utcnow(),
+                }
+                self.state[f"replication_{message.task_id}"] = state
+                self.serializable_state[int(message.task_id.split("_")[1])]["state"] = state
 
-                    for channel in self.replication_jobs_channels[message.task_id]:
-                        channel.put(message)
+                for channel in self.replication_jobs_channels[message.task_id]:
+                    channel.put(message)
 
-                if isinstance(message, ReplicationTaskError):
-                    state = {
-                        "state": "ERROR",
-                        "datetime": datetime.utcnow(),
-                        "error": message.error,
-                    }
+            if isinstance(message, ReplicationTaskError):
+                state = {
+                    "state": "ERROR",
+                    "datetime": datetime.utcnow(),
+                    "error": message.error,
+                }
 
-                    self.state[f"replication_{message.task_id}"] = state
-                    self.serializable_state[int(message.task_id.split("_")[1])]["state"] = state
+                self.state[f"replication_{message.task_id}"] = state
+                self.serializable_state[int(message.task_id.split("_")[1])]["state"] = state
 
-                    for channel in self.replication_jobs_channels[message.task_id]:
-                        channel.put(message)
+                for channel in self.replication_jobs_channels[message.task_id]:
+                    channel.put(message)
 
-            except Exception:
-                self.logger.warning("Unhandled exception in observer_queue_reader", exc_info=True)
+        except Exception:
+            self.logger.warning("Unhandled exception in observer_queue_reader", exc_info=True)
 
     async def terminate(self):
         await self.flush_state()
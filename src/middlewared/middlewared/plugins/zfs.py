@@ -7,7 +7,6 @@ from copy import deepcopy
 from datetime import datetime
 
 from bsd import geom
-import libzfs
 
 from middlewared.alert.base import (
     Alert, AlertCategory, AlertClass, AlertLevel, OneShotAlertClass, SimpleOneShotAlertClass
@@ -17,8 +16,11 @@ from middlewared.service import (
     CallError, CRUDService, ValidationError, ValidationErrors, filterable, job,
 )
 from middlewared.utils import filter_list, filter_getattrs, start_daemon_thread
+from middlewared.utils.lazy import lazy_import
 from middlewared.validators import ReplicationSnapshotNamingSchema
 
+libzfs = lazy_import('libzfs')
+
 SCAN_THREADS = {}
 
 
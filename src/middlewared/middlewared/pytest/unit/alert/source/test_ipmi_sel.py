@@ -8,9 +8,10 @@ import pytest
 from middlewared.alert.source.ipmi_sel import (
     IPMISELRecord, parse_ipmitool_output, parse_sel_information,
     IPMISELAlertClass, IPMISELSpaceLeftAlertClass,
-    IPMISELAlertSource, IPMISELSpaceLeftAlertSource,
+    IPMISELAlertSource, IPMISELSpaceLeftAlertSource, IPMISELTracker,
     Alert
 )
+from middlewared.pytest.unit.middleware import Middleware
 
 
 def test__parse_ipmitool_output():
@@ -188,3 +189,119 @@ def test_ipmi_sel_space_left_alert_source__emits():
         },
         key=None,
     )
+
+
+class FakeIPMITool:
+    def __init__(self):
+        self.records = []
+        self.next_id = 1
+        self.last_add_time = "Not Available"
+        self.last_del_time = "Not Available"
+        self.calls = []
+
+    def add(self, dt):
+        self.records.append(f"{self.next_id:x},{dt:%m/%d/%Y,%H:%M:%S},Watchdog2 #0xca,Timer interrupt (),Asserted")
+        self.next_id += 1
+        self.last_add_time = f"{dt:%m/%d/%Y %H:%M:%S}"
+
+    def clear(self, dt):
+        self.records = []
+        self.last_del_time = f"{dt:%m/%d/%Y %H:%M:%S}"
+
+    async def __call__(self, *args):
+        self.calls.append(args)
+        if args == ("sel", "info"):
+            return textwrap.dedent(f"""\
+                SEL Information
+                Entries          : {len(self.records)}
+                Free Space       : 9860 bytes
+                Percent Used     : 2%
+                Last Add Time    : {self.last_add_time}
+                Last Del Time    : {self.last_del_time}
+            """)
+        if args == ("-c", "sel", "elist"):
+            return "\n".join(self.records) + "\n"
+        if args[:4] == ("-c", "sel", "elist", "last"):
+            return "\n".join(self.records[-int(args[4]):]) + "\n"
+        raise ValueError(args)
+
+
+@pytest.fixture
+def tracker_middleware():
+    kv = {}
+    middleware = Middleware()
+    middleware["keyvalue.has_key"] = lambda key: key in kv
+    middleware["keyvalue.get"] = lambda key: kv[key]
+    middleware["keyvalue.set"] = kv.__setitem__
+    return middleware
+
+
+@pytest.mark.asyncio
+async def test_ipmi_sel_tracker__skips_reading_unchanged_sel(tracker_middleware):
+    ipmitool = FakeIPMITool()
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 7))
+    tracker = IPMISELTracker(tracker_middleware, ipmitool, interval=0)
+
+    info, records = await tracker.probe()
+    assert [record.id for record in records] == [1]
+    assert info["Entries"] == "1"
+
+    ipmitool.calls = []
+    info, records = await tracker.probe()
+    assert [record.id for record in records] == [1]
+    assert ipmitool.calls == [("sel", "info")]
+
+
+@pytest.mark.asyncio
+async def test_ipmi_sel_tracker__reads_only_new_records(tracker_middleware):
+    ipmitool = FakeIPMITool()
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 7))
+    tracker = IPMISELTracker(tracker_middleware, ipmitool, interval=0)
+    await tracker.probe()
+
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 8))
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 9))
+    ipmitool.calls = []
+    info, records = await tracker.probe()
+    assert [record.id for record in records] == [1, 2, 3]
+    assert ipmitool.calls == [("sel", "info"), ("-c", "sel", "elist", "last", "2")]
+
+
+@pytest.mark.asyncio
+async def test_ipmi_sel_tracker__reads_all_records_after_clear(tracker_middleware):
+    ipmitool = FakeIPMITool()
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 7))
+    tracker = IPMISELTracker(tracker_middleware, ipmitool, interval=0)
+    await tracker.probe()
+
+    ipmitool.clear(datetime(2017, 4, 20, 6, 4, 0))
+    ipmitool.add(datetime(2017, 4, 20, 6, 4, 1))
+    ipmitool.add(datetime(2017, 4, 20, 6, 4, 2))
+    ipmitool.calls = []
+    info, records = await tracker.probe()
+    assert [record.id for record in records] == [2, 3]
+    assert ipmitool.calls == [("sel", "info"), ("-c", "sel", "elist")]
+
+
+@pytest.mark.asyncio
+async def test_ipmi_sel_tracker__restores_persisted_cursor(tracker_middleware):
+    ipmitool = FakeIPMITool()
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 7))
+    await IPMISELTracker(tracker_middleware, ipmitool, interval=0).probe()
+
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 8))
+    ipmitool.calls = []
+    info, records = await IPMISELTracker(tracker_middleware, ipmitool, interval=0).probe()
+    assert records == parse_ipmitool_output("\n".join(ipmitool.records))
+    assert ipmitool.calls == [("sel", "info"), ("-c", "sel", "elist", "last", "1")]
+
+
+@pytest.mark.asyncio
+async def test_ipmi_sel_tracker__reuses_recent_probe(tracker_middleware):
+    ipmitool = FakeIPMITool()
+    ipmitool.add(datetime(2017, 4, 20, 6, 3, 7))
+    tracker = IPMISELTracker(tracker_middleware, ipmitool)
+
+    await tracker.probe()
+    await tracker.probe()
+    assert ipmitool.calls == [("sel", "info"), ("-c", "sel", "elist")]
@@ -1,11 +1,12 @@
+import bz2
 from datetime import datetime
+import os
 
 import pytest
 
-from middlewared.alert.source.ssh_login_failures import get_login_failures
+from middlewared.alert.source.ssh_login_failures import get_login_failures, LoginFailuresCounter, LogScanner
 
-
-@pytest.mark.parametrize("now,messages,failures", [
+LOGIN_FAILURES = [
     (datetime(year=2017, month=8, day=31), [
         b'Aug 30 invalid login\n',  # 2017
         b'Aug 31 invalid login\n',  # 2017
@@ -35,6 +36,65 @@ from middlewared.alert.source.ssh_login_failures import get_login_failures
     ], [
         b'Aug 30 invalid login\n',
     ]),
-])
+]
+
+
+@pytest.mark.parametrize("now,messages,failures", LOGIN_FAILURES)
 def test__get_login_failures(now, messages, failures):
     assert get_login_failures(now, messages) == failures
+
+
+@pytest.mark.parametrize("now,messages,failures", LOGIN_FAILURES)
+def test__login_failures_counter(now, messages, failures):
+    counter = LoginFailuresCounter()
+    for message in messages:
+        counter.feed([message])
+
+    assert counter.get_login_failures(now) == (len(failures), [failure.decode() for failure in failures])
+
+
+def test__log_scanner(tmpdir):
+    log = tmpdir.join("auth.log")
+    log.write_binary(b"Aug 30 first\nAug 30 second\nAug 30 incomp")
+
+    scanner = LogScanner(log_directory=str(tmpdir))
+    assert list(scanner.scan()) == [b"Aug 30 first\n", b"Aug 30 second\n"]
+    assert scanner.full
+
+    log.write(b"lete\nAug 31 third\n", mode="ab")
+    scanner = LogScanner(scanner.checkpoint(), log_directory=str(tmpdir))
+    assert list(scanner.scan()) == [b"Aug 30 incomplete\n", b"Aug 31 third\n"]
+    assert not scanner.full
+
+    # Rotate
+    log.write(b"Aug 31 fourth\n", mode="ab")
+    with bz2.BZ2File(str(tmpdir.join("auth.log.0.bz2")), "wb") as f:
+        f.write(log.read_binary())
+    os.unlink(str(log))
+    log.write_binary(b"Aug 31 fifth\n")
+
+    scanner = LogScanner(scanner.checkpoint(), log_directory=str(tmpdir))
+    assert list(scanner.scan()) == [b"Aug 31 fourth\n", b"Aug 31 fifth\n"]
+    assert not scanner.full
+
+    # Nothing new
+    scanner = LogScanner(scanner.checkpoint(), log_directory=str(tmpdir))
+    assert list(scanner.scan()) == []
+    assert not scanner.full
+
+
+def test__log_scanner__unknown_rotation(tmpdir):
+    log = tmpdir.join("auth.log")
+    log.write_binary(b"Aug 30 first\n")
+
+    scanner = LogScanner(log_directory=str(tmpdir))
+    list(scanner.scan())
+
+    with bz2.BZ2File(str(tmpdir.join("auth.log.0.bz2")), "wb") as f:
+        f.write(b"Aug 30 other\n")
+    os.unlink(str(log))
+    log.write_binary(b"Aug 31 second\n")
+
+    scanner = LogScanner(scanner.checkpoint(), log_directory=str(tmpdir))
+    assert list(scanner.scan()) == [b"Aug 30 other\n", b"Aug 31 second\n"]
+    assert scanner.full
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+import pytest
+
+from middlewared.client import ejson
+
+
+@pytest.mark.parametrize("obj", [
+    "string",
+    [],
+    {},
+    list(range(25)),
+    [{"id": i, "created": datetime(2019, 7, 18, 12, i % 60)} for i in range(25)],
+    {"id": "call", "msg": "result", "result": list(range(25))},
+    {"a": {str(i): i for i in range(25)}, "b": None},
+    [list(range(25)), 1, [list(range(25))]],
+    {1: list(range(25))},
+])
+def test__iterdumps(obj):
+    assert "".join(ejson.iterdumps(obj, chunk_length=10)) == ejson.dumps(obj)
+
+
+def test__iterdumps__pieces():
+    assert len(list(ejson.iterdumps(list(range(25)), chunk_length=10))) == 7
@@ -0,0 +1,179 @@
+import textwrap
+
+from middlewared.common.ctl.ctladm import parse_config, parse_devlist, parse_portlist, plan
+
+TARGET = 'iqn.2005-10.org.freenas.ctl:target'
+
+
+def lun_section(name, ctl_lun, path, serial, size=None, options=None):
+    section = (
+        f'lun "{name}" {{\n'
+        f'\tctl-lun "{ctl_lun}"\n'
+        f'\tpath "{path}"\n'
+        f'\tblocksize "512"\n'
+        f'\tserial "{serial}"\n'
+        f'\tdevice-id "iSCSI Disk      {serial}"\n'
+    )
+    if size is not None:
+        section += f'\t\tsize "{size}"\n'
+    for k, v in (options or {'vendor': 'FreeNAS'}).items():
+        section += f'\toption "{k}" "{v}"\n'
+    return section + '}\n\n'
+
+
+def config(luns, mapping):
+    return (
+        'portal-group "default" {\n}\n\n' +
+        'portal-group "pg1" {\n\ttag "0x0001"\n\tlisten "0.0.0.0:3260"\n}\n\n' +
+        ''.join(luns) +
+        f'target "{TARGET}" {{\n\talias "target"\n\tportal-group "pg1" "no-authentication"\n\n' +
+        ''.join(f'\tlun "{number}" "{name}"\n' for number, name in mapping.items()) +
+        '}\n\n'
+    )
+
+
+def devlist(luns):
+    return '<ctllunlist>\n' + ''.join(
+        f'<lun id="{ctl_lun}">\n'
+        f'\t<backend_type>block</backend_type>\n'
+        f'\t<size>{size // 512}</size>\n'
+        f'\t<blocksize>512</blocksize>\n'
+        f'\t<serial_number>{serial}</serial_number>\n'
+        f'\t<device_id>iSCSI Disk      {serial}</device_id>\n'
+        f'\t<file>{path}</file>\n'
+        f'\t<ctld_name>{name}</ctld_name>\n'
+        f'\t<vendor>FreeNAS</vendor>\n'
+        f'</lun>\n'
+        for ctl_lun, (name, path, serial, size) in luns.items()
+    ) + '</ctllunlist>\n'
+
+
+def portlist(mapping):
+    return textwrap.dedent('''\
+        <ctlportlist>
+        <targ_port id="0">
+        \t<frontend_type>ioctl</frontend_type>
+        \t<port_name>ioctl</port_name>
+        </targ_port>
+        <targ_port id="3">
+        \t<frontend_type>iscsi</frontend_type>
+        \t<port_name>iscsi</port_name>
+        \t<target>%s</target>
+        %s</targ_port>
+        </ctlportlist>
+    ''') % (TARGET, ''.join(f'\t<lun id="{number}">{ctl_lun}</lun>\n' for number, ctl_lun in mapping.items()))
+
+
+OLD = config([lun_section('a', 0, '/dev/zvol/tank/a', 'A'), lun_section('b', 1, '/dev/zvol/tank/b', 'B')],
+             {0: 'a', 1: 'b'})
+DEVLIST = devlist({0: ('a', '/dev/zvol/tank/a', 'A', 1048576), 1: ('b', '/dev/zvol/tank/b', 'B', 1048576)})
+PORTLIST = portlist({0: 0, 1: 1})
+
+
+def test__parse_config():
+    conf = parse_config(config([lun_section('a', 4, '/mnt/tank/file', 'A', '10G')], {0: 'a'}))
+
+    assert conf.luns == {'a': {
+        'ctl_lun': 4, 'path': '/mnt/tank/file', 'blocksize': 512, 'serial': 'A', 'device_id': 'iSCSI Disk      A',
+        'size': 10 * 1024 ** 3, 'options': {'vendor': 'FreeNAS'},
+    }}
+    assert conf.targets == {TARGET: {0: 'a'}}
+    assert 'lun' not in conf.skeleton
+    assert f'target "{TARGET}"' in conf.skeleton
+
+
+def test__parse_devlist():
+    assert parse_devlist(DEVLIST)[1] == {
+        'name': 'b', 'backend': 'block', 'path': '/dev/zvol/tank/b', 'blocksize': 512, 'size': 1048576,
+        'serial': 'B', 'device_id': 'iSCSI Disk      B', 'options': {'vendor': 'FreeNAS'},
+    }
+
+
+def test__parse_portlist():
+    assert parse_portlist(PORTLIST) == [
+        {'id': 0, 'frontend': 'ioctl', 'target': None, 'luns': {}},
+        {'id': 3, 'frontend': 'iscsi', 'target': TARGET, 'luns': {0: 0, 1: 1}},
+    ]
+
+
+def test__plan__unchanged():
+    assert plan(parse_config(OLD), parse_config(OLD), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) == []
+
+
+def test__plan__add_lun():
+    new = config([
+        lun_section('a', 0, '/dev/zvol/tank/a', 'A'),
+        lun_section('b', 1, '/dev/zvol/tank/b', 'B'),
+        lun_section('c', 2, '/dev/zvol/tank/c', 'C'),
+    ], {0: 'a', 1: 'b', 2: 'c'})
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) == [
+        ['create', '-b', 'block', '-l', '2', '-o', 'file=/dev/zvol/tank/c', '-o', 'ctld_name=c', '-B', '512',
+         '-S', 'C', '-d', 'iSCSI Disk      C', '-o', 'vendor=FreeNAS'],
+        ['lunmap', '-p', '3', '-l', '2', '-L', '2'],
+    ]
+
+
+def test__plan__remove_lun():
+    new = config([lun_section('a', 0, '/dev/zvol/tank/a', 'A')], {0: 'a'})
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) == [
+        ['lunmap', '-p', '3', '-l', '1'],
+        ['remove', '-b', 'block', '-l', '1'],
+    ]
+
+
+def test__plan__resize_lun():
+    new = config([
+        lun_section('a', 0, '/dev/zvol/tank/a', 'A'),
+        lun_section('b', 1, '/dev/zvol/tank/b', 'B', '2097152', {'vendor': 'FreeNAS', 'rpm': '1'}),
+    ], {0: 'a', 1: 'b'})
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) == [
+        ['modify', '-b', 'block', '-l', '1', '-s', '2097152', '-o', 'rpm=1'],
+    ]
+
+
+def test__plan__changed_path_recreates_lun():
+    new = config([
+        lun_section('a', 0, '/dev/zvol/tank/a', 'A'),
+        lun_section('b', 1, '/dev/zvol/tank/other', 'B'),
+    ], {0: 'a', 1: 'b'})
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) == [
+        ['lunmap', '-p', '3', '-l', '1'],
+        ['remove', '-b', 'block', '-l', '1'],
+        ['create', '-b', 'block', '-l', '1', '-o', 'file=/dev/zvol/tank/other', '-o', 'ctld_name=b', '-B', '512',
+         '-S', 'B', '-d', 'iSCSI Disk      B', '-o', 'vendor=FreeNAS'],
+        ['lunmap', '-p', '3', '-l', '1', '-L', '1'],
+    ]
+
+
+def test__plan__portal_group_changed():
+    new = OLD.replace('0.0.0.0:3260', '0.0.0.0:3261')
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) is None
+
+
+def test__plan__removed_option():
+    new = config([
+        lun_section('a', 0, '/dev/zvol/tank/a', 'A'),
+        lun_section('b', 1, '/dev/zvol/tank/b', 'B', options={'rpm': '1'}),
+    ], {0: 'a', 1: 'b'})
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(DEVLIST), parse_portlist(PORTLIST)) is None
+
+
+def test__plan__ctl_lun_taken():
+    new = config([
+        lun_section('a', 0, '/dev/zvol/tank/a', 'A'),
+        lun_section('b', 1, '/dev/zvol/tank/b', 'B'),
+        lun_section('c', 5, '/dev/zvol/tank/c', 'C'),
+    ], {0: 'a', 1: 'b', 2: 'c'})
+    devices = devlist({
+        0: ('a', '/dev/zvol/tank/a', 'A', 1048576),
+        1: ('b', '/dev/zvol/tank/b', 'B', 1048576),
+        5: ('', '/dev/zvol/tank/manual', 'M', 1048576),
+    })
+
+    assert plan(parse_config(OLD), parse_config(new), parse_devlist(devices), parse_portlist(PORTLIST)) is None
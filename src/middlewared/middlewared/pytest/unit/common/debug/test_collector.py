@@ -0,0 +1,74 @@
+import io
+import os
+import tarfile
+import textwrap
+
+from middlewared.common.debug.collector import DebugCollector, list_modules
+
+
+def make_module(moduledir, name, directory, body, opt=None):
+    os.makedirs(os.path.join(moduledir, name))
+    with open(os.path.join(moduledir, name, f'{name}.sh'), 'w') as f:
+        f.write(
+            f'{name}_opt() {{ echo {opt or name[0]}; }}\n'
+            f'{name}_help() {{ echo "Dump {directory} Configuration"; }}\n'
+            f'{name}_directory() {{ echo "{directory}"; }}\n'
+            f'{name}_func()\n'
+            '{\n' + textwrap.indent(body, '\t') + '\n}\n'
+        )
+
+
+def collect(tmpdir, **kwargs):
+    moduledir = str(tmpdir.mkdir('freenas-debug'))
+    with open(os.path.join(moduledir, 'include.sh'), 'w') as f:
+        f.write('section_header() { echo "--- $1"; }\n')
+    make_module(moduledir, 'zfs', 'ZFS', 'section_header "zpool status"\necho ONLINE')
+    make_module(moduledir, 'slow', 'Slow', 'sleep 30')
+    make_module(moduledir, 'db_dump', 'db_dump', 'echo dump', 'B')
+    make_module(moduledir, 'jails', 'Jails', (
+        'mkdir -p "$FREENAS_DEBUG_DIRECTORY/Jails/iocage-debug"\n'
+        'echo debug > "$FREENAS_DEBUG_DIRECTORY/Jails/iocage-debug/jail1.txt"\n'
+        'echo "$FREENAS_DEBUG_DIRECTORY" > "%s"' % tmpdir.join('directory')
+    ))
+
+    logs = tmpdir.mkdir('log')
+    logs.join('messages').write(''.join(f'line {i}\n' for i in range(100)))
+    logs.join('messages.0.bz2').write_binary(b'compressed')
+    logs.join('textdump.tar.last').write(''.join(f'line {i}\n' for i in range(100)))
+
+    bundle = io.BytesIO()
+    progress = []
+    DebugCollector(
+        bundle, moduledir=moduledir, timeout=1, limit=10, progress_cb=lambda *args: progress.append(args),
+        **kwargs,
+    ).collect(extra_paths={'log': str(logs)})
+    bundle.seek(0)
+    with tarfile.open(fileobj=bundle, mode='r:gz') as tar:
+        return {member.name: tar.extractfile(member).read() for member in tar.getmembers()}, progress
+
+
+def test__list_modules(tmpdir):
+    moduledir = str(tmpdir)
+    make_module(moduledir, 'zfs', 'ZFS', 'zpool status')
+    os.makedirs(os.path.join(moduledir, 'empty'))
+
+    assert list_modules(moduledir) == [('zfs', 'z', 'ZFS', 'Dump ZFS Configuration')]
+
+
+def test__collect(tmpdir):
+    files, progress = collect(tmpdir)
+
+    assert files['ixdiagnose/fndebug/ZFS/dump.txt'] == b'--- zpool status\nONLINE\n'
+    assert b'timed out' in files['ixdiagnose/fndebug/Slow/dump.txt']
+    assert 'ixdiagnose/fndebug/db_dump/dump.txt' not in files
+    assert files['ixdiagnose/log/messages'] == b''.join(f'line {i}\n'.encode() for i in range(90, 100))
+    assert files['ixdiagnose/log/messages.0.bz2'] == b'compressed'
+    assert files['ixdiagnose/log/textdump.tar.last'].count(b'\n') == 100
+    assert progress[-1] == (100, 'Debug generation finished')
+
+
+def test__collect__module_directory(tmpdir):
+    files, progress = collect(tmpdir)
+
+    assert files['ixdiagnose/fndebug/Jails/iocage-debug/jail1.txt'] == b'debug\n'
+    assert not os.path.exists(tmpdir.join('directory').read().strip())
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from middlewared.common.filesystem.listdir import listdir
+from middlewared.service_exception import CallError
+
+
+@pytest.fixture
+def directory(tmpdir):
+    for i in range(20):
+        tmpdir.join(f'file{i:02d}').write('x' * i)
+    tmpdir.mkdir('dir')
+    os.symlink('missing', str(tmpdir.join('link')))
+    return str(tmpdir)
+
+
+def names(entries):
+    return [entry['name'] for entry in entries]
+
+
+def test__listdir(directory):
+    entries = listdir(directory, [], {'order_by': ['name']})
+
+    assert names(entries) == ['dir'] + [f'file{i:02d}' for i in range(20)] + ['link']
+    assert entries[0]['type'] == 'DIRECTORY'
+    assert entries[5] == {
+        'name': 'file04', 'path': os.path.join(directory, 'file04'), 'realpath': os.path.join(directory, 'file04'),
+        'type': 'FILE', 'size': 4, 'mode': entries[5]['mode'], 'uid': os.getuid(), 'gid': entries[5]['gid'],
+    }
+    assert entries[-1]['type'] == 'SYMLINK'
+    assert entries[-1]['size'] is None
+
+
+def test__listdir__limit(directory):
+    entries = listdir(directory, [['name', '^', 'file1']], {'limit': 3})
+
+    assert len(entries) == 3
+    assert all(name.startswith('file1') for name in names(entries))
+
+
+def test__listdir__filters(directory):
+    assert names(listdir(directory, [['name', '^', 'file'], ['size', '>', 17]], {'order_by': ['-name']})) == [
+        'file19', 'file18',
+    ]
+    assert listdir(directory, [['name', '~', 'file0.']], {'count': True}) == 10
+    assert listdir(directory, [['type', '=', 'DIRECTORY']], {'get': True})['name'] == 'dir'
+
+
+def test__listdir__no_stat(directory):
+    entry = listdir(directory, [['name', '=', 'file05']], {'get': True, 'extra': {'stat': False}})
+
+    assert entry['type'] == 'FILE'
+    assert entry['size'] is None
+
+
+@pytest.mark.parametrize('filters,limit,pages', [
+    ([], 10, [
+        ['dir'] + [f'file{i:02d}' for i in range(9)], [f'file{i:02d}' for i in range(9, 19)], ['file19', 'link'],
+    ]),
+    ([['name', '^', 'file']], 10, [[f'file{i:02d}' for i in range(10)], [f'file{i:02d}' for i in range(10, 20)], []]),
+    ([['type', '!=', 'FILE']], 1, [['dir'], ['link'], []]),
+])
+def test__listdir__cursor(directory, filters, limit, pages):
+    after = ''
+    result = []
+    while after is not None:
+        page = listdir(directory, filters, {'limit': limit, 'extra': {'after': after}})
+        result.append(names(page['entries']))
+        after = page['after']
+
+    assert result == pages
+
+
+def test__listdir__cursor_order(directory):
+    with pytest.raises(CallError):
+        listdir(directory, [], {'order_by': ['size'], 'extra': {'after': ''}})
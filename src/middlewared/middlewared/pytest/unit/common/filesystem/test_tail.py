@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+from middlewared.common.filesystem.tail import TailBrokers
+
+
+class Subscriber:
+    def __init__(self):
+        self.data = []
+
+    def __call__(self, data):
+        self.data.append(data)
+
+    def wait(self, data):
+        for _ in range(100):
+            if ''.join(self.data) == data:
+                return
+            time.sleep(0.01)
+
+        assert ''.join(self.data) == data
+
+
+@pytest.fixture
+def log(tmpdir):
+    path = str(tmpdir.join('messages'))
+    with open(path, 'w') as f:
+        f.write(''.join(f'line {i}\n' for i in range(200)) + 'partial')
+    return path
+
+
+def append(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+
+
+def test__tail__fan_out(log):
+    brokers = TailBrokers(interval=0.01)
+    first, second = Subscriber(), Subscriber()
+    brokers.subscribe(log, 2, first)
+    brokers.subscribe(log, 150, second)
+
+    assert first.data == ['line 199\npartial']
+    assert second.data == [''.join(f'line {i}\n' for i in range(51, 200)) + 'partial']
+    assert len(brokers.brokers) == 1
+
+    append(log, ' line\nline 201\n')
+    first.wait('line 199\npartial line\nline 201\n')
+    second.wait(second.data[0] + ' line\nline 201\n')
+
+
+def test__tail__truncate(log):
+    brokers = TailBrokers(interval=0.01)
+    subscriber = Subscriber()
+    brokers.subscribe(log, 1, subscriber)
+
+    with open(log, 'w') as f:
+        f.write('new\n')
+    subscriber.wait('partialnew\n')
+
+    late = Subscriber()
+    brokers.subscribe(log, 5, late)
+    assert late.data == ['new\n']
+
+
+def test__tail__rotate(log):
+    brokers = TailBrokers(interval=0.01)
+    subscriber = Subscriber()
+    brokers.subscribe(log, 1, subscriber)
+
+    append(log, '\n')
+    os.rename(log, f'{log}.0')
+    append(f'{log}.0', 'last\n')
+    append(log, 'first\n')
+    subscriber.wait('partial\nlast\nfirst\n')
+
+
+def test__tail__unsubscribe(log):
+    brokers = TailBrokers(interval=0.01)
+    first, second = Subscriber(), Subscriber()
+    brokers.subscribe(log, 1, first)
+    brokers.subscribe(log, 1, second)
+    broker = brokers.brokers[log]
+
+    brokers.unsubscribe(log, first)
+    assert broker.thread.is_alive()
+
+    brokers.unsubscribe(log, second)
+    assert brokers.brokers == {}
+    broker.thread.join(1)
+    assert not broker.thread.is_alive()
@@ -0,0 +1,86 @@
+import json
+import textwrap
+
+import pytest
+
+from middlewared.common.open_files.index import index_processes, parse_lsof_processes, parse_procstat, PathTrie
+
+
+def test__path_trie():
+    trie = PathTrie({'/mnt/tank': 'tank', '/mnt/tank/data': 'data', '/mnt/tank2': 'tank2', '/': 'root'})
+
+    assert trie.lookup('/mnt/tank/data/file') == ['root', 'tank', 'data']
+    assert trie.lookup('/mnt/tank2/file') == ['root', 'tank2']
+    assert trie.lookup('/mnt/tank') == ['root', 'tank']
+    assert trie.lookup('/usr/lib') == ['root']
+
+
+def test__parse_procstat():
+    output = json.dumps({'__version': '1', 'procstat': {'files': {
+        '2520': {'process_id': 2520, 'command': 'smbd', 'files': [
+            {'fd': 'cwd', 'type': 'vnode', 'path': '/mnt/tank'},
+            {'fd': '3', 'type': 'socket'},
+        ]},
+        '97778': {'process_id': 97778, 'command': 'minio', 'files': []},
+    }}})
+
+    assert parse_procstat(output) == [(2520, 'smbd', ['/mnt/tank']), (97778, 'minio', [])]
+
+
+def test__parse_lsof_processes():
+    assert parse_lsof_processes('p535\ncpython3.7\nf5\nn/usr/lib/data\nn/mnt/tank\npbad\nn/mnt/x\np536\n') == [
+        (535, 'python3.7', ['/usr/lib/data', '/mnt/tank']),
+        (536, None, []),
+    ]
+
+
+def test__index_processes():
+    processes = [
+        (535, 'python3.7', ['/usr/lib/data', 'socket']),
+        (537, 'python3.7', ['/dev/zvol/tank/vols/vol1']),
+        (2520, 'smbd', ['/mnt/tank/blob1', '/mnt/backup/blob2', '/mnt/tank/data/blob3']),
+        (2521, None, ['/mnt/tank/blob1']),
+    ]
+
+    assert index_processes(processes, {
+        '/mnt/tank': 'tank', '/dev/zvol/tank': 'tank', '/mnt/tank/data': 'tank/data', '/mnt/backup': 'backup',
+        '/mnt/empty': 'empty',
+    }) == {
+        'tank': {537: 'python3.7', 2520: 'smbd'},
+        'tank/data': {2520: 'smbd'},
+        'backup': {2520: 'smbd'},
+    }
+
+
+@pytest.mark.parametrize('lsof,dirs,result', [
+    (
+        textwrap.dedent('''\
+            p535
+            cpython3.7
+            f5
+            n/usr/lib/data
+            p536
+            cpython3.7
+            f5
+            n/dev/zvol/backup/vol1
+            p537
+            cpython3.7
+            f5
+            n/dev/zvol/tank/vols/vol1
+            p2520
+            csmbd
+            f9
+            n/mnt/tank/blob1
+            f31
+            n/mnt/backup/blob2
+            p97778
+            cminio
+            f7
+            n/mnt/tank/data/blob3
+        '''),
+        ['/mnt/tank', '/dev/zvol/tank'],
+        {537: 'python3.7', 2520: 'smbd', 97778: 'minio'},
+    ),
+])
+def test__index_processes__lsof(lsof, dirs, result):
+    assert index_processes(parse_lsof_processes(lsof), {dir: None for dir in dirs}) == {None: result}
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from middlewared.common.permissions.acl import inherit_acl, InheritedACLs, POSIXACLBackend
+
+
+def entry(tag, id=None, type='ALLOW', perms=('READ_DATA',), **flags):
+    return {
+        'tag': tag,
+        'id': id,
+        'type': type,
+        'perms': {perm: True for perm in perms},
+        'flags': dict({flag: False for flag in ['FILE_INHERIT', 'DIRECTORY_INHERIT', 'NO_PROPAGATE_INHERIT',
+                                                'INHERIT_ONLY', 'INHERITED']}, **flags),
+    }
+
+
+def flags(entries):
+    return [(e['tag'], {k for k, v in e['flags'].items() if v}) for e in entries]
+
+
+ACL = [
+    entry('USER_OBJ', FILE_INHERIT=True, DIRECTORY_INHERIT=True),
+    entry('GROUP_OBJ', FILE_INHERIT=True),
+    entry('EVERYONE', DIRECTORY_INHERIT=True, NO_PROPAGATE_INHERIT=True),
+    entry('GROUP', 1000),
+]
+
+
+def test__inherit_acl__file():
+    assert flags(inherit_acl(ACL, False)) == [
+        ('USER_OBJ', {'INHERITED'}),
+        ('GROUP_OBJ', {'INHERITED'}),
+    ]
+
+
+def test__inherit_acl__directory():
+    assert flags(inherit_acl(ACL, True)) == [
+        ('USER_OBJ', {'FILE_INHERIT', 'DIRECTORY_INHERIT', 'INHERITED'}),
+        ('GROUP_OBJ', {'FILE_INHERIT', 'INHERIT_ONLY', 'INHERITED'}),
+        ('EVERYONE', {'INHERITED'}),
+    ]
+
+
+def test__inherited_acls():
+    inherited = InheritedACLs(ACL)
+
+    assert inherited.get(1, True) == inherit_acl(ACL, True)
+    assert inherited.get(1, False) == inherit_acl(ACL, False)
+    # File-only entries are still inherited by files deep down, no-propagate ones are not
+    assert flags(inherited.get(3, True)) == [
+        ('USER_OBJ', {'FILE_INHERIT', 'DIRECTORY_INHERIT', 'INHERITED'}),
+        ('GROUP_OBJ', {'FILE_INHERIT', 'INHERIT_ONLY', 'INHERITED'}),
+    ]
+    assert flags(inherited.get(3, False)) == [('USER_OBJ', {'INHERITED'}), ('GROUP_OBJ', {'INHERITED'})]
+
+
+def test__posix_acl_backend__encode():
+    backend = POSIXACLBackend()
+
+    assert backend.mode(backend.encode([
+        entry('USER_OBJ', perms=['READ_DATA', 'WRITE_DATA', 'EXECUTE']),
+        entry('GROUP_OBJ', perms=['READ_DATA', 'EXECUTE']),
+        entry('EVERYONE', type='DENY', perms=['READ_DATA']),
+    ])) == 0o750
+    assert backend.mode(backend.encode(ACL)) is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'setxattr'), reason='Linux only')
+def test__posix_acl_backend(tmpdir):
+    backend = POSIXACLBackend()
+    path = str(tmpdir.mkdir('dir'))
+    entries = inherit_acl(ACL + [entry('USER', 1000, FILE_INHERIT=True, DIRECTORY_INHERIT=True)], True)
+    try:
+        backend.set(path, entries, True)
+    except OSError as e:
+        pytest.skip(f'POSIX ACLs are not supported: {e.strerror}')
+
+    assert not backend.is_trivial(path)
+    assert backend.matches(path, os.stat(path), entries, True)
+    assert not backend.matches(path, os.stat(path), inherit_acl(ACL, True), True)
+
+    backend.strip(path)
+    assert backend.is_trivial(path)
@@ -0,0 +1,83 @@
+import os
+import threading
+
+import pytest
+
+from middlewared.common.permissions.walker import Walker
+from middlewared.service_exception import CallError
+
+
+@pytest.fixture
+def tree(tmpdir):
+    os.makedirs(str(tmpdir.join('a/b/c')))
+    os.makedirs(str(tmpdir.join('d')))
+    for f in ['f1', 'a/f2', 'a/b/f3', 'a/b/c/f4', 'd/f5']:
+        tmpdir.join(f).write('')
+    os.symlink('a', str(tmpdir.join('link')))
+    return str(tmpdir)
+
+
+class Visitor:
+    def __init__(self, fail=None, skip=()):
+        self.fail = fail
+        self.skip = skip
+        self.visited = []
+        self.lock = threading.Lock()
+
+    def __call__(self, dir_fd, name, path, st, depth):
+        assert os.stat(name, dir_fd=dir_fd, follow_symlinks=False).st_ino == st.st_ino
+        if path.endswith(f'/{self.fail}'):
+            raise OSError(13, 'Permission denied')
+
+        with self.lock:
+            self.visited.append((os.path.relpath(path, self.root), depth))
+
+        return os.path.basename(path) not in self.skip
+
+    def walk(self, root, **kwargs):
+        self.root = root
+        walker = Walker(root, self, workers=3, **kwargs)
+        return walker, walker.run()
+
+
+def test__walker(tree):
+    visitor = Visitor(skip=['f1', 'f4'])
+    walker, result = visitor.walk(tree)
+
+    assert sorted(visitor.visited) == [
+        ('a', 1), ('a/b', 2), ('a/b/c', 3), ('a/b/c/f4', 4), ('a/b/f3', 3), ('a/f2', 2), ('d', 1), ('d/f5', 2),
+        ('f1', 1), ('link', 1),
+    ]
+    assert result == {'visited': 10, 'changed': 8}
+    assert walker.checkpoint() == ['']
+
+
+def test__walker__progress(tree):
+    progress = []
+    walker = Walker(tree, lambda *args: True)
+    walker.run(lambda *args: progress.append(args))
+
+    assert progress[-1] == (100, '10 entries processed, 10 changed')
+
+
+def test__walker__failure_checkpoint(tree):
+    visitor = Visitor(fail='f3')
+    checkpoints = []
+    with pytest.raises(CallError) as e:
+        visitor.root = tree
+        Walker(tree, visitor, workers=3).run(checkpoint=checkpoints.append)
+
+    assert 'a/b/f3: Permission denied' in e.value.errmsg
+    # Failed directory and its parents are not finished, their finished subdirectories are
+    assert checkpoints[-1] == ['a/b/c', 'd']
+
+    visitor = Visitor()
+    visitor.walk(tree, done=checkpoints[-1])
+    assert sorted(visitor.visited) == [('a', 1), ('a/b', 2), ('a/b/f3', 3), ('a/f2', 2), ('f1', 1), ('link', 1)]
+
+
+def test__walker__vanished(tree):
+    def visit(dir_fd, name, path, st, depth):
+        raise FileNotFoundError(2, 'No such file or directory')
+
+    assert Walker(tree, visit).run() == {'visited': 0, 'changed': 0}
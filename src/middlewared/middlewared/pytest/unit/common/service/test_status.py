@@ -0,0 +1,89 @@
+import subprocess
+import threading
+
+from asynctest import Mock
+
+from middlewared.common.service.status import ProcessWatcher, ServiceStatusTracker
+
+
+def tracker(ttl=60, alive=True):
+    watcher = Mock()
+    watcher.watch.return_value = alive
+    on_exit = Mock()
+    return ServiceStatusTracker(on_exit, ttl=ttl, watcher=watcher), on_exit
+
+
+def test__tracker__unknown_service_has_to_be_probed():
+    t, _ = tracker()
+    assert t.get('ssh') is None
+
+
+def test__tracker__running_service_trusted_until_process_exits():
+    t, on_exit = tracker(ttl=0)
+
+    assert t.set('ssh', 'RUNNING', [100]) is False
+    assert t.get('ssh') == ('RUNNING', [100])
+
+    t._process_exited(100)
+
+    on_exit.assert_called_once_with('ssh')
+    assert t.get('ssh') is None
+    assert t.last('ssh') == ('RUNNING', [100])
+    assert t.set('ssh', 'STOPPED', []) is True
+
+
+def test__tracker__running_service_without_watched_pids_expires():
+    t, _ = tracker(ttl=0, alive=False)
+
+    t.set('ssh', 'RUNNING', [100])
+    assert t.get('ssh') is None
+
+
+def test__tracker__stopped_service_trusted_while_pidfile_unchanged(tmpdir):
+    pidfile = tmpdir.join('sshd.pid')
+    t, _ = tracker(ttl=0)
+
+    t.set('ssh', 'STOPPED', [], str(pidfile))
+    assert t.get('ssh', str(pidfile)) == ('STOPPED', [])
+
+    pidfile.write('100')
+    assert t.get('ssh', str(pidfile)) is None
+
+
+def test__tracker__ttl():
+    t, _ = tracker(ttl=60)
+
+    t.set('cifs', 'RUNNING', [])
+    assert t.get('cifs') == ('RUNNING', [])
+
+    t.invalidate('cifs')
+    assert t.get('cifs') is None
+
+
+def test__tracker__stale_probe_discarded():
+    t, _ = tracker()
+
+    generation = t.generation('ssh')
+    t.invalidate('ssh')
+    t.set('ssh', 'STOPPED', [], generation=generation)
+
+    assert t.last('ssh') is None
+
+
+def test__process_watcher__poll():
+    exited = threading.Event()
+    pids = []
+
+    def callback(pid):
+        pids.append(pid)
+        exited.set()
+
+    watcher = ProcessWatcher(callback, poll_interval=0.01)
+    watcher.kqueue = None
+
+    process = subprocess.Popen(['sleep', '0.1'])
+    assert watcher.watch(process.pid)
+    process.wait()
+
+    assert exited.wait(5)
+    assert pids == [process.pid]
@@ -0,0 +1,90 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from middlewared.common.vmware.snapshot import (
+    find_snapshot, format_timings, PhaseTimer, run_concurrently, vm_depends_on_datastore,
+)
+
+# Fake managed object references, pyVmomi ones are hashable the same way
+DATASTORE1 = ('vim.Datastore', 'datastore-1')
+DATASTORE2 = ('vim.Datastore', 'datastore-2')
+DATASTORE_NAMES = {DATASTORE1: 'freenas', DATASTORE2: 'local'}
+
+
+def disk(datastore):
+    return SimpleNamespace(backing=SimpleNamespace(fileName='[ds] vm/vm.vmdk', datastore=datastore))
+
+
+def snapshot_tree(name, snapshot, children=None):
+    return SimpleNamespace(name=name, snapshot=snapshot, childSnapshotList=children or [])
+
+
+@pytest.mark.parametrize('vm,result', [
+    ({'datastore': [DATASTORE1]}, True),
+    ({'datastore': [DATASTORE2], 'config.hardware.device': [disk(DATASTORE1)]}, True),
+    ({'datastore': [DATASTORE2], 'config.hardware.device': [disk(DATASTORE2), SimpleNamespace(backing=None)]}, False),
+    ({'datastore': [('vim.Datastore', 'unknown')]}, False),
+    ({}, False),
+])
+def test__vm_depends_on_datastore(vm, result):
+    assert vm_depends_on_datastore(vm, 'freenas', DATASTORE_NAMES) is result
+
+
+def test__find_snapshot():
+    info = SimpleNamespace(rootSnapshotList=[
+        snapshot_tree('daily', 'snapshot-1', [snapshot_tree('hourly', 'snapshot-2')]),
+        snapshot_tree('weekly', 'snapshot-3', [
+            snapshot_tree('other', 'snapshot-4'),
+            snapshot_tree('freenas', 'snapshot-5', [snapshot_tree('child', 'snapshot-6')]),
+        ]),
+    ])
+
+    assert find_snapshot(info, 'freenas') == 'snapshot-5'
+    assert find_snapshot(info, 'hourly') == 'snapshot-2'
+    assert find_snapshot(info, 'missing') is None
+    assert find_snapshot(None, 'freenas') is None
+
+
+def test__run_concurrently():
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def snapshot(vm):
+        with lock:
+            running.append(vm)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(vm)
+        if vm == 'vm3':
+            raise ValueError('Snapshot failed')
+        return f'snapshot-{vm}'
+
+    vms = [f'vm{i}' for i in range(10)]
+    start = time.monotonic()
+    results = run_concurrently(snapshot, vms, 4)
+
+    assert time.monotonic() - start < 0.05 * 10
+    assert max(max_running) == 4
+    assert [(vm, result) for vm, result, error in results] == [
+        (vm, None if vm == 'vm3' else f'snapshot-{vm}') for vm in vms
+    ]
+    assert isinstance(results[3][2], ValueError)
+    assert run_concurrently(snapshot, [], 4) == []
+
+
+def test__phase_timer():
+    timer = PhaseTimer()
+    with timer('login'):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with timer('login'):
+            raise ValueError()
+
+    assert list(timer.timings) == ['login']
+    assert timer.timings['login'] >= 0.01
+    assert format_timings({'vcenter': {'login': 1.5, 'snapshot': 10}}) == 'vcenter: login 1.50s, snapshot 10.00s'
@@ -0,0 +1,85 @@
+import time
+
+from middlewared.common.zettarepl.observer import ObserverMetrics, ProgressCoalescer
+
+
+class Progress:
+    def __init__(self, task_id, i):
+        self.task_id = task_id
+        self.i = i
+
+
+class Success:
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+
+def coalescer(interval=60):
+    sent = []
+    return ProgressCoalescer(
+        sent.append, lambda message: message.task_id if isinstance(message, Progress) else None, interval,
+    ), sent
+
+
+def test__coalescer__first_progress_sent_immediately():
+    c, sent = coalescer()
+
+    c(Progress('task_1', 0))
+    c(Progress('task_2', 0))
+
+    assert [(m.task_id, m.i) for m in sent] == [('task_1', 0), ('task_2', 0)]
+
+
+def test__coalescer__progress_flood():
+    c, sent = coalescer()
+
+    for i in range(10000):
+        c(Progress('task_1', i))
+    c(Success('task_1'))
+
+    assert [type(m).__name__ for m in sent] == ['Progress', 'Progress', 'Success']
+    assert [m.i for m in sent[:2]] == [0, 9999]
+    assert c.coalesced == 9998
+
+
+def test__coalescer__other_task_progress_kept_pending():
+    c, sent = coalescer()
+
+    c(Progress('task_1', 0))
+    c(Progress('task_2', 0))
+    c(Progress('task_1', 1))
+    c(Progress('task_2', 1))
+    c(Success('task_1'))
+
+    assert [(m.task_id, getattr(m, 'i', None)) for m in sent] == [
+        ('task_1', 0), ('task_2', 0), ('task_1', 1), ('task_1', None),
+    ]
+    assert list(c.pending) == ['task_2']
+
+
+def test__coalescer__pending_flushed_after_interval():
+    c, sent = coalescer(interval=0.05)
+
+    c(Progress('task_1', 0))
+    c(Progress('task_1', 1))
+
+    deadline = time.monotonic() + 5
+    while len(sent) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert [m.i for m in sent] == [0, 1]
+
+
+def test__metrics():
+    metrics = ObserverMetrics()
+
+    now = time.monotonic()
+    metrics.record(now - 2, 3)
+    metrics.record(now, 1)
+
+    result = metrics.get()
+    assert result['messages'] == 2
+    assert result['queue_depth'] == 1
+    assert result['max_queue_depth'] == 3
+    assert 1 <= result['average_latency'] < 2
+    assert result['max_latency'] >= 2
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from asynctest import Mock
+import pytest
+
+from middlewared.common.zettarepl.snapshots import list_snapshot_names, NamingSchemaMatcher, SnapshotIndex
+
+
+@pytest.mark.parametrize("naming_schema,name", [
+    ("auto-%Y-%m-%d_%H-%M", "auto-2019-07-18_12-00"),
+    ("auto-%Y-%m-%d_%H-%M", "auto-2019-7-8_2-0"),
+    ("auto-%Y-%m-%d_%H-%M", "AUTO-2019-07-18_12-00"),
+    ("auto-%Y-%m-%d_%H-%M", "auto-2019-07-18_12-00-extra"),
+    ("auto-%Y-%m-%d_%H-%M", "manual-2019-07-18_12-00"),
+    ("auto-%Y-%m-%d_%H-%M", "auto-2019-13-18_12-00"),
+    ("auto %Y%m%d.%H%M", "auto  20190718.1200"),
+    ("auto %Y%m%d.%H%M", "auto 20190718x1200"),
+    ("auto-%Y-%m-%d_%H-%M-%S%z", "auto-2019-07-18_12-00-00+0300"),
+    ("auto-%Y-%m-%d_%H-%M-%S%z", "auto-2019-07-18_12-00-00"),
+    ("100%%-%Y-%m-%d_%H-%M", "100%-2019-07-18_12-00"),
+])
+def test__naming_schema_matcher__superset_of_strptime(naming_schema, name):
+    try:
+        datetime.strptime(name, naming_schema)
+    except ValueError:
+        pass
+    else:
+        assert NamingSchemaMatcher([naming_schema]).filter([name]) == [name]
+
+
+def test__naming_schema_matcher__filter():
+    matcher = NamingSchemaMatcher(["auto-%Y-%m-%d_%H-%M", "manual-%Y%m%d"])
+
+    assert matcher.filter([
+        "auto-2019-07-18_12-00", "auto-2019-07-18", "manual-20190718", "manual-2019-07-18_12-00", "migration",
+    ]) == ["auto-2019-07-18_12-00", "manual-20190718"]
+
+
+def test__list_snapshot_names():
+    shell = Mock()
+    shell.exec.return_value = "tank/a@auto-1\ntank/a@auto-2\ntank/b@weird@name\n"
+
+    assert list_snapshot_names(shell, ["tank/a", "tank/b", "tank/c"]) == {
+        "tank/a": ["auto-1", "auto-2"],
+        "tank/b": ["weird@name"],
+        "tank/c": [],
+    }
+    shell.exec.assert_called_once_with(["zfs", "list", "-t", "snapshot", "-H", "-o", "name", "-s", "name", "-d", "1",
+                                        "tank/a", "tank/b", "tank/c"])
+
+
+def test__snapshot_index():
+    index = SnapshotIndex(ttl=60)
+
+    index.put_datasets("peer", ["tank/a"])
+    index.put_snapshots("peer", {"tank/a": ["auto-1"]})
+    assert index.get_datasets("peer") == ["tank/a"]
+    assert index.get_snapshots("peer", "tank/a") == ["auto-1"]
+    assert index.get_snapshots("peer", "tank/b") is None
+    assert index.get_snapshots("other", "tank/a") is None
+
+    index.invalidate("peer")
+    assert index.get_datasets("peer") is None
+    assert index.get_snapshots("peer", "tank/a") is None
+
+
+def test__snapshot_index__ttl():
+    index = SnapshotIndex(ttl=0)
+
+    index.put_snapshots("peer", {"tank/a": ["auto-1"]})
+    assert index.get_snapshots("peer", "tank/a") is None
@@ -20,6 +20,9 @@ class Middleware(dict):
     async def call(self, name, *args):
         return self[name](*args)
 
+    def call_sync(self, name, *args):
+        return self[name](*args)
+
     async def run_in_thread(self, method, *args, **kwargs):
         return method(*args, **kwargs)
 
@@ -0,0 +1,53 @@
+import pytest
+
+from middlewared.plugins.account import GroupService, next_free_ids, UserService
+from middlewared.pytest.unit.middleware import Middleware
+
+
+@pytest.mark.parametrize("used,count,result", [
+    (set(), 3, [1000, 1001, 1002]),
+    ({1000, 1001, 1003}, 3, [1002, 1004, 1005]),
+    ({0, 500, 65534}, 1, [1000]),
+])
+def test__next_free_ids(used, count, result):
+    assert next_free_ids(used, count) == result
+
+
+@pytest.mark.asyncio
+async def test__user_extend_context():
+    m = Middleware()
+    m['datastore.sql'] = lambda query: [
+        {'bsdgrpmember_user_id': 1, 'bsdgrpmember_group_id': 10},
+        {'bsdgrpmember_user_id': 1, 'bsdgrpmember_group_id': 11},
+        {'bsdgrpmember_user_id': 2, 'bsdgrpmember_group_id': 10},
+    ]
+    service = UserService(m)
+
+    context = await service.user_extend_context()
+
+    user = await service.user_extend({'id': 1, 'email': '', 'home': '/nonexistent'}, context)
+    assert user['groups'] == [10, 11]
+    assert user['email'] is None
+    assert (await service.user_extend({'id': 3, 'email': None, 'home': '/nonexistent'}, context))['groups'] == []
+
+
+@pytest.mark.asyncio
+async def test__group_extend_context():
+    m = Middleware()
+    m['datastore.sql'] = lambda query: {
+        'SELECT bsdgrpmember_group_id, bsdgrpmember_user_id FROM account_bsdgroupmembership': [
+            {'bsdgrpmember_user_id': 1, 'bsdgrpmember_group_id': 10},
+            {'bsdgrpmember_user_id': 2, 'bsdgrpmember_group_id': 10},
+        ],
+        'SELECT id, bsdusr_group_id FROM account_bsdusers': [
+            {'id': 1, 'bsdusr_group_id': 11},
+            {'id': 2, 'bsdusr_group_id': 12},
+            {'id': 3, 'bsdusr_group_id': 10},
+        ],
+    }[query]
+    service = GroupService(m)
+
+    context = await service.group_extend_context()
+
+    assert (await service.group_extend({'id': 10}, context))['users'] == [1, 2, 3]
+    assert (await service.group_extend({'id': 13}, context))['users'] == []
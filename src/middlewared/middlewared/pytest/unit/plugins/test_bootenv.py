@@ -0,0 +1,176 @@
+from datetime import datetime
+
+from mock import Mock, patch
+import pytest
+
+from middlewared.plugins.bootenv import BE_ROOT, BOOT_POOL, BootEnvService, nicenum
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.service import ValidationErrors
+
+CREATED = datetime(2019, 5, 1, 12, 30, 45)
+
+
+class ZFSException(Exception):
+    pass
+
+
+class Property:
+    def __init__(self, value, rawvalue=None):
+        self.value = value
+        self.rawvalue = value if rawvalue is None else rawvalue
+
+
+class Dataset:
+    def __init__(self, name, properties, mountpoint=None):
+        self.name = name
+        self.properties = properties
+        self.mountpoint = mountpoint
+        self.children = []
+
+
+class BootPool:
+    """
+    `libzfs.ZFS()` with only `freenas-boot` pool and its boot environments.
+    """
+
+    def __init__(self):
+        self.bootfs = None
+        self.root = Dataset(BE_ROOT, {})
+        self.snapshots = {}
+
+    def add(self, name, used, created=CREATED, origin=None, mountpoint=None, active=False, **user_properties):
+        properties = {
+            'used': Property(nicenum(used), str(used)),
+            'creation': Property(created.strftime('%a %b %d %H:%M %Y'), str(int(created.timestamp()))),
+            'origin': Property(origin or '-'),
+        }
+        properties.update({f'beadm:{k}': Property(v) for k, v in user_properties.items()})
+        dataset = Dataset(f'{BE_ROOT}/{name}', properties, mountpoint)
+        self.root.children.append(dataset)
+        if active:
+            self.bootfs = dataset.name
+
+    def add_snapshot(self, name, used):
+        self.snapshots[name] = Dataset(name, {'used': Property(nicenum(used), str(used))})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get(self, name):
+        assert name == BOOT_POOL
+        return Mock(properties={'bootfs': Property(self.bootfs)})
+
+    def get_dataset(self, name):
+        assert name == BE_ROOT
+        return self.root
+
+    def get_snapshot(self, name):
+        try:
+            return self.snapshots[name]
+        except KeyError:
+            raise ZFSException(f'{name} not found')
+
+
+@pytest.fixture
+def boot_pool():
+    pool = BootPool()
+    pool.add('default', 2 * 1024 ** 3, created=datetime(2018, 1, 1))
+    pool.add_snapshot(f'{BE_ROOT}/default@11.2-U4', 256 * 1024 ** 2)
+    pool.add('11.2-U4', 1024 * 1024, origin=f'{BE_ROOT}/default@11.2-U4', mountpoint='/', active=True,
+             nickname='Stable', keep='True')
+    pool.add('11.3', 5000, created=datetime(2019, 6, 1), keep='False')
+    with patch('middlewared.plugins.bootenv.libzfs', Mock(ZFS=Mock(return_value=pool), ZFSException=ZFSException)):
+        yield pool
+
+
+@pytest.mark.parametrize('num,result', [
+    (0, '0'),
+    (1023, '1023'),
+    (1024, '1K'),
+    (1536, '1.50K'),
+    (15 * 1024 ** 2 + 1024 ** 2 // 3, '15.3M'),
+    (1000 * 1024 ** 3 - 1, '1000G'),
+    (3 * 1024 ** 4, '3T'),
+])
+def test__nicenum(num, result):
+    assert nicenum(num) == result
+
+
+def test__bootenv__list(boot_pool):
+    boot_pool.root.children[0].mountpoint = '/mnt'
+
+    assert BootEnvService(Middleware()).get_boot_environments() == [
+        {
+            'name': 'default',
+            'realname': 'default',
+            'active': '-',
+            'mountpoint': '/mnt',
+            'space': '2G',
+            'created': datetime(2018, 1, 1),
+            'keep': None,
+            'rawspace': 2 * 1024 ** 3,
+        },
+        {
+            'name': 'Stable',
+            'realname': '11.2-U4',
+            'active': 'NR',
+            'mountpoint': '/',
+            'space': '257M',
+            'created': datetime(2019, 5, 1, 12, 30),
+            'keep': True,
+            'rawspace': 257 * 1024 ** 2,
+        },
+        {
+            'name': '11.3',
+            'realname': '11.3',
+            'active': '-',
+            'mountpoint': '-',
+            'space': '4.88K',
+            'created': datetime(2019, 6, 1),
+            'keep': False,
+            'rawspace': 5000,
+        },
+    ]
+
+
+def test__bootenv__list__active_on_reboot(boot_pool):
+    boot_pool.bootfs = f'{BE_ROOT}/11.3'
+
+    assert {be['realname']: be['active'] for be in BootEnvService(Middleware()).get_boot_environments()} == {
+        'default': '-', '11.2-U4': 'N', '11.3': 'R',
+    }
+
+
+def test__bootenv__list__missing_origin(boot_pool):
+    boot_pool.snapshots.clear()
+
+    assert BootEnvService(Middleware()).get_boot_environments()[1]['rawspace'] == 1024 ** 2
+
+
+def test__bootenv__list__cached_until_invalidated(boot_pool):
+    service = BootEnvService(Middleware())
+
+    assert len(service.get_boot_environments()) == 3
+
+    boot_pool.add('11.3-U1', 1024, created=datetime(2019, 7, 1))
+    assert len(service.get_boot_environments()) == 3
+
+    service.invalidate()
+    assert [be['name'] for be in service.get_boot_environments()] == ['default', 'Stable', '11.3', '11.3-U1']
+
+
+@pytest.mark.parametrize('name,exists', [
+    ('Stable', True),
+    ('11.2-U4', True),
+    ('11.3', True),
+    ('11.3-U1', False),
+])
+def test__bootenv__clean_be_name(boot_pool, name, exists):
+    verrors = ValidationErrors()
+
+    BootEnvService(Middleware())._clean_be_name(verrors, 'bootenv_create', name)
+
+    assert bool(verrors) == exists
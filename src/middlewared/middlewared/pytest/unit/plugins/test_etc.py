@@ -0,0 +1,77 @@
+import asyncio
+
+from mock import Mock
+
+import pytest
+
+from middlewared.plugins.etc import EtcService, RenderContext
+from middlewared.pytest.unit.middleware import Middleware
+
+
+def test__render_context__memoises_config():
+    middleware = Mock()
+    middleware.call_sync.return_value = {'workgroup': 'WORKGROUP'}
+
+    context = RenderContext(middleware)
+    config = context.call_sync('smb.config')
+    config['workgroup'] = 'CHANGED'
+
+    assert context.call_sync('smb.config') == {'workgroup': 'WORKGROUP'}
+    middleware.call_sync.assert_called_once_with('smb.config')
+
+
+def test__render_context__different_params():
+    middleware = Mock()
+    middleware.call_sync.side_effect = lambda name, *params: list(params)
+
+    context = RenderContext(middleware)
+
+    assert context.call_sync('user.query', [['builtin', '=', False]]) == [[['builtin', '=', False]]]
+    assert context.call_sync('user.query') == []
+    assert middleware.call_sync.call_count == 2
+
+
+def test__render_context__invalidated_by_write():
+    middleware = Mock()
+
+    context = RenderContext(middleware)
+    context.call_sync('smb.config')
+    context.call_sync('cronjob.construct_cron_command', {}, 'root', 'true')
+    context.call_sync('smb.config')
+    context.call_sync('datastore.update', 'services.cifs', 1, {'cifs_SID': 'S-1'})
+    context.call_sync('smb.config')
+
+    assert [c[0][0] for c in middleware.call_sync.call_args_list] == [
+        'smb.config', 'cronjob.construct_cron_command', 'datastore.update', 'smb.config',
+    ]
+
+
+def test__render_context__failure_not_memoised():
+    middleware = Mock()
+    middleware.call_sync.side_effect = [ValueError(), {}]
+
+    context = RenderContext(middleware)
+    with pytest.raises(ValueError):
+        context.call_sync('smb.config')
+
+    assert context.call_sync('smb.config') == {}
+
+
+@pytest.mark.asyncio
+async def test__generate_all__user_first():
+    events = []
+
+    async def generate(name, context=None):
+        events.append(('start', name))
+        await asyncio.sleep(0)
+        events.append(('end', name))
+
+    service = EtcService(Middleware())
+    service.GROUPS = {'ups': [], 'user': [], 'ssh': []}
+    service.generate = generate
+
+    await service.generate_all()
+
+    # Groups resolving owners by name never run while accounts are being written
+    assert events[:2] == [('start', 'user'), ('end', 'user')]
+    assert events[2:4] == [('start', 'ups'), ('start', 'ssh')]
@@ -1,7 +1,9 @@
+import asyncio
 import copy
+import enum
 import pytest
 
-from asynctest import Mock
+from asynctest import CoroutineMock, Mock, patch
 
 from middlewared.service import ValidationErrors
 from middlewared.plugins.network import InterfaceService
@@ -366,3 +368,114 @@ async def test__interfaces_service__update_mtu_options():
             },
         )
     assert 'interface_update.options' in ve.value
+
+
+class InterfaceFlags(enum.Enum):
+    UP = 1
+
+
+class AggregationProtocol(enum.Enum):
+    LACP = 1
+
+
+class NeighborDiscoveryFlags(enum.Enum):
+    IFDISABLED = 1
+    AUTO_LINKLOCAL = 2
+    ACCEPT_RTADV = 3
+
+
+class AddressFamily(enum.Enum):
+    LINK = 1
+    INET = 2
+    INET6 = 3
+
+
+def interface_config(id, name):
+    return {
+        'id': id,
+        'int_interface': name,
+        'int_name': '',
+        'int_dhcp': False,
+        'int_ipv6auto': False,
+        'int_ipv4address': '',
+        'int_ipv6address': '',
+        'int_vip': '',
+        'int_options': '',
+        'int_mtu': None,
+    }
+
+
+@pytest.mark.asyncio
+async def test__interfaces_service__sync_dry_run():
+
+    tables = {
+        'network.interfaces': [interface_config(1, 'lagg0'), interface_config(2, 'vlan5')],
+        'network.alias': [],
+        'network.lagginterface': [
+            {'id': 1, 'lagg_interface': {'int_interface': 'lagg0', 'int_mtu': None}, 'lagg_protocol': 'lacp'},
+        ],
+        'network.lagginterfacemembers': [{'lagg_interfacegroup': {'id': 1}, 'lagg_physnic': 'em0'}],
+        'network.vlan': [{'vlan_vint': 'vlan5', 'vlan_pint': 'lagg0', 'vlan_tag': 5, 'vlan_pcp': None}],
+        'network.bridge': [],
+    }
+    m = Middleware()
+    m['datastore.query'] = Mock(side_effect=lambda table, *args: tables[table])
+    em0 = Mock(mtu=1500, flags={InterfaceFlags.UP}, addresses=[])
+    netif = Mock(
+        list_interfaces=Mock(return_value={'em0': em0}), InterfaceFlags=InterfaceFlags,
+        AggregationProtocol=AggregationProtocol, NeighborDiscoveryFlags=NeighborDiscoveryFlags,
+        AddressFamily=AddressFamily,
+    )
+
+    with patch('middlewared.plugins.network.netif', netif):
+        with patch('middlewared.plugins.network.dhclient_statuses', Mock(return_value={})):
+            report = await InterfaceService(m).sync(dry_run=True)
+
+    assert [(r['phase'], r['interface'], r['steps']) for r in report] == [
+        ('lagg', 'lagg0', ['create', 'change protocol to LACP', 'add port em0']),
+        ('vlan', 'vlan5', ['create', 'configure parent lagg0 tag 5 pcp None', 'bring lagg0 up']),
+        ('interface', 'lagg0', ['set nd6 flags IFDISABLED', 'set mtu 1500', 'bring up']),
+        ('interface', 'vlan5', ['set nd6 flags IFDISABLED', 'set mtu 1500', 'bring up']),
+    ]
+    assert all(r['time'] is None for r in report)
+    m.call_hook.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test__interfaces_service__sync_wait_dhcp():
+    tables = {
+        'network.interfaces': [],
+        'network.alias': [],
+        'network.lagginterface': [],
+        'network.lagginterfacemembers': [],
+        'network.vlan': [],
+        'network.bridge': [],
+    }
+    m = Middleware()
+    m['datastore.query'] = Mock(side_effect=lambda table, *args: tables[table])
+    netif = Mock(list_interfaces=Mock(return_value={
+        f'em{i}': Mock(mtu=1500, flags={InterfaceFlags.UP}, addresses=[]) for i in range(10)
+    }))
+
+    # dhclient never gets a lease
+    lease = asyncio.Event()
+
+    async def dhclient_start(interface, wait):
+        await lease.wait()
+
+    service = InterfaceService(m)
+    service.dhclient_start = CoroutineMock(side_effect=dhclient_start)
+
+    with patch('middlewared.plugins.network.netif', netif):
+        with patch('middlewared.plugins.network.dhclient_statuses', Mock(return_value={})):
+            with patch('middlewared.plugins.network.DHCP_WAIT_TIMEOUT', 0.1):
+                report = await asyncio.wait_for(service.sync(wait_dhcp=True), 1)
+
+    # All dhclients are started at once and waited for with a single timeout
+    assert sorted(call[0] for call in service.dhclient_start.call_args_list) == [
+        (f'em{i}', True) for i in range(10)
+    ]
+    assert [r['steps'] for r in report] == [['start dhclient']] * 10
+    m.call_hook.assert_called_with('interface.post_sync')
+
+    lease.set()
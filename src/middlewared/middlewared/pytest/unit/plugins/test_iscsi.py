@@ -0,0 +1,153 @@
+import os
+import subprocess
+
+from asynctest import CoroutineMock, Mock, patch
+import pytest
+
+from middlewared.plugins.iscsi import ISCSIGlobalService
+from middlewared.plugins.service import ServiceService
+from middlewared.pytest.unit.middleware import Middleware
+
+
+@pytest.fixture
+def loaded_config(tmpdir):
+    path = str(tmpdir.join("ctld.loaded.conf"))
+    with patch("middlewared.plugins.iscsi.CTLD_LOADED_CONFIG", path):
+        yield path
+
+
+@pytest.fixture
+def ctld(loaded_config):
+    m = Middleware()
+    iscsi = ISCSIGlobalService(m)
+    m["iscsi.global.read_ctl_config"] = Mock(return_value="old")
+    m["iscsi.global.reset_ctld_sync"] = iscsi.reset_ctld_sync
+    m["etc.generate"] = Mock()
+
+    service = ServiceService(m)
+    service._started = CoroutineMock(return_value=(True, []))
+    service._service = CoroutineMock()
+    return m, iscsi, service
+
+
+def ctld_calls(service):
+    return [call[0][1] for call in service._service.call_args_list]
+
+
+def ctladm_run(*outputs):
+    return patch("middlewared.plugins.iscsi.run", CoroutineMock(side_effect=[
+        subprocess.CompletedProcess([], returncode, stdout, "") for returncode, stdout in outputs
+    ]))
+
+
+async def apply_delta(iscsi, operations):
+    with ctladm_run((0, "<ctllunlist/>"), (0, "<ctlportlist/>"), *[(0, "")] * len(operations)) as run, \
+            patch("middlewared.plugins.iscsi.ctladm") as ctladm:
+        ctladm.plan.return_value = operations
+        assert await iscsi.apply_config_delta("old")
+    assert [call[0][0][1:] for call in run.call_args_list[2:]] == operations
+
+
+@pytest.mark.asyncio
+async def test__reload_iscsitarget__delta(ctld):
+    m, iscsi, service = ctld
+    m["iscsi.global.apply_config_delta"] = Mock(return_value=True)
+
+    await service._reload_iscsitarget()
+
+    assert ctld_calls(service) == []
+
+
+@pytest.mark.asyncio
+async def test__reload_iscsitarget__full_reload(ctld, loaded_config):
+    m, iscsi, service = ctld
+    m["iscsi.global.apply_config_delta"] = Mock(return_value=False)
+    m["iscsi.global.sync_ctld"] = Mock(return_value=True)
+    iscsi.write_ctld_loaded_config("old")
+
+    await service._reload_iscsitarget()
+
+    m["iscsi.global.sync_ctld"].assert_called_once_with("old")
+    assert ctld_calls(service) == ["reload"]
+    assert not os.path.exists(loaded_config)
+
+
+@pytest.mark.asyncio
+async def test__reload_iscsitarget__sync_impossible(ctld, loaded_config):
+    m, iscsi, service = ctld
+    m["iscsi.global.apply_config_delta"] = Mock(return_value=False)
+    m["iscsi.global.sync_ctld"] = Mock(return_value=False)
+    iscsi.write_ctld_loaded_config("old")
+
+    await service._reload_iscsitarget()
+
+    # ctld has to read kernel LUNs again
+    assert ctld_calls(service) == ["stop", "restart"]
+    assert not os.path.exists(loaded_config)
+
+
+@pytest.mark.asyncio
+async def test__apply_config_delta__remembers_loaded_config(ctld, loaded_config):
+    m, iscsi, service = ctld
+
+    await apply_delta(iscsi, [["create", "-b", "block", "-l", "1"]])
+    with open(loaded_config) as f:
+        assert f.read() == "old"
+
+    # ctld still has the first configuration loaded
+    m["iscsi.global.read_ctl_config"] = Mock(return_value="new")
+    await apply_delta(iscsi, [["create", "-b", "block", "-l", "2"]])
+    with open(loaded_config) as f:
+        assert f.read() == "old"
+
+
+@pytest.mark.asyncio
+async def test__apply_config_delta__failed(ctld, loaded_config):
+    m, iscsi, service = ctld
+
+    # Some ctladm operations could have been run before one failed
+    with ctladm_run((0, "<ctllunlist/>"), (0, "<ctlportlist/>"), (0, ""), (1, "")), \
+            patch("middlewared.plugins.iscsi.ctladm") as ctladm:
+        ctladm.plan.return_value = [["remove", "-b", "block", "-l", "1"], ["create", "-b", "block", "-l", "1"]]
+        assert not await iscsi.apply_config_delta("old")
+
+    assert os.path.exists(loaded_config)
+
+
+@pytest.mark.asyncio
+async def test__sync_ctld__in_sync(ctld):
+    m, iscsi, service = ctld
+
+    with ctladm_run() as run:
+        assert await iscsi.sync_ctld("old")
+
+    assert run.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test__sync_ctld(ctld):
+    m, iscsi, service = ctld
+    await apply_delta(iscsi, [["create", "-b", "block", "-l", "1"]])
+
+    # Out of sync state survives middleware restart
+    iscsi = ISCSIGlobalService(m)
+    with ctladm_run((0, "<ctllunlist/>"), (0, "<ctlportlist/>"), (0, "")) as run, \
+            patch("middlewared.plugins.iscsi.ctladm") as ctladm:
+        ctladm.parse_config.side_effect = lambda text: text
+        ctladm.plan.return_value = [["remove", "-b", "block", "-l", "1"]]
+        assert await iscsi.sync_ctld("new")
+
+    # Kernel LUNs are brought from the current configuration back to the one ctld has loaded
+    assert ctladm.plan.call_args[0][:2] == ("new", "old")
+    assert run.call_args[0][0] == ["ctladm", "remove", "-b", "block", "-l", "1"]
+
+
+@pytest.mark.asyncio
+async def test__sync_ctld__impossible(ctld):
+    m, iscsi, service = ctld
+    iscsi.write_ctld_loaded_config("old")
+
+    with ctladm_run((0, "<ctllunlist/>"), (0, "<ctlportlist/>")), \
+            patch("middlewared.plugins.iscsi.ctladm") as ctladm:
+        ctladm.plan.return_value = None
+        assert not await iscsi.sync_ctld("new")
@@ -0,0 +1,61 @@
+import json
+import subprocess
+
+from asynctest import Mock, patch
+
+from middlewared.plugins.jail import JailService
+from middlewared.pytest.unit.middleware import Middleware
+
+JLS = json.dumps({'__version': '2', 'jail-information': {'jail': [
+    {'jid': 3, 'name': 'ioc-web'},
+    {'jid': 5, 'name': 'ioc-dhcp'},
+]}}).encode()
+
+
+def jail(uuid, dhcp=0):
+    return {'host_hostuuid': uuid, 'state': 'up', 'dhcp': dhcp, 'interfaces': 'vnet0:bridge0', 'ip4_addr': 'none'}
+
+
+def test__jail_service__live_state_single_jls_call(tmpdir):
+    leases = tmpdir.mkdir('jails').mkdir('dhcp').mkdir('root').mkdir('var').mkdir('db').join('dhclient.leases.epair0b')
+    leases.write('lease {\n  fixed-address 192.168.0.10;\n}\nlease {\n  fixed-address 192.168.0.11;\n}\n')
+
+    run = Mock(return_value=subprocess.CompletedProcess([], 0, stdout=JLS))
+    with patch('middlewared.plugins.jail.su.run', run):
+        with patch('middlewared.plugins.jail.su.check_output') as check_output:
+            jails = JailService(Middleware())._extend_live_state(str(tmpdir), [
+                jail('web'), jail('dhcp', 1), jail('stopped'), jail('stopped_dhcp', 1),
+            ])
+
+    run.assert_called_once()
+    check_output.assert_not_called()
+    assert [(j['host_hostuuid'], j['state'], j['jid'], j['ip4_addr']) for j in jails] == [
+        ('web', 'up', '3', 'none'),
+        ('dhcp', 'up', '5', 'epair0b|192.168.0.11'),
+        ('stopped', 'down', None, 'none'),
+        ('stopped_dhcp', 'down', None, 'DHCP (not running)'),
+    ]
+
+
+def test__jail_service__catalogue_reloaded_when_config_changes(tmpdir):
+    config = tmpdir.mkdir('jails').mkdir('web').join('config.json')
+    config.write('{}')
+
+    cache = {}
+    m = Middleware()
+    m['cache.get'] = Mock(side_effect=lambda key: cache[key])
+    m['cache.put'] = Mock(side_effect=lambda key, value: cache.__setitem__(key, value))
+
+    service = JailService(m)
+    service.iocage_set_up = Mock(return_value=True)
+    service.get_iocroot = Mock(return_value=str(tmpdir))
+    with patch('middlewared.plugins.jail.ioc') as ioc:
+        ioc.IOCage.return_value.get.return_value = [{'web': jail('web')}]
+
+        assert list(service.get_catalogue()['jails']) == ['web']
+        assert list(service.get_catalogue()['jails']) == ['web']
+        assert ioc.IOCage.return_value.get.call_count == 1
+
+        config.setmtime(config.mtime() + 10)
+        service.get_catalogue()
+        assert ioc.IOCage.return_value.get.call_count == 2
@@ -1,43 +1,56 @@
-import textwrap
-
 import pytest
 
-from middlewared.plugins.pool import parse_lsof
-
-
-@pytest.mark.parametrize("lsof,dirs,result", [
-    (
-        textwrap.dedent("""\
-            p535
-            cpython3.7
-            f5
-            n/usr/lib/data
-            p536
-            cpython3.7
-            f5
-            n/dev/zvol/backup/vol1
-            p537
-            cpython3.7
-            f5
-            n/dev/zvol/tank/vols/vol1
-            p2520
-            csmbd
-            f9
-            n/mnt/tank/blob1
-            f31
-            n/mnt/backup/blob2
-            p97778
-            cminio
-            f7
-            n/mnt/tank/data/blob3
-        """),
-        ["/mnt/tank", "/dev/zvol/tank"],
-        [
-            (537, "python3.7"),
-            (2520, "smbd"),
-            (97778, "minio"),
-        ]
-    )
+from asynctest import Mock
+
+from middlewared.plugins.pool import PoolService, query_fields
+from middlewared.pytest.unit.middleware import Middleware
+
+
+@pytest.mark.parametrize("filters,options,fields", [
+    ([], {}, None),
+    ([], {"get": True}, None),
+    ([["name", "=", "tank"]], {"count": True}, {"name"}),
+    ([["OR", [["status", "=", "ONLINE"], ["topology.data", "=", []]]]], {"select": ["name"]}, {
+        "name", "status", "topology",
+    }),
+    ([], {"select": ["name"], "order_by": ["-guid"]}, {"name", "guid"}),
 ])
-def test__parse_lsof(lsof, dirs, result):
-    assert parse_lsof(lsof, dirs) == result
+def test__query_fields(filters, options, fields):
+    assert query_fields(filters, options) == fields
+
+
+def zpool(name):
+    return {
+        "name": name, "status": "ONLINE", "scan": None, "healthy": True, "status_detail": None,
+        "groups": {"data": [{"type": "disk", "path": None}]},
+    }
+
+
+def test__pool_extend__zpools_not_queried_if_not_selected():
+    m = Middleware()
+    m["zfs.pool.query"] = Mock(return_value=[zpool("tank")])
+    service = PoolService(m)
+
+    pool = service.pool_extend({"id": 1, "name": "tank", "encrypt": 0}, service.pool_extend_context({"name"}))
+
+    m["zfs.pool.query"].assert_not_called()
+    assert "topology" not in pool
+
+
+def test__pool_extend__zpool_states_cached_until_invalidated():
+    m = Middleware()
+    m["zfs.pool.query"] = Mock(return_value=[zpool("tank")])
+    service = PoolService(m)
+
+    for i in range(2):
+        pool = service.pool_extend({"id": 1, "name": "tank", "encrypt": 0}, service.pool_extend_context())
+        assert pool["topology"] == {"data": [{"type": "DISK", "path": None}]}
+        assert pool["status"] == "ONLINE"
+        # Callers modifying results must not modify the cache
+        pool["topology"]["data"].clear()
+    assert m["zfs.pool.query"].call_count == 1
+
+    service.invalidate_zpool_states()
+    pool = service.pool_extend({"id": 2, "name": "backup", "encrypt": 0}, service.pool_extend_context())
+    assert m["zfs.pool.query"].call_count == 2
+    assert pool["status"] == "OFFLINE"
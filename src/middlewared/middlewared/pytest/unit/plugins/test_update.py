@@ -1,6 +1,10 @@
+from mock import Mock, patch
 import pytest
 
-from middlewared.plugins.update import CompareTrainsResult, compare_trains
+from middlewared.plugins.update import (
+    CHECK_AVAILABLE_TTL, CompareTrainsResult, UpdateService, compare_trains, pending_validator,
+)
+from middlewared.pytest.unit.middleware import Middleware
 
 
 @pytest.mark.parametrize("t1,t2,result", [
@@ -24,3 +28,88 @@ from middlewared.plugins.update import CompareTrainsResult, compare_trains
 ])
 def test__compare_trains(t1, t2, result):
     assert compare_trains(t1, t2) == result
+
+
+@pytest.fixture
+def update_server():
+    server = Mock()
+    server.manifest = Mock(**{
+        "Sequence.return_value": "FreeNAS-11.3-RELEASE-1", "Notice.return_value": None, "Notes.return_value": {},
+        "Version.return_value": "FreeNAS-11.3-RELEASE",
+    })
+    conf = server.Configuration.Configuration.return_value
+    conf.FindLatestManifest.side_effect = lambda train, require_signature: server.manifest
+    conf.SystemManifest.return_value.Sequence.return_value = "FreeNAS-11.2-U7-1"
+    server.time = 0
+    with patch("middlewared.plugins.update.Configuration", server.Configuration), \
+            patch("middlewared.plugins.update.CheckForUpdates", server.CheckForUpdates), \
+            patch("middlewared.plugins.update.get_changelog", server.get_changelog), \
+            patch("middlewared.plugins.update.monotonic", lambda: server.time):
+        server.CheckForUpdates.side_effect = lambda **kwargs: server.manifest
+        yield server
+
+
+def check_available():
+    m = Middleware()
+    m["cache.get"] = Mock(side_effect=KeyError("update.applied"))
+    return UpdateService(m)
+
+
+def test__check_available__cached(update_server):
+    service = check_available()
+
+    for i in range(2):
+        result = service.check_available({"train": "FreeNAS-11.3-STABLE"})
+        assert result["version"] == "FreeNAS-11.3-RELEASE"
+        # Callers modifying results must not modify the cache
+        result["changes"].append("modified")
+    assert update_server.CheckForUpdates.call_count == 1
+    assert update_server.get_changelog.call_count == 1
+    # Manifest fetched by the update check is not fetched again for the validator
+    assert update_server.Configuration.Configuration().FindLatestManifest.call_count == 0
+
+    update_server.time = CHECK_AVAILABLE_TTL + 1
+    assert service.check_available({"train": "FreeNAS-11.3-STABLE"})["changes"] == []
+    assert update_server.CheckForUpdates.call_count == 1
+    assert update_server.Configuration.Configuration().FindLatestManifest.call_count == 1
+
+    service.check_available({"train": "FreeNAS-11.3-Nightlies"})
+    assert update_server.CheckForUpdates.call_count == 2
+
+
+def test__check_available__revalidated(update_server):
+    service = check_available()
+    service.check_available({"train": "FreeNAS-11.3-STABLE"})
+
+    update_server.manifest.Sequence.return_value = "FreeNAS-11.3-U1-1"
+    update_server.manifest.Version.return_value = "FreeNAS-11.3-U1"
+    assert service.check_available({"train": "FreeNAS-11.3-STABLE"})["version"] == "FreeNAS-11.3-RELEASE"
+
+    update_server.time = CHECK_AVAILABLE_TTL + 1
+    assert service.check_available({"train": "FreeNAS-11.3-STABLE"})["version"] == "FreeNAS-11.3-U1"
+    assert update_server.CheckForUpdates.call_count == 2
+
+
+def test__check_available__unavailable(update_server):
+    update_server.CheckForUpdates.side_effect = lambda **kwargs: None
+    update_server.manifest.Sequence.return_value = "FreeNAS-11.2-U7-1"
+    service = check_available()
+    assert service.check_available({"train": "FreeNAS-11.2-STABLE"}) == {"status": "UNAVAILABLE"}
+
+    update_server.time = CHECK_AVAILABLE_TTL + 1
+    assert service.check_available({"train": "FreeNAS-11.2-STABLE"}) == {"status": "UNAVAILABLE"}
+    assert update_server.CheckForUpdates.call_count == 1
+
+    update_server.manifest.Sequence.return_value = "FreeNAS-11.2-U8-1"
+    update_server.time = 2 * (CHECK_AVAILABLE_TTL + 1)
+    service.check_available({"train": "FreeNAS-11.2-STABLE"})
+    assert update_server.CheckForUpdates.call_count == 2
+
+
+def test__pending_validator(tmpdir):
+    path = str(tmpdir)
+    validator = pending_validator(path)
+    assert pending_validator(path) == validator
+
+    tmpdir.join("MANIFEST").write("manifest")
+    assert pending_validator(path) != validator
@@ -0,0 +1,48 @@
+import pytest
+
+from asynctest import CoroutineMock, Mock, patch
+
+from middlewared.plugins.vm import VMService
+from middlewared.pytest.unit.middleware import Middleware
+
+
+def vm(id, order=0, delay=0):
+    return {'id': id, 'name': f'vm{id}', 'autostart': True, 'autostart_order': order, 'autostart_delay': delay}
+
+
+@pytest.mark.asyncio
+async def test__vm_service__autostart_order():
+    events = []
+
+    async def sleep(delay):
+        events.append(('sleep', delay))
+
+    m = Middleware()
+    m['vm.query'] = Mock(return_value=[vm(1, 10), vm(2, 0, 30), vm(3, 10), vm(4, 0, 5), vm(5, 20)])
+    m['vm.start'] = Mock(side_effect=lambda id: events.append(('start', id)))
+
+    with patch('middlewared.plugins.vm.asyncio.sleep', CoroutineMock(side_effect=sleep)):
+        await VMService(m).autostart()
+
+    assert events == [
+        ('start', 2), ('start', 4), ('sleep', 30), ('start', 1), ('start', 3), ('start', 5),
+    ]
+
+
+@pytest.mark.asyncio
+async def test__vm_service__autostart_failure_does_not_stop_others():
+    m = Middleware()
+    m['vm.query'] = Mock(return_value=[vm(1), vm(2), vm(3)])
+    started = []
+
+    def start(id):
+        if id == 2:
+            raise RuntimeError('Cannot guarantee memory for guest')
+        started.append(id)
+
+    m['vm.start'] = Mock(side_effect=start)
+
+    await VMService(m).autostart([1, 2, 3])
+
+    assert sorted(started) == [1, 3]
+    m['vm.query'].assert_called_once_with([('autostart', '=', True), ('id', 'in', [1, 2, 3])])
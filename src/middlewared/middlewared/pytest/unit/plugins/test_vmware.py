@@ -0,0 +1,249 @@
+import itertools
+from types import SimpleNamespace
+
+from mock import Mock, patch
+import pytest
+
+from middlewared.plugins.vmware import VMWareService
+from middlewared.pytest.unit.middleware import Middleware
+
+SNAPSHOT_NAME = "4bf0fb3e-2a4d-4c4b-8b1f-6d0b1bd4a0ab"
+VMWARE_TASK = {"id": 1, "hostname": "vcenter", "username": "root", "password": "secret", "datastore": "freenas",
+               "filesystem": "tank/vms"}
+
+
+class VirtualPCIPassthrough:
+    pass
+
+
+class Snapshot:
+    def __init__(self, vcenter, vm, name):
+        self.vcenter = vcenter
+        self.vm = vm
+        self.name = name
+        self._moId = f"snapshot-{next(vcenter.ids)}"
+        vcenter.snapshots[self._moId] = self
+
+    def RemoveSnapshot_Task(self, removeChildren):
+        self.vm.snapshots.remove(self)
+        return SimpleNamespace(info=SimpleNamespace(result=None))
+
+
+class VM:
+    def __init__(self, vcenter, name, datastore, power_state="poweredOn", devices=None):
+        self.vcenter = vcenter
+        self.name = name
+        self.datastore = datastore
+        self.power_state = power_state
+        self.devices = devices or []
+        self.snapshots = []
+
+    def properties(self):
+        return {
+            "name": self.name,
+            "config.uuid": f"uuid-{self.name}",
+            "summary.runtime.powerState": self.power_state,
+            "datastore": [self.datastore],
+            "config.hardware.device": self.devices,
+            "snapshot": SimpleNamespace(rootSnapshotList=[
+                SimpleNamespace(name=snapshot.name, snapshot=snapshot, childSnapshotList=[])
+                for snapshot in self.snapshots
+            ]) if self.snapshots else None,
+        }
+
+    def CreateSnapshot_Task(self, name, description, memory, quiesce):
+        snapshot = Snapshot(self.vcenter, self, name)
+        self.snapshots.append(snapshot)
+        return SimpleNamespace(info=SimpleNamespace(result=snapshot))
+
+
+class Session:
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+        self._stub = object()
+        self.content = SimpleNamespace(
+            rootFolder=object(),
+            sessionManager=SimpleNamespace(currentSession=object()),
+            viewManager=SimpleNamespace(CreateContainerView=self.create_container_view),
+            propertyCollector=SimpleNamespace(
+                RetrievePropertiesEx=self.retrieve_properties,
+                ContinueRetrievePropertiesEx=self.continue_retrieve_properties,
+            ),
+        )
+        self.pages = {}
+
+    def RetrieveContent(self):
+        return self.content
+
+    def create_container_view(self, container, types, recursive):
+        return SimpleNamespace(types=types, Destroy=lambda: None)
+
+    def retrieve_properties(self, specs, options):
+        self.vcenter.retrieves += 1
+        spec = specs[0].propSet[0]
+        objects = {"Datastore": self.vcenter.datastores, "VirtualMachine": self.vcenter.vms}[spec.type]
+        objects = [
+            SimpleNamespace(obj=obj, propSet=[
+                SimpleNamespace(name=name, val=value)
+                for name, value in properties.items() if name in spec.pathSet and value is not None
+            ])
+            for obj, properties in objects.items()
+        ]
+        # One object per page to exercise paging
+        return self.page(objects)
+
+    def continue_retrieve_properties(self, token):
+        return self.page(self.pages.pop(token))
+
+    def page(self, objects):
+        token = None
+        if len(objects) > 1:
+            token = f"token-{next(self.vcenter.ids)}"
+            self.pages[token] = objects[1:]
+        return SimpleNamespace(objects=objects[:1], token=token)
+
+
+class VCenter:
+    """
+    Fake pyVmomi `connect`, `vim`, `vmodl` and `pyVim.task` talking to an in-memory vCenter.
+    """
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.logins = []
+        self.logouts = []
+        self.retrieves = 0
+        self.snapshots = {}
+        self.datastores = {"datastore-1": {"name": "freenas"}, "datastore-2": {"name": "local"}}
+        self.vm_objects = []
+
+        self.connect = SimpleNamespace(SmartConnect=self.smart_connect, Disconnect=self.logouts.append)
+        self.task = SimpleNamespace(WaitForTask=lambda task: task.info.result)
+        self.vim = SimpleNamespace(
+            Datastore="Datastore",
+            VirtualMachine="VirtualMachine",
+            VirtualPCIPassthrough=VirtualPCIPassthrough,
+            view=SimpleNamespace(ContainerView="ContainerView"),
+            vm=SimpleNamespace(Snapshot=lambda moid, stub: self.snapshots[moid]),
+        )
+        self.vmodl = SimpleNamespace(query=SimpleNamespace(PropertyCollector=SimpleNamespace(
+            FilterSpec=SimpleNamespace, ObjectSpec=SimpleNamespace, TraversalSpec=SimpleNamespace,
+            PropertySpec=SimpleNamespace, RetrieveOptions=SimpleNamespace,
+        )))
+
+    @property
+    def vms(self):
+        return {vm: vm.properties() for vm in self.vm_objects}
+
+    def add_vm(self, *args, **kwargs):
+        vm = VM(self, *args, **kwargs)
+        self.vm_objects.append(vm)
+        return vm
+
+    def smart_connect(self, host, user, pwd, sslContext):
+        session = Session(self)
+        self.logins.append((host, user, pwd, session))
+        return session
+
+
+@pytest.fixture
+def vcenter():
+    vcenter = VCenter()
+    with patch("middlewared.plugins.vmware.connect", vcenter.connect), \
+            patch("middlewared.plugins.vmware.VimTask", vcenter.task), \
+            patch("middlewared.plugins.vmware.vim", vcenter.vim), \
+            patch("middlewared.plugins.vmware.vmodl", vcenter.vmodl), \
+            patch("middlewared.plugins.vmware.uuid.uuid4", Mock(return_value=SNAPSHOT_NAME)):
+        yield vcenter
+
+
+@pytest.fixture
+def service():
+    m = Middleware()
+    m["vmware.query"] = Mock(return_value=[dict(VMWARE_TASK)])
+    m["alert.oneshot_create"] = Mock()
+    m["alert.oneshot_delete"] = Mock()
+    m["datastore.update"] = Mock()
+    m["datastore.delete"] = Mock()
+    return VMWareService(m)
+
+
+def test__snapshot_begin_end(vcenter, service):
+    vm = vcenter.add_vm("vm", "datastore-1")
+    vcenter.add_vm("off", "datastore-1", power_state="poweredOff")
+    vcenter.add_vm("local", "datastore-2")
+    passthrough = vcenter.add_vm("passthrough", "datastore-1", devices=[VirtualPCIPassthrough()])
+
+    context = service.snapshot_begin("tank/vms", False)
+
+    assert [snapshot.name for snapshot in vm.snapshots] == [SNAPSHOT_NAME]
+    assert passthrough.snapshots == []
+    elem = context["vmsnapobjs"][0]
+    assert elem["snapvms"] == ["uuid-vm", "uuid-passthrough"]
+    assert elem["snapvmskips"] == ["uuid-passthrough"]
+    assert elem["snapshots"] == {"uuid-vm": {"vm": "vm", "snapshot": vm.snapshots[0]._moId}}
+    assert context["vmsynced"]
+    # Datastores and VMs are retrieved with a single call each
+    assert vcenter.retrieves == 2
+
+    service.snapshot_end(context)
+
+    assert vm.snapshots == []
+    assert len(vcenter.logins) == 1
+    assert vcenter.logouts == []
+    assert set(context["timings"]["vcenter"]) == {"login", "retrieve", "snapshot", "remove"}
+
+
+def test__snapshot_begin__snapshot_exists(vcenter, service):
+    vm = vcenter.add_vm("vm", "datastore-1")
+    vm.CreateSnapshot_Task(SNAPSHOT_NAME, "", False, True)
+
+    context = service.snapshot_begin("tank/vms", False)
+
+    assert len(vm.snapshots) == 1
+    assert context["vmsnapobjs"][0]["snapshots"] == {"uuid-vm": {"vm": "vm", "snapshot": vm.snapshots[0]._moId}}
+
+    service.snapshot_end(context)
+
+    assert vm.snapshots == []
+
+
+def test__snapshot_end__session_expired(vcenter, service):
+    vm = vcenter.add_vm("vm", "datastore-1")
+    context = service.snapshot_begin("tank/vms", False)
+    expired = vcenter.logins[0][3]
+    expired.content.sessionManager.currentSession = None
+
+    service.snapshot_end(context)
+
+    assert vm.snapshots == []
+    assert len(vcenter.logins) == 2
+    assert vcenter.logouts == [expired]
+
+
+def test__get_session__reused(vcenter, service):
+    first = service._get_session(VMWARE_TASK)
+
+    assert service._get_session(dict(VMWARE_TASK)) == first
+    assert len(vcenter.logins) == 1
+    assert "secret" not in repr(service._sessions)
+
+
+def test__get_session__credentials_changed(vcenter, service):
+    service._get_session(VMWARE_TASK)
+
+    service._get_session(dict(VMWARE_TASK, password="changed"))
+
+    assert [login[2] for login in vcenter.logins] == ["secret", "changed"]
+    assert vcenter.logouts == [vcenter.logins[0][3]]
+
+
+@pytest.mark.asyncio
+async def test__delete__closes_session(vcenter, service):
+    service._get_session(VMWARE_TASK)
+
+    await service.do_delete(1)
+
+    assert vcenter.logouts == [vcenter.logins[0][3]]
+    assert service._sessions == {}
+    assert dict(service._session_locks) == {}
@@ -577,3 +577,40 @@ def test__schema_str_job_default():
     jobm = Mock()
 
     assert strdef(self, jobm, 'foo') == 'BAR'
+
+
+def test__schema_does_not_alter_args():
+
+    @accepts(Dict(
+        'data',
+        Str('foo'),
+        List('list', items=[Dict('item', Int('id'), Bool('flag', default=False))]),
+        Dict('extra', additional_attrs=True),
+        Str('bar', default='BAR'),
+    ))
+    def dictargs(self, data):
+        data['list'][0]['id'] = 2
+        data['extra']['nested'].append('b')
+        return data
+
+    self = Mock()
+
+    value = {'foo': 'foo', 'list': [{'id': 1}], 'extra': {'nested': ['a']}}
+    assert dictargs(self, value) == {
+        'foo': 'foo', 'list': [{'id': 2, 'flag': False}], 'extra': {'nested': ['a', 'b']}, 'bar': 'BAR',
+    }
+    assert value == {'foo': 'foo', 'list': [{'id': 1}], 'extra': {'nested': ['a']}}
+
+
+def test__schema_kwargs_not_altered():
+
+    @accepts(Str('foo'), List('bar'))
+    def listkwarg(self, foo, bar):
+        bar.append('b')
+        return bar
+
+    self = Mock()
+
+    bar = ['a']
+    assert listkwarg(self, 'foo', bar=bar) == ['a', 'b']
+    assert bar == ['a']
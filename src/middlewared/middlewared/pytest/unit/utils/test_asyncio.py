@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from middlewared.utils.asyncio_ import DebouncedCall
+
+
+@pytest.mark.asyncio
+async def test__debounced_call__shared_by_callers():
+    calls = []
+
+    async def func():
+        calls.append(None)
+        return len(calls)
+
+    call = DebouncedCall(func, 0.01)
+
+    assert await asyncio.gather(call(), call(), call()) == [1, 1, 1]
+    assert await call() == 2
+
+
+@pytest.mark.asyncio
+async def test__debounced_call__callers_during_call_wait_for_next_one():
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = []
+
+    async def func():
+        calls.append(None)
+        started.set()
+        await release.wait()
+        return len(calls)
+
+    call = DebouncedCall(func, 0)
+
+    first = asyncio.ensure_future(call())
+    await started.wait()
+    second = asyncio.ensure_future(call())
+    third = asyncio.ensure_future(call())
+    release.set()
+
+    assert await first == 1
+    assert await second == 2
+    assert await third == 2
+
+
+@pytest.mark.asyncio
+async def test__debounced_call__exception():
+    async def func():
+        raise ValueError()
+
+    call = DebouncedCall(func, 0)
+
+    with pytest.raises(ValueError):
+        await call()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import threading
+
+from mock import patch
+
+from middlewared.utils.io import copy_pipe_to_file, write_if_changed
+
+
+def test__copy_pipe_to_file():
+    data = os.urandom(3 * 1048576 + 17)
+    r, w = os.pipe()
+    with os.fdopen(r, 'rb') as src:
+        def write():
+            with os.fdopen(w, 'wb') as dst:
+                dst.write(data)
+
+        t = threading.Thread(target=write, daemon=True)
+        t.start()
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'header')
+            assert copy_pipe_to_file(src, f) == len(data)
+            t.join()
+
+            f.seek(0)
+            assert f.read() == b'header' + data
+
+
+def test__write_if_changed(tmpdir):
+    path = str(tmpdir / 'file')
+
+    with patch('middlewared.utils.io.os.fsync') as fsync:
+        assert write_if_changed(path, 'data') is True
+        assert write_if_changed(path, b'data') is False
+        assert write_if_changed(path, 'da') is True
+
+    assert fsync.call_count == 2
+    with open(path) as f:
+        assert f.read() == 'da'
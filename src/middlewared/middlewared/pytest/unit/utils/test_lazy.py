@@ -0,0 +1,16 @@
+import json
+
+from mock import Mock
+
+from middlewared.utils.lazy import lazy_import
+
+
+def test__lazy_import__on_load():
+    on_load = Mock()
+
+    module = lazy_import('json', on_load)
+    on_load.assert_not_called()
+
+    assert module.dumps([]) == '[]'
+    assert module.loads('{}') == {}
+    on_load.assert_called_once_with(json)
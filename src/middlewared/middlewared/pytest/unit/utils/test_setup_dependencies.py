@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import pytest
+
+from middlewared.utils import setup_dependencies
+
+
+def plugin(depends=None):
+    if depends is None:
+        return SimpleNamespace()
+    return SimpleNamespace(SETUP_DEPENDS=depends)
+
+
+def test__setup_dependencies_default():
+    assert setup_dependencies({
+        'alert': plugin(),
+        'pool': plugin(),
+        'system': plugin(),
+    }) == {
+        'alert': {'system'},
+        'pool': {'system', 'alert'},
+        'system': set(),
+    }
+
+
+def test__setup_dependencies_explicit():
+    assert setup_dependencies({
+        'alert': plugin(),
+        'mdns': plugin(),
+        'network': plugin(['system', 'mdns']),
+        'system': plugin(),
+    })['network'] == {'system', 'mdns'}
+
+
+def test__setup_dependencies_ignores_plugins_without_setup():
+    assert setup_dependencies({
+        'pool': plugin(['zfs']),
+    }) == {'pool': set()}
+
+
+def test__setup_dependencies_circular():
+    with pytest.raises(ValueError) as e:
+        setup_dependencies({
+            'a': plugin(['b']),
+            'b': plugin(['c']),
+            'c': plugin(['a']),
+        })
+
+    assert 'a -> b -> c -> a' in str(e.value)
@@ -1,8 +1,9 @@
-import boto3
-from botocore.client import Config
-
 from middlewared.rclone.base import BaseRcloneRemote
 from middlewared.schema import Bool, Str
+from middlewared.utils.lazy import lazy_import
+
+boto3 = lazy_import("boto3")
+botocore_client = lazy_import("botocore.client")
 
 
 class S3RcloneRemote(BaseRcloneRemote):
@@ -35,7 +36,7 @@ class S3RcloneRemote(BaseRcloneRemote):
         config = None
 
         if credentials["attributes"].get("signatures_v2", False):
-            config = Config(signature_version="s3")
+            config = botocore_client.Config(signature_version="s3")
 
         client = boto3.client(
             "s3",
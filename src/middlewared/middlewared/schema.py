@@ -132,6 +132,13 @@ class Attribute(object):
 
 class Any(Attribute):
 
+    def clean(self, value):
+        value = super().clean(value)
+        if isinstance(value, (dict, list)):
+            # Arbitrary structure, the only attribute we can't clean into a new object while walking it
+            return copy.deepcopy(value)
+        return value
+
     def to_json_schema(self, parent=None):
         schema = {
             'anyOf': [
@@ -454,18 +461,22 @@ class List(EnumMixin, Attribute):
             raise Error(self.name, 'Not a list')
         if not self.empty and not value:
             raise Error(self.name, 'Empty value not allowed')
-        if self.items:
-            for index, v in enumerate(value):
-                for i in self.items:
-                    try:
-                        value[index] = i.clean(v)
-                        found = True
-                    except Error as e:
-                        found = e
-                        break
-                if self.items and found is not True:
-                    raise Error(self.name, 'Item#{0} is not valid per list types: {1}'.format(index, found))
-        return value
+        if not self.items:
+            return copy.deepcopy(value)
+        # Items are cleaned into a new list so the caller's value is never altered
+        cleaned = []
+        for index, v in enumerate(value):
+            for i in self.items:
+                try:
+                    item = i.clean(v)
+                    found = True
+                except Error as e:
+                    found = e
+                    break
+            if found is not True:
+                raise Error(self.name, 'Item#{0} is not valid per list types: {1}'.format(index, found))
+            cleaned.append(item)
+        return cleaned
 
     def dump(self, value):
         if self.private or (self.items and any(item.private for item in self.items)):
@@ -582,26 +593,26 @@ class Dict(Attribute):
         if not isinstance(data, dict):
             raise Error(self.name, 'A dict was expected')
 
-        for key, value in list(data.items()):
-            if not self.additional_attrs:
-                if key not in self.attrs:
-                    raise Error(key, 'Field was not expected')
-
+        # Cleaned values are put into a new dict so the caller's data is never altered
+        cleaned = {}
+        for key, value in data.items():
             attr = self.attrs.get(key)
-            if not attr:
-                continue
-
-            data[key] = attr.clean(value)
+            if attr:
+                cleaned[key] = attr.clean(value)
+            elif self.additional_attrs:
+                cleaned[key] = copy.deepcopy(value)
+            else:
+                raise Error(key, 'Field was not expected')
 
         # Do not make any field and required and not populate default values
         if not self.update:
-            for attr in list(self.attrs.values()):
-                if attr.name not in data and (
+            for attr in self.attrs.values():
+                if attr.name not in cleaned and (
                     attr.required or attr.has_default
                 ):
-                    data[attr.name] = attr.clean(NOT_PROVIDED)
+                    cleaned[attr.name] = attr.clean(NOT_PROVIDED)
 
-        return data
+        return cleaned
 
     def dump(self, value):
         if self.private:
@@ -891,10 +902,13 @@ def accepts(*schema):
             args_index += f._skip_arg
         assert len(schema) == f.__code__.co_argcount - args_index  # -1 for self
 
+        # Argument names which can be passed as keywords, in the order of the schema
+        kwarg_names = f.__code__.co_varnames[args_index:f.__code__.co_argcount]
+
         def clean_and_validate_args(args, kwargs):
+            # `clean` builds new containers while walking the value so arguments are not deep-copied here:
+            # cleaned values never share mutable state with what the caller passed.
             args = list(args)
-            args = args[:args_index] + copy.deepcopy(args[args_index:])
-            kwargs = copy.deepcopy(kwargs)
 
             verrors = ValidationErrors()
 
@@ -914,9 +928,8 @@ def accepts(*schema):
                 i += 1
 
             # Use i counter to map keyword argument to rpc positional
-            for x in list(range(i + args_index, f.__code__.co_argcount)):
-                kwarg = f.__code__.co_varnames[x]
-
+            kwargs = dict(kwargs)
+            for kwarg in kwarg_names[i:]:
                 if kwarg in kwargs:
                     attr = nf.accepts[i]
                     i += 1
@@ -594,6 +594,20 @@ class CoreService(Service):
             }
         return events
 
+    @accepts()
+    def startup_profile(self):
+        """
+        Returns how long middlewared took to load its plugins on startup.
+
+        `import`, `resolve`, `setup` and `total` are the time in seconds spent importing plugin
+        modules, resolving methods schemas, running plugins `setup` functions and in the whole process.
+
+        `plugins` contains, for every plugin, its `import` time, its `setup` time (null if plugin
+        has no setup function), when its setup started relative to the beginning of the setup phase
+        (`setup_start`) and which plugins setups it had to wait for (`setup_depends`).
+        """
+        return self.middleware.get_startup_profile()
+
     @private
     async def call_hook(self, name, args, kwargs=None):
         kwargs = kwargs or {}
@@ -623,7 +637,7 @@ class CoreService(Service):
 
         Returns the job id and the URL for download.
         """
-        job = await self.middleware.call(method, *args, pipes=Pipes(output=self.middleware.pipe()))
+        job = await self.middleware.call(method, *args, pipes=Pipes(output=self.middleware.pipe(sendfile=True)))
         token = await self.middleware.call('auth.generate_token', 300, {'filename': filename, 'job': job.id})
         self.middleware.fileapp.register_job(job.id)
         return job.id, f'/_download/{job.id}?auth_token={token}'
@@ -475,6 +475,58 @@ def load_classes(module, base, blacklist):
     return classes
 
 
+# Plugins whose `setup` runs before every other plugin `setup` unless the plugin sets
+# `SETUP_DEPENDS` itself:
+#   - system: when system boots the right timezone is not configured yet. See #72131
+#   - alert: other plugins can issue one-shot alerts during their initialization
+SETUP_DEPENDS_DEFAULT = ['system', 'alert']
+
+
+def setup_dependencies(modules):
+    """
+    Build the setup dependency graph for plugin modules that have a `setup` function.
+
+    `modules` maps plugin name to the plugin module. A module can list the plugins
+    whose `setup` must be finished before its own one starts in `SETUP_DEPENDS`.
+    Dependencies on plugins without a `setup` function are ignored.
+
+    Returns a dict mapping plugin name to the set of plugins it has to wait for.
+    Raises ValueError if the dependencies are circular.
+    """
+    graph = {}
+    for name, mod in modules.items():
+        depends = getattr(mod, 'SETUP_DEPENDS', None)
+        if depends is None:
+            depends = SETUP_DEPENDS_DEFAULT[:SETUP_DEPENDS_DEFAULT.index(name)] \
+                if name in SETUP_DEPENDS_DEFAULT else SETUP_DEPENDS_DEFAULT
+        graph[name] = {i for i in depends if i in modules and i != name}
+
+    visited = set()
+    for name in graph:
+        path = []
+        stack = [(name, iter(graph[name]))]
+        on_path = {name}
+        path.append(name)
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child in on_path:
+                    cycle = path[path.index(child):] + [child]
+                    raise ValueError(f'Circular plugin setup dependency: {" -> ".join(cycle)}')
+                if child not in visited:
+                    stack.append((child, iter(graph[child])))
+                    on_path.add(child)
+                    path.append(child)
+                    break
+            else:
+                stack.pop()
+                on_path.discard(node)
+                path.pop()
+                visited.add(node)
+
+    return graph
+
+
 class LoadPluginsMixin(object):
 
     def __init__(self, overlay_dirs):
@@ -14,3 +14,37 @@ async def asyncio_map(func, arguments, limit=None):
 
     futures = [func(arg) for arg in arguments]
     return await asyncio.gather(*futures)
+
+
+class DebouncedCall:
+    """
+    Runs coroutine function `func` on behalf of many callers.
+
+    Callers arriving within `delay` seconds from each other, or while the previous call is still running, share a
+    single call of `func` that starts after they arrived. Each of them waits for it and gets its result.
+    """
+
+    def __init__(self, func, delay):
+        self.func = func
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.pending = None
+
+    async def __call__(self):
+        if self.pending is None:
+            self.pending = asyncio.get_event_loop().create_future()
+            asyncio.ensure_future(self._run(self.pending))
+
+        return await asyncio.shield(self.pending)
+
+    async def _run(self, future):
+        await asyncio.sleep(self.delay)
+        async with self.lock:
+            # Callers arriving from now on need another call
+            self.pending = None
+            try:
+                result = await self.func()
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -1,3 +1,4 @@
+import errno
 import os
 
 
@@ -16,6 +17,43 @@ def write_if_changed(path, data):
             f.seek(0)
             f.write(data)
             f.truncate()
-        os.fsync(f)
+            # Nothing to flush to disk if the file did not change
+            os.fsync(f)
 
     return changed
+
+
+def copy_pipe_to_file(src, dst, chunk_size=1048576):
+    """
+    Copy everything readable from pipe `src` to regular file `dst`.
+
+    Uses `splice(2)` where available so data does not get copied through userspace,
+    otherwise reads into a single preallocated buffer. Returns number of bytes copied.
+    """
+    dst.flush()
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    copied = 0
+
+    if hasattr(os, 'splice'):
+        try:
+            while True:
+                n = os.splice(src_fd, dst_fd, chunk_size)
+                if n == 0:
+                    return copied
+                copied += n
+        except OSError as e:
+            # e.g. `dst` opened with O_APPEND
+            if e.errno != errno.EINVAL or copied:
+                raise
+
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while True:
+        n = os.readv(src_fd, [buf])
+        if n == 0:
+            return copied
+        written = 0
+        while written < n:
+            written += os.write(dst_fd, view[written:n])
+        copied += n
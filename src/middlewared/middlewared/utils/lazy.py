@@ -0,0 +1,56 @@
+import importlib
+import threading
+import types
+
+__all__ = ["lazy_import"]
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module placeholder that only imports the real module on first attribute access.
+
+    Used by plugins to defer importing heavy libraries (libzfs, iocage, boto3, ...)
+    until a method that actually needs them is called, so middlewared startup does
+    not pay for every library of every plugin.
+    """
+
+    def __init__(self, name, on_load=None):
+        super().__init__(name)
+        self.__dict__['_lazy_lock'] = threading.Lock()
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_on_load'] = on_load
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            with self.__dict__['_lazy_lock']:
+                module = self.__dict__['_lazy_module']
+                if module is None:
+                    module = importlib.import_module(self.__name__)
+                    if self.__dict__['_lazy_on_load'] is not None:
+                        self.__dict__['_lazy_on_load'](module)
+                    self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return f'<lazy module {self.__name__!r}>'
+        return repr(self.__dict__['_lazy_module'])
+
+
+def lazy_import(name, on_load=None):
+    """
+    Returns a module object for `name` which is imported on first use.
+
+    `on_load(module)` is called once the module is imported, before it is used (e.g. to configure the library).
+    """
+    return LazyModule(name, on_load)
@@ -0,0 +1,109 @@
+"""
+Measures creating many local accounts one by one (`user.create`) versus at once (`user.create_bulk`).
+
+Does not need middlewared to be running, e.g.
+
+    python3 account_files_benchmark.py --users 1000,10000,50000 --pwd-mkdb true
+
+For every number of users we generate synthetic users and groups and time:
+
+* uid allocation: walking all users for every created user (what `get_next_uid` did) versus a single
+  `next_free_ids` call for all of them
+* account files regeneration: rendering `master.passwd` and `group` templates from `etc_files` and running
+  `--pwd-mkdb` (stubbed by default, pass `pwd_mkdb -d <dir> -p` to run the real thing). Creating users one by
+  one regenerates them after every user, that is estimated from a single regeneration at full size.
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from mako.lookup import TemplateLookup
+
+from middlewared.plugins.account import next_free_ids
+
+ETC_FILES = os.path.join(os.path.dirname(__file__), "..", "middlewared", "etc_files")
+
+
+class FakeMiddleware:
+    def __init__(self, users, groups):
+        self.users = users
+        self.groups = groups
+
+    def call_sync(self, method, *args):
+        if method == "user.query":
+            return self.users
+        if method == "group.query":
+            return self.groups
+        if method == "notifier.common":
+            return False
+        raise ValueError(method)
+
+
+def generate(count):
+    groups = [
+        {"id": i, "group": f"user{i}", "gid": 1000 + i, "builtin": False, "users": [i]}
+        for i in range(count)
+    ]
+    users = [
+        {
+            "id": i, "username": f"user{i}", "uid": 1000 + i, "group": {"id": i, "bsdgrp_gid": 1000 + i},
+            "password_disabled": False, "locked": False, "unixhash": "$6$salt$hash", "full_name": f"User {i}",
+            "home": "/nonexistent", "shell": "/bin/csh", "builtin": False,
+        }
+        for i in range(count)
+    ]
+    return users, groups
+
+
+def allocate_walk(uids):
+    last_uid = 999
+    for uid in sorted(uids):
+        if uid - last_uid > 1:
+            return last_uid + 1
+        last_uid = uid
+    return last_uid + 1
+
+
+def regenerate(lookup, middleware, directory, pwd_mkdb):
+    for name in ("master.passwd", "group"):
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(lookup.get_template(name).render(middleware=middleware))
+
+    subprocess.run(pwd_mkdb.split() + [os.path.join(directory, "master.passwd")], check=True)
+
+
+def main(args):
+    lookup = TemplateLookup(directories=[ETC_FILES])
+    with tempfile.TemporaryDirectory() as directory:
+        for count in map(int, args.users.split(",")):
+            users, groups = generate(count)
+
+            sample = min(count, args.sample)
+            uids = []
+            start = time.monotonic()
+            for _ in range(sample):
+                uids.append(allocate_walk(uids + list(range(1000 + sample, 1000 + count))))
+            walk = (time.monotonic() - start) / sample * count
+
+            start = time.monotonic()
+            next_free_ids(set(), count)
+            gap_index = time.monotonic() - start
+
+            start = time.monotonic()
+            regenerate(lookup, FakeMiddleware(users, groups), directory, args.pwd_mkdb)
+            single = time.monotonic() - start
+
+            print(f"{count} users:")
+            print(f"  uid allocation:   {walk:.3f}s estimated walking all users, {gap_index:.3f}s gap index")
+            print(f"  account files:    {single * count / 2:.3f}s estimated one by one, {single:.3f}s at once")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1000,10000,50000", help="Comma separated numbers of users")
+    parser.add_argument("--pwd-mkdb", default="true", help="Command to run on generated master.passwd")
+    parser.add_argument("--sample", type=int, default=100, help="Number of users to time walking uid allocation for")
+    main(parser.parse_args())
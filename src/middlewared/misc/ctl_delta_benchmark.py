@@ -0,0 +1,191 @@
+"""
+Measures incremental iSCSI configuration apply (`iscsi.global.apply_config_delta`) against a fake `ctladm`.
+
+Does not need middlewared or CTL to be running, e.g.
+
+    python3 ctl_delta_benchmark.py --extents 5000
+
+A ctl.conf with `--extents` LUNs mapped to `--targets` targets is generated and loaded into a fake
+`ctladm` which keeps the kernel state in a JSON file. Then a LUN is added, resized and removed and for
+each change we measure how long it takes to compute and run the `ctladm` operations, compared to the
+number of LUNs ctld would have to go through on a full reload.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from middlewared.common.ctl import ctladm
+
+FAKE_CTLADM = r'''#!/usr/bin/env python3
+import json
+import sys
+
+state_path = __file__ + '.json'
+with open(state_path) as f:
+    state = json.load(f)
+luns, ports = state['luns'], state['ports']
+
+args = sys.argv[1:]
+command, args = args[0], args[1:]
+opts = {}
+options = {}
+while len(args) > 1:
+    opt, value = args[0], args[1]
+    args = args[2:]
+    if opt == '-o':
+        k, v = value.split('=', 1)
+        options[k] = v
+    else:
+        opts[opt] = value
+
+if command == 'devlist':
+    print('<ctllunlist>')
+    for id, lun in luns.items():
+        print(f'<lun id="{id}">')
+        print(f'\t<backend_type>block</backend_type>')
+        print(f'\t<size>{lun["size"] // lun["blocksize"]}</size>')
+        print(f'\t<blocksize>{lun["blocksize"]}</blocksize>')
+        print(f'\t<serial_number>{lun["serial"]}</serial_number>')
+        print(f'\t<device_id>{lun["device_id"]}</device_id>')
+        for k, v in lun['options'].items():
+            print(f'\t<{k}>{v}</{k}>')
+        print('</lun>')
+    print('</ctllunlist>')
+    sys.exit(0)
+elif command == 'portlist':
+    print('<ctlportlist>')
+    for id, port in ports.items():
+        print(f'<targ_port id="{id}">\n\t<frontend_type>iscsi</frontend_type>\n\t<target>{port["target"]}</target>')
+        for number, ctl_lun in port['luns'].items():
+            print(f'\t<lun id="{number}">{ctl_lun}</lun>')
+        print('</targ_port>')
+    print('</ctlportlist>')
+    sys.exit(0)
+elif command == 'create':
+    if opts['-l'] in luns:
+        sys.exit('LUN already exists')
+    luns[opts['-l']] = {
+        'size': int(opts.get('-s', 1048576)), 'blocksize': int(opts['-B']), 'serial': opts['-S'],
+        'device_id': opts['-d'], 'options': options,
+    }
+elif command == 'remove':
+    luns.pop(opts['-l'])
+elif command == 'modify':
+    lun = luns[opts['-l']]
+    if '-s' in opts:
+        lun['size'] = int(opts['-s'])
+    lun['options'].update(options)
+elif command == 'lunmap':
+    if '-L' in opts:
+        ports[opts['-p']]['luns'][opts['-l']] = int(opts['-L'])
+    else:
+        ports[opts['-p']]['luns'].pop(opts['-l'], None)
+
+with open(state_path, 'w') as f:
+    json.dump(state, f)
+'''
+
+
+def generate_config(extents, targets, size=None):
+    lines = ['portal-group "default" {\n}\n\n', 'portal-group "pg1" {\n\ttag "0x0001"\n\tlisten "0.0.0.0:3260"\n}\n\n']
+    for i in range(extents):
+        serial = f'{i:015d}'
+        lines.append(
+            f'lun "extent{i}" {{\n\tctl-lun "{i}"\n\tpath "/dev/zvol/tank/vol{i}"\n\tblocksize "512"\n'
+            f'\tserial "{serial}"\n\tdevice-id "iSCSI Disk      {serial.ljust(31)}"\n'
+        )
+        if size and i in size:
+            lines.append(f'\t\tsize "{size[i]}"\n')
+        lines.append(
+            '\toption "vendor" "FreeNAS"\n\toption "product" "iSCSI Disk"\n\toption "revision" "0123"\n'
+            f'\toption "naa" "0x6589cfc000000{i:019x}"\n\toption "rpm" "1"\n}}\n\n'
+        )
+    for t in range(targets):
+        lines.append(f'target "iqn.2005-10.org.freenas.ctl:target{t}" {{\n\tportal-group "pg1" "no-authentication"\n\n')
+        for number, i in enumerate(range(t, extents, targets)):
+            lines.append(f'\tlun "{number}" "extent{i}"\n')
+        lines.append('}\n\n')
+    return ''.join(lines)
+
+
+def load_state(path, config):
+    conf = ctladm.parse_config(config)
+    luns = {
+        str(lun['ctl_lun']): {
+            'size': lun['size'] or 1048576, 'blocksize': lun['blocksize'], 'serial': lun['serial'],
+            'device_id': lun['device_id'], 'options': dict(lun['options'], file=lun['path'], ctld_name=name),
+        }
+        for name, lun in conf.luns.items()
+    }
+    ports = {
+        str(i + 1): {'target': target, 'luns': {str(k): conf.luns[v]['ctl_lun'] for k, v in mapping.items()}}
+        for i, (target, mapping) in enumerate(conf.targets.items())
+    }
+    with open(path, 'w') as f:
+        json.dump({'luns': luns, 'ports': ports}, f)
+
+
+def apply(fake_ctladm, old, new):
+    def run(*args):
+        return subprocess.run([sys.executable, fake_ctladm] + list(args), stdout=subprocess.PIPE, check=True).stdout
+
+    start = time.monotonic()
+    devlist = run('devlist', '-x')
+    portlist = run('portlist', '-x')
+    query = time.monotonic() - start
+
+    start = time.monotonic()
+    operations = ctladm.plan(
+        ctladm.parse_config(old), ctladm.parse_config(new),
+        ctladm.parse_devlist(devlist), ctladm.parse_portlist(portlist),
+    )
+    planning = time.monotonic() - start
+
+    start = time.monotonic()
+    for args in operations:
+        run(*args)
+    applying = time.monotonic() - start
+
+    return operations, query, planning, applying
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fake_ctladm = os.path.join(tmpdir, 'ctladm')
+        with open(fake_ctladm, 'w') as f:
+            f.write(FAKE_CTLADM)
+
+        start = time.monotonic()
+        base = generate_config(args.extents, args.targets)
+        print(f'Generated ctl.conf with {args.extents} LUNs in {time.monotonic() - start:.3f}s')
+        load_state(fake_ctladm + '.json', base)
+
+        changes = [
+            ('add LUN', generate_config(args.extents + 1, args.targets)),
+            ('resize LUN', generate_config(args.extents + 1, args.targets, {args.extents: 2 * 1048576})),
+            ('remove LUN', generate_config(args.extents, args.targets)),
+        ]
+        old = base
+        print(f'{"change":<12} {"ops":>5} {"ctladm -x (s)":>14} {"plan (s)":>9} {"apply (s)":>10} {"reload LUNs":>12}')
+        for name, new in changes:
+            operations, query, planning, applying = apply(fake_ctladm, old, new)
+            print(
+                f'{name:<12} {len(operations):5d} {query:14.3f} {planning:9.3f} {applying:10.3f} '
+                f'{len(ctladm.parse_config(new).luns):12d}'
+            )
+            old = new
+
+        operations, *_ = apply(fake_ctladm, old, old)
+        assert operations == [], operations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extents', type=int, default=5000)
+    parser.add_argument('--targets', type=int, default=50)
+    main(parser.parse_args())
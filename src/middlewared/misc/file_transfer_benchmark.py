@@ -0,0 +1,105 @@
+"""
+Measures /_download and /_upload throughput over the Unix socket and TCP.
+
+Must be run as root on the middlewared host, e.g.
+
+    python3 file_transfer_benchmark.py --sizes 1 5 10 --dir /mnt/tank/bench
+
+Files of the given sizes (in GiB) are created in --dir, downloaded using `filesystem.get`
+(served with sendfile), downloaded again with a Range request resuming from the middle,
+and uploaded back using `filesystem.put`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+
+from middlewared.client import Client
+
+GiB = 1024 ** 3
+CHUNK_SIZE = 1048576
+
+
+def create_file(path, size):
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return
+    chunk = os.urandom(CHUNK_SIZE)
+    with open(path, 'wb') as f:
+        for i in range(size // CHUNK_SIZE):
+            f.write(chunk)
+
+
+def report(name, transport, size, elapsed):
+    print(f'{name:<10} {transport:<5} {size / GiB:6.1f} GiB {elapsed:8.2f}s {size / elapsed / 1024 ** 2:10.1f} MiB/s')
+
+
+async def download(session, base_url, c, path, offset=0):
+    job_id, url = c.call('core.download', 'filesystem.get', [path], os.path.basename(path))
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    received = 0
+    start = time.monotonic()
+    async with session.get(f'{base_url}{url}', headers=headers) as resp:
+        assert resp.status == (206 if offset else 200), resp.status
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            received += len(chunk)
+    return received, time.monotonic() - start
+
+
+async def upload(session, base_url, c, src, dst):
+    token = c.call('auth.generate_token', 300)
+
+    async def body():
+        with open(src, 'rb') as f:
+            while True:
+                read = f.read(CHUNK_SIZE)
+                if not read:
+                    break
+                yield read
+
+    data = aiohttp.FormData()
+    data.add_field('data', json.dumps({'method': 'filesystem.put', 'params': [dst]}))
+    data.add_field('file', body(), filename='file', content_type='application/octet-stream')
+
+    start = time.monotonic()
+    async with session.post(f'{base_url}/_upload?auth_token={token}', data=data) as resp:
+        assert resp.status == 200, await resp.text()
+        job_id = (await resp.json())['job_id']
+    c.call('core.job_wait', job_id, job=True)
+    return os.path.getsize(dst), time.monotonic() - start
+
+
+async def run(args):
+    transports = {
+        'unix': (lambda: aiohttp.UnixConnector(path='/var/run/middlewared.sock'), 'http://localhost'),
+        'tcp': (lambda: aiohttp.TCPConnector(), f'http://{args.host}:6000'),
+    }
+    with Client() as c:
+        for size in args.sizes:
+            path = os.path.join(args.dir, f'bench-{size}G')
+            create_file(path, size * GiB)
+            for transport, (connector, base_url) in transports.items():
+                async with aiohttp.ClientSession(connector=connector()) as session:
+                    received, elapsed = await download(session, base_url, c, path)
+                    report('download', transport, received, elapsed)
+
+                    received, elapsed = await download(session, base_url, c, path, size * GiB // 2)
+                    report('resume', transport, received, elapsed)
+
+                    received, elapsed = await upload(session, base_url, c, path, f'{path}.upload')
+                    report('upload', transport, received, elapsed)
+                    os.unlink(f'{path}.upload')
+            if not args.keep:
+                os.unlink(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--keep', action='store_true')
+    asyncio.get_event_loop().run_until_complete(run(parser.parse_args()))
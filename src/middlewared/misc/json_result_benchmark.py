@@ -0,0 +1,102 @@
+"""
+Measures sending large method call results to websocket clients.
+
+Does not need middlewared to be running, e.g.
+
+    python3 json_result_benchmark.py --items 1000000
+
+A result of `--items` dicts (like `disk.query` or `zfs.snapshot.query` ones) is sent by `Application._send_result` to
+a fake websocket. We compare encoding it with a single `json.dumps` in the event loop (what every result used to do)
+to encoding it in a thread piece by piece and to sending it as chunked results. For each we report the time to send
+the whole result, the longest time event loop was not able to run anything else and (with `--trace-memory`, which
+makes everything a lot slower) peak memory allocated while encoding.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+import time
+import tracemalloc
+
+from middlewared.client import ejson
+from middlewared.main import Application
+
+
+class FakeMiddleware:
+    def __init__(self, loop):
+        self.loop = loop
+
+    async def run_in_thread(self, method, *args, **kwargs):
+        return await self.loop.run_in_executor(None, lambda: method(*args, **kwargs))
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages = 0
+        self.length = 0
+
+    async def send_str(self, data):
+        self.messages += 1
+        self.length += len(data)
+        # Let the event loop write it
+        await asyncio.sleep(0)
+
+
+async def measure_lag(stop, lags):
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(0.001)
+        lags.append(time.monotonic() - start)
+
+
+async def send(loop, result, how, trace_memory):
+    ws = FakeWebSocket()
+    app = Application(FakeMiddleware(loop), loop, None, ws)
+    message = {"id": "benchmark"}
+
+    stop = asyncio.Event()
+    lags = []
+    lag = asyncio.ensure_future(measure_lag(stop, lags))
+    await asyncio.sleep(0.01)
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    if how == "single":
+        await ws.send_str(ejson.dumps({"id": message["id"], "msg": "result", "result": result}))
+    else:
+        app._chunked_results = how == "chunked"
+        await app._send_result(message, result)
+    elapsed = time.monotonic() - start
+    memory = ""
+    if trace_memory:
+        memory = f", peak memory {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MB"
+        tracemalloc.stop()
+
+    stop.set()
+    await lag
+
+    print(f"{how:>8}: {elapsed:.3f}s, {ws.messages} messages of {ws.length / 1024 / 1024:.1f} MB, "
+          f"longest event loop stall {max(lags):.3f}s{memory}")
+
+
+def main(args):
+    result = [
+        {
+            "id": i, "name": f"tank/dataset{i % 1000}@auto-{i:08d}", "pool": "tank", "type": "SNAPSHOT",
+            "properties": {"used": {"parsed": i * 4096, "rawvalue": str(i * 4096), "source": "NONE"}},
+            "created": datetime(2019, 7, 18, 12, i % 60),
+        }
+        for i in range(args.items)
+    ]
+
+    loop = asyncio.get_event_loop()
+    for how in ["single", "threaded", "chunked"]:
+        loop.run_until_complete(send(loop, result, how, args.trace_memory))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--trace-memory", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+"""
+Measures `filesystem.listdir` on a directory with a lot of entries.
+
+Does not need middlewared to be running, but needs a filesystem with enough free inodes, e.g.
+
+    mount -t tmpfs -o size=1g,nr_inodes=2m tmpfs /mnt/benchmark
+    python3 listdir_benchmark.py --directory /mnt/benchmark --entries 1000000
+
+Creates `--entries` empty files in a single directory in random order (ZFS lists directories in hash order and
+tmpfs in reverse creation order, so names are not listed sorted either way). We compare listing a page of
+`--limit` entries the way `filesystem.listdir` used to (build and `stat` every entry, then `filter_list`) to the
+current implementation: first page in directory order, a page in name order in the middle of the directory using
+a cursor, a name prefix filter, a page without `stat` and counting entries.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from middlewared.common.filesystem.listdir import listdir, listdir_entry
+from middlewared.utils import filter_list
+
+
+def listdir_all(path, filters, options):
+    # What `filesystem.listdir` did
+    return filter_list([listdir_entry(entry) for entry in os.scandir(path)], filters, options)
+
+
+def measure(title, func, *args):
+    start = time.monotonic()
+    result = func(*args)
+    if isinstance(result, dict):
+        result = result['entries']
+    count = result if isinstance(result, int) else len(result)
+    print(f'{title:<45} {time.monotonic() - start:8.3f}s, {count} entries')
+
+
+def main(args):
+    with tempfile.TemporaryDirectory(dir=args.directory) as path:
+        random.seed(0)
+        indexes = list(range(args.entries))
+        random.shuffle(indexes)
+
+        start = time.monotonic()
+        for i in indexes:
+            os.close(os.open(os.path.join(path, f'IMG_{i:07d}.JPG'), os.O_CREAT | os.O_WRONLY, 0o644))
+        print(f'Created {args.entries} entries in {time.monotonic() - start:.3f}s')
+
+        middle = f'IMG_{args.entries // 2:07d}.JPG'
+        prefix = [['name', '^', f'IMG_{args.entries // 2:07d}'[:-2]]]
+        for title, filters, options in [
+            ('First page', [], {'limit': args.limit}),
+            ('Page after cursor (ordered by name)', [], {'limit': args.limit, 'extra': {'after': middle}}),
+            ('Name prefix filter', prefix, {}),
+            ('First page without stat', [], {'limit': args.limit, 'extra': {'stat': False}}),
+            ('Count', [], {'count': True}),
+        ]:
+            old_filters, old_options = filters, options
+            if 'after' in options.get('extra', {}):
+                # Closest thing the old implementation could do
+                old_filters = filters + [['name', '>', middle]]
+                old_options = {'limit': args.limit, 'order_by': ['name']}
+
+            measure(f'{title}:', listdir, path, filters, options)
+            measure(f'{title} (old):', listdir_all, path, old_filters, old_options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--directory', default='/dev/shm')
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--limit', type=int, default=100)
+    main(parser.parse_args())
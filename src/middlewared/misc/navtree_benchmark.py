@@ -0,0 +1,94 @@
+"""
+Measures legacy UI menu (`freeadmin.navtree`) render time on a database with many shares and tasks.
+
+Needs to be run on a FreeNAS system (the menu asks middlewared about enabled features), e.g.
+
+    python3 navtree_benchmark.py --shares 2000 --tasks 2000 --iterations 20
+
+A copy of the configuration database is made and `--shares` SMB shares and `--tasks` cron jobs are added to it.
+We compare generating and dehydrating the whole tree on every render (what every menu request used to do) to
+renders served from the cached tree, and a render right after a share was saved (which invalidates the cache).
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append("/usr/local/www")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "freenasUI.settings")
+
+from django.conf import settings  # noqa
+
+
+class User:
+    pk = 1
+    is_superuser = True
+
+    def has_perm(self, perm):
+        return True
+
+
+def render(navtree):
+    navtree.generate()
+    return navtree.dijitTree(User())
+
+
+def timeit(iterations, func):
+    start = time.monotonic()
+    for _ in range(iterations):
+        func()
+    return (time.monotonic() - start) / iterations
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "freenas-v1.db")
+        shutil.copy(args.database, database)
+        settings.DATABASES["default"]["NAME"] = database
+
+        import django
+        django.setup()
+
+        from freenasUI.freeadmin.navtree import navtree
+        from freenasUI.sharing.models import CIFS_Share
+        from freenasUI.tasks.models import CronJob
+
+        navtree.prepare_modelforms()
+
+        CIFS_Share.objects.bulk_create([
+            CIFS_Share(cifs_name=f"share{i}", cifs_path=f"/mnt/tank/share{i}") for i in range(args.shares)
+        ])
+        CronJob.objects.bulk_create([
+            CronJob(cron_user="root", cron_command=f"echo {i}", cron_description=f"Task {i}")
+            for i in range(args.tasks)
+        ])
+
+        def uncached():
+            navtree.invalidate()
+            render(navtree)
+
+        print(f"{args.shares} shares, {args.tasks} tasks:")
+        print(f"  Generated on every render: {timeit(args.iterations, uncached):.3f}s")
+
+        render(navtree)
+        print(f"  Cached:                    {timeit(args.iterations, lambda: render(navtree)):.6f}s")
+
+        def after_save():
+            share = CIFS_Share.objects.order_by("-id")[0]
+            share.cifs_comment = str(time.monotonic())
+            share.save()
+            render(navtree)
+
+        print(f"  After a share is saved:    {timeit(args.iterations, after_save):.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", default="/data/freenas-v1.db")
+    parser.add_argument("--shares", type=int, default=2000)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=20)
+    main(parser.parse_args())
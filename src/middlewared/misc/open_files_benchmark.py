@@ -0,0 +1,78 @@
+"""
+Measures finding processes which use datasets (`pool.dataset.processes`) over a synthetic process table.
+
+Does not need middlewared to be running, e.g.
+
+    python3 open_files_benchmark.py --processes 20000 --files 20 --datasets 200
+
+Every process gets `--files` open files spread over `--datasets` datasets (and some files outside of them).
+We compare matching every open file against every dataset separately (what scanning `lsof` output for each
+dataset used to do) to a single pass over the process table using the mountpoint prefix trie.
+"""
+
+import argparse
+import os
+import random
+import time
+
+from middlewared.common.open_files.index import index_processes
+
+
+def generate(processes, files, datasets):
+    mountpoints = [f'/mnt/tank/share{i}' for i in range(datasets)]
+    paths = mountpoints + ['/usr/local/lib', '/var/log', '/dev/null']
+    table = []
+    for pid in range(1, processes + 1):
+        table.append((pid, random.choice(['smbd', 'nfsd', 'python3.7', 'minio']), [
+            os.path.join(random.choice(paths), f'dir{random.randrange(10)}', f'file{random.randrange(1000)}')
+            for _ in range(files)
+        ]))
+    return mountpoints, table
+
+
+def per_dataset(table, mountpoints):
+    result = {}
+    for mountpoint in mountpoints:
+        dirs = [mountpoint, f'/dev/zvol/{mountpoint[len("/mnt/"):]}']
+        for pid, command, paths in table:
+            for path in paths:
+                if os.path.isabs(path) and any(os.path.commonpath([path, dir]) == dir for dir in dirs):
+                    result.setdefault(mountpoint, {})[pid] = command
+    return result
+
+
+def single_pass(table, mountpoints):
+    prefixes = {}
+    for mountpoint in mountpoints:
+        prefixes[mountpoint] = mountpoint
+        prefixes[f'/dev/zvol/{mountpoint[len("/mnt/"):]}'] = mountpoint
+    return index_processes(table, prefixes)
+
+
+def main(args):
+    random.seed(0)
+    start = time.monotonic()
+    mountpoints, table = generate(args.processes, args.files, args.datasets)
+    print(f'Generated {args.processes} processes with {args.processes * args.files} open files '
+          f'over {args.datasets} datasets in {time.monotonic() - start:.3f}s')
+
+    start = time.monotonic()
+    expected = per_dataset(table, mountpoints[:args.sample])
+    elapsed = time.monotonic() - start
+    print(f'per dataset scan: {elapsed / args.sample:.3f}s per dataset, '
+          f'{elapsed / args.sample * args.datasets:.3f}s estimated for all {args.datasets} datasets')
+
+    start = time.monotonic()
+    result = single_pass(table, mountpoints)
+    print(f'single pass:      {time.monotonic() - start:.3f}s for all {args.datasets} datasets')
+
+    assert {k: v for k, v in result.items() if k in expected} == expected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=20000)
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--datasets', type=int, default=200)
+    parser.add_argument('--sample', type=int, default=3, help='Number of datasets to run per dataset scan for')
+    main(parser.parse_args())
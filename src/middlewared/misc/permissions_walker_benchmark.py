@@ -0,0 +1,123 @@
+"""
+Measures recursive `filesystem.setacl` on a synthetic tree.
+
+Does not need middlewared to be running, but needs Linux (ACLs are applied with `POSIXACLBackend` instead of NFSv4
+ones) and a filesystem with enough free inodes, e.g.
+
+    mount -t tmpfs -o size=4g,nr_inodes=2m tmpfs /mnt/benchmark
+    python3 permissions_walker_benchmark.py --directory /mnt/benchmark --files 1000000
+
+Creates `--files` files in directories of `--files-per-directory` files each. We compare applying the inherited ACL
+and owner to every entry one by one in `os.walk` order (what `winacl -a clone` used to do) to `Walker` with
+`--workers` threads that skips entries that already match, both when every entry has to be changed and when
+nothing has to.
+"""
+
+import argparse
+import os
+import stat
+import tempfile
+import time
+
+from middlewared.common.permissions.acl import InheritedACLs, POSIXACLBackend
+from middlewared.common.permissions.walker import Walker
+
+
+def entry(tag, perms, id=None):
+    return {
+        'tag': tag,
+        'id': id,
+        'type': 'ALLOW',
+        'perms': {perm: True for perm in perms},
+        'flags': {'FILE_INHERIT': True, 'DIRECTORY_INHERIT': True},
+    }
+
+
+def root_acl(uid):
+    return [
+        entry('USER_OBJ', ['READ_DATA', 'WRITE_DATA', 'EXECUTE']),
+        entry('GROUP_OBJ', ['READ_DATA', 'EXECUTE']),
+        entry('USER', ['READ_DATA', 'WRITE_DATA', 'EXECUTE'], uid),
+        entry('EVERYONE', []),
+    ]
+
+
+def generate(directory, files, files_per_directory):
+    for i in range(0, files, files_per_directory):
+        path = os.path.join(directory, f'dir{i // files_per_directory // 100}', f'dir{i // files_per_directory}')
+        os.makedirs(path)
+        for j in range(min(files_per_directory, files - i)):
+            os.close(os.open(os.path.join(path, f'file{j}'), os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+def sequential(backend, root, uid):
+    inherited = InheritedACLs(root_acl(uid))
+    backend.set(root, inherited.get(0, True), True)
+    count = 0
+    for path, dirs, files in os.walk(root):
+        depth = path[len(root):].count(os.sep) + 1
+        for name, is_dir in [(name, True) for name in dirs] + [(name, False) for name in files]:
+            child = os.path.join(path, name)
+            backend.set(child, inherited.get(depth, is_dir), is_dir)
+            os.chown(child, uid, uid, follow_symlinks=False)
+            count += 1
+
+    return {'visited': count, 'changed': count}
+
+
+def parallel(backend, root, uid, workers, progress):
+    inherited = InheritedACLs(root_acl(uid))
+    backend.set(root, inherited.get(0, True), True)
+
+    # Same as `filesystem.setacl` visitor
+    def visit(dir_fd, name, path, st, depth):
+        changed = False
+        is_dir = stat.S_ISDIR(st.st_mode)
+        entries = inherited.get(depth, is_dir)
+        if not backend.matches(path, st, entries, is_dir):
+            backend.set(path, entries, is_dir)
+            changed = True
+
+        if st.st_uid != uid or st.st_gid != uid:
+            os.chown(name, uid, uid, dir_fd=dir_fd, follow_symlinks=False)
+            changed = True
+
+        return changed
+
+    return Walker(root, visit, workers=workers).run(progress)
+
+
+def measure(title, func, *args):
+    start = time.monotonic()
+    result = func(*args)
+    print(f'{title:<40} {time.monotonic() - start:8.3f}s, {result["visited"]} entries, {result["changed"]} changed')
+
+
+def main(args):
+    backend = POSIXACLBackend()
+    with tempfile.TemporaryDirectory(dir=args.directory) as root:
+        start = time.monotonic()
+        generate(root, args.files, args.files_per_directory)
+        print(f'Generated {args.files} files in {time.monotonic() - start:.3f}s')
+
+        progress = []
+
+        def report(percent, description):
+            progress.append(percent)
+
+        measure('Sequential, everything changed:', sequential, backend, root, 1000)
+        measure(f'Walker ({args.workers} workers), everything changed:', parallel, backend, root, 1001, args.workers,
+                report)
+        measure(f'Walker ({args.workers} workers), nothing changed:', parallel, backend, root, 1001, args.workers,
+                report)
+        measure('Sequential, nothing changed:', sequential, backend, root, 1001)
+        print(f'Walker progress reports: {progress}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--directory', default='/dev/shm')
+    parser.add_argument('--files', type=int, default=1000000)
+    parser.add_argument('--files-per-directory', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=8)
+    main(parser.parse_args())
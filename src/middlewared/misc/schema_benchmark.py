@@ -0,0 +1,139 @@
+"""
+Measures argument cleaning/validation cost of `@accepts` for the registered schemas.
+
+Plugins are loaded the same way the worker does it, so it must be run on a middlewared host, e.g.
+
+    python3 schema_benchmark.py --items 1000 --rounds 20
+
+For every method argument schema (and every registered schema) a representative payload is
+generated: all dict attributes are filled in and lists get `--items` elements. The payload is then
+cleaned and validated the way `accepts` does it now (a single pass which builds the cleaned copy)
+and the way it used to (deep copy of the argument, then clean and validate it).
+"""
+
+import argparse
+import copy
+import time
+
+from middlewared.schema import (
+    Any, Bool, Cron, Dict, Error, Float, Int, IPAddr, List, Str, Time, UnixPerm,
+)
+from middlewared.service_exception import ValidationErrors
+from middlewared.worker import FakeMiddleware
+
+# Methods which get big payloads, they are always reported first
+METHODS = [
+    'core.bulk',
+    'filesystem.setacl',
+    'iscsi.extent.create',
+    'pool.create',
+    'sharing.smb.create',
+    'user.create',
+]
+
+
+def sample(attr, items):
+    if hasattr(attr, 'value'):
+        # `Inheritable` from pool plugin
+        return sample(attr.value, items)
+    if getattr(attr, 'enum', None):
+        return attr.enum[0]
+    if isinstance(attr, Cron):
+        return {'minute': '00', 'hour': '*', 'dom': '*', 'month': '*', 'dow': '*'}
+    if isinstance(attr, Dict):
+        return {name: sample(a, items) for name, a in attr.attrs.items()}
+    if isinstance(attr, List):
+        if not attr.items:
+            return ['item'] * items
+        return [sample(attr.items[0], items) for i in range(items)]
+    if isinstance(attr, IPAddr):
+        return '192.168.0.0/24' if attr.network or attr.cidr else '192.168.0.1'
+    if isinstance(attr, Time):
+        return '10:00'
+    if isinstance(attr, UnixPerm):
+        return '755'
+    if isinstance(attr, Str):
+        return 'value'
+    if isinstance(attr, Bool):
+        return True
+    if isinstance(attr, Int):
+        return 1
+    if isinstance(attr, Float):
+        return 1.0
+    if isinstance(attr, Any):
+        return {'key': ['value']}
+    return None
+
+
+def clean_and_validate(attr, value):
+    value = attr.clean(value)
+    try:
+        attr.validate(value)
+    except ValidationErrors:
+        pass
+    return value
+
+
+def measure(attr, value, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        clean_and_validate(attr, value)
+    new = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        clean_and_validate(attr, copy.deepcopy(value))
+    old = time.perf_counter() - start
+
+    return new / rounds, old / rounds
+
+
+def schemas(middleware):
+    for namespace, service in sorted(middleware.get_services().items()):
+        for name in dir(service):
+            method = getattr(service, name)
+            if not callable(method) or not hasattr(method, 'accepts'):
+                continue
+            for attr in method.accepts:
+                yield f'{namespace}.{name}', attr
+
+    for name, attr in sorted(middleware._schemas.items()):
+        yield f'schema:{name}', attr
+
+
+def main(args):
+    middleware = FakeMiddleware(None)
+    middleware._load_plugins()
+
+    results = []
+    for name, attr in schemas(middleware):
+        if args.filter and not any(f in name for f in args.filter):
+            continue
+
+        value = sample(attr, args.items)
+        try:
+            clean_and_validate(attr, copy.deepcopy(value))
+        except (Error, ValueError, TypeError, KeyError):
+            # Our generated payload does not fit (e.g. mutually exclusive attributes), skip it
+            continue
+
+        new, old = measure(attr, value, args.rounds)
+        results.append((name not in METHODS, -old, name, attr.name, new, old))
+
+    total_new = total_old = 0
+    print(f'{"method":<50} {"argument":<25} {"clean (ms)":>11} {"deepcopy+clean (ms)":>20} {"speedup":>8}')
+    for _, _, name, attr_name, new, old in sorted(results)[:args.top]:
+        print(f'{name:<50} {attr_name:<25} {new * 1000:11.3f} {old * 1000:20.3f} {old / new:7.2f}x')
+    for *_, new, old in results:
+        total_new += new
+        total_old += old
+    print(f'{len(results)} schemas, total {total_new * 1000:.3f} ms vs {total_old * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=100, help='Number of elements generated for every list')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--top', type=int, default=50, help='Number of schemas to report')
+    parser.add_argument('--filter', nargs='*', help='Only measure methods/schemas containing these strings')
+    main(parser.parse_args())
@@ -0,0 +1,126 @@
+"""
+Measures v1 REST API snapshot listing (`storage/snapshot`) of a single page over a fake `zfs` binary.
+
+Does not need middlewared to be running (but `freenasUI` has to be importable), e.g.
+
+    python3 snapshot_list_benchmark.py --snapshots 1000000 --datasets 1000 --offset 500000 --limit 25
+
+Generates `zfs list -H -p` output for `--snapshots` snapshots spread over `--datasets` datasets and a fake `zfs`
+that prints it. We compare what `SnapshotResource.get_list` used to do (build every snapshot object, sort all of
+them in Python, slice a page) to `list_snapshots_page` with the default order and sorted by `used` (sorting
+is done by `zfs` so the fake one prints rows in the order requested).
+"""
+
+import argparse
+import os
+import random
+import stat
+import subprocess
+import tempfile
+import time
+
+from freenasUI.common.snapshots import list_snapshots_page, ZFS_LIST_PROPERTIES
+
+
+class Snapshot(object):
+    def __init__(self, name, filesystem, used, refer, mostrecent=False, parent_type=None, vmsynced=False):
+        self.name = name
+        self.filesystem = filesystem
+        self.used = used
+        self.refer = refer
+        self.mostrecent = mostrecent
+        self.parent_type = parent_type
+        self.vmsynced = vmsynced
+
+
+def generate(directory, snapshots, datasets):
+    rows = []
+    for i in range(snapshots):
+        rows.append((
+            f"tank/dataset{i % datasets}@auto-{i // datasets:08d}", i + 1, random.randrange(1 << 30),
+            random.randrange(1 << 40), "-",
+        ))
+
+    outputs = {
+        # `zfs list` default order: by dataset, then by creation
+        "default": sorted(rows, key=lambda row: (row[0].split("@")[0], row[1])),
+        "creation": sorted(rows, key=lambda row: -row[1]),
+        "used": sorted(rows, key=lambda row: row[2]),
+    }
+    for name, output in outputs.items():
+        with open(os.path.join(directory, name), "w") as f:
+            for row in output:
+                f.write("\t".join(map(str, row)) + "\n")
+
+    zfs = os.path.join(directory, "zfs")
+    with open(zfs, "w") as f:
+        f.write(f"""#!/bin/sh
+case "$*" in
+    *"-S creation"*) exec cat {directory}/creation ;;
+    *"-s used"*) exec cat {directory}/used ;;
+    *) exec cat {directory}/default ;;
+esac
+""")
+    os.chmod(zfs, os.stat(zfs).st_mode | stat.S_IEXEC)
+    return zfs
+
+
+def list_all(zfs, offset, limit, field):
+    # What `notifier.zfs_snapshot_list` and `SnapshotResource.get_list` did
+    fsinfo = {}
+    output = subprocess.run(
+        [zfs, "list", "-p", "-t", "snapshot", "-H", "-S", "creation", "-o", ZFS_LIST_PROPERTIES],
+        stdout=subprocess.PIPE, encoding="utf8",
+    ).stdout
+    for line in output.split("\n"):
+        if line != "":
+            _list = line.split("\t")
+            fs, name = _list[0].split("@")
+            try:
+                snaplist = fsinfo[fs]
+                mostrecent = False
+            except KeyError:
+                snaplist = []
+                mostrecent = True
+
+            snaplist.insert(0, Snapshot(name, fs, int(_list[2]), int(_list[3]), mostrecent, "filesystem",
+                                        _list[4] == "Y"))
+            fsinfo[fs] = snaplist
+
+    results = []
+    for snaps in fsinfo.values():
+        results.extend(snaps)
+    if field:
+        results.sort(key=lambda item: getattr(item, field))
+
+    return results[offset:offset + limit], len(results)
+
+
+def main(args):
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.monotonic()
+        zfs = generate(directory, args.snapshots, args.datasets)
+        print(f"Generated {args.snapshots} snapshots in {time.monotonic() - start:.3f}s")
+
+        for title, field in [("default order", None), ("sorted by used", "used")]:
+            start = time.monotonic()
+            snapshots, total = list_snapshots_page(args.offset, args.limit, [field] if field else None, zfs=zfs)
+            print(f"Page ({title}):       {time.monotonic() - start:.3f}s, {len(snapshots)} of {total} snapshots")
+
+            start = time.monotonic()
+            expected, total = list_all(zfs, args.offset, args.limit, field)
+            print(f"Full list ({title}):  {time.monotonic() - start:.3f}s, {len(expected)} of {total} snapshots")
+
+            if field:
+                # Default order of the full list was grouped by datasets with the most recent snapshot first
+                assert [s["used"] for s in snapshots] == [s.used for s in expected]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshots", type=int, default=1000000)
+    parser.add_argument("--datasets", type=int, default=1000)
+    parser.add_argument("--offset", type=int, default=500000)
+    parser.add_argument("--limit", type=int, default=25)
+    main(parser.parse_args())
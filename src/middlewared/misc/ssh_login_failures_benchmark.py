@@ -0,0 +1,117 @@
+"""
+Measures SSH login failures alert source check over a synthetic `auth.log` set.
+
+Does not need middlewared to be running, e.g.
+
+    python3 ssh_login_failures_benchmark.py --archives 7 --size 256 --daily 64
+
+Generates `--archives` rotated gzip archives and `auth.log` of `--size` MB each in a temporary directory. We compare
+reading and matching all of them (what every check used to do) to the checkpointed scanner: its first check (which
+has to read everything too), a check after `--daily` MB were appended to `auth.log` and a check after `auth.log`
+was rotated once more.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from middlewared.alert.source.ssh_login_failures import catmsgs, get_login_failures, LoginFailuresCounter, LogScanner
+
+MESSAGES = [
+    "sshd[{pid}]: Accepted publickey for root from 10.0.0.{host} port {port} ssh2",
+    "sshd[{pid}]: Failed password for invalid user admin from 10.0.0.{host} port {port} ssh2",
+    "sshd[{pid}]: Connection closed by 10.0.0.{host} port {port} [preauth]",
+    "sshd[{pid}]: Received disconnect from 10.0.0.{host} port {port}:11: disconnected by user",
+]
+
+
+def generate(size, day):
+    prefix = day.strftime("%b %e ")
+    lines = []
+    length = 0
+    while length < size:
+        line = (prefix + "12:00:00 freenas " + random.choice(MESSAGES).format(
+            pid=random.randrange(100000), host=random.randrange(256), port=random.randrange(1024, 65536),
+        ) + "\n").encode("ascii")
+        lines.append(line)
+        length += len(line)
+    return b"".join(lines)
+
+
+def rotate(directory):
+    archives = sorted(
+        (name for name in os.listdir(directory) if name.startswith("auth.log.")),
+        key=lambda name: int(name.split(".")[2]),
+        reverse=True,
+    )
+    for name in archives:
+        n = int(name.split(".")[2])
+        os.rename(os.path.join(directory, name), os.path.join(directory, f"auth.log.{n + 1}.gz"))
+
+    path = os.path.join(directory, "auth.log")
+    with open(path, "rb") as src, gzip.GzipFile(os.path.join(directory, "auth.log.0.gz"), "wb", 1) as dst:
+        shutil.copyfileobj(src, dst)
+    os.unlink(path)
+
+
+def check(directory, checkpoint, segments):
+    scanner = LogScanner(checkpoint, log_directory=directory)
+    messages = scanner.scan()
+    counter = LoginFailuresCounter(None if scanner.full else segments)
+    counter.feed(messages)
+    return scanner.checkpoint(), counter.segments, counter.get_login_failures(datetime.now())[0]
+
+
+def main(args):
+    random.seed(0)
+    yesterday = datetime.now() - timedelta(days=1)
+    size = args.size * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.monotonic()
+        for i in range(args.archives):
+            with open(os.path.join(directory, "auth.log"), "wb") as f:
+                f.write(generate(size, yesterday - timedelta(days=args.archives - i)))
+            rotate(directory)
+        with open(os.path.join(directory, "auth.log"), "wb") as f:
+            f.write(generate(size, yesterday))
+        print(f"Generated {args.archives} archives and auth.log of {args.size} MB each "
+              f"in {time.monotonic() - start:.3f}s")
+
+        start = time.monotonic()
+        expected = len(get_login_failures(datetime.now(), catmsgs(directory)))
+        print(f"Full scan:                {time.monotonic() - start:.3f}s, {expected} login failures")
+
+        start = time.monotonic()
+        checkpoint, segments, count = check(directory, None, None)
+        print(f"First checkpointed check: {time.monotonic() - start:.3f}s, {count} login failures")
+        assert count == expected
+
+        with open(os.path.join(directory, "auth.log"), "ab") as f:
+            f.write(generate(args.daily * 1024 * 1024, yesterday))
+
+        start = time.monotonic()
+        checkpoint, segments, count = check(directory, checkpoint, segments)
+        print(f"Check after append:       {time.monotonic() - start:.3f}s, {count} login failures")
+
+        rotate(directory)
+        with open(os.path.join(directory, "auth.log"), "wb") as f:
+            f.write(generate(args.daily * 1024 * 1024, yesterday))
+
+        start = time.monotonic()
+        checkpoint, segments, count = check(directory, checkpoint, segments)
+        print(f"Check after rotation:     {time.monotonic() - start:.3f}s, {count} login failures")
+        assert count == len(get_login_failures(datetime.now(), catmsgs(directory)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--archives", type=int, default=7)
+    parser.add_argument("--size", type=int, default=256, help="Size of every log file in MB")
+    parser.add_argument("--daily", type=int, default=64, help="MB logged between checks")
+    main(parser.parse_args())
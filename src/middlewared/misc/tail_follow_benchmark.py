@@ -0,0 +1,101 @@
+"""
+Measures `filesystem.file_tail_follow` with many concurrent followers of the same file.
+
+Does not need middlewared to be running, e.g.
+
+    python3 tail_follow_benchmark.py --followers 200 --seconds 10
+
+A log file of `--size` bytes is created and followed by `--followers` subscribers asking for its last 100 lines
+while a writer appends `--rate` lines per second to it for `--seconds`. We compare a reader per follower (own
+descriptor, thread and tail read, what every subscription used to do) to followers sharing `TailBrokers`. For each
+we report the time to subscribe all of them, threads and descriptors they use and CPU time spent following.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from middlewared.common.filesystem.tail import TailBroker, TailBrokers
+
+
+class Follower:
+    def __init__(self):
+        self.length = 0
+
+    def __call__(self, data):
+        self.length += len(data)
+
+
+class SeparateReaders:
+    def __init__(self):
+        self.brokers = {}
+
+    def subscribe(self, path, lines, callback):
+        self.brokers[callback] = TailBroker(path)
+        self.brokers[callback].subscribe(lines, callback)
+
+    def unsubscribe(self, path, callback):
+        self.brokers.pop(callback).unsubscribe(callback)
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd' if os.path.exists('/proc') else '/dev/fd'))
+
+
+def measure(title, brokers, path, args):
+    initial_threads = threads = threading.active_count()
+    fds = open_fds()
+    followers = [Follower() for _ in range(args.followers)]
+
+    start = time.monotonic()
+    for follower in followers:
+        brokers.subscribe(path, 100, follower)
+    subscribed = time.monotonic() - start
+    threads = threading.active_count() - threads
+    fds = open_fds() - fds
+    initial = followers[0].length
+
+    cpu = time.process_time()
+    written = 0
+    with open(path, 'a') as f:
+        for i in range(int(args.seconds * args.rate)):
+            line = f'{time.time()} host kernel: benchmark line {i}\n'
+            f.write(line)
+            f.flush()
+            written += len(line)
+            time.sleep(1 / args.rate)
+    # Let followers read the rest
+    time.sleep(1)
+    cpu = time.process_time() - cpu
+
+    for follower in followers:
+        brokers.unsubscribe(path, follower)
+    # Wait for readers to stop
+    while threading.active_count() > initial_threads:
+        time.sleep(0.1)
+
+    received = sum(follower.length - initial for follower in followers) / args.followers
+    print(f'{title:<20} subscribed in {subscribed:.3f}s, {threads} threads, {fds} descriptors, '
+          f'{cpu:.3f}s CPU following, {received / written * 100:.0f}% of {written} bytes received')
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'messages')
+        with open(path, 'w') as f:
+            line = 'Jul 18 12:00:00 freenas kernel: ' + 'x' * 80 + '\n'
+            f.write(line * (args.size // len(line)))
+
+        measure('Reader per follower:', SeparateReaders(), path, args)
+        measure('Shared reader:', TailBrokers(), path, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--followers', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rate', type=int, default=100)
+    parser.add_argument('--size', type=int, default=10 * 1024 * 1024)
+    main(parser.parse_args())
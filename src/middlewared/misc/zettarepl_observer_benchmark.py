@@ -0,0 +1,90 @@
+"""
+Drives zettarepl observer message handling with a fake recursive replication task.
+
+Does not need middlewared to be running, e.g.
+
+    python3 zettarepl_observer_benchmark.py --datasets 1000 --snapshots 10000
+
+A child process (like the zettarepl process) reports progress of every snapshot sent by a replication task of
+`--datasets` datasets with `--snapshots` snapshots in total (`--progress` progress messages per snapshot, as
+`zfs send` progress is reported). Messages go through the same observer as in zettarepl process and are handled by
+`ZettareplService` observer queue reader in this process. We report how many messages crossed the queue,
+observer queue depth and latency, and the replication task state in the end.
+"""
+
+import argparse
+import multiprocessing
+import time
+import types
+
+from zettarepl.observer import (
+    ReplicationTaskScheduled, ReplicationTaskSnapshotProgress, ReplicationTaskSnapshotSuccess, ReplicationTaskSuccess,
+)
+
+from middlewared.plugins.zettarepl import ZettareplProcess, ZettareplService
+
+TASK_ID = "task_1"
+
+
+def definition(datasets):
+    return {
+        "timezone": "UTC",
+        "periodic-snapshot-tasks": {},
+        "replication-tasks": {
+            TASK_ID: {
+                "direction": "push",
+                "transport": {"type": "local"},
+                "source-dataset": [f"tank/data/{i}" for i in range(datasets)],
+                "target-dataset": "backup/data",
+                "recursive": True,
+                "auto": False,
+                "retention-policy": "none",
+            },
+        },
+    }
+
+
+def zettarepl(args, observer_queue):
+    process = ZettareplProcess(definition(args.datasets), "INFO", None, None, observer_queue)
+
+    process._observer(ReplicationTaskScheduled(TASK_ID))
+    for i in range(args.snapshots):
+        dataset = f"tank/data/{i % args.datasets}"
+        snapshot = f"auto-{i:08d}"
+        for _ in range(args.progress):
+            process._observer(ReplicationTaskSnapshotProgress(TASK_ID, dataset, snapshot, i, args.snapshots))
+        process._observer(ReplicationTaskSnapshotSuccess(TASK_ID, dataset, snapshot))
+    process._observer(ReplicationTaskSuccess(TASK_ID))
+
+
+def main(args):
+    middleware = types.SimpleNamespace(call_sync=lambda *args: None)
+    service = ZettareplService(middleware)
+    process = multiprocessing.Process(target=zettarepl, args=(args, service.observer_queue))
+
+    start = time.monotonic()
+    process.start()
+    while True:
+        queued_at, message = service.observer_queue.get()
+        service._observer_queue_message(message)
+        service.observer_metrics.record(queued_at, service.observer_queue.qsize())
+        if isinstance(message, ReplicationTaskSuccess):
+            break
+    elapsed = time.monotonic() - start
+    process.join()
+
+    reported = args.snapshots * (args.progress + 1) + 2
+    metrics = service.get_observer_metrics()
+    print(f"Reported {reported} messages, {metrics['messages']} crossed the observer queue in {elapsed:.3f}s")
+    print(f"Queue depth: max {metrics['max_queue_depth']}, latency: average {metrics['average_latency']:.6f}s, "
+          f"max {metrics['max_latency']:.6f}s")
+    print(f"Last snapshot: {service.last_snapshot[f'replication_{TASK_ID}']}, "
+          f"state: {service.state[f'replication_{TASK_ID}']['state']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--datasets", type=int, default=1000)
+    parser.add_argument("--snapshots", type=int, default=10000)
+    parser.add_argument("--progress", type=int, default=5)
+    main(parser.parse_args())